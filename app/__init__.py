@@ -1 +1,5 @@
 # app package
+import time
+
+# Reference point for the import phase of the start-up profile (app.startup)
+IMPORT_STARTED = time.perf_counter()
@@ -0,0 +1,360 @@
+"""
+Spend analytics by supplier, material and invoice month.
+
+Two aggregate tables (:class:`app.models.SupplierMonthlySpend` and
+:class:`app.models.MaterialMonthlySpend`) are kept current by session
+listeners in the same transaction as every write to purchases or their
+items: the affected rows' contributions are read before the flush and
+again after it, and only the difference is applied. Reads are a lookup on
+the aggregate tables and don't depend on the size of the purchase history.
+
+:func:`rebuild_spend_aggregates` recomputes both tables from scratch with
+vectorised group-by passes over the item columns (NumPy when installed,
+plain Python otherwise), e.g. after a bulk load that bypassed the ORM.
+Running the module also rebuilds the price statistics of ``app.pricing``::
+
+    python -m app.analytics
+"""
+import re
+from collections import defaultdict
+from itertools import chain
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, bindparam, delete, event, func, select
+from sqlalchemy.orm import Session
+
+from app import models
+
+_UNLOADED = object()
+# Imported by the first rebuild rather than at start-up, see _load_numpy();
+# None when NumPy isn't installed
+numpy = _UNLOADED
+
+purchase_table = models.Purchase.__table__
+item_table = models.PurchaseItem.__table__
+supplier_spend_table = models.SupplierMonthlySpend.__table__
+material_spend_table = models.MaterialMonthlySpend.__table__
+
+_MONTH = re.compile(r"^\d{4}-\d{2}")
+# Ids per IN (...) list, well below SQLite's bound parameter limit
+_IN_CHUNK = 500
+# Item rows fetched per block by the rebuild
+_REBUILD_CHUNK = 50000
+# Session.info key holding the contributions read before a flush
+_BEFORE_FLUSH_KEY = "spend_before_flush"
+
+
+def spend_month(invoice_date: Optional[str], created_at) -> str:
+    """Month (YYYY-MM) a purchase is reported under: invoice date, else creation date."""
+    if invoice_date and _MONTH.match(invoice_date):
+        return invoice_date[:7]
+    return created_at.strftime("%Y-%m") if created_at else ""
+
+
+def item_spend(quantity: Optional[float], unit_price: Optional[float], total_price: Optional[float]) -> float:
+    if total_price is not None:
+        return total_price
+    return (quantity or 0.0) * (unit_price or 0.0)
+
+
+class SpendTotals:
+    """
+    Aggregates keyed like the two spend tables.
+
+    ``suppliers`` maps (supplier, month) to [purchases, total_amount] and
+    ``materials`` maps (material_id, month) to [items, quantity, spend].
+    """
+
+    def __init__(self):
+        self.suppliers = defaultdict(lambda: [0, 0.0])
+        self.materials = defaultdict(lambda: [0, 0.0, 0.0])
+
+    def add_purchase(self, supplier, invoice_date, created_at, total_amount):
+        row = self.suppliers[(supplier or "", spend_month(invoice_date, created_at))]
+        row[0] += 1
+        row[1] += total_amount or 0.0
+
+    def add_item(self, material_id, quantity, unit_price, total_price, invoice_date, created_at):
+        if material_id is None:
+            return
+        row = self.materials[(material_id, spend_month(invoice_date, created_at))]
+        row[0] += 1
+        row[1] += quantity or 0.0
+        row[2] += item_spend(quantity, unit_price, total_price)
+
+    def minus(self, other: "SpendTotals") -> "SpendTotals":
+        """Per-key difference ``self - other``, without keys that didn't change."""
+        delta = SpendTotals()
+        for name in ("suppliers", "materials"):
+            mine, theirs = getattr(self, name), getattr(other, name)
+            for key in set(mine) | set(theirs):
+                values = [a - b for a, b in zip(mine.get(key, [0, 0.0, 0.0]), theirs.get(key, [0, 0.0, 0.0]))]
+                if any(values):
+                    getattr(delta, name)[key] = values
+        return delta
+
+
+def _chunks(ids: Iterable) -> Iterable[list]:
+    ids = list(ids)
+    for start in range(0, len(ids), _IN_CHUNK):
+        yield ids[start:start + _IN_CHUNK]
+
+
+def _load_totals(connection, purchase_ids: Iterable[int], item_ids: Iterable[int]) -> SpendTotals:
+    """Contributions of the given purchases and items as currently stored."""
+    totals = SpendTotals()
+    columns = (purchase_table.c.supplier, purchase_table.c.invoice_date,
+               purchase_table.c.created_at, purchase_table.c.total_amount)
+    for chunk in _chunks(purchase_ids):
+        for row in connection.execute(select(*columns).where(purchase_table.c.id.in_(chunk))):
+            totals.add_purchase(*row)
+
+    columns = (item_table.c.material_id, item_table.c.quantity, item_table.c.unit_price,
+               item_table.c.total_price, purchase_table.c.invoice_date, purchase_table.c.created_at)
+    for chunk in _chunks(item_ids):
+        query = (
+            select(*columns)
+            .join_from(item_table, purchase_table, item_table.c.purchase_id == purchase_table.c.id)
+            .where(item_table.c.id.in_(chunk))
+        )
+        for row in connection.execute(query):
+            totals.add_item(*row)
+    return totals
+
+
+def _changed_ids(session: Session, objects, dirty=()) -> tuple:
+    purchase_ids, item_ids = set(), set()
+    for obj in objects:
+        if obj in dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, models.Purchase) and obj.id is not None:
+            purchase_ids.add(obj.id)
+        elif isinstance(obj, models.PurchaseItem) and obj.id is not None:
+            item_ids.add(obj.id)
+    return purchase_ids, item_ids
+
+
+@event.listens_for(Session, "before_flush")
+def _read_before_flush(session, flush_context, instances):
+    dirty = session.dirty
+    purchase_ids, item_ids = _changed_ids(session, list(dirty) + list(session.deleted), dirty)
+    if not (purchase_ids or item_ids):
+        return
+    connection = session.connection()
+    # A purchase's supplier or date moves all of its items to another group
+    for chunk in _chunks(purchase_ids):
+        item_ids.update(connection.execute(
+            select(item_table.c.id).where(item_table.c.purchase_id.in_(chunk))
+        ).scalars())
+    session.info[_BEFORE_FLUSH_KEY] = (purchase_ids, item_ids, _load_totals(connection, purchase_ids, item_ids))
+
+
+@event.listens_for(Session, "after_flush")
+def _apply_after_flush(session, flush_context):
+    purchase_ids, item_ids, before = session.info.pop(_BEFORE_FLUSH_KEY, (set(), set(), SpendTotals()))
+    new_purchase_ids, new_item_ids = _changed_ids(session, session.new)
+    purchase_ids |= new_purchase_ids
+    item_ids |= new_item_ids
+    if not (purchase_ids or item_ids):
+        return
+    connection = session.connection()
+    delta = _load_totals(connection, purchase_ids, item_ids).minus(before)
+    _apply_delta(connection, supplier_spend_table, ("supplier", "month"), ("purchases", "total_amount"), delta.suppliers)
+    _apply_delta(connection, material_spend_table, ("material_id", "month"), ("items", "quantity", "spend"), delta.materials)
+
+
+def _apply_delta(connection, table, key_columns, value_columns, delta: Dict[tuple, list]):
+    """Add ``delta`` to the matching rows, inserting missing ones and dropping emptied ones."""
+    if not delta:
+        return
+    first = table.c[key_columns[0]]
+    existing = set()
+    for chunk in _chunks({key[0] for key in delta}):
+        existing.update(tuple(row) for row in connection.execute(
+            select(*(table.c[c] for c in key_columns)).where(first.in_(chunk))
+        ))
+
+    updates = [
+        {**{f"k_{c}": v for c, v in zip(key_columns, key)}, **{f"d_{c}": v for c, v in zip(value_columns, values)}}
+        for key, values in delta.items() if key in existing
+    ]
+    inserts = [
+        dict(zip(key_columns + value_columns, key + tuple(values)))
+        for key, values in delta.items() if key not in existing
+    ]
+    if updates:
+        connection.execute(
+            table.update()
+            .where(and_(*(table.c[c] == bindparam(f"k_{c}") for c in key_columns)))
+            .values({c: table.c[c] + bindparam(f"d_{c}") for c in value_columns}),
+            updates
+        )
+    if inserts:
+        connection.execute(table.insert(), inserts)
+    # Groups whose last purchase or item went away: only a row whose count
+    # went down can have emptied, so the DELETE looks up just those keys
+    emptied = [
+        {f"k_{c}": v for c, v in zip(key_columns, key)}
+        for key, values in delta.items() if key in existing and values[0] < 0
+    ]
+    if emptied:
+        connection.execute(
+            delete(table)
+            .where(and_(*(table.c[c] == bindparam(f"k_{c}") for c in key_columns)))
+            .where(table.c[value_columns[0]] <= 0),
+            emptied
+        )
+
+
+def _aggregate_python(purchases, items) -> SpendTotals:
+    totals = SpendTotals()
+    dates = {}
+    for purchase_id, supplier, invoice_date, created_at, total_amount in purchases:
+        totals.add_purchase(supplier, invoice_date, created_at, total_amount)
+        dates[purchase_id] = (invoice_date, created_at)
+    for block in items:
+        for purchase_id, material_id, quantity, spend in block:
+            totals.add_item(material_id, quantity, None, spend, *dates.get(purchase_id, (None, None)))
+    return totals
+
+
+def _load_numpy():
+    global numpy
+    if numpy is _UNLOADED:
+        try:
+            import numpy
+        except ImportError:  # rebuild falls back to a pure-Python pass
+            numpy = None
+    return numpy
+
+
+def _aggregate_numpy(purchases, items) -> SpendTotals:
+    totals = SpendTotals()
+    if not purchases:
+        return totals
+
+    purchase_ids = numpy.array([p[0] for p in purchases], dtype=numpy.int64)
+    months, month_codes = numpy.unique(
+        numpy.array([spend_month(p[2], p[3]) for p in purchases], dtype=str), return_inverse=True
+    )
+    suppliers, supplier_codes = numpy.unique(
+        numpy.array([p[1] or "" for p in purchases], dtype=str), return_inverse=True
+    )
+    amounts = numpy.array([p[4] or 0.0 for p in purchases], dtype=float)
+
+    groups, inverse = numpy.unique(supplier_codes * len(months) + month_codes, return_inverse=True)
+    counts = numpy.bincount(inverse)
+    sums = numpy.bincount(inverse, weights=amounts)
+    for group, count, total in zip(groups, counts, sums):
+        key = (str(suppliers[group // len(months)]), str(months[group % len(months)]))
+        totals.suppliers[key] = [int(count), float(total)]
+
+    # Item columns arrive NULL-free (see rebuild_spend_aggregates), so each
+    # block is flattened straight into a float buffer
+    blocks = [
+        numpy.fromiter(chain.from_iterable(block), dtype=float, count=len(block) * 4).reshape(-1, 4)
+        for block in items
+    ]
+    columns = numpy.concatenate(blocks) if blocks else numpy.empty((0, 4))
+    if not len(columns):
+        return totals
+    item_purchases, material_ids = columns[:, 0].astype(numpy.int64), columns[:, 1].astype(numpy.int64)
+    quantity, spend = columns[:, 2], columns[:, 3]
+
+    # purchases are ordered by id, so each item finds its purchase's month by bisection
+    item_months = month_codes[numpy.searchsorted(purchase_ids, item_purchases).clip(0, len(purchase_ids) - 1)]
+
+    materials, material_codes = numpy.unique(material_ids, return_inverse=True)
+    groups, inverse = numpy.unique(material_codes * len(months) + item_months, return_inverse=True)
+    counts = numpy.bincount(inverse)
+    quantities = numpy.bincount(inverse, weights=quantity)
+    spends = numpy.bincount(inverse, weights=spend)
+    for group, count, qty, total in zip(groups, counts, quantities, spends):
+        key = (int(materials[group // len(months)]), str(months[group % len(months)]))
+        totals.materials[key] = [int(count), float(qty), float(total)]
+    return totals
+
+
+def rebuild_spend_aggregates(session: Session) -> dict:
+    """Recompute both spend tables from purchases and items, and commit."""
+    connection = session.connection()
+    purchases = connection.execute(
+        select(purchase_table.c.id, purchase_table.c.supplier, purchase_table.c.invoice_date,
+               purchase_table.c.created_at, purchase_table.c.total_amount)
+        .order_by(purchase_table.c.id)
+    ).all()
+    quantity = func.coalesce(item_table.c.quantity, 0.0)
+    result = connection.execute(
+        select(item_table.c.purchase_id, item_table.c.material_id, quantity,
+               func.coalesce(item_table.c.total_price, quantity * func.coalesce(item_table.c.unit_price, 0.0)))
+        .where(item_table.c.material_id.isnot(None))
+        .execution_options(stream_results=True)
+    )
+    items = result.partitions(_REBUILD_CHUNK)
+    totals = _aggregate_numpy(purchases, items) if _load_numpy() is not None else _aggregate_python(purchases, items)
+    result.close()
+
+    connection.execute(delete(supplier_spend_table))
+    connection.execute(delete(material_spend_table))
+    if totals.suppliers:
+        connection.execute(supplier_spend_table.insert(), [
+            {"supplier": supplier, "month": month, "purchases": count, "total_amount": amount}
+            for (supplier, month), (count, amount) in totals.suppliers.items()
+        ])
+    if totals.materials:
+        connection.execute(material_spend_table.insert(), [
+            {"material_id": material_id, "month": month, "items": count, "quantity": qty, "spend": spend}
+            for (material_id, month), (count, qty, spend) in totals.materials.items()
+        ])
+    session.commit()
+    return {"supplier_rows": len(totals.suppliers), "material_rows": len(totals.materials)}
+
+
+def supplier_spend(
+    session: Session,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+    supplier: Optional[str] = None,
+) -> List[dict]:
+    """Spend per supplier and month, months inclusive (YYYY-MM)."""
+    table = supplier_spend_table
+    query = select(table).order_by(table.c.month, table.c.supplier)
+    if month_from:
+        query = query.where(table.c.month >= month_from)
+    if month_to:
+        query = query.where(table.c.month <= month_to)
+    if supplier is not None:
+        query = query.where(table.c.supplier == supplier)
+    return [dict(row) for row in session.connection().execute(query).mappings()]
+
+
+def material_spend(
+    session: Session,
+    month_from: Optional[str] = None,
+    month_to: Optional[str] = None,
+    material_id: Optional[int] = None,
+) -> List[dict]:
+    """Quantity and spend per material and month, months inclusive (YYYY-MM)."""
+    table = material_spend_table
+    material = models.Material.__table__
+    query = (
+        select(table, material.c.sku, material.c.name)
+        .join_from(table, material, table.c.material_id == material.c.id)
+        .order_by(table.c.month, table.c.material_id)
+    )
+    if month_from:
+        query = query.where(table.c.month >= month_from)
+    if month_to:
+        query = query.where(table.c.month <= month_to)
+    if material_id is not None:
+        query = query.where(table.c.material_id == material_id)
+    return [dict(row) for row in session.connection().execute(query).mappings()]
+
+
+if __name__ == "__main__":
+    from app.database import engine, init_db
+    from app.pricing import rebuild_price_stats
+
+    init_db()
+    with Session(engine) as session:
+        print({**rebuild_spend_aggregates(session), **rebuild_price_stats(session)})
@@ -0,0 +1,44 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlmodel import Session
+
+from app import analytics, pricing
+from app.database import get_read_session, get_session
+
+router = APIRouter(prefix="/api/v1/analytics", tags=["analytics"])
+
+MONTH_PATTERN = r"^\d{4}-\d{2}$"
+
+@router.get("/spend/suppliers", operation_id="spend_by_supplier")
+def spend_by_supplier(
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN, description="Inclusive lower bound (YYYY-MM)"),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN, description="Inclusive upper bound (YYYY-MM)"),
+    supplier: Optional[str] = None,
+    session: Session = Depends(get_read_session)
+):
+    """Number of purchases and invoiced total per supplier and invoice month."""
+    return analytics.supplier_spend(session, month_from=month_from, month_to=month_to, supplier=supplier)
+
+@router.get("/spend/materials", operation_id="spend_by_material")
+def spend_by_material(
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN, description="Inclusive lower bound (YYYY-MM)"),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN, description="Inclusive upper bound (YYYY-MM)"),
+    material_id: Optional[int] = None,
+    session: Session = Depends(get_read_session)
+):
+    """Purchased quantity and spend per material and invoice month."""
+    return analytics.material_spend(session, month_from=month_from, month_to=month_to, material_id=material_id)
+
+@router.get("/prices/{material_id}", operation_id="material_price_stats")
+def material_price_stats(material_id: int, session: Session = Depends(get_read_session)):
+    """Last, min, max and average unit price paid for a material, with a rolling mean and deviation."""
+    stats = pricing.load_price_stats(session, [material_id]).get(material_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No prices recorded for this material")
+    return pricing.describe_stats(stats)
+
+@router.post("/rebuild", operation_id="rebuild_spend_aggregates")
+def rebuild_spend_aggregates(session: Session = Depends(get_session)):
+    """Recompute the spend aggregates and price statistics from all purchases (e.g. after a bulk load outside the API)."""
+    return {**analytics.rebuild_spend_aggregates(session), **pricing.rebuild_price_stats(session)}
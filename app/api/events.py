@@ -0,0 +1,29 @@
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app import events as feed
+from app.config import config
+
+router = APIRouter(prefix="/api/v1/events", tags=["events"])
+
+@router.get("", operation_id="stream_events")
+async def stream_events(
+    last_event_id: Optional[str] = Header(None, description="Set by EventSource when it reconnects"),
+    since: Optional[str] = Query(None, description="Event id to resume after, for clients that can't send Last-Event-ID"),
+):
+    """
+    Server-sent events for new purchases (``purchase.created``) and stock
+    changes (``stock.movement``, per material and transaction), replacing
+    polling of list_purchases. A ``reset`` event means events were missed
+    and the client should reload what it shows.
+    """
+    if config.EVENTS_BUFFER_SIZE <= 0:
+        raise HTTPException(status_code=404, detail="Event feed disabled")
+    return StreamingResponse(
+        feed.event_stream(last_event_id or since),
+        media_type="text/event-stream",
+        # No caching, and no response buffering by nginx
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
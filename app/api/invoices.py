@@ -1,132 +1,107 @@
 """
 Invoice upload and XML parsing endpoints.
+
+The parser client (:mod:`app.parser_client`, with httpx) is imported by the
+first request that needs it, so it doesn't add to worker start-up.
 """
 import logging
-from typing import Optional
-from fastapi import APIRouter, Depends, File, UploadFile, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, Body, Depends, File, Query, UploadFile, HTTPException
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
 from sqlmodel import Session
-import httpx
-from app import models
+from app import confirm, duplicates, models, tracing
 from app.database import get_session
+from app.duplicates import DuplicatePolicy, DuplicatePurchase
 from app.config import config
+from app.compression import sniff_encoding
+from app.uploads import UploadReader, UploadTooLarge, upload_http_error
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/invoices", tags=["invoices"])
 
+# Purchase items are flushed to the database in batches of this size while
+# the parser response is still streaming in
+ITEM_FLUSH_SIZE = 500
+
+
+def build_purchase_item(purchase_id: int, item_data: dict) -> models.PurchaseItem:
+    """Map one parsed invoice line to a PurchaseItem."""
+    return models.PurchaseItem(
+        purchase_id=purchase_id,
+        sku_raw=item_data.get('sku_raw'),
+        description=item_data.get('description'),
+        quantity=item_data.get('quantity', 0.0),
+        unit_price=item_data.get('unit_price'),
+        total_price=item_data.get('total_price')
+    )
+
 
-async def call_xml_parser(xml_content: bytes, filename: str) -> dict:
+async def create_purchase_from_parser_stream(events, session: Session, on_duplicate: str = "reject") -> tuple:
     """
-    Call the XML parser microservice to parse the invoice.
+    Create a Purchase record while the parsed invoice streams in.
+    
+    The Purchase row is inserted first so items can reference it, items are
+    flushed in batches of ITEM_FLUSH_SIZE as they arrive and the invoice
+    metadata (sent last by the parser) is filled in before the single
+    commit. On any error the transaction is rolled back. Traced as an
+    ``ingest`` span (with ``db.commit`` inside it).
     
     Args:
-        xml_content: Raw XML file content
-        filename: Name of the uploaded file
+        events: Async iterator from :func:`app.parser_client.iter_parser_events`
+        session: Database session
+        on_duplicate: Duplicate invoice policy (see :mod:`app.duplicates`)
         
     Returns:
-        Parsed invoice data as dict
-        
+        Tuple of (created Purchase record, number of items)
+    
     Raises:
-        HTTPException: If parser service fails or is not configured
+        DuplicatePurchase: If the invoice was already imported (or was
+            committed by a concurrent import meanwhile) and the policy is
+            not ``force``
     """
-    if not config.XML_PARSER_URL:
-        raise HTTPException(
-            status_code=503, 
-            detail="XML parser service not configured. Set XML_PARSER_URL environment variable."
-        )
-    
-    parser_url = f"{config.XML_PARSER_URL.rstrip('/')}/parse"
-    
-    try:
-        # Prepare headers
-        headers = {}
-        if config.XML_PARSER_TOKEN:
-            headers['Authorization'] = f'Bearer {config.XML_PARSER_TOKEN}'
-        
-        # Send file to parser service
-        files = {'file': (filename, xml_content, 'application/xml')}
-        
-        async with httpx.AsyncClient(timeout=config.XML_PARSER_TIMEOUT) as client:
-            logger.info(f"Calling XML parser at {parser_url} for file {filename}")
-            response = await client.post(parser_url, files=files, headers=headers)
+    purchase = models.Purchase()
+    items_count = 0
+    with tracing.span("ingest") as span:
+        try:
+            session.add(purchase)
+            session.flush()
             
-            if response.status_code == 200:
-                result = response.json()
-                logger.info(f"Successfully parsed {filename}")
-                return result
-            elif response.status_code == 401:
-                logger.error("XML parser authentication failed")
-                raise HTTPException(status_code=502, detail="Parser service authentication failed")
-            else:
-                error_detail = response.json().get('error', 'Unknown error') if response.text else 'Unknown error'
-                logger.error(f"Parser service error: {error_detail}")
-                raise HTTPException(
-                    status_code=502, 
-                    detail=f"Parser service error: {error_detail}"
-                )
+            # The key is claimed when the metadata is flushed; a concurrent
+            # import of the same invoice may have committed it since the check
+            with duplicates.key_conflicts_as_duplicates(session, purchase):
+                async for kind, payload in events:
+                    if kind == 'invoice_metadata':
+                        purchase.supplier = payload.get('supplier')
+                        purchase.invoice_number = payload.get('invoice_number')
+                        purchase.invoice_date = payload.get('invoice_date')
+                        purchase.total_amount = payload.get('total_amount')
+                        duplicates.check_duplicate(session, purchase, on_duplicate)
+                        continue
+                    
+                    session.add(build_purchase_item(purchase.id, payload))
+                    items_count += 1
+                    if items_count % ITEM_FLUSH_SIZE == 0:
+                        session.flush()
                 
-    except HTTPException:
-        # Re-raise HTTPException as-is
-        raise
-    except httpx.TimeoutException:
-        logger.error(f"Timeout calling XML parser for {filename}")
-        raise HTTPException(status_code=504, detail="Parser service timeout")
-    except httpx.RequestError as e:
-        logger.error(f"Request error calling XML parser: {e}")
-        raise HTTPException(status_code=502, detail=f"Cannot connect to parser service: {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error calling XML parser: {e}")
-        raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
-
-
-def create_purchase_from_parsed_xml(parsed_data: dict, session: Session) -> models.Purchase:
-    """
-    Create a Purchase record from parsed XML invoice data.
+                span.set(items=items_count)
+                session.commit()
+        except BaseException:
+            session.rollback()
+            raise
     
-    Args:
-        parsed_data: Parsed invoice data from XML parser
-        session: Database session
-        
-    Returns:
-        Created Purchase record
-    """
-    metadata = parsed_data.get('data', {}).get('invoice_metadata', {})
-    line_items = parsed_data.get('data', {}).get('line_items', [])
-    
-    # Create Purchase record
-    purchase = models.Purchase(
-        supplier=metadata.get('supplier'),
-        invoice_number=metadata.get('invoice_number'),
-        invoice_date=metadata.get('invoice_date'),
-        total_amount=metadata.get('total_amount')
-    )
-    session.add(purchase)
-    session.commit()
     session.refresh(purchase)
-    
-    logger.info(f"Created purchase {purchase.id} from XML invoice")
-    
-    # Create PurchaseItem records
-    for item_data in line_items:
-        purchase_item = models.PurchaseItem(
-            purchase_id=purchase.id,
-            sku_raw=item_data.get('sku_raw'),
-            description=item_data.get('description'),
-            quantity=item_data.get('quantity', 0.0),
-            unit_price=item_data.get('unit_price'),
-            total_price=item_data.get('total_price')
-        )
-        session.add(purchase_item)
-    
-    session.commit()
-    logger.info(f"Created {len(line_items)} purchase items for purchase {purchase.id}")
-    
-    return purchase
+    logger.info("Created purchase %s with %s items from XML invoice", purchase.id, items_count)
+    return purchase, items_count
 
 
 @router.post("/upload", status_code=201)
 async def upload_invoice(
     file: UploadFile = File(...),
+    on_duplicate: Optional[DuplicatePolicy] = Query(
+        None, description="reject (409), return_existing or force; defaults to PVAPP_DUPLICATE_POLICY"
+    ),
     session: Session = Depends(get_session)
 ):
     """
@@ -134,21 +109,32 @@ async def upload_invoice(
     
     For XML files:
     - Detects XML by file extension or MIME type
-    - Calls XML parser microservice for parsing
-    - Creates Purchase and PurchaseItem records from parsed data
+    - Accepts gzip/zstd compressed files (``.xml.gz``), which are forwarded
+      to the parser without being decompressed here
+    - Streams the upload to the XML parser microservice in chunks
+    - Creates Purchase and PurchaseItem records as parsed lines stream back
+    - Handles an invoice that was already imported according to ``on_duplicate``
     
     For other formats:
     - Returns error (not yet implemented)
     """
-    # Read file content
-    content = await file.read()
+    try:
+        reader = UploadReader(file)
+        head = await reader.peek()
+    except UploadTooLarge as e:
+        raise upload_http_error(e)
     
-    if not content:
+    if not head:
         raise HTTPException(status_code=400, detail="Empty file uploaded")
     
+    # Detect compressed files (.xml.gz) by magic bytes or extension
+    content_encoding = sniff_encoding(head, file.filename)
+    
     # Detect XML files
+    filename = (file.filename or "").lower()
     is_xml = (
-        file.filename and file.filename.lower().endswith('.xml') or
+        filename.endswith('.xml') or
+        content_encoding and filename.endswith(('.xml.gz', '.xml.zst')) or
         file.content_type and 'xml' in file.content_type.lower()
     )
     
@@ -158,43 +144,91 @@ async def upload_invoice(
             detail="Only XML invoice files are currently supported"
         )
     
-    logger.info(f"Processing XML invoice upload: {file.filename}, size: {len(content)} bytes")
+    logger.info("Processing XML invoice upload: %s", file.filename)
+    
+    from app.parser_client import stream_xml_parser
     
-    # Parse XML using microservice
+    policy = duplicates.resolve_policy(on_duplicate)
     try:
-        parsed_data = await call_xml_parser(content, file.filename or "invoice.xml")
+        async with stream_xml_parser(reader, file.filename or "invoice.xml", content_encoding) as events:
+            purchase, items_count = await create_purchase_from_parser_stream(events, session, policy)
+    except DuplicatePurchase as e:
+        logger.info("%s duplicates purchase %s", file.filename, e.purchase_id)
+        if policy != "return_existing":
+            raise duplicates.duplicate_http_error(e)
+        existing = session.get(models.Purchase, e.purchase_id)
+        return JSONResponse(status_code=200, content={
+            "success": True,
+            "duplicate": True,
+            "message": str(e),
+            "purchase_id": existing.id,
+            "invoice_number": existing.invoice_number,
+            "supplier": existing.supplier,
+            "total_amount": existing.total_amount,
+            "sha256": reader.sha256
+        })
     except HTTPException:
         # Re-raise HTTP exceptions from parser
         raise
     except Exception as e:
-        logger.error(f"Unexpected error parsing XML: {e}")
-        raise HTTPException(status_code=500, detail=f"Failed to parse XML: {e}")
-    
-    # Create purchase records from parsed data
-    try:
-        purchase = create_purchase_from_parsed_xml(parsed_data, session)
-        
-        return {
-            "success": True,
-            "message": "Invoice uploaded and parsed successfully",
-            "purchase_id": purchase.id,
-            "invoice_number": purchase.invoice_number,
-            "supplier": purchase.supplier,
-            "total_amount": purchase.total_amount,
-            "items_count": len(parsed_data.get('data', {}).get('line_items', []))
-        }
-        
-    except Exception as e:
-        logger.error(f"Error creating purchase from parsed XML: {e}", exc_info=True)
+        logger.error("Error creating purchase from parsed XML: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Failed to create purchase: {e}")
+    
+    logger.info("Processed %s: %s bytes, sha256: %s", file.filename, reader.size, reader.sha256)
+    
+    return {
+        "success": True,
+        "message": "Invoice uploaded and parsed successfully",
+        "purchase_id": purchase.id,
+        "invoice_number": purchase.invoice_number,
+        "supplier": purchase.supplier,
+        "total_amount": purchase.total_amount,
+        "items_count": items_count,
+        "sha256": reader.sha256
+    }
+
+
+class ConfirmRequest(BaseModel):
+    invoice_ids: Optional[List[int]] = None
+
+
+@router.post("/confirm")
+def confirm_invoices(
+    payload: Optional[ConfirmRequest] = Body(None),
+    chunk_size: Optional[int] = Query(None, ge=1, le=20000, description="Invoices per transaction; defaults to PVAPP_IMPORT_CHUNK_SIZE"),
+    on_duplicate: Optional[DuplicatePolicy] = Query(
+        None, description="reject (left VALIDATED), return_existing or force; defaults to PVAPP_DUPLICATE_POLICY"
+    ),
+    session: Session = Depends(get_session)
+):
+    """
+    Confirm VALIDATED invoices into purchases, items and stock movements.
+    
+    Takes the given ``invoice_ids`` or, without a body, every VALIDATED
+    invoice, and writes them a chunk per transaction with batched INSERTs
+    (see :mod:`app.confirm`). Returns counts, the purchase created for each
+    invoice, duplicates, failures and the throughput.
+    """
+    return confirm.confirm_invoices(
+        session,
+        invoice_ids=payload.invoice_ids if payload else None,
+        chunk_size=chunk_size or config.IMPORT_CHUNK_SIZE,
+        on_duplicate=on_duplicate,
+    )
 
 
 @router.get("/health")
 def invoice_health():
-    """Health check for invoice endpoints."""
+    """Health check for invoice endpoints, with per-parser-endpoint stats."""
+    from app.parser_client import parser_latency
+    from app.parser_pool import parser_pool
+    
     parser_configured = config.XML_PARSER_URL is not None
+    p95 = parser_latency.percentile(95)
     return {
         "status": "healthy",
         "xml_parser_configured": parser_configured,
-        "xml_parser_url": config.XML_PARSER_URL if parser_configured else None
+        "xml_parser_url": config.XML_PARSER_URL if parser_configured else None,
+        "xml_parser_endpoints": [endpoint.stats() for endpoint in parser_pool.endpoints],
+        "xml_parser_latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None
     }
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Optional
 from sqlmodel import Session, select
 from app import models
-from app.database import get_session
-from pydantic import BaseModel
-from app.parsers.invoice_xml import parse_invoice_products
+from app.database import get_read_session, get_session
+from pydantic import BaseModel, Field
+from app.config import config
+from app.compression import DecompressionError
+from app.uploads import UploadTooLarge, spool_upload, upload_http_error
+from app import bulk_import, caching, duplicates, export, pricing, tracing
+from app.duplicates import DuplicatePolicy, DuplicatePurchase
 
 router = APIRouter(prefix="/api/v1/purchases", tags=["purchases"])
 
@@ -23,6 +29,14 @@ class PurchaseCreate(BaseModel):
     total_amount: Optional[float] = None
     items: List[PurchaseItemCreate]
 
+class InvoiceIdentity(BaseModel):
+    supplier: Optional[str] = None
+    invoice_number: Optional[str] = None
+    invoice_date: Optional[str] = None
+
+class DuplicateCheckRequest(BaseModel):
+    invoices: List[InvoiceIdentity] = Field(..., max_length=50000)
+
 class PurchaseItemRead(BaseModel):
     id: int
     purchase_id: int
@@ -47,12 +61,50 @@ class PurchaseRead(BaseModel):
         from_attributes = True
 
 @router.get("/", response_model=List[PurchaseRead], operation_id="list_purchases")
-def list_purchases(session: Session = Depends(get_session)):
-    purchases = session.exec(select(models.Purchase).order_by(models.Purchase.id.desc())).all()
-    return purchases
+def list_purchases(request: Request, session: Session = Depends(get_read_session)):
+    """
+    List purchases, newest first.
+    
+    Responses carry an ETag; send it back in If-None-Match to get a 304
+    while no purchase has changed.
+    """
+    version = caching.get_versions(session, [caching.PURCHASES])[caching.PURCHASES]
+
+    def render():
+        purchases = session.exec(select(models.Purchase).order_by(models.Purchase.id.desc())).all()
+        return [
+            PurchaseRead(
+                id=p.id,
+                supplier=p.supplier,
+                invoice_number=p.invoice_number,
+                invoice_date=p.invoice_date,
+                total_amount=p.total_amount,
+                created_at=str(p.created_at)
+            ).model_dump()
+            for p in purchases
+        ]
+
+    etag = caching.make_etag("purchases", version)
+    return caching.cached_json_response(request, caching.PURCHASES, etag, render)
+
+ON_DUPLICATE_QUERY = Query(
+    None, description="reject (409), return_existing or force; defaults to PVAPP_DUPLICATE_POLICY"
+)
+
+def existing_purchase_response(session: Session, purchase_id: int) -> JSONResponse:
+    existing = session.get(models.Purchase, purchase_id)
+    return JSONResponse(status_code=200, content={
+        "id": existing.id,
+        "created_at": str(existing.created_at),
+        "duplicate": True
+    })
 
 @router.post("/", status_code=201, operation_id="create_purchase")
-def create_purchase(payload: PurchaseCreate, session: Session = Depends(get_session)):
+def create_purchase(
+    payload: PurchaseCreate,
+    on_duplicate: Optional[DuplicatePolicy] = ON_DUPLICATE_QUERY,
+    session: Session = Depends(get_session)
+):
     if not payload.items:
         raise HTTPException(status_code=400, detail="items required")
 
@@ -65,8 +117,17 @@ def create_purchase(payload: PurchaseCreate, session: Session = Depends(get_sess
         invoice_date=payload.invoice_date,
         total_amount=purchase_total
     )
-    session.add(purchase)
-    session.commit()
+    policy = duplicates.resolve_policy(on_duplicate)
+    try:
+        duplicates.check_duplicate(session, purchase, policy)
+        session.add(purchase)
+        # A concurrent import of the same invoice may commit in between
+        with duplicates.key_conflicts_as_duplicates(session, purchase):
+            session.commit()
+    except DuplicatePurchase as e:
+        if policy == "return_existing":
+            return existing_purchase_response(session, e.purchase_id)
+        raise duplicates.duplicate_http_error(e)
     session.refresh(purchase)
 
     for it in payload.items:
@@ -98,8 +159,106 @@ def create_purchase(payload: PurchaseCreate, session: Session = Depends(get_sess
 
     return {"id": purchase.id, "created_at": str(purchase.created_at)}
 
+@router.post("/import", operation_id="import_purchases")
+async def import_purchases(
+    request: Request,
+    chunk_size: Optional[int] = Query(None, ge=1, le=20000, description="Purchases per transaction; defaults to PVAPP_IMPORT_CHUNK_SIZE"),
+    on_duplicate: Optional[DuplicatePolicy] = ON_DUPLICATE_QUERY,
+    session: Session = Depends(get_session)
+):
+    """
+    Bulk import purchases from an NDJSON body, one PurchaseCreate per line.
+    
+    The body (gzip/zstd Content-Encoding accepted, up to
+    PVAPP_MAX_IMPORT_SIZE) is spooled to a temporary file, then validated
+    line by line and committed in chunks. The response streams one NDJSON result per input line
+    (`line`, `status`: created, existing, duplicate or error, `id`,
+    `error`) followed by a `summary` line.
+    """
+    try:
+        body = await bulk_import.spool_body(request.stream(), config.MAX_IMPORT_SIZE)
+    except (UploadTooLarge, DecompressionError) as e:
+        raise upload_http_error(e)
+    
+    def results():
+        with body:
+            yield from bulk_import.import_purchases(
+                bulk_import.iter_lines(body),
+                session,
+                schema=PurchaseCreate,
+                chunk_size=chunk_size or config.IMPORT_CHUNK_SIZE,
+                on_duplicate=on_duplicate
+            )
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@router.post("/duplicates/check", operation_id="check_duplicate_purchases")
+def check_duplicate_purchases(payload: DuplicateCheckRequest, session: Session = Depends(get_session)):
+    """
+    Look up many invoices at once before importing them.
+    
+    Returns, in request order, the id of the purchase that already holds
+    each invoice (same normalised supplier, number and date), or null.
+    """
+    keys = [duplicates.invoice_key(i.supplier, i.invoice_number, i.invoice_date) for i in payload.invoices]
+    existing = duplicates.find_duplicates(session, keys)
+    return {
+        "duplicates": existing,
+        "duplicate_count": sum(1 for purchase_id in existing if purchase_id is not None)
+    }
+
+@router.get("/export", operation_id="export_purchases")
+def export_purchases(
+    format: str = Query("csv", description="csv, ndjson, parquet or arrow"),
+    date_from: Optional[str] = Query(None, description="Inclusive invoice_date lower bound (YYYY-MM-DD)"),
+    date_to: Optional[str] = Query(None, description="Inclusive invoice_date upper bound (YYYY-MM-DD)"),
+    supplier: Optional[str] = None,
+    cursor: int = Query(0, ge=0, description="Resume after this item_id"),
+    chunk_size: int = Query(5000, ge=1, le=50000),
+    session: Session = Depends(get_read_session)
+):
+    """
+    Stream purchases joined with their items and materials.
+    
+    Rows are ordered by item_id and read in chunks, so memory stays flat for
+    any export size. To resume an interrupted export, pass the last received
+    item_id as `cursor`.
+    """
+    if format not in export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {format}")
+    if format in export.BINARY_FORMATS and export.load_pyarrow() is None:
+        raise HTTPException(status_code=501, detail=f"{format} export requires the 'pyarrow' package")
+
+    chunks = export.iter_export_chunks(
+        session,
+        date_from=date_from,
+        date_to=date_to,
+        supplier=supplier,
+        cursor=cursor,
+        chunk_size=chunk_size
+    )
+    return StreamingResponse(
+        export.stream_export(format, chunks),
+        media_type=export.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="purchases.{format}"'}
+    )
+
 @router.get("/{purchase_id}", operation_id="get_purchase_detail")
-def get_purchase_detail(purchase_id: int, session: Session = Depends(get_session)):
+def get_purchase_detail(purchase_id: int, request: Request, session: Session = Depends(get_read_session)):
+    """
+    Purchase with its items and their materials.
+    
+    The ETag changes whenever the purchase, its items or any material
+    changes; a matching If-None-Match is answered with 304.
+    """
+    key = caching.purchase_key(purchase_id)
+    versions = caching.get_versions(session, [key, caching.MATERIALS])
+    etag = caching.make_etag("purchase", purchase_id, versions[key], versions[caching.MATERIALS])
+    return caching.cached_json_response(
+        request, key, etag, lambda: _render_purchase_detail(purchase_id, session)
+    )
+
+def _render_purchase_detail(purchase_id: int, session: Session) -> dict:
     purchase = session.get(models.Purchase, purchase_id)
     if not purchase:
         raise HTTPException(status_code=404, detail="Not Found")
@@ -123,28 +282,43 @@ def get_purchase_detail(purchase_id: int, session: Session = Depends(get_session
             "material": {"id": mat.id, "sku": mat.sku, "name": mat.name} if mat else None
         })
 
-    return {"purchase": purchase, "items": result_items}
+    return jsonable_encoder({"purchase": purchase, "items": result_items})
 
 @router.post("/upload-xml", status_code=201, operation_id="upload_invoice_xml")
 async def upload_invoice_xml(
     file: UploadFile = File(...),
+    on_duplicate: Optional[DuplicatePolicy] = ON_DUPLICATE_QUERY,
     session: Session = Depends(get_session)
 ):
     """
     Upload și parsare automată a facturii XML în format UBL (e-Factura RO).
     Creează automat un purchase cu toate produsele din factură.
+    Acceptă și fișiere comprimate (.xml.gz, .xml.zst).
+    O factură deja importată (același furnizor, număr și dată) este tratată
+    conform `on_duplicate`.
     """
-    if not file.filename.endswith('.xml'):
+    if not file.filename.endswith(('.xml', '.xml.gz', '.xml.zst')):
         raise HTTPException(status_code=400, detail="Doar fișiere XML sunt acceptate")
     
-    # Citește conținutul fișierului
-    xml_content = await file.read()
-    
+    # Copiază fișierul în bucăți într-un fișier temporar (pe disc peste prag),
+    # decomprimând .xml.gz / .xml.zst din mers, cu limite de dimensiune
     try:
-        # Parsează XML-ul
-        invoice_data = parse_invoice_products(xml_content.decode('utf-8'))
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Eroare la parsarea XML: {str(e)}")
+        with tracing.span("upload.read", filename=file.filename):
+            upload = await spool_upload(file, decode=True)
+    except (UploadTooLarge, DecompressionError) as e:
+        raise upload_http_error(e)
+    
+    # Parserul UBL (defusedxml, lxml) se importă la primul upload, nu la pornire
+    from app.parsers.invoice_xml import parse_invoice_products
+    
+    with upload:
+        try:
+            # Parsează XML-ul direct din fișier
+            with tracing.span("parse", size=upload.size) as parse_span:
+                invoice_data = parse_invoice_products(upload.file)
+                parse_span.set(products=len(invoice_data["products"]))
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Eroare la parsarea XML: {str(e)}")
     
     if not invoice_data["products"]:
         raise HTTPException(status_code=400, detail="Nu s-au găsit produse în factură")
@@ -156,8 +330,27 @@ async def upload_invoice_xml(
         invoice_date=invoice_data["invoice_date"],
         total_amount=invoice_data["total_amount"]
     )
-    session.add(purchase)
-    session.commit()
+    
+    # Verifică dacă factura a mai fost importată (căutare în index)
+    policy = duplicates.resolve_policy(on_duplicate)
+    try:
+        duplicates.check_duplicate(session, purchase, policy)
+        session.add(purchase)
+        # Un import concurent al aceleiași facturi poate face commit între timp
+        with duplicates.key_conflicts_as_duplicates(session, purchase):
+            session.commit()
+    except DuplicatePurchase as e:
+        if policy == "return_existing":
+            return JSONResponse(status_code=200, content={
+                "success": True,
+                "duplicate": True,
+                "purchase_id": e.purchase_id,
+                "invoice_number": invoice_data["invoice_number"],
+                "supplier": invoice_data["supplier"],
+                "total_amount": invoice_data["total_amount"]
+            })
+        raise duplicates.duplicate_http_error(e)
+    
     session.refresh(purchase)
     
     # Creează items pentru fiecare produs
@@ -171,21 +364,21 @@ async def upload_invoice_xml(
     for product in invoice_data["products"]:
         # Încearcă să găsești material după SKU
         material = None
-        if product["sku"]:
+        if product.sku:
             material = session.exec(
-                select(models.Material).where(models.Material.sku == product["sku"])
+                select(models.Material).where(models.Material.sku == product.sku)
             ).first()
             if material:
-                material_cache[product["sku"]] = material
+                material_cache[product.sku] = material
         
         # Dacă nu există material, creează unul nou
-        if not material and product["name"]:
+        if not material and product.name:
             material = models.Material(
-                sku=product["sku"] or None,
-                name=product["name"],
-                unit=product["unit"]
+                sku=product.sku or None,
+                name=product.name,
+                unit=product.unit
             )
-            new_materials.append((product["sku"], material))
+            new_materials.append((product.sku, material))
             session.add(material)
     
     # Commit toate materialele noi odată
@@ -196,34 +389,43 @@ async def upload_invoice_xml(
             if sku:
                 material_cache[sku] = material
     
+    # Statisticile de preț ale materialelor din factură, citite o singură dată
+    price_stats = pricing.load_price_stats(session, (m.id for m in material_cache.values()))
+    price_anomalies = []
+    
     # A doua trecere: creează purchase items și stock movements
     for product in invoice_data["products"]:
         # Folosește cache-ul pentru a obține materialul
-        material = material_cache.get(product["sku"]) if product["sku"] else None
+        material = material_cache.get(product.sku) if product.sku else None
         
         # Creează purchase item
         pi = models.PurchaseItem(
             purchase_id=purchase.id,
             material_id=material.id if material else None,
-            sku_raw=product["sku"],
-            sku_clean=product["sku"],
-            description=product["name"],
-            quantity=product["quantity"],
-            unit_price=product["unit_price"],
-            total_price=product["total_price"]
+            sku_raw=product.sku,
+            sku_clean=product.sku,
+            description=product.name,
+            quantity=product.quantity,
+            unit_price=product.unit_price,
+            total_price=product.total_price
         )
         purchase_items.append(pi)
         session.add(pi)
         
+        # Marchează prețurile care deviază de la media materialului
+        anomaly = pricing.price_anomaly(price_stats.get(material.id), pi.unit_price) if material else None
+        if anomaly:
+            price_anomalies.append((pi, anomaly))
+        
         # Creează stock movement dacă există material
         if material:
             sm = models.StockMovement(
                 material_id=material.id,
-                change=product["quantity"],
+                change=product.quantity,
                 movement_type="purchase_in",
                 reference_type="purchase",
                 reference_id=purchase.id,
-                quantity=product["quantity"]
+                quantity=product.quantity
             )
             stock_movements.append(sm)
             session.add(sm)
@@ -246,5 +448,15 @@ async def upload_invoice_xml(
         "supplier": invoice_data["supplier"],
         "total_amount": invoice_data["total_amount"],
         "items_created": len(created_items),
-        "items": created_items
+        "items": created_items,
+        "price_anomalies": [
+            {
+                "item_id": pi.id,
+                "material_id": pi.material_id,
+                "description": pi.description,
+                "unit_price": pi.unit_price,
+                **anomaly
+            }
+            for pi, anomaly in price_anomalies
+        ]
     }
@@ -0,0 +1,31 @@
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlmodel import Session
+
+from app import search as full_text
+from app.database import get_read_session, get_session
+
+router = APIRouter(prefix="/api/v1/search", tags=["search"])
+
+@router.get("", operation_id="search")
+def search(
+    q: str = Query(..., min_length=1, max_length=200, description="Words to find, each matched as a prefix"),
+    kind: Optional[Literal["material", "item"]] = Query(None, description="Only materials or only purchase items"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    session: Session = Depends(get_read_session)
+):
+    """Ranked full-text search over material names and purchase line descriptions (diacritics-insensitive)."""
+    try:
+        return full_text.search(session, q, kind=kind, limit=limit, offset=offset)
+    except full_text.SearchUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+@router.post("/rebuild", operation_id="rebuild_search_index")
+def rebuild_search_index(session: Session = Depends(get_session)):
+    """Re-index all materials and purchase items (e.g. after a bulk load outside the API)."""
+    try:
+        return full_text.rebuild_search_index(session)
+    except full_text.SearchUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
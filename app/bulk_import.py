@@ -0,0 +1,216 @@
+"""
+Streaming NDJSON bulk import of purchases.
+
+The request body is first spooled to a temporary file (the streamed
+response can't read the body while it is being sent), then read line by
+line, each line validated on its own (one ``PurchaseCreate`` object per
+line) and valid purchases are written in chunks: one flush inserts a chunk's purchases, a second its items and stock
+movements (batched multi-row INSERTs), then the chunk is committed. Duplicate
+invoices are resolved for a whole chunk with a single index query. A
+result line is streamed back per input line, so a caller can resume after
+the last committed line; invalid lines are reported straight away, so
+results are not necessarily in input order.
+"""
+import json
+import logging
+import tempfile
+from collections import Counter
+from typing import AsyncIterator, BinaryIO, Iterator, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError
+from sqlmodel import Session
+
+from app import duplicates, models
+from app.config import config
+from app.uploads import UploadTooLarge
+
+logger = logging.getLogger(__name__)
+
+# Longest accepted input line (bytes)
+MAX_LINE_SIZE = 1024 * 1024
+
+
+async def spool_body(chunks: AsyncIterator[bytes], max_size: int) -> BinaryIO:
+    """Copy a request body into a spooled temporary file, positioned at the start."""
+    spool = tempfile.SpooledTemporaryFile(max_size=config.UPLOAD_SPOOL_THRESHOLD)
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise UploadTooLarge(f"Import body exceeds limit of {max_size} bytes")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def iter_lines(file: BinaryIO) -> Iterator[bytes]:
+    """Yield the lines of ``file`` without their newline."""
+    while True:
+        line = file.readline(MAX_LINE_SIZE + 1)
+        if not line:
+            return
+        if len(line) > MAX_LINE_SIZE:
+            raise ValueError(f"Line longer than {MAX_LINE_SIZE} bytes")
+        yield line.rstrip(b"\r\n")
+
+
+def _result(line: int, status: str, **fields) -> dict:
+    return {"line": line, "status": status, **fields}
+
+
+def _encode(record: dict) -> bytes:
+    return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _validation_message(e: Exception) -> str:
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(str(p) for p in err['loc']) or 'line'}: {err['msg']}" for err in e.errors())
+    return str(e)
+
+
+def add_purchases(session: Session, entries: List[Tuple[models.Purchase, List[dict]]]):
+    """
+    Add purchases with their items (PurchaseItem fields as dicts) and a
+    stock movement per item with a material, in two batched flushes: the
+    purchases first, for their ids, then all items and movements, each
+    table written with multi-row INSERTs rather than a statement per row.
+    """
+    session.add_all([purchase for purchase, _ in entries])
+    session.flush()
+    rows = []
+    for purchase, items in entries:
+        for item in items:
+            rows.append(models.PurchaseItem(purchase_id=purchase.id, **item))
+            if item.get("material_id") is not None:
+                rows.append(models.StockMovement(
+                    material_id=item["material_id"],
+                    change=item["quantity"],
+                    movement_type="purchase_in",
+                    reference_type="purchase",
+                    reference_id=purchase.id,
+                    quantity=item["quantity"]
+                ))
+    session.add_all(rows)
+    session.flush()
+
+
+def import_chunk(session: Session, batch: List[Tuple[int, BaseModel]], policy: str) -> List[dict]:
+    """Write one chunk of validated purchases in a single transaction and return its results."""
+    keys = [duplicates.invoice_key(p.supplier, p.invoice_number, p.invoice_date) for _, p in batch]
+    existing = duplicates.find_duplicates(session, keys)
+
+    created = []  # (line, payload, purchase)
+    skipped = []  # (line, existing purchase id, or the Purchase created earlier in this chunk)
+    first_in_chunk = {}
+    for (line, payload), key, existing_id in zip(batch, keys, existing):
+        duplicate_of = existing_id if existing_id is not None else first_in_chunk.get(key)
+        if duplicate_of is not None and policy != "force":
+            skipped.append((line, duplicate_of))
+            continue
+
+        purchase = models.Purchase(
+            supplier=payload.supplier,
+            invoice_number=payload.invoice_number,
+            invoice_date=payload.invoice_date,
+            total_amount=payload.total_amount or sum(i.quantity * i.unit_price for i in payload.items)
+        )
+        if duplicate_of is not None:
+            duplicates.allow_duplicate(session, purchase)
+        elif key is not None:
+            first_in_chunk[key] = purchase
+        created.append((line, payload, purchase))
+
+    try:
+        add_purchases(session, [
+            (purchase, [{
+                "material_id": it.material_id,
+                "sku_raw": it.sku_raw,
+                "sku_clean": it.sku_clean,
+                "description": it.description,
+                "quantity": it.quantity,
+                "unit_price": it.unit_price,
+                "total_price": it.quantity * it.unit_price,
+            } for it in payload.items])
+            for _, payload, purchase in created
+        ])
+        # Read the ids now; the commit expires the objects
+        ids = {id(purchase): purchase.id for _, _, purchase in created}
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error("Bulk import chunk of %s purchases failed: %s", len(batch), e)
+        return [_result(line, "error", error=f"Chunk not imported: {e}") for line, _ in batch]
+    finally:
+        # Don't keep a chunk's objects in the identity map
+        session.expunge_all()
+
+    results = [(line, _result(line, "created", id=ids[id(purchase)])) for line, _, purchase in created]
+    for line, duplicate_of in skipped:
+        purchase_id = duplicate_of if isinstance(duplicate_of, int) else ids[id(duplicate_of)]
+        if policy == "return_existing":
+            results.append((line, _result(line, "existing", id=purchase_id)))
+        else:
+            results.append((line, _result(
+                line, "duplicate", id=purchase_id, error=f"Invoice already imported as purchase {purchase_id}"
+            )))
+    return [result for _, result in sorted(results, key=lambda r: r[0])]
+
+
+def import_purchases(
+    lines: Iterator[bytes],
+    session: Session,
+    schema: type,
+    chunk_size: int,
+    on_duplicate: Optional[str] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Import NDJSON purchase lines and yield one NDJSON result per line.
+
+    Each result has the 1-based input ``line`` and a ``status``: ``created``
+    (with the new ``id``), ``existing`` / ``duplicate`` (with the ``id`` of
+    the purchase already holding the invoice, per the duplicate policy) or
+    ``error``. A final ``{"summary": {...}}`` line carries the counts.
+    """
+    policy = duplicates.resolve_policy(on_duplicate)
+    counts = Counter()
+    batch = []
+    line = 0
+
+    def flush_batch():
+        results = import_chunk(session, batch, policy)
+        batch.clear()
+        for result in results:
+            counts[result["status"]] += 1
+        return [_encode(result) for result in results]
+
+    try:
+        for raw in lines:
+            line += 1
+            if not raw.strip():
+                continue
+            try:
+                payload = schema.model_validate_json(raw)
+                if not payload.items:
+                    raise ValueError("items required")
+            except ValueError as e:
+                counts["error"] += 1
+                yield _encode(_result(line, "error", error=_validation_message(e)))
+                continue
+
+            batch.append((line, payload))
+            if len(batch) >= chunk_size:
+                for result in flush_batch():
+                    yield result
+    except ValueError as e:
+        counts["error"] += 1
+        yield _encode(_result(line + 1, "error", error=str(e)))
+    if batch:
+        for result in flush_batch():
+            yield result
+
+    logger.info("Bulk import of %s lines: %s", line, dict(counts))
+    yield _encode({"summary": {"lines": line, **counts}})
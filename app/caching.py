@@ -0,0 +1,194 @@
+"""
+Conditional GET and response caching for the purchase read endpoints.
+
+Every write path goes through the ORM, so an ``after_flush`` listener bumps
+version counters (:class:`app.models.DataVersion`) in the same transaction
+as the write: ``purchases`` for any purchase change, ``purchase:<id>`` for
+a purchase or its items and ``materials`` for materials, which appear in
+purchase details. ETags are built from these counters alone, so a request
+with a matching ``If-None-Match`` is answered 304 after a single indexed
+lookup, without loading any purchase rows.
+
+Rendered bodies are kept in a small in-process LRU (RESPONSE_CACHE_SIZE
+entries, RESPONSE_CACHE_TTL seconds) tagged with the ETag they were built
+for; committed writes evict the entries they touched.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Callable, Dict, Iterable, Optional
+
+from fastapi import Request, Response
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import config
+
+PURCHASES = "purchases"
+MATERIALS = "materials"
+
+# Session.info key collecting the version keys bumped by the open transaction
+_PENDING_KEY = "changed_versions"
+
+
+def purchase_key(purchase_id: int) -> str:
+    return f"purchase:{purchase_id}"
+
+
+def changed_version_keys(session: Session) -> set:
+    """Version keys affected by the objects pending in ``session``'s flush."""
+    keys = set()
+    dirty = session.dirty
+    for obj in chain(session.new, dirty, session.deleted):
+        if obj in dirty and not session.is_modified(obj):
+            continue
+        if isinstance(obj, models.Purchase):
+            keys.update((PURCHASES, purchase_key(obj.id)))
+        elif isinstance(obj, models.PurchaseItem):
+            keys.add(purchase_key(obj.purchase_id))
+        elif isinstance(obj, models.Material):
+            keys.add(MATERIALS)
+    return keys
+
+
+def bump_versions(session: Session, keys: Iterable[str]):
+    """
+    Increment the version counters for ``keys`` in the session's transaction.
+
+    Called automatically after each ORM flush; code writing through Core
+    statements must call it for the keys it touched.
+    """
+    keys = set(keys)
+    if not keys:
+        return
+    table = models.DataVersion.__table__
+    connection = session.connection()
+    result = connection.execute(
+        table.update().where(table.c.key.in_(keys)).values(version=table.c.version + 1)
+    )
+    if result.rowcount < len(keys):
+        existing = set(connection.execute(select(table.c.key).where(table.c.key.in_(keys))).scalars())
+        connection.execute(table.insert(), [{"key": key, "version": 1} for key in keys - existing])
+    session.info.setdefault(_PENDING_KEY, set()).update(keys)
+
+
+def get_versions(session: Session, keys: Iterable[str]) -> Dict[str, int]:
+    """Current version of each key (0 for keys never written)."""
+    keys = list(keys)
+    table = models.DataVersion.__table__
+    rows = session.connection().execute(
+        select(table.c.key, table.c.version).where(table.c.key.in_(keys))
+    )
+    versions = dict.fromkeys(keys, 0)
+    versions.update({key: version for key, version in rows})
+    return versions
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_after_flush(session, flush_context):
+    bump_versions(session, changed_version_keys(session))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    keys = session.info.pop(_PENDING_KEY, None)
+    if keys:
+        response_cache.invalidate(keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+class ResponseCache:
+    """
+    LRU cache of rendered response bodies with a TTL.
+
+    Entries are keyed by version key and remember the ETag they were
+    rendered for, so a stale entry is never served even if an eviction was
+    missed (e.g. a write from another process).
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (etag, body, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key: str, etag: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            cached_etag, body, expires_at = entry
+            if cached_etag != etag or self.clock() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def put(self, key: str, etag: str, body: bytes):
+        max_entries = config.RESPONSE_CACHE_SIZE
+        if max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (etag, body, self.clock() + config.RESPONSE_CACHE_TTL)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keys: Iterable[str]):
+        """Drop the entries for ``keys``; a materials change drops every purchase detail."""
+        keys = set(keys)
+        with self._lock:
+            if MATERIALS in keys:
+                keys.update(k for k in self._entries if k.startswith("purchase:"))
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Shared by all requests in this process
+response_cache = ResponseCache()
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from version parts, e.g. ``"purchase-7-3-12"``."""
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of ``etag`` against an If-None-Match header value."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+
+def cached_json_response(request: Request, key: str, etag: str, render: Callable[[], object]) -> Response:
+    """
+    Answer a read with 304, a cached body or a freshly rendered one.
+
+    ``render`` is only called on a miss; it returns JSON-serialisable data.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body = response_cache.get(key, etag)
+    headers["X-Cache"] = "HIT" if body is not None else "MISS"
+    if body is None:
+        body = json.dumps(render(), ensure_ascii=False).encode("utf-8")
+        response_cache.put(key, etag, body)
+    return Response(content=body, media_type="application/json", headers=headers)
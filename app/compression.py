@@ -0,0 +1,276 @@
+"""
+Content-Encoding support for compressed XML uploads.
+
+UBL invoices compress very well, so clients may send request bodies (or
+``.xml.gz`` files) encoded with gzip or zstd. Everything here decodes
+incrementally and enforces a ceiling on the decompressed size so a small
+compressed payload cannot expand into an unbounded amount of memory.
+"""
+import json
+import zlib
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Upper bound on the output produced per decompress() call for zlib streams
+_CHUNK_OUTPUT = 64 * 1024
+
+
+class DecompressionError(ValueError):
+    """Raised when an encoded payload is corrupt or uses an unknown encoding."""
+
+
+class DecompressionLimitExceeded(DecompressionError):
+    """Raised when the decoded payload grows beyond the configured limit."""
+
+
+def supported_encodings() -> list:
+    """Return the content codings this process can decode, preferred first."""
+    encodings = ["gzip", "deflate"]
+    if zstandard is not None:
+        encodings.insert(0, "zstd")
+    return encodings
+
+
+def normalize_encoding(value: Optional[str]) -> Optional[str]:
+    """
+    Normalise a Content-Encoding header value.
+
+    Returns None for identity (no encoding) and the lower-cased coding name
+    otherwise. Stacked codings (``gzip, br``) are rejected.
+    """
+    if not value:
+        return None
+    value = value.strip().lower()
+    if value in ("", "identity"):
+        return None
+    if value == "x-gzip":
+        return "gzip"
+    if "," in value:
+        raise DecompressionError(f"Stacked content encodings are not supported: {value}")
+    return value
+
+
+def sniff_encoding(data: bytes, filename: Optional[str] = None) -> Optional[str]:
+    """
+    Detect a compressed file from its magic bytes or file extension.
+
+    Used for ``.xml.gz`` uploads that arrive without a Content-Encoding header.
+    """
+    if data.startswith(GZIP_MAGIC):
+        return "gzip"
+    if data.startswith(ZSTD_MAGIC):
+        return "zstd"
+    if filename:
+        name = filename.lower()
+        if name.endswith(".gz"):
+            return "gzip"
+        if name.endswith(".zst"):
+            return "zstd"
+    return None
+
+
+def strip_compression_suffix(filename: str) -> str:
+    """Return ``invoice.xml`` for ``invoice.xml.gz`` (or ``.zst``)."""
+    for suffix in (".gz", ".zst"):
+        if filename.lower().endswith(suffix):
+            return filename[: -len(suffix)]
+    return filename
+
+
+class StreamDecoder:
+    """
+    Incremental decoder for a single content coding with a size ceiling.
+
+    Feed compressed chunks to :meth:`decompress` and call :meth:`flush` once
+    the input is exhausted. :class:`DecompressionLimitExceeded` is raised as
+    soon as the decoded output passes ``max_size`` bytes.
+    """
+
+    def __init__(self, encoding: str, max_size: int):
+        self.encoding = encoding
+        self.max_size = max_size
+        self.size = 0
+
+        if encoding == "gzip":
+            self._zlib = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            # Accept both zlib-wrapped and raw deflate streams
+            self._zlib = zlib.decompressobj(wbits=32 + zlib.MAX_WBITS)
+        elif encoding == "zstd":
+            if zstandard is None:
+                raise DecompressionError("zstd encoding requires the 'zstandard' package")
+            self._zlib = None
+            # The writer hands each decoded step (at most _CHUNK_OUTPUT) to
+            # _ZstdSink, which checks the limit before the next one is made
+            self._zstd_out = _ZstdSink(self)
+            self._zstd = zstandard.ZstdDecompressor().stream_writer(self._zstd_out, write_size=_CHUNK_OUTPUT)
+        else:
+            raise DecompressionError(f"Unsupported content encoding: {encoding}")
+
+    def _account(self, data: bytes) -> bytes:
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise DecompressionLimitExceeded(
+                f"Decompressed payload exceeds limit of {self.max_size} bytes"
+            )
+        return data
+
+    def decompress(self, chunk: bytes) -> bytes:
+        """Decode one chunk of compressed input."""
+        try:
+            if self._zlib is None:
+                self._zstd.write(chunk)
+                return self._zstd_out.take()
+
+            parts = []
+            data = chunk
+            while data:
+                out = self._zlib.decompress(data, _CHUNK_OUTPUT)
+                parts.append(self._account(out))
+                data = self._zlib.unconsumed_tail
+                if self._zlib.eof:
+                    break
+            return b"".join(parts)
+        except DecompressionLimitExceeded:
+            raise
+        except Exception as e:
+            raise DecompressionError(f"Corrupt {self.encoding} payload: {e}")
+
+    def flush(self) -> bytes:
+        """Return any buffered output and verify the stream was complete."""
+        if self._zlib is None:
+            return b""
+        try:
+            out = self._zlib.flush()
+        except zlib.error as e:
+            raise DecompressionError(f"Corrupt {self.encoding} payload: {e}")
+        if not self._zlib.eof:
+            raise DecompressionError(f"Truncated {self.encoding} payload")
+        return self._account(out)
+
+
+class _ZstdSink:
+    """Output side of a zstd stream writer, accounting for each step as it is decoded."""
+
+    def __init__(self, decoder: StreamDecoder):
+        self.decoder = decoder
+        self.parts = []
+
+    def write(self, data) -> int:
+        self.parts.append(self.decoder._account(bytes(data)))
+        return len(data)
+
+    def take(self) -> bytes:
+        out = b"".join(self.parts)
+        self.parts.clear()
+        return out
+
+
+class RequestDecompressionMiddleware:
+    """
+    ASGI middleware that decodes compressed request bodies.
+
+    Requests to ``paths`` carrying ``Content-Encoding: gzip|deflate|zstd``
+    are decoded on the fly before the body reaches the multipart parser, so
+    handlers see a plain request. Oversized or corrupt bodies are answered
+    with 413/400 before the handler produces a response. ``limits`` maps a
+    path prefix to its own size ceiling getter, for routes that accept more
+    than ``max_size_getter()`` allows.
+    """
+
+    def __init__(self, app, paths, max_size_getter, limits=None):
+        self.app = app
+        self.paths = tuple(paths)
+        self.max_size_getter = max_size_getter
+        self.limits = dict(limits or {})
+
+    def max_size(self, path: str) -> int:
+        getter = next((g for prefix, g in self.limits.items() if path.startswith(prefix)), self.max_size_getter)
+        return getter()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        headers = [(k, v) for k, v in scope["headers"]]
+        raw_encoding = next((v for k, v in headers if k == b"content-encoding"), None)
+        if raw_encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            encoding = normalize_encoding(raw_encoding.decode("latin-1"))
+            decoder = StreamDecoder(encoding, self.max_size(scope["path"])) if encoding else None
+        except DecompressionError as e:
+            await _send_error(send, 415, str(e))
+            return
+        if decoder is None:
+            await self.app(scope, receive, send)
+            return
+
+        scope = dict(scope)
+        scope["headers"] = [
+            (k, v) for k, v in headers if k not in (b"content-encoding", b"content-length")
+        ]
+
+        rejected = False
+        response_started = False
+
+        async def reject(e: DecompressionError):
+            nonlocal rejected
+            if rejected or response_started:
+                return
+            rejected = True
+            status = 413 if isinstance(e, DecompressionLimitExceeded) else 400
+            await _send_error(send, status, str(e))
+
+        async def decoded_receive():
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            try:
+                body = decoder.decompress(message.get("body", b""))
+                more_body = message.get("more_body", False)
+                if not more_body:
+                    body += decoder.flush()
+            except DecompressionError as e:
+                # Answer right away; whatever the handler makes of the
+                # aborted body afterwards is discarded.
+                await reject(e)
+                raise
+            return {"type": "http.request", "body": body, "more_body": more_body}
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, decoded_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+
+async def _send_error(send, status_code: int, detail: str):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -8,15 +8,104 @@ from typing import Optional
 class Config:
     """Application configuration."""
     
+    # Debug mode: responses report the request's SQL statements, commits
+    # and database time (X-DB-Queries, X-DB-Commits, X-DB-Time-ms)
+    DEBUG: bool = os.environ.get("PVAPP_DEBUG", "false").lower() in ("1", "true", "yes")
+    
     # Database
     DB_URL: str = os.environ.get("PVAPP_DB_URL", "sqlite:///./db.sqlite3")
     
-    # XML Parser Microservice
+    # Optional read-only database for list/detail/report reads (a replica, or
+    # sqlite:///file:db.sqlite3?mode=ro&uri=true), with its own connection pool
+    READ_DB_URL: Optional[str] = os.environ.get("PVAPP_READ_DB_URL") or None
+    READ_DB_POOL_SIZE: int = int(os.environ.get("PVAPP_READ_DB_POOL_SIZE", "10"))
+    
+    # After a write, the same client reads from the primary for this long
+    # (seconds), so it never sees a replica that hasn't caught up yet
+    READ_YOUR_WRITES_WINDOW: float = float(os.environ.get("PVAPP_READ_YOUR_WRITES_WINDOW", "10"))
+    
+    # Tree backend for the in-process UBL parser: etree (defusedxml) or lxml
+    XML_BACKEND: str = os.environ.get("PVAPP_XML_BACKEND", "etree")
+    
+    # XML Parser Microservice; several instances may be listed, comma-separated,
+    # as http(s) URLs or unix:/path/to/parser.sock for a parser on this host
     XML_PARSER_URL: Optional[str] = os.environ.get("XML_PARSER_URL")
     XML_PARSER_TOKEN: Optional[str] = os.environ.get("XML_PARSER_TOKEN")
     
     # Parser timeout (seconds)
     XML_PARSER_TIMEOUT: int = int(os.environ.get("XML_PARSER_TIMEOUT", "30"))
+    
+    # Connect timeout per parser attempt (seconds); a restarting worker
+    # refuses or stalls connections, which should fail over quickly
+    XML_PARSER_CONNECT_TIMEOUT: float = float(os.environ.get("XML_PARSER_CONNECT_TIMEOUT", "2"))
+    
+    # Retries after connection errors, timeouts and 502/503/504, spaced by
+    # full-jitter exponential backoff (seconds)
+    XML_PARSER_RETRIES: int = int(os.environ.get("XML_PARSER_RETRIES", "2"))
+    XML_PARSER_BACKOFF_BASE: float = float(os.environ.get("XML_PARSER_BACKOFF_BASE", "0.1"))
+    XML_PARSER_BACKOFF_MAX: float = float(os.environ.get("XML_PARSER_BACKOFF_MAX", "2"))
+    
+    # Send a second (hedged) request when the first has not answered within
+    # the recent p95 latency, but never sooner than XML_PARSER_HEDGE_MIN_DELAY
+    XML_PARSER_HEDGE: bool = os.environ.get("XML_PARSER_HEDGE", "false").lower() in ("1", "true", "yes")
+    XML_PARSER_HEDGE_MIN_DELAY: float = float(os.environ.get("XML_PARSER_HEDGE_MIN_DELAY", "0.05"))
+    
+    # Circuit breaker: open after this many consecutive failures, probe again
+    # after the reset timeout (seconds)
+    XML_PARSER_BREAKER_THRESHOLD: int = int(os.environ.get("XML_PARSER_BREAKER_THRESHOLD", "5"))
+    XML_PARSER_BREAKER_RESET: float = float(os.environ.get("XML_PARSER_BREAKER_RESET", "30"))
+    
+    # Balancing across parser instances: p2c (power of two choices) or least_outstanding
+    XML_PARSER_BALANCER: str = os.environ.get("XML_PARSER_BALANCER", "p2c")
+    
+    # Active /health probing of parser instances (seconds, 0 disables)
+    XML_PARSER_PROBE_INTERVAL: float = float(os.environ.get("XML_PARSER_PROBE_INTERVAL", "10"))
+    XML_PARSER_PROBE_TIMEOUT: float = float(os.environ.get("XML_PARSER_PROBE_TIMEOUT", "2"))
+    
+    # Content-Encoding used for XML sent to the parser: gzip, zstd or identity
+    XML_PARSER_REQUEST_ENCODING: str = os.environ.get("XML_PARSER_REQUEST_ENCODING", "gzip")
+    
+    # Upper bound on decompressed upload size (bytes), guards against zip bombs
+    MAX_DECOMPRESSED_SIZE: int = int(os.environ.get("PVAPP_MAX_DECOMPRESSED_SIZE", str(50 * 1024 * 1024)))
+    
+    # In-process cache of rendered purchase read responses (entries, 0 disables)
+    # and how long an entry may be served before it is re-rendered (seconds)
+    RESPONSE_CACHE_SIZE: int = int(os.environ.get("PVAPP_RESPONSE_CACHE_SIZE", "256"))
+    RESPONSE_CACHE_TTL: float = float(os.environ.get("PVAPP_RESPONSE_CACHE_TTL", "60"))
+    
+    # Unit price statistics per material: weight of the newest price in the
+    # rolling mean/variance, and the relative deviation from that mean that
+    # flags an ingested line (0 disables) once a material has enough prices
+    PRICE_STATS_ALPHA: float = float(os.environ.get("PVAPP_PRICE_STATS_ALPHA", "0.2"))
+    PRICE_ANOMALY_THRESHOLD: float = float(os.environ.get("PVAPP_PRICE_ANOMALY_THRESHOLD", "0.3"))
+    PRICE_ANOMALY_MIN_SAMPLES: int = int(os.environ.get("PVAPP_PRICE_ANOMALY_MIN_SAMPLES", "3"))
+    
+    # What to do with an invoice already imported (same normalised supplier,
+    # number and date): reject (409), return_existing or force
+    DUPLICATE_POLICY: str = os.environ.get("PVAPP_DUPLICATE_POLICY", "reject")
+    
+    # Purchases written per transaction by the NDJSON bulk import and the
+    # bulk invoice confirm, and the largest accepted import body (bytes)
+    IMPORT_CHUNK_SIZE: int = int(os.environ.get("PVAPP_IMPORT_CHUNK_SIZE", "1000"))
+    MAX_IMPORT_SIZE: int = int(os.environ.get("PVAPP_MAX_IMPORT_SIZE", str(512 * 1024 * 1024)))
+    
+    # Request tracing: finished spans are written as JSON records on the
+    # pvapp.trace logger ("log") or appended as OTLP/JSON lines to TRACE_FILE
+    # ("file"); empty only propagates the trace and request ids
+    TRACE_EXPORTER: str = os.environ.get("PVAPP_TRACE_EXPORTER", "").lower()
+    TRACE_FILE: str = os.environ.get("PVAPP_TRACE_FILE", "traces.jsonl")
+    
+    # Purchase and stock events kept for GET /api/v1/events to replay to
+    # reconnecting clients (0 disables the feed), and the seconds between
+    # keep-alive comments on an idle stream
+    EVENTS_BUFFER_SIZE: int = int(os.environ.get("PVAPP_EVENTS_BUFFER_SIZE", "1000"))
+    EVENTS_HEARTBEAT: float = float(os.environ.get("PVAPP_EVENTS_HEARTBEAT", "15"))
+    
+    # Upper bound on the size of an uploaded file as received (bytes)
+    MAX_UPLOAD_SIZE: int = int(os.environ.get("PVAPP_MAX_UPLOAD_SIZE", str(20 * 1024 * 1024)))
+    
+    # Uploads larger than this are spooled to a temporary file on disk (bytes)
+    UPLOAD_SPOOL_THRESHOLD: int = int(os.environ.get("PVAPP_UPLOAD_SPOOL_THRESHOLD", str(1024 * 1024)))
 
 
 config = Config()
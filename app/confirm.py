@@ -0,0 +1,203 @@
+"""
+Bulk confirmation of validated invoices into purchases and stock.
+
+:func:`confirm_invoices` converts VALIDATED :class:`app.models.Invoice`
+rows (all of them, or the given ids) in chunks, one transaction per chunk:
+the chunk's invoices and items are read with one query each, a single
+``UPDATE ... RETURNING`` flips them to CONFIRMED (only rows still
+VALIDATED, so two concurrent confirms never convert an invoice twice) and
+the purchases, items and stock movements are written by
+:func:`app.bulk_import.add_purchases` with multi-row INSERTs. The ORM
+listeners keep the spend aggregates, price statistics, invoice keys and
+search index current as for any other write.
+
+Invoices already imported as a purchase follow the duplicate policy:
+``reject`` leaves them VALIDATED, ``return_existing`` confirms them
+against the existing purchase and ``force`` creates a purchase anyway.
+"""
+import logging
+import time
+from collections import defaultdict
+from typing import Iterator, List, Optional
+
+from sqlalchemy import select, update
+from sqlmodel import Session
+
+from app import duplicates, models
+from app.bulk_import import add_purchases
+
+logger = logging.getLogger(__name__)
+
+invoice_table = models.Invoice.__table__
+invoice_item_table = models.InvoiceItem.__table__
+
+VALIDATED = "VALIDATED"
+CONFIRMED = "CONFIRMED"
+
+
+def _candidate_chunks(session: Session, invoice_ids: Optional[List[int]], chunk_size: int) -> Iterator[List[dict]]:
+    """VALIDATED invoice rows in id order, a chunk at a time (keyset pagination)."""
+    columns = (invoice_table.c.id, invoice_table.c.supplier, invoice_table.c.invoice_number,
+               invoice_table.c.invoice_date, invoice_table.c.total_amount)
+    if invoice_ids is not None:
+        wanted = sorted(set(invoice_ids))
+        for start in range(0, len(wanted), chunk_size):
+            yield [dict(row) for row in session.connection().execute(
+                select(*columns)
+                .where(invoice_table.c.id.in_(wanted[start:start + chunk_size]), invoice_table.c.status == VALIDATED)
+                .order_by(invoice_table.c.id)
+            ).mappings()]
+        return
+
+    cursor = 0
+    while True:
+        rows = [dict(row) for row in session.connection().execute(
+            select(*columns)
+            .where(invoice_table.c.id > cursor, invoice_table.c.status == VALIDATED)
+            .order_by(invoice_table.c.id)
+            .limit(chunk_size)
+        ).mappings()]
+        if not rows:
+            return
+        yield rows
+        cursor = rows[-1]["id"]
+
+
+def _load_items(session: Session, invoice_ids: List[int]) -> dict:
+    items = defaultdict(list)
+    rows = session.connection().execute(
+        select(invoice_item_table.c.invoice_id, invoice_item_table.c.material_id, invoice_item_table.c.description,
+               invoice_item_table.c.quantity, invoice_item_table.c.unit_price, invoice_item_table.c.total_price)
+        .where(invoice_item_table.c.invoice_id.in_(invoice_ids))
+        .order_by(invoice_item_table.c.id)
+    )
+    for invoice_id, material_id, description, quantity, unit_price, total_price in rows:
+        quantity = quantity or 0.0
+        if total_price is None and unit_price is not None:
+            total_price = quantity * unit_price
+        items[invoice_id].append({
+            "material_id": material_id,
+            "description": description,
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "total_price": total_price,
+        })
+    return items
+
+
+def confirm_chunk(session: Session, invoices: List[dict], policy: str, report: dict):
+    """Confirm one chunk of VALIDATED invoice rows in a single transaction, adding the outcome to ``report``."""
+    keys = [duplicates.invoice_key(i["supplier"], i["invoice_number"], i["invoice_date"]) for i in invoices]
+    existing = duplicates.find_duplicates(session, keys)
+    items = _load_items(session, [invoice["id"] for invoice in invoices])
+
+    to_create, to_link, rejected, empty = [], [], [], []
+    first_in_chunk = {}
+    for invoice, key, existing_id in zip(invoices, keys, existing):
+        if not items.get(invoice["id"]):
+            empty.append(invoice["id"])
+            continue
+        duplicate_of = existing_id if existing_id is not None else first_in_chunk.get(key)
+        if duplicate_of is not None and policy == "reject":
+            rejected.append((invoice["id"], duplicate_of))
+        elif duplicate_of is not None and policy == "return_existing":
+            to_link.append((invoice["id"], duplicate_of))
+        else:
+            purchase = models.Purchase(
+                supplier=invoice["supplier"],
+                invoice_number=invoice["invoice_number"],
+                invoice_date=invoice["invoice_date"],
+                total_amount=invoice["total_amount"] or sum(i["total_price"] or 0.0 for i in items[invoice["id"]])
+            )
+            if duplicate_of is not None:
+                duplicates.allow_duplicate(session, purchase)
+            elif key is not None:
+                first_in_chunk[key] = purchase
+            to_create.append((invoice["id"], purchase))
+
+    claim = [invoice_id for invoice_id, _ in to_create + to_link]
+    try:
+        claimed = set()
+        if claim:
+            claimed = set(session.connection().execute(
+                update(invoice_table)
+                .where(invoice_table.c.id.in_(claim), invoice_table.c.status == VALIDATED)
+                .values(status=CONFIRMED)
+                .returning(invoice_table.c.id)
+            ).scalars())
+        # Invoices confirmed concurrently since they were read are left alone
+        to_create = [(invoice_id, p) for invoice_id, p in to_create if invoice_id in claimed]
+        add_purchases(session, [(purchase, items[invoice_id]) for invoice_id, purchase in to_create])
+        # Read the ids now; the commit expires the objects
+        ids = {id(purchase): purchase.id for _, purchase in to_create}
+        created = {invoice_id: ids[id(purchase)] for invoice_id, purchase in to_create}
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error("Confirming a chunk of %s invoices failed: %s", len(invoices), e)
+        report["failed"].extend({"invoice_id": invoice["id"], "error": str(e)} for invoice in invoices)
+        return
+    finally:
+        # Don't keep a chunk's objects in the identity map
+        session.expunge_all()
+
+    def purchase_id(duplicate_of):
+        # An existing purchase's id, or a Purchase created earlier in this chunk
+        return duplicate_of if isinstance(duplicate_of, int) else ids.get(id(duplicate_of))
+
+    report["existing"].extend(
+        {"invoice_id": invoice_id, "purchase_id": purchase_id(duplicate_of)}
+        for invoice_id, duplicate_of in to_link if invoice_id in claimed
+    )
+    report["purchases"].update(created)
+    report["confirmed"] += len(claimed)
+    report["items"] += sum(len(items[invoice_id]) for invoice_id in created)
+    report["stock_movements"] += sum(
+        1 for invoice_id in created for item in items[invoice_id] if item["material_id"] is not None
+    )
+    report["duplicates"].extend(
+        {"invoice_id": invoice_id, "purchase_id": purchase_id(duplicate_of)} for invoice_id, duplicate_of in rejected
+    )
+    report["failed"].extend({"invoice_id": invoice_id, "error": "Invoice has no items"} for invoice_id in empty)
+
+
+def confirm_invoices(
+    session: Session,
+    invoice_ids: Optional[List[int]] = None,
+    chunk_size: int = 1000,
+    on_duplicate: Optional[str] = None,
+) -> dict:
+    """
+    Convert VALIDATED invoices (all, or those in ``invoice_ids``) into
+    purchases, items and stock movements, and mark them CONFIRMED.
+
+    Returns counts, the ``purchases`` created per invoice id, the
+    ``duplicates`` left VALIDATED, the ``existing`` purchases duplicates
+    were confirmed against, the invoices that ``failed`` (with ids that
+    were requested but are not VALIDATED listed under ``not_validated``)
+    and the throughput.
+    """
+    policy = duplicates.resolve_policy(on_duplicate)
+    report = {
+        "confirmed": 0, "items": 0, "stock_movements": 0, "chunks": 0,
+        "purchases": {}, "duplicates": [], "existing": [], "failed": [],
+    }
+    seen = set()
+    started = time.perf_counter()
+    for invoices in _candidate_chunks(session, invoice_ids, chunk_size):
+        if not invoices:
+            continue
+        seen.update(invoice["id"] for invoice in invoices)
+        confirm_chunk(session, invoices, policy, report)
+        report["chunks"] += 1
+    elapsed = time.perf_counter() - started
+
+    if invoice_ids is not None:
+        report["not_validated"] = sorted(set(invoice_ids) - seen)
+    report["seconds"] = round(elapsed, 3)
+    report["invoices_per_second"] = round(report["confirmed"] / elapsed, 1) if elapsed else None
+    logger.info(
+        "Confirmed %d invoices (%d items) in %.2fs, %d duplicates, %d failed",
+        report["confirmed"], report["items"], elapsed, len(report["duplicates"]), len(report["failed"]),
+    )
+    return report
@@ -1,14 +1,216 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from fastapi import Request
+from sqlalchemy import event, exc, select
+from sqlalchemy.engine import Engine
 from sqlmodel import create_engine, SQLModel, Session
+import hashlib
+import math
 import os
+import time
+from app.config import config
+
+# Register the listeners that bump read-cache versions, maintain the spend
+# aggregates, price statistics, invoice keys and search index, and publish
+# purchase and stock events on every write
+from app import analytics, caching, duplicates, events, pricing, search  # noqa: F401
 
 DB_URL = os.environ.get("PVAPP_DB_URL", "sqlite:///./db.sqlite3")
 engine = create_engine(DB_URL, connect_args={"check_same_thread": False} if DB_URL.startswith("sqlite") else {})
 
-def init_db():
+def create_read_engine(url: str):
+    """Engine for read-only traffic, with a pool separate from the primary's."""
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    return create_engine(url, connect_args=connect_args, pool_size=config.READ_DB_POOL_SIZE, pool_pre_ping=True)
+
+# The primary itself unless PVAPP_READ_DB_URL is set
+read_engine = create_read_engine(config.READ_DB_URL) if config.READ_DB_URL else engine
+
+# Cookie marking a client that wrote within READ_YOUR_WRITES_WINDOW
+WROTE_COOKIE = "pvapp_wrote"
+WRITE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+def schema_fingerprint(metadata=SQLModel.metadata) -> str:
+    """Hash of every table, column, constraint and index definition (and the search index DDL)."""
+    parts = [search.INDEX_DDL]
+    for table in metadata.sorted_tables:
+        parts.append(f"table {table.name}")
+        for column in table.columns:
+            references = ",".join(sorted(fk.target_fullname for fk in column.foreign_keys))
+            parts.append(f"  {column.name} {column.type!r} null={column.nullable} pk={column.primary_key} fk={references}")
+        # Constraints and indexes are sets, often unnamed: sort what's rendered
+        parts.extend(sorted(
+            f"  {type(constraint).__name__} {constraint.name} {[c.name for c in constraint.columns]}"
+            for constraint in table.constraints
+        ))
+        parts.extend(sorted(
+            f"  index {index.name} unique={index.unique} {[c.name for c in index.columns]}"
+            for index in table.indexes
+        ))
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+def stored_schema_fingerprint(bind=None):
+    """Fingerprint recorded by the last init_db(), or None (new database, or one predating the check)."""
+    from app import models
+    table = models.SchemaVersion.__table__
+    try:
+        with (bind or engine).connect() as connection:
+            return connection.execute(select(table.c.fingerprint).where(table.c.id == 1)).scalar()
+    except exc.DBAPIError:
+        return None
+
+def init_db(force: bool = False, bind=None) -> bool:
+    """
+    Create missing tables, unless the database already has this schema.
+
+    create_all() checks every table with a round-trip per table; the
+    fingerprint stored by the previous run makes a restart a single query.
+    Returns whether create_all() ran.
+    """
     # Import models here to ensure they are registered
     from app import models  # noqa: F401
-    SQLModel.metadata.create_all(engine)
+    bind = bind or engine
+    fingerprint = schema_fingerprint()
+    if not force and stored_schema_fingerprint(bind) == fingerprint:
+        return False
+    SQLModel.metadata.create_all(bind)
+    with Session(bind) as session:
+        session.merge(models.SchemaVersion(id=1, fingerprint=fingerprint))
+        session.commit()
+    return True
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+def get_read_session(request: Request):
+    """
+    Session for endpoints that only read: bound to the read engine, except
+    for a client that wrote recently (see ReadYourWritesMiddleware), which
+    is served by the primary so it sees its own writes.
+    """
+    bind = read_engine
+    if WROTE_COOKIE in request.cookies:
+        bind = engine
+    with Session(bind) as session:
+        yield session
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware that marks clients after a successful write.
+
+    While a read engine is configured, a 2xx answer to a POST/PUT/PATCH/
+    DELETE sets a short-lived cookie (READ_YOUR_WRITES_WINDOW seconds) that
+    sends the client's reads to the primary until the replica has caught up.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS or read_engine is engine:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_marked(message):
+            if message["type"] == "http.response.start" and 200 <= message["status"] < 300:
+                max_age = math.ceil(config.READ_YOUR_WRITES_WINDOW)
+                cookie = f"{WROTE_COOKIE}=1; Max-Age={max_age}; Path=/; HttpOnly; SameSite=Lax"
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_marked)
+
+class QueryStats:
+    """SQL statements, commits and time spent in the database, per request."""
+
+    __slots__ = ("statements", "commits", "seconds", "parent")
+
+    def __init__(self, parent: Optional["QueryStats"] = None):
+        self.statements = 0
+        self.commits = 0
+        self.seconds = 0.0
+        # Enclosing track_queries(), which counts the same work
+        self.parent = parent
+
+    def headers(self) -> list:
+        return [
+            (b"x-db-queries", str(self.statements).encode()),
+            (b"x-db-commits", str(self.commits).encode()),
+            (b"x-db-time-ms", f"{self.seconds * 1000:.2f}".encode()),
+        ]
+
+_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("pvapp_query_stats", default=None)
+# Connection.info key of the start times of the statements running on it
+_STARTED_KEY = "query_stats_started"
+
+@contextmanager
+def track_queries():
+    """
+    Count the statements and commits of every engine (primary, read, or
+    one made by a test) run in this context and the threads it hands work
+    to (FastAPI copies the context into the threadpool). Blocks may nest.
+    """
+    stats = QueryStats(_query_stats.get())
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+def _count_statement(conn):
+    started = conn.info.get(_STARTED_KEY)
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats = _query_stats.get()
+    while stats is not None:
+        stats.statements += 1
+        stats.seconds += elapsed
+        stats = stats.parent
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if _query_stats.get() is not None:
+        conn.info.setdefault(_STARTED_KEY, []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    _count_statement(conn)
+
+@event.listens_for(Engine, "handle_error")
+def _fail_statement(exception_context):
+    if exception_context.connection is not None:
+        _count_statement(exception_context.connection)
+
+@event.listens_for(Engine, "commit")
+def _count_commit(conn):
+    stats = _query_stats.get()
+    while stats is not None:
+        stats.commits += 1
+        stats = stats.parent
+
+class QueryStatsMiddleware:
+    """
+    ASGI middleware reporting a request's database work in debug mode
+    (PVAPP_DEBUG): ``X-DB-Queries``, ``X-DB-Commits`` and ``X-DB-Time-ms``
+    on the response. Work done after the headers are sent (a streamed
+    body) isn't included.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not config.DEBUG:
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+            async def send_with_stats(message):
+                if message["type"] == "http.response.start":
+                    message = {**message, "headers": [*message.get("headers", []), *stats.headers()]}
+                await send(message)
+
+            await self.app(scope, receive, send_with_stats)
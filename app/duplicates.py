@@ -0,0 +1,231 @@
+"""
+Duplicate supplier invoice detection.
+
+Each purchase with a supplier and an invoice number gets a
+:class:`app.models.PurchaseKey` row holding the normalised (supplier,
+invoice_number, invoice_date) under a composite unique index, written by a
+session listener in the same transaction as the purchase. Checking an
+incoming invoice is a single index lookup, and the index itself rejects a
+duplicate that slips past the check (e.g. two concurrent uploads), which
+:func:`key_conflicts_as_duplicates` reports like any other duplicate.
+
+What happens to a duplicate is decided by a policy (DUPLICATE_POLICY, or
+``on_duplicate`` per request): ``reject`` it, ``return_existing`` purchase,
+or ``force`` the import, in which case the new purchase is stored without a
+key and the original keeps it.
+"""
+import re
+import unicodedata
+from contextlib import contextmanager
+from typing import Iterable, List, Literal, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import delete, event, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.util import IdentitySet
+
+from app import models
+from app.config import config
+
+DuplicatePolicy = Literal["reject", "return_existing", "force"]
+
+key_table = models.PurchaseKey.__table__
+purchase_table = models.Purchase.__table__
+
+# Candidates per IN (...) list (three bound parameters each)
+_IN_CHUNK = 500
+# Session.info key with the purchases allowed to duplicate an existing key
+_FORCED_KEY = "forced_duplicate_purchases"
+_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}")
+_NON_ALNUM = re.compile(r"[\W_]+", re.UNICODE)
+
+
+class DuplicatePurchase(Exception):
+    """Raised when an incoming invoice matches an existing purchase."""
+
+    def __init__(self, purchase_id: int):
+        super().__init__(f"Invoice already imported as purchase {purchase_id}")
+        self.purchase_id = purchase_id
+
+
+def resolve_policy(on_duplicate: Optional[str]) -> str:
+    """The per-request policy, or DUPLICATE_POLICY when none was given."""
+    return on_duplicate or config.DUPLICATE_POLICY
+
+
+def duplicate_http_error(e: DuplicatePurchase) -> HTTPException:
+    return HTTPException(status_code=409, detail=str(e))
+
+
+def _fold(value: str) -> str:
+    # Drop accents (ș -> s), case and any punctuation or whitespace
+    decomposed = unicodedata.normalize("NFKD", value)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALNUM.sub("", stripped.casefold())
+
+
+def invoice_key(supplier: Optional[str], invoice_number: Optional[str], invoice_date: Optional[str]) -> Optional[Tuple[str, str, str]]:
+    """
+    Normalised (supplier, invoice_number, invoice_date), or None when the
+    supplier or number is missing and the invoice can't be identified.
+
+    "Alpha S.R.L." / "alpha srl" and "INV-2024/001" / "inv 2024 001" give
+    the same key; the date is reduced to YYYY-MM-DD.
+    """
+    supplier, number = _fold(supplier or ""), _fold(invoice_number or "")
+    if not supplier or not number:
+        return None
+    date = (invoice_date or "").strip()
+    return supplier, number, date[:10] if _DATE.match(date) else date
+
+
+def find_duplicates(session: Session, keys: Iterable[Optional[tuple]]) -> List[Optional[int]]:
+    """
+    Existing purchase id for each key (None for new or unidentifiable
+    invoices), with one indexed query per 500 candidates.
+    """
+    keys = list(keys)
+    wanted = list({key for key in keys if key is not None})
+    found = {}
+    connection = session.connection()
+    columns = (key_table.c.supplier, key_table.c.invoice_number, key_table.c.invoice_date)
+    for start in range(0, len(wanted), _IN_CHUNK):
+        chunk = wanted[start:start + _IN_CHUNK]
+        rows = connection.execute(select(*columns, key_table.c.purchase_id).where(tuple_(*columns).in_(chunk)))
+        found.update({tuple(row[:3]): row[3] for row in rows})
+    return [found.get(key) if key is not None else None for key in keys]
+
+
+def find_duplicate(session: Session, supplier: Optional[str], invoice_number: Optional[str], invoice_date: Optional[str]) -> Optional[int]:
+    """Id of the purchase already holding this invoice, or None."""
+    return find_duplicates(session, [invoice_key(supplier, invoice_number, invoice_date)])[0]
+
+
+def check_duplicate(session: Session, purchase: models.Purchase, policy: str):
+    """
+    Apply the duplicate policy to ``purchase`` before it is committed.
+
+    Raises :class:`DuplicatePurchase` for ``reject`` and
+    ``return_existing``; with ``force`` the purchase is let through
+    without claiming the key.
+    """
+    existing = find_duplicate(session, purchase.supplier, purchase.invoice_number, purchase.invoice_date)
+    if existing is None or existing == purchase.id:
+        return
+    if policy != "force":
+        raise DuplicatePurchase(existing)
+    allow_duplicate(session, purchase)
+
+
+@contextmanager
+def key_conflicts_as_duplicates(session: Session, purchase: models.Purchase):
+    """
+    Turn the unique index rejecting ``purchase``'s key in the block (a
+    concurrent import of the same invoice committed after
+    :func:`check_duplicate`) into :class:`DuplicatePurchase`, after rolling
+    the session back. Other integrity errors propagate unchanged.
+    """
+    try:
+        yield
+    except IntegrityError:
+        key = invoice_key(purchase.supplier, purchase.invoice_number, purchase.invoice_date)
+        session.rollback()
+        existing = find_duplicates(session, [key])[0] if key is not None else None
+        if existing is None:
+            raise
+        raise DuplicatePurchase(existing) from None
+
+
+def allow_duplicate(session: Session, purchase: models.Purchase):
+    """Let ``purchase`` be stored even though its invoice is already imported."""
+    session.info.setdefault(_FORCED_KEY, IdentitySet()).add(purchase)
+
+
+@event.listens_for(Session, "before_flush")
+def _drop_deleted_keys(session, flush_context, instances):
+    # Before the purchase rows go, as the keys reference them
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, models.Purchase)]
+    if deleted:
+        session.connection().execute(delete(key_table).where(key_table.c.purchase_id.in_(deleted)))
+
+
+@event.listens_for(Session, "after_flush")
+def _store_keys(session, flush_context):
+    new = [obj for obj in session.new if isinstance(obj, models.Purchase)]
+    changed = [
+        obj for obj in session.dirty
+        if isinstance(obj, models.Purchase) and session.is_modified(obj)
+    ]
+    if not (new or changed):
+        return
+
+    connection = session.connection()
+    forced = session.info.get(_FORCED_KEY, IdentitySet())
+    purchases = new + changed
+    changed = [p.id for p in changed]
+    if changed:
+        connection.execute(delete(key_table).where(key_table.c.purchase_id.in_(changed)))
+
+    rows = []
+    claimed = set()
+    for purchase in purchases:
+        key = invoice_key(purchase.supplier, purchase.invoice_number, purchase.invoice_date)
+        if key is None:
+            continue
+        if purchase in forced and (key in claimed or find_duplicates(session, [key])[0] is not None):
+            continue
+        claimed.add(key)
+        rows.append(dict(zip(("supplier", "invoice_number", "invoice_date"), key), purchase_id=purchase.id))
+    if rows:
+        # A duplicate that was not checked (or raced a concurrent import)
+        # fails here with an IntegrityError and rolls the write back
+        connection.execute(key_table.insert(), rows)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _forget_forced(session):
+    session.info.pop(_FORCED_KEY, None)
+
+
+def rebuild_purchase_keys(session: Session) -> dict:
+    """
+    Recompute the keys of all purchases, and commit.
+
+    Needed once for purchases created before duplicate detection existed;
+    when history already holds duplicates, the oldest purchase keeps the key.
+    """
+    connection = session.connection()
+    rows = connection.execute(
+        select(purchase_table.c.id, purchase_table.c.supplier, purchase_table.c.invoice_number,
+               purchase_table.c.invoice_date)
+        .order_by(purchase_table.c.id)
+    )
+    keys = {}
+    duplicates = 0
+    for purchase_id, supplier, number, date in rows:
+        key = invoice_key(supplier, number, date)
+        if key is None:
+            continue
+        if key in keys:
+            duplicates += 1
+            continue
+        keys[key] = purchase_id
+
+    connection.execute(delete(key_table))
+    if keys:
+        connection.execute(key_table.insert(), [
+            dict(zip(("supplier", "invoice_number", "invoice_date"), key), purchase_id=purchase_id)
+            for key, purchase_id in keys.items()
+        ])
+    session.commit()
+    return {"purchase_keys": len(keys), "duplicates": duplicates}
+
+
+if __name__ == "__main__":
+    from app.database import engine, init_db
+
+    init_db()
+    with Session(engine) as session:
+        print(rebuild_purchase_keys(session))
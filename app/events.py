@@ -0,0 +1,245 @@
+"""
+In-process feed of purchase and stock changes for ``GET /api/v1/events``.
+
+Session listeners collect ``purchase.created`` events for new purchases
+and ``stock.movement`` events (one per material, summed over the
+transaction's movements) as rows are flushed, and publish them to the
+:data:`event_hub` once the transaction commits; a rollback discards them.
+Every write path goes through the ORM, so the single-purchase endpoints,
+invoice uploads, bulk import and confirm all feed the hub.
+
+The hub keeps the last EVENTS_BUFFER_SIZE events in a ring buffer. Each
+event is encoded once, and publishing only appends to the ring and
+schedules a wake-up on the loop of every open stream, so a slow client
+never holds up a writer: it reads the ring from its own cursor and, if it
+falls so far behind that its next event has been overwritten, gets a
+``reset`` event telling it to reload instead. Clients resume after a
+reconnect from ``Last-Event-ID``; ids carry a token of this process, so an
+id from before a restart (or from another worker) also yields ``reset``.
+
+The hub lives in the worker process: with several uvicorn workers a stream
+only sees the writes made by the worker serving it.
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from itertools import islice
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import config
+
+PURCHASE_CREATED = "purchase.created"
+STOCK_MOVEMENT = "stock.movement"
+RESET = "reset"
+
+# Session.info keys collecting the open transaction's new purchases
+# (id -> snapshot) and stock movements (material id -> [change, count])
+_PURCHASES_KEY = "event_purchases"
+_MOVEMENTS_KEY = "event_movements"
+
+# Reconnect delay suggested to EventSource clients (milliseconds)
+RETRY_MS = 3000
+
+
+class Event:
+    """A published event and its ``text/event-stream`` encoding."""
+
+    __slots__ = ("seq", "type", "data", "message")
+
+    def __init__(self, stream_id: str, seq: int, type: str, data: dict):
+        self.seq = seq
+        self.type = type
+        self.data = data
+        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str)
+        self.message = f"id: {stream_id}-{seq}\nevent: {type}\ndata: {payload}\n\n".encode("utf-8")
+
+
+class EventHub:
+    """
+    Ring buffer of the latest events, with wake-ups for the streams reading it.
+
+    Thread-safe: writers publish from the threadpool running sync endpoints
+    (or from the event loop), streams read from the event loop.
+    """
+
+    def __init__(self):
+        # Identifies this process's sequence in event ids
+        self.stream_id = os.urandom(4).hex()
+        self._events = deque()
+        self._last = 0
+        self._lock = threading.Lock()
+        self._listeners = {}  # loop -> set of asyncio.Event
+
+    @property
+    def last_seq(self) -> int:
+        return self._last
+
+    def publish(self, events: Iterable[Tuple[str, dict]]):
+        """Append ``(type, data)`` events to the ring and wake every stream."""
+        size = config.EVENTS_BUFFER_SIZE
+        with self._lock:
+            for type, data in events:
+                self._last += 1
+                self._events.append(Event(self.stream_id, self._last, type, data))
+            while len(self._events) > size:
+                self._events.popleft()
+            listeners = [(loop, list(wakes)) for loop, wakes in self._listeners.items()]
+        # One call per loop (usually the only one): each call is a syscall
+        for loop, wakes in listeners:
+            try:
+                loop.call_soon_threadsafe(_set_all, wakes)
+            except RuntimeError:
+                # The streams' loop has closed
+                pass
+
+    def since(self, seq: int) -> Tuple[List[Event], int, bool]:
+        """
+        Events after ``seq``, the last sequence number, and whether the
+        events are complete (False when some after ``seq`` were overwritten
+        or ``seq`` isn't from this ring).
+        """
+        with self._lock:
+            last = self._last
+            if seq == last:
+                return [], last, True
+            if seq > last or not self._events or seq < self._events[0].seq - 1:
+                return [], last, False
+            return list(islice(self._events, seq - self._events[0].seq + 1, None)), last, True
+
+    def resume_seq(self, last_event_id: Optional[str]) -> int:
+        """
+        Sequence number to stream after: the one in ``last_event_id``, the
+        current last one without an id, or -1 for an id of another process.
+        """
+        if not last_event_id:
+            return self._last
+        stream_id, _, seq = last_event_id.strip().rpartition("-")
+        if stream_id != self.stream_id or not seq.isdigit():
+            return -1
+        return int(seq)
+
+    def reset_message(self, seq: int) -> bytes:
+        data = json.dumps({"last_event_id": f"{self.stream_id}-{seq}"})
+        return f"id: {self.stream_id}-{seq}\nevent: {RESET}\ndata: {data}\n\n".encode("utf-8")
+
+    @contextmanager
+    def listen(self):
+        """asyncio.Event set by every publish while the block runs (call from the loop)."""
+        loop, wake = asyncio.get_running_loop(), asyncio.Event()
+        with self._lock:
+            self._listeners.setdefault(loop, set()).add(wake)
+        try:
+            yield wake
+        finally:
+            with self._lock:
+                wakes = self._listeners[loop]
+                wakes.discard(wake)
+                if not wakes:
+                    del self._listeners[loop]
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+
+def _set_all(wakes):
+    for wake in wakes:
+        wake.set()
+
+
+# Shared by all requests in this process
+event_hub = EventHub()
+
+
+async def event_stream(last_event_id: Optional[str] = None, hub: EventHub = None,
+                       heartbeat: Optional[float] = None) -> AsyncIterator[bytes]:
+    """
+    ``text/event-stream`` body: the events after ``last_event_id`` (new
+    events only without one), then each event as it is published, with a
+    comment every ``heartbeat`` seconds (EVENTS_HEARTBEAT) to keep proxies
+    from closing an idle connection.
+    """
+    hub = event_hub if hub is None else hub
+    heartbeat = config.EVENTS_HEARTBEAT if heartbeat is None else heartbeat
+    cursor = hub.resume_seq(last_event_id)
+    with hub.listen() as wake:
+        yield f"retry: {RETRY_MS}\n\n".encode()
+        while True:
+            wake.clear()
+            events, last, complete = hub.since(cursor)
+            if not complete:
+                cursor = last
+                yield hub.reset_message(last)
+            for item in events:
+                cursor = item.seq
+                yield item.message
+            try:
+                await asyncio.wait_for(wake.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+
+
+def purchase_data(purchase: models.Purchase) -> dict:
+    return {
+        "id": purchase.id,
+        "supplier": purchase.supplier,
+        "invoice_number": purchase.invoice_number,
+        "invoice_date": purchase.invoice_date,
+        "total_amount": purchase.total_amount,
+        "created_at": str(purchase.created_at),
+    }
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_after_flush(session, flush_context):
+    if config.EVENTS_BUFFER_SIZE <= 0:
+        return
+    purchases = session.info.get(_PURCHASES_KEY)
+    for obj in session.new:
+        if isinstance(obj, models.Purchase):
+            if purchases is None:
+                purchases = session.info[_PURCHASES_KEY] = {}
+            purchases[obj.id] = purchase_data(obj)
+        elif isinstance(obj, models.StockMovement):
+            movements = session.info.get(_MOVEMENTS_KEY)
+            if movements is None:
+                movements = session.info[_MOVEMENTS_KEY] = defaultdict(lambda: [0.0, 0])
+            totals = movements[obj.material_id]
+            totals[0] += obj.change or 0.0
+            totals[1] += 1
+    if purchases:
+        # A purchase inserted before its invoice metadata arrived (upload
+        # streaming) is re-read when it is updated in the same transaction
+        for obj in session.dirty:
+            if isinstance(obj, models.Purchase) and obj.id in purchases:
+                purchases[obj.id] = purchase_data(obj)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_after_commit(session):
+    purchases = session.info.pop(_PURCHASES_KEY, None)
+    movements = session.info.pop(_MOVEMENTS_KEY, None)
+    if not purchases and not movements:
+        return
+    events = [(PURCHASE_CREATED, data) for _, data in sorted((purchases or {}).items())]
+    events.extend(
+        (STOCK_MOVEMENT, {"material_id": material_id, "change": change, "movements": count})
+        for material_id, (change, count) in sorted((movements or {}).items())
+    )
+    event_hub.publish(events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_PURCHASES_KEY, None)
+    session.info.pop(_MOVEMENTS_KEY, None)
@@ -0,0 +1,203 @@
+"""
+Streaming bulk export of purchases joined with their line items.
+
+Rows are read in keyset-paginated chunks (``PurchaseItem.id > cursor``), so
+memory stays flat however many rows match and no long-lived cursor or
+transaction is held open between chunks. Every row carries its ``item_id``,
+which doubles as the resume cursor for an interrupted export.
+"""
+import csv
+import io
+import json
+from typing import Iterator, List, Optional
+
+from sqlmodel import Session, select
+
+from app import models
+
+_UNLOADED = object()
+# Imported by the first Parquet/Arrow export rather than at start-up, see
+# load_pyarrow(); None when pyarrow isn't installed
+pyarrow = _UNLOADED
+
+EXPORT_COLUMNS = [
+    "item_id",
+    "purchase_id",
+    "supplier",
+    "invoice_number",
+    "invoice_date",
+    "purchase_total",
+    "material_id",
+    "material_sku",
+    "material_name",
+    "sku_raw",
+    "sku_clean",
+    "description",
+    "quantity",
+    "unit_price",
+    "total_price",
+]
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+BINARY_FORMATS = ("parquet", "arrow")
+
+
+def iter_export_chunks(
+    session: Session,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    supplier: Optional[str] = None,
+    cursor: int = 0,
+    chunk_size: int = 5000,
+) -> Iterator[List[dict]]:
+    """
+    Yield lists of export rows, at most ``chunk_size`` rows each.
+
+    Args:
+        session: Database session
+        date_from: Inclusive lower bound on ``Purchase.invoice_date`` (ISO date)
+        date_to: Inclusive upper bound on ``Purchase.invoice_date`` (ISO date)
+        supplier: Only export purchases from this supplier
+        cursor: Resume after this ``PurchaseItem.id``
+        chunk_size: Rows fetched per query
+    """
+    stmt = (
+        select(
+            models.PurchaseItem.id,
+            models.Purchase.id,
+            models.Purchase.supplier,
+            models.Purchase.invoice_number,
+            models.Purchase.invoice_date,
+            models.Purchase.total_amount,
+            models.PurchaseItem.material_id,
+            models.Material.sku,
+            models.Material.name,
+            models.PurchaseItem.sku_raw,
+            models.PurchaseItem.sku_clean,
+            models.PurchaseItem.description,
+            models.PurchaseItem.quantity,
+            models.PurchaseItem.unit_price,
+            models.PurchaseItem.total_price,
+        )
+        .join(models.Purchase, models.Purchase.id == models.PurchaseItem.purchase_id)
+        .outerjoin(models.Material, models.Material.id == models.PurchaseItem.material_id)
+    )
+    if date_from:
+        stmt = stmt.where(models.Purchase.invoice_date >= date_from)
+    if date_to:
+        stmt = stmt.where(models.Purchase.invoice_date <= date_to)
+    if supplier:
+        stmt = stmt.where(models.Purchase.supplier == supplier)
+
+    last_id = cursor
+    while True:
+        page = stmt.where(models.PurchaseItem.id > last_id).order_by(models.PurchaseItem.id).limit(chunk_size)
+        rows = session.exec(page).all()
+        if not rows:
+            return
+        yield [dict(zip(EXPORT_COLUMNS, row)) for row in rows]
+        last_id = rows[-1][0]
+        if len(rows) < chunk_size:
+            return
+
+
+class _RowBuffer:
+    """File-like sink that hands each CSV row straight back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(chunks: Iterator[List[dict]]) -> Iterator[str]:
+    writer = csv.writer(_RowBuffer())
+    yield writer.writerow(EXPORT_COLUMNS)
+    for chunk in chunks:
+        yield "".join(
+            writer.writerow(["" if row[c] is None else row[c] for c in EXPORT_COLUMNS]) for row in chunk
+        )
+
+
+def iter_ndjson(chunks: Iterator[List[dict]]) -> Iterator[str]:
+    for chunk in chunks:
+        yield "".join(json.dumps(row) + "\n" for row in chunk)
+
+
+def load_pyarrow():
+    """pyarrow with its IPC and Parquet modules, or None when it isn't installed."""
+    global pyarrow
+    if pyarrow is _UNLOADED:
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:  # Parquet/Arrow export is optional
+            pyarrow = None
+    return pyarrow
+
+
+def _arrow_schema():
+    string, double, integer = pyarrow.string(), pyarrow.float64(), pyarrow.int64()
+    types = {
+        "item_id": integer,
+        "purchase_id": integer,
+        "material_id": integer,
+        "purchase_total": double,
+        "quantity": double,
+        "unit_price": double,
+        "total_price": double,
+    }
+    return pyarrow.schema([(c, types.get(c, string)) for c in EXPORT_COLUMNS])
+
+
+class _DrainableSink(io.RawIOBase):
+    """Write-only buffer whose contents are handed out after each chunk."""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def iter_arrow(chunks: Iterator[List[dict]], output_format: str) -> Iterator[bytes]:
+    """Encode chunks as Parquet row groups or Arrow IPC record batches."""
+    load_pyarrow()
+    schema = _arrow_schema()
+    sink = _DrainableSink()
+    if output_format == "parquet":
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+
+    for chunk in chunks:
+        writer.write_table(pyarrow.Table.from_pylist(chunk, schema=schema))
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+
+def stream_export(output_format: str, chunks: Iterator[List[dict]]):
+    """Return the body iterator for ``output_format``."""
+    if output_format == "csv":
+        return iter_csv(chunks)
+    if output_format == "ndjson":
+        return iter_ndjson(chunks)
+    return iter_arrow(chunks, output_format)
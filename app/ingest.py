@@ -0,0 +1,514 @@
+"""
+Backfill of e-Factura archives and drop folders (``pvapp-ingest``).
+
+Walks the given directories (and files) for invoice XML and for the ZIPs
+ANAF's e-Factura downloads come in (the invoice next to its
+``semnatura_*.xml`` signature, which is skipped), and imports each invoice
+as a purchase with its items, materials (matched by SKU, created when
+missing) and stock movements, as ``/api/v1/purchases/upload-xml`` does::
+
+    pvapp-ingest ~/efactura/2021 ~/efactura/2022.zip
+    pvapp-ingest --watch --interval 30 /srv/efactura/inbox
+
+The pipeline:
+
+- Every document is hashed (SHA-256) and looked up, a batch at a time, in
+  :class:`app.models.ImportedDocument`. Content imported before, by any
+  run and from any path, is skipped before it is parsed.
+- New documents are parsed in a process pool (``--workers``) with the
+  shared UBL engine (:func:`app.parsers.invoice_xml.parse_invoice_products`).
+  At most ``--workers`` x 4 documents are in flight, and results come
+  back in input order.
+- Parsed invoices are written in chunks (``--chunk-size``), one
+  transaction each, through :func:`app.bulk_import.add_purchases`.
+  Duplicate invoices follow ``--on-duplicate`` (see :mod:`app.duplicates`).
+  The document hashes are stored in the same transaction.
+- A file is appended to the checkpoint (JSON lines, ``--checkpoint``) once
+  all its documents are committed. An interrupted run started again with
+  the same checkpoint skips finished files without reading them. A file
+  that was half done is re-read, and its committed documents are skipped
+  by hash.
+
+``--watch`` keeps polling the paths for new files. Files modified in the
+last ``--settle`` seconds are left for the next pass, as they may still be
+being written.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+
+from sqlalchemy import select
+from sqlmodel import Session
+
+from app import duplicates, models
+from app.bulk_import import add_purchases
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+document_table = models.ImportedDocument.__table__
+material_table = models.Material.__table__
+
+# ANAF ships the invoice's signature as semnatura_<id>.xml next to it
+SIGNATURE_PREFIX = "semnatura"
+# Hashes / SKUs per IN (...) list
+_IN_CHUNK = 500
+
+
+@dataclass(slots=True, eq=False)
+class Source:
+    """A file given to the ingest (an invoice XML or a ZIP of them) and how far it got."""
+    path: str
+    size: int
+    mtime_ns: int
+    documents: int = 0
+    remaining: int = 0
+    imported: int = 0
+    failed: bool = False
+
+
+@dataclass(slots=True, eq=False)
+class Document:
+    """One invoice XML: a file, or a ZIP member (``name`` is then ``archive.zip!member.xml``)."""
+    source: Source
+    name: str
+    content: Optional[bytes]
+    sha256: Optional[str] = None
+    invoice: Optional[dict] = None
+    error: Optional[str] = None
+
+
+class Checkpoint:
+    """
+    Append-only JSON lines file of the sources fully ingested.
+
+    A source counts as done while its size and modification time are
+    unchanged; a torn last line (from a killed run) is ignored.
+    """
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.done = {}
+        self._file = None
+        if not path:
+            return
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.done[entry["path"]] = (entry["size"], entry["mtime_ns"])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, path: str, size: int, mtime_ns: int) -> bool:
+        return self.done.get(path) == (size, mtime_ns)
+
+    def mark(self, source: Source):
+        self.done[source.path] = (source.size, source.mtime_ns)
+        if self._file is not None:
+            self._file.write(json.dumps({
+                "path": source.path, "size": source.size, "mtime_ns": source.mtime_ns,
+                "documents": source.documents, "imported": source.imported,
+            }) + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _is_signature(name: str) -> bool:
+    return os.path.basename(name).lower().startswith(SIGNATURE_PREFIX)
+
+
+def _is_candidate(name: str) -> bool:
+    lower = name.lower()
+    return lower.endswith((".xml", ".zip")) and not _is_signature(name)
+
+
+def walk_sources(paths: Iterable[str], checkpoint: Checkpoint, settle: float = 0.0) -> Iterator[Source]:
+    """
+    The invoice XML and ZIP files under ``paths``, in name order, except
+    those already in the checkpoint and those modified in the last
+    ``settle`` seconds.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                files.extend(os.path.join(directory, name) for name in sorted(filenames) if _is_candidate(name))
+        elif _is_candidate(path):
+            files.append(path)
+
+    cutoff = time.time_ns() - int(settle * 1e9)
+    for file in files:
+        path = os.path.abspath(file)
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            logger.warning("Skipping %s: %s", path, e)
+            continue
+        if checkpoint.is_done(path, stat.st_size, stat.st_mtime_ns) or stat.st_mtime_ns > cutoff:
+            continue
+        yield Source(path, stat.st_size, stat.st_mtime_ns)
+
+
+def _read_bounded(file, limit: int) -> bytes:
+    content = file.read(limit + 1)
+    if len(content) > limit:
+        raise ValueError(f"Document exceeds {limit} bytes")
+    return content
+
+
+def iter_documents(source: Source) -> Iterator[Document]:
+    """
+    The invoices in ``source``, read one at a time; ``source.documents``
+    is set before the first one is yielded.
+
+    Raises:
+        OSError, zipfile.BadZipFile: The file can't be read
+    """
+    if not source.path.lower().endswith(".zip"):
+        source.documents = source.remaining = 1
+        try:
+            with open(source.path, "rb") as f:
+                yield Document(source, source.path, _read_bounded(f, config.MAX_UPLOAD_SIZE))
+        except ValueError as e:
+            yield Document(source, source.path, None, error=str(e))
+        return
+
+    with zipfile.ZipFile(source.path) as archive:
+        members = sorted(
+            (info for info in archive.infolist()
+             if not info.is_dir() and info.filename.lower().endswith(".xml") and not _is_signature(info.filename)),
+            key=lambda info: info.filename,
+        )
+        source.documents = source.remaining = len(members)
+        for info in members:
+            name = f"{source.path}!{info.filename}"
+            try:
+                with archive.open(info) as member:
+                    yield Document(source, name, _read_bounded(member, config.MAX_DECOMPRESSED_SIZE))
+            except (ValueError, zipfile.BadZipFile, OSError, EOFError) as e:
+                yield Document(source, name, None, error=str(e))
+
+
+def parse_content(content: bytes) -> tuple:
+    """
+    Parse one invoice (in a worker process): ``(invoice, None)`` or
+    ``(None, error message)``. Errors are returned rather than raised, as
+    not every parser exception survives the trip back.
+    """
+    from app.parsers.invoice_xml import parse_invoice_products
+
+    try:
+        return parse_invoice_products(content), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+class Ingest:
+    """
+    One ingest session: a database session, a checkpoint and (with more
+    than one worker) a process pool, reused by every :meth:`run`.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        checkpoint: Checkpoint,
+        workers: int = 0,
+        chunk_size: Optional[int] = None,
+        on_duplicate: Optional[str] = None,
+    ):
+        self.session = session
+        self.checkpoint = checkpoint
+        self.chunk_size = chunk_size or config.IMPORT_CHUNK_SIZE
+        self.policy = duplicates.resolve_policy(on_duplicate)
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.window = max(workers, 1) * 4
+        self.report = None
+        # Hashes of the documents queued in this run
+        self._queued = set()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+        self.checkpoint.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, paths: Iterable[str], settle: float = 0.0) -> dict:
+        """Ingest the new files under ``paths`` once and return the counts."""
+        self.report = report = {
+            "files": 0, "documents": 0, "imported": 0, "items": 0, "already_imported": 0,
+            "duplicates": 0, "empty": 0, "failed": [],
+        }
+        self._queued = set()
+        started = time.perf_counter()
+        batch = []
+        for document in self._parse(self._unseen(self._documents(walk_sources(paths, self.checkpoint, settle)))):
+            if document.error is not None:
+                self._fail(document, document.error)
+                self._done(document)
+            elif not document.invoice["products"]:
+                report["empty"] += 1
+                self._done(document)
+            else:
+                batch.append(document)
+                if len(batch) >= self.chunk_size:
+                    self.write_chunk(batch)
+                    batch = []
+        if batch:
+            self.write_chunk(batch)
+
+        elapsed = time.perf_counter() - started
+        report["seconds"] = round(elapsed, 3)
+        report["documents_per_second"] = round(report["documents"] / elapsed, 1) if elapsed else None
+        if report["documents"]:
+            logger.info(
+                "Ingested %s files, %s documents: %s imported, %s already imported, %s duplicates, %s failed "
+                "in %.2fs", report["files"], report["documents"], report["imported"], report["already_imported"],
+                report["duplicates"], len(report["failed"]), elapsed,
+            )
+        return report
+
+    def _documents(self, sources: Iterable[Source]) -> Iterator[Document]:
+        for source in sources:
+            self.report["files"] += 1
+            try:
+                for document in iter_documents(source):
+                    self.report["documents"] += 1
+                    if document.content is not None:
+                        document.sha256 = hashlib.sha256(document.content).hexdigest()
+                    yield document
+            except (OSError, zipfile.BadZipFile) as e:
+                # Left out of the checkpoint, so the next run retries it
+                source.failed = True
+                logger.error("Can't read %s: %s", source.path, e)
+                self.report["failed"].append({"source": source.path, "error": str(e)})
+                continue
+            if not source.documents:
+                self.checkpoint.mark(source)
+
+    def _unseen(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Drop the documents whose content was imported before, checking a window of hashes per query."""
+        pending = []
+        for document in documents:
+            pending.append(document)
+            if len(pending) >= _IN_CHUNK:
+                yield from self._filter_imported(pending)
+                pending = []
+        if pending:
+            yield from self._filter_imported(pending)
+
+    def _filter_imported(self, documents: List[Document]) -> Iterator[Document]:
+        hashes = [d.sha256 for d in documents if d.sha256 is not None]
+        imported = set(self.session.connection().execute(
+            select(document_table.c.sha256).where(document_table.c.sha256.in_(hashes))
+        ).scalars()) if hashes else set()
+        for document in documents:
+            if document.sha256 in imported or document.sha256 in self._queued:
+                # Or a copy of a file met earlier in this run
+                self.report["already_imported"] += 1
+                self._done(document)
+                continue
+            if document.sha256 is not None:
+                self._queued.add(document.sha256)
+            yield document
+
+    def _parse(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Parse in the pool (or here, without one), yielding documents in input order."""
+        if self.pool is None:
+            for document in documents:
+                if document.content is not None:
+                    document.invoice, document.error = parse_content(document.content)
+                    document.content = None
+                yield document
+            return
+
+        pending = deque()
+        for document in documents:
+            future = self.pool.submit(parse_content, document.content) if document.content is not None else None
+            pending.append((document, future))
+            if len(pending) >= self.window:
+                yield self._collect(*pending.popleft())
+        while pending:
+            yield self._collect(*pending.popleft())
+
+    @staticmethod
+    def _collect(document: Document, future) -> Document:
+        if future is not None:
+            document.invoice, document.error = future.result()
+            document.content = None
+        return document
+
+    def _materials(self, invoices: List[dict]) -> dict:
+        """Material id per SKU in ``invoices``, adding the materials that don't exist yet."""
+        products = {}
+        for invoice in invoices:
+            for product in invoice["products"]:
+                if product.sku:
+                    products.setdefault(product.sku, product)
+        skus = sorted(products)
+        ids = {}
+        for start in range(0, len(skus), _IN_CHUNK):
+            for sku, material_id in self.session.connection().execute(
+                select(material_table.c.sku, material_table.c.id)
+                .where(material_table.c.sku.in_(skus[start:start + _IN_CHUNK]))
+                .order_by(material_table.c.id)
+            ):
+                ids.setdefault(sku, material_id)
+
+        new = [models.Material(sku=sku, name=products[sku].name or sku, unit=products[sku].unit)
+               for sku in skus if sku not in ids]
+        if new:
+            self.session.add_all(new)
+            self.session.flush()
+            ids.update((material.sku, material.id) for material in new)
+        return ids
+
+    def write_chunk(self, documents: List[Document]):
+        """Import one chunk of parsed documents in a single transaction."""
+        session = self.session
+        invoices = [document.invoice for document in documents]
+        keys = [duplicates.invoice_key(i["supplier"], i["invoice_number"], i["invoice_date"]) for i in invoices]
+        try:
+            existing = duplicates.find_duplicates(session, keys)
+            materials = self._materials(invoices)
+
+            created, linked = [], []
+            first_in_chunk = {}
+            for document, invoice, key, existing_id in zip(documents, invoices, keys, existing):
+                duplicate_of = existing_id if existing_id is not None else first_in_chunk.get(key)
+                if duplicate_of is not None and self.policy != "force":
+                    linked.append((document, duplicate_of))
+                    continue
+                purchase = models.Purchase(
+                    supplier=invoice["supplier"],
+                    invoice_number=invoice["invoice_number"],
+                    invoice_date=invoice["invoice_date"],
+                    total_amount=invoice["total_amount"],
+                )
+                if duplicate_of is not None:
+                    duplicates.allow_duplicate(session, purchase)
+                elif key is not None:
+                    first_in_chunk[key] = purchase
+                created.append((document, purchase))
+
+            add_purchases(session, [
+                (purchase, [{
+                    "material_id": materials.get(product.sku) if product.sku else None,
+                    "sku_raw": product.sku,
+                    "sku_clean": product.sku,
+                    "description": product.name,
+                    "quantity": product.quantity,
+                    "unit_price": product.unit_price,
+                    "total_price": product.total_price,
+                } for product in document.invoice["products"]])
+                for document, purchase in created
+            ])
+
+            def purchase_id(purchase):
+                # An existing purchase's id, or a Purchase created earlier in this chunk
+                return purchase if isinstance(purchase, int) else purchase.id
+
+            session.connection().execute(document_table.insert(), [
+                {"sha256": document.sha256, "purchase_id": purchase_id(purchase), "source": document.name}
+                for document, purchase in created + linked
+            ])
+            items = sum(len(document.invoice["products"]) for document, _ in created)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error("Ingesting a chunk of %s documents failed: %s", len(documents), e)
+            for document in documents:
+                self._fail(document, f"Chunk not imported: {e}")
+                self._done(document)
+            return
+        finally:
+            # Don't keep a chunk's objects in the identity map
+            session.expunge_all()
+
+        self.report["imported"] += len(created)
+        self.report["items"] += items
+        self.report["duplicates"] += len(linked)
+        for document, _ in created:
+            document.source.imported += 1
+        for document in documents:
+            self._done(document)
+
+    def _fail(self, document: Document, error: str):
+        logger.warning("Not imported %s: %s", document.name, error)
+        document.source.failed = True
+        self.report["failed"].append({"source": document.name, "error": error})
+
+    def _done(self, document: Document):
+        """Count a document as settled; a file whose documents all are goes in the checkpoint."""
+        source = document.source
+        source.remaining -= 1
+        if source.remaining == 0 and not source.failed:
+            self.checkpoint.mark(source)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="pvapp-ingest",
+        description="Import e-Factura invoice XML files and ZIP archives as purchases.",
+    )
+    parser.add_argument("paths", nargs="+", help="directories, .xml or .zip files")
+    parser.add_argument("--checkpoint", default="pvapp-ingest.checkpoint.jsonl",
+                        help="file recording the finished files, to resume an interrupted run (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="parser processes (default: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=config.IMPORT_CHUNK_SIZE,
+                        help="invoices per transaction (default: %(default)s)")
+    parser.add_argument("--on-duplicate", choices=["reject", "return_existing", "force"],
+                        help="already imported invoices (default: PVAPP_DUPLICATE_POLICY)")
+    parser.add_argument("--watch", action="store_true", help="keep polling the paths for new files")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between watch passes (default: %(default)s)")
+    parser.add_argument("--settle", type=float, default=5.0,
+                        help="in watch mode, skip files modified in the last N seconds (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    from app.database import engine, init_db
+
+    init_db()
+    with Session(engine) as session, Ingest(session, Checkpoint(args.checkpoint), args.workers, args.chunk_size,
+                                            args.on_duplicate) as ingest:
+        try:
+            report = ingest.run(args.paths, settle=args.settle if args.watch else 0.0)
+            print(json.dumps(report, ensure_ascii=False))
+            while args.watch:
+                time.sleep(args.interval)
+                report = ingest.run(args.paths, settle=args.settle)
+                if report["documents"] or report["failed"]:
+                    print(json.dumps(report, ensure_ascii=False))
+        except KeyboardInterrupt:
+            logger.info("Interrupted; run again with --checkpoint %s to resume", args.checkpoint)
+            return 130
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
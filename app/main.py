@@ -1,16 +1,71 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.database import init_db
-from app.api import purchases, invoices
+from app import IMPORT_STARTED
+from app.database import QueryStatsMiddleware, ReadYourWritesMiddleware, init_db
+from app.api import purchases, invoices, analytics, search, events
+from app.compression import RequestDecompressionMiddleware
+from app.config import config
+from app.startup import StartupProfile
+from app.tracing import TracingMiddleware
 
-app = FastAPI(title="PVApp stable backend")
+logger = logging.getLogger(__name__)
 
-@app.on_event("startup")
-def on_startup():
-    init_db()
+# Filled in as the worker starts, see app.startup
+startup_profile = StartupProfile()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    created = init_db()
+    startup_profile.record("init_db (create_all)" if created else "init_db (schema current)", time.perf_counter() - started)
+    # Eject and re-admit parser instances based on their /health; the
+    # parser client (httpx) is only imported when a parser is configured
+    probes = None
+    if config.XML_PARSER_URL and config.XML_PARSER_PROBE_INTERVAL > 0:
+        with startup_profile.phase("parser probes"):
+            from app.parser_pool import parser_pool
+            probes = asyncio.create_task(parser_pool.run_probes())
+    logger.info("Started in %s", startup_profile)
+    yield
+    if probes is not None:
+        probes.cancel()
+
+app = FastAPI(title="PVApp stable backend", lifespan=lifespan)
+
+# Decode gzip/zstd request bodies on the XML upload and bulk import endpoints
+app.add_middleware(
+    RequestDecompressionMiddleware,
+    paths=["/api/invoices/upload", "/api/v1/purchases/upload-xml", "/api/v1/purchases/import"],
+    max_size_getter=lambda: config.MAX_DECOMPRESSED_SIZE,
+    # The import is spooled to disk and may be as large as an uncompressed one
+    limits={"/api/v1/purchases/import": lambda: config.MAX_IMPORT_SIZE},
+)
+
+# Send a client's reads to the primary right after it wrote (with PVAPP_READ_DB_URL)
+app.add_middleware(ReadYourWritesMiddleware)
+
+# SQL statement counts and database time per request, as headers (PVAPP_DEBUG)
+app.add_middleware(QueryStatsMiddleware)
+
+# Outermost: a trace (and X-Request-ID) per request, see app.tracing
+app.add_middleware(TracingMiddleware)
 
 app.include_router(purchases.router)
 app.include_router(invoices.router)
+app.include_router(analytics.router)
+app.include_router(search.router)
+app.include_router(events.router)
 
 @app.get("/api/v1")
 def root():
     return {"ok": True}
+
+@app.get("/api/v1/startup")
+def startup():
+    """Time spent importing the app and in each start-up step of this worker."""
+    return startup_profile.as_dict()
+
+startup_profile.record("import app", time.perf_counter() - IMPORT_STARTED)
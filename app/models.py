@@ -1,4 +1,5 @@
 from typing import Optional
+from sqlalchemy import UniqueConstraint
 from sqlmodel import Field, SQLModel
 from datetime import datetime
 
@@ -59,3 +60,59 @@ class InvoiceItem(SQLModel, table=True):
     total_price: Optional[float] = None
     suggested_material_id: Optional[int] = None
     match_confidence: Optional[float] = None
+
+class DataVersion(SQLModel, table=True):
+    """Write counter for a table ("purchases") or a row ("purchase:42"), see app.caching."""
+    key: str = Field(primary_key=True)
+    version: int = 0
+
+class SupplierMonthlySpend(SQLModel, table=True):
+    """Purchases per supplier and invoice month, maintained by app.analytics."""
+    supplier: str = Field(primary_key=True)  # "" when the purchase has no supplier
+    month: str = Field(primary_key=True)  # YYYY-MM
+    purchases: int = 0
+    total_amount: float = 0.0
+
+class MaterialMonthlySpend(SQLModel, table=True):
+    """Purchased quantity and spend per material and invoice month, maintained by app.analytics."""
+    material_id: int = Field(primary_key=True, foreign_key="material.id")
+    month: str = Field(primary_key=True)  # YYYY-MM
+    items: int = 0
+    quantity: float = 0.0
+    spend: float = 0.0
+
+class MaterialPriceStats(SQLModel, table=True):
+    """Running unit price statistics per material, maintained by app.pricing."""
+    material_id: int = Field(primary_key=True, foreign_key="material.id")
+    count: int = 0
+    last_price: float = 0.0
+    last_item_id: Optional[int] = None
+    min_price: float = 0.0
+    max_price: float = 0.0
+    sum_price: float = 0.0
+    # Exponentially weighted, so recent prices dominate (PRICE_STATS_ALPHA)
+    mean: float = 0.0
+    variance: float = 0.0
+
+class PurchaseKey(SQLModel, table=True):
+    """Normalised identity of a supplier invoice, unique across purchases (see app.duplicates)."""
+    __table_args__ = (UniqueConstraint("supplier", "invoice_number", "invoice_date", name="uq_purchasekey_invoice"),)
+    purchase_id: int = Field(primary_key=True, foreign_key="purchase.id")
+    supplier: str
+    invoice_number: str
+    invoice_date: str  # YYYY-MM-DD, "" when unknown
+
+class ImportedDocument(SQLModel, table=True):
+    """SHA-256 of an invoice file ingested by app.ingest, so the same content is never imported twice."""
+    sha256: str = Field(primary_key=True)
+    # The purchase created for it, or the one already holding the invoice;
+    # no foreign key, so deleting the purchase doesn't bring the file back
+    purchase_id: Optional[int] = None
+    source: str
+    imported_at: datetime = Field(default_factory=datetime.utcnow)
+
+class SchemaVersion(SQLModel, table=True):
+    """Fingerprint of the table definitions create_all() last ran for, see app.database.init_db."""
+    id: int = Field(default=1, primary_key=True)
+    fingerprint: str
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
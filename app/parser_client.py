@@ -0,0 +1,364 @@
+"""
+HTTP client for the XML parser microservice.
+
+Streams uploads to the parser endpoints of :data:`app.parser_pool.parser_pool`
+with retries, hedging and circuit breakers, and decodes the NDJSON answer.
+Every attempt carries the request's ``traceparent`` and ``X-Request-ID``
+(see :mod:`app.tracing`), so the parser logs and traces it under the same id.
+Imported on the first upload rather than at startup, together with httpx.
+"""
+import asyncio
+import json
+import logging
+import time
+import zlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from app import tracing
+from app.config import config
+from app.compression import supported_encodings
+from app.parser_pool import ParserEndpoint, parser_pool, parser_ssl_context
+from app.resilience import LatencyWindow, backoff_delay
+from app.uploads import ReplayableBody, UploadTooLarge, upload_http_error
+
+logger = logging.getLogger(__name__)
+
+# Parser answers that mean "try again", typically a worker restarting
+# behind a proxy
+RETRYABLE_STATUSES = (502, 503, 504)
+
+# Latency of all parser endpoints, used to time hedged requests
+parser_latency = LatencyWindow()
+
+
+def encode_for_parser(chunks: AsyncIterator[bytes], content_encoding: Optional[str]) -> tuple:
+    """
+    Compress XML for the parser hop according to XML_PARSER_REQUEST_ENCODING.
+    
+    Chunks are compressed as they arrive, so the body can be sent with
+    chunked transfer encoding. Content that is already encoded (e.g. an
+    uploaded ``.xml.gz``) is passed through untouched instead of being
+    decompressed and compressed again.
+    
+    Returns:
+        Tuple of (async iterator over body chunks, Content-Encoding value or None)
+    """
+    if content_encoding:
+        return chunks, content_encoding
+    
+    wanted = (config.XML_PARSER_REQUEST_ENCODING or "identity").lower()
+    if wanted == "gzip":
+        compressor, encoding = zlib.compressobj(1, wbits=16 + zlib.MAX_WBITS), "gzip"
+    elif wanted == "zstd" and "zstd" in supported_encodings():
+        import zstandard
+        compressor, encoding = zstandard.ZstdCompressor(level=3).compressobj(), "zstd"
+    else:
+        return chunks, None
+    
+    async def compressed():
+        async for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    
+    return compressed(), encoding
+
+
+async def iter_parser_events(response: httpx.Response):
+    """
+    Decode the parser's NDJSON response as it arrives.
+    
+    Yields ('line_item', dict) per invoice line and finally one
+    ('invoice_metadata', dict) event taken from the trailer record.
+    
+    Raises:
+        HTTPException: 502 if the parser reports an error mid-stream or the
+            stream ends without its trailer
+    """
+    async for line in response.aiter_lines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        if 'error' in record:
+            logger.error("Parser service error while streaming: %s", record['error'])
+            raise HTTPException(status_code=502, detail=f"Parser service error: {record['error']}")
+        if 'invoice_metadata' in record:
+            yield 'invoice_metadata', record['invoice_metadata']
+            return
+        yield 'line_item', record
+    
+    raise HTTPException(status_code=502, detail="Parser service response ended unexpectedly")
+
+
+async def _attempt(client: httpx.AsyncClient, endpoint: ParserEndpoint, build_request) -> tuple:
+    """
+    Send one request to ``endpoint`` and record the outcome on it.
+    
+    The endpoint counts as outstanding until :func:`_release` is called
+    with the returned response.
+    
+    Returns:
+        Tuple of (endpoint, streamed response)
+    """
+    endpoint.start()
+    started = time.monotonic()
+    with tracing.span("parser.attempt", kind=tracing.CLIENT, endpoint=endpoint.url) as span:
+        try:
+            response = await client.send(build_request(endpoint.base_url), stream=True)
+        except BaseException as e:
+            endpoint.finish()
+            if isinstance(e, httpx.TransportError):
+                endpoint.record_failure()
+            else:
+                # Cancelled (the losing hedge) or failed locally: no verdict
+                # on the parser, but a half-open trial must not stay taken
+                endpoint.record_abandoned()
+            raise
+        span.set(**{"http.status_code": response.status_code})
+    
+    if response.status_code in RETRYABLE_STATUSES:
+        endpoint.record_failure()
+    else:
+        elapsed = time.monotonic() - started
+        endpoint.record_success(elapsed)
+        parser_latency.observe(elapsed)
+    return endpoint, response
+
+
+async def _release(call: tuple):
+    endpoint, response = call
+    try:
+        await response.aclose()
+    finally:
+        endpoint.finish()
+
+
+async def _send_hedged(client: httpx.AsyncClient, endpoint: ParserEndpoint, build_request, tried: list) -> tuple:
+    """
+    Send a request, hedging it with a second copy if it is slow to answer.
+    
+    With XML_PARSER_HEDGE enabled and enough latency samples recorded, a
+    second request is started (on another endpoint when one is available)
+    once the first has not produced response headers within the recent p95
+    latency. The first usable response wins; the other request is cancelled
+    (or its response closed).
+    """
+    primary = asyncio.create_task(_attempt(client, endpoint, build_request))
+    p95 = parser_latency.percentile(95)
+    if not config.XML_PARSER_HEDGE or p95 is None:
+        return await primary
+    
+    tasks = [primary]
+    winner = None
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=max(p95, config.XML_PARSER_HEDGE_MIN_DELAY))
+        hedge_endpoint = None if done else parser_pool.choose(exclude=tried)
+        if hedge_endpoint is not None:
+            logger.info("Parser slower than p95 (%.0f ms), sending hedged request to %s", p95 * 1000, hedge_endpoint.url)
+            tried.append(hedge_endpoint)
+            tasks.append(asyncio.create_task(_attempt(client, hedge_endpoint, build_request)))
+        
+        pending = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result()[1].status_code not in RETRYABLE_STATUSES:
+                    winner = task
+                    break
+        
+        # Both attempts failed: surface the primary's outcome
+        winner = winner or primary
+        return winner.result()
+    finally:
+        for task in tasks:
+            if task is winner:
+                continue
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None:
+                await _release(task.result())
+
+
+async def send_to_parser(client: httpx.AsyncClient, build_request, filename: str) -> tuple:
+    """
+    Send a parse request with load balancing, retries, hedging and circuit breakers.
+    
+    Every attempt goes to an endpoint picked by :data:`parser_pool`,
+    preferring instances this request has not tried yet. Parsing is
+    idempotent, so connection errors, timeouts and 502/503/504 answers are
+    retried up to XML_PARSER_RETRIES times with full-jitter backoff. Each
+    failed attempt counts against that endpoint's circuit breaker; once no
+    endpoint is in rotation, calls fail fast with 503 instead of waiting on
+    a dead service.
+    
+    Args:
+        client: HTTP client
+        build_request: Callable taking an endpoint base URL and returning
+            the request to send
+        filename: Name of the uploaded file, for logging
+    
+    Returns:
+        Tuple of (endpoint, response) for the first response that is not
+        retryable (possibly an error status); pass it to :func:`_release`
+        
+    Raises:
+        HTTPException: 503 when no endpoint is in rotation, 504/502 once
+            retries are exhausted on timeouts/connection errors
+    """
+    tried = []
+    last_error = None
+    for attempt in range(config.XML_PARSER_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(backoff_delay(attempt, config.XML_PARSER_BACKOFF_BASE, config.XML_PARSER_BACKOFF_MAX))
+        endpoint = parser_pool.choose(exclude=tried)
+        if endpoint is None:
+            logger.warning("No parser endpoint in rotation, not calling XML parser for %s", filename)
+            if isinstance(last_error, tuple):
+                await _release(last_error)
+            raise HTTPException(
+                status_code=503, 
+                detail="Parser service unavailable (circuit breaker open on all endpoints)"
+            )
+        tried.append(endpoint)
+        
+        try:
+            call = await _send_hedged(client, endpoint, build_request, tried)
+        except httpx.TimeoutException as e:
+            logger.warning("Timeout calling XML parser at %s for %s (attempt %s)", endpoint.url, filename, attempt + 1)
+            last_error = e
+            continue
+        except httpx.TransportError as e:
+            logger.warning("Request error calling XML parser at %s for %s (attempt %s): %s", endpoint.url, filename, attempt + 1, e)
+            last_error = e
+            continue
+        
+        if isinstance(last_error, tuple):
+            await _release(last_error)
+        if call[1].status_code not in RETRYABLE_STATUSES:
+            return call
+        logger.warning("XML parser at %s answered %s for %s (attempt %s)", call[0].url, call[1].status_code, filename, attempt + 1)
+        last_error = call
+    
+    if isinstance(last_error, tuple):
+        return last_error
+    if isinstance(last_error, httpx.TimeoutException):
+        logger.error("Timeout calling XML parser for %s", filename)
+        raise HTTPException(status_code=504, detail="Parser service timeout")
+    logger.error("Request error calling XML parser: %s", last_error)
+    raise HTTPException(status_code=502, detail=f"Cannot connect to parser service: {last_error}")
+
+
+@asynccontextmanager
+async def stream_xml_parser(chunks: AsyncIterator[bytes], filename: str, content_encoding: Optional[str] = None):
+    """
+    Stream an upload through the XML parser microservice.
+    
+    The upload is posted to the parser's raw ``application/xml`` endpoint as
+    a chunked request body (compressed per XML_PARSER_REQUEST_ENCODING) and
+    the parser answers with NDJSON, so neither the XML nor the parsed
+    invoice is ever held in memory as a whole. Requests are balanced over
+    the endpoints listed in XML_PARSER_URL. The body is teed into a
+    spooled file as it is sent so retries and hedged requests can replay
+    it (see :func:`send_to_parser`). The context manager yields the async
+    iterator from :func:`iter_parser_events`.
+    
+    Args:
+        chunks: Async iterator over the raw upload
+        filename: Name of the uploaded file
+        content_encoding: Encoding the chunks are already in, if any
+        
+    Raises:
+        HTTPException: If parser service fails or is not configured
+    """
+    if not config.XML_PARSER_URL:
+        raise HTTPException(
+            status_code=503, 
+            detail="XML parser service not configured. Set XML_PARSER_URL environment variable."
+        )
+    
+    encoded, body_encoding = encode_for_parser(chunks, content_encoding)
+    body = ReplayableBody(encoded)
+    
+    # Prepare headers
+    headers = {
+        'Content-Type': 'application/xml',
+        'Accept': 'application/x-ndjson',
+        'Accept-Encoding': ', '.join(supported_encodings()),
+    }
+    if body_encoding:
+        headers['Content-Encoding'] = body_encoding
+    if config.XML_PARSER_TOKEN:
+        headers['Authorization'] = f'Bearer {config.XML_PARSER_TOKEN}'
+    
+    timeout = httpx.Timeout(config.XML_PARSER_TIMEOUT, connect=config.XML_PARSER_CONNECT_TIMEOUT)
+    
+    try:
+        async with httpx.AsyncClient(
+            timeout=timeout, mounts=parser_pool.mounts(), verify=parser_ssl_context()
+        ) as client:
+            def build_request(base_url):
+                # Called within the attempt's span, which becomes the parser's parent
+                return client.build_request(
+                    'POST', f"{base_url}/parse", content=body.__aiter__(),
+                    headers={**headers, **tracing.propagation_headers()},
+                    params={'filename': filename, 'format': 'ndjson'}
+                )
+            
+            logger.info("Streaming %s to XML parser", filename)
+            round_trip = tracing.start_span("parser.request", filename=filename)
+            try:
+                with tracing.use_span(round_trip):
+                    call = await send_to_parser(client, build_request, filename)
+            except BaseException as e:
+                round_trip.end(e)
+                raise
+            endpoint, response = call
+            round_trip.set(endpoint=endpoint.url, **{"http.status_code": response.status_code})
+            try:
+                if response.status_code == 401:
+                    logger.error("XML parser authentication failed")
+                    raise HTTPException(status_code=502, detail="Parser service authentication failed")
+                if response.status_code in (413, 422):
+                    # Over the parser's size or complexity limits
+                    await response.aread()
+                    raise HTTPException(status_code=response.status_code, detail=_parser_error(response))
+                if response.status_code != 200:
+                    await response.aread()
+                    error_detail = _parser_error(response)
+                    logger.error("Parser service error: %s", error_detail)
+                    raise HTTPException(
+                        status_code=502, 
+                        detail=f"Parser service error: {error_detail}"
+                    )
+                
+                logger.info("Parser at %s is parsing %s", endpoint.url, filename)
+                yield iter_parser_events(response)
+            except BaseException as e:
+                round_trip.end(e)
+                raise
+            finally:
+                await _release(call)
+                round_trip.end()
+                
+    except UploadTooLarge as e:
+        raise upload_http_error(e)
+    except httpx.TimeoutException:
+        logger.error("Timeout reading XML parser response for %s", filename)
+        raise HTTPException(status_code=504, detail="Parser service timeout")
+    except httpx.RequestError as e:
+        logger.error("Request error reading XML parser response: %s", e)
+        raise HTTPException(status_code=502, detail=f"Parser service connection lost: {e}")
+    finally:
+        body.close()
+
+
+def _parser_error(response: httpx.Response) -> str:
+    try:
+        return response.json().get('error', 'Unknown error')
+    except ValueError:
+        return 'Unknown error'
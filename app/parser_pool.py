@@ -0,0 +1,217 @@
+"""
+Client-side load balancing across XML parser instances.
+
+XML_PARSER_URL may list several parser endpoints separated by commas, as
+HTTP URLs or ``unix:/path/to/socket`` for an instance on the same host. Each
+request picks an endpoint with power-of-two-choices (or plain
+least-outstanding) over the instances currently in rotation. An instance
+leaves the rotation when its own circuit breaker opens after consecutive
+failures, or when an active ``/health`` probe fails. It comes back after a
+successful probe or a successful half-open trial request.
+"""
+import asyncio
+import functools
+import hashlib
+import logging
+import random
+import time
+from typing import Iterable, List, Optional
+
+import httpx
+
+from app.config import config
+from app.resilience import CircuitBreaker, LatencyWindow
+
+logger = logging.getLogger(__name__)
+
+
+UNIX_PREFIX = "unix:"
+
+
+@functools.lru_cache(maxsize=None)
+def parser_ssl_context():
+    """
+    SSL context shared by every parser client and transport.
+
+    httpx loads the CA bundle for each new client or transport (~50 ms),
+    which would otherwise dominate the latency of a parser call.
+    """
+    return httpx.create_ssl_context()
+
+
+def parser_urls() -> List[str]:
+    """Return the configured parser base URLs (XML_PARSER_URL, comma-separated)."""
+    return [url.strip().rstrip("/") for url in (config.XML_PARSER_URL or "").split(",") if url.strip()]
+
+
+class ParserEndpoint:
+    """
+    One parser instance with its breaker, latency window and counters.
+
+    ``url`` is either an HTTP base URL or ``unix:/path/to/parser.sock`` for
+    a parser on the same host. Socket endpoints get a synthetic
+    ``base_url`` whose host is routed to the socket by :meth:`ParserPool.mounts`.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        if url.startswith(UNIX_PREFIX):
+            self.socket_path = url[len(UNIX_PREFIX):]
+            digest = hashlib.sha1(self.socket_path.encode("utf-8")).hexdigest()[:12]
+            self.base_url = f"http://uds-{digest}.localhost"
+        else:
+            self.socket_path = None
+            self.base_url = url
+        self.breaker = CircuitBreaker(
+            failure_threshold=config.XML_PARSER_BREAKER_THRESHOLD,
+            reset_timeout=config.XML_PARSER_BREAKER_RESET
+        )
+        self.latency = LatencyWindow(min_samples=1)
+        # Assume healthy until a probe says otherwise
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.last_probe = None
+
+    @property
+    def available(self) -> bool:
+        """True while the endpoint is in rotation."""
+        return self.healthy and self.breaker.state != CircuitBreaker.OPEN
+
+    def start(self):
+        self.outstanding += 1
+        self.requests += 1
+
+    def finish(self):
+        self.outstanding -= 1
+
+    def record_success(self, seconds: float):
+        self.breaker.record_success()
+        self.latency.observe(seconds)
+
+    def record_failure(self):
+        self.failures += 1
+        self.breaker.record_failure()
+        if self.breaker.state == CircuitBreaker.OPEN:
+            logger.warning("Ejecting parser endpoint %s after repeated failures", self.url)
+
+    def record_abandoned(self):
+        """The request ended without an answer about the parser (e.g. a cancelled hedge)."""
+        self.breaker.release_trial()
+
+    def stats(self) -> dict:
+        p50, p95 = self.latency.percentile(50), self.latency.percentile(95)
+        return {
+            "url": self.url,
+            "in_rotation": self.available,
+            "healthy": self.healthy,
+            "circuit": self.breaker.snapshot(),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "last_probe": self.last_probe,
+        }
+
+
+class ParserPool:
+    """The set of parser endpoints, kept in sync with XML_PARSER_URL."""
+
+    def __init__(self):
+        self._endpoints = {}
+
+    @property
+    def endpoints(self) -> List[ParserEndpoint]:
+        self.sync(parser_urls())
+        return list(self._endpoints.values())
+
+    def sync(self, urls: Iterable[str]):
+        """Add endpoints for new URLs and drop removed ones, keeping the state of the rest."""
+        urls = list(dict.fromkeys(urls))
+        if list(self._endpoints) == urls:
+            return
+        self._endpoints = {url: self._endpoints.get(url) or ParserEndpoint(url) for url in urls}
+
+    def reset(self):
+        self._endpoints = {}
+
+    def mounts(self) -> dict:
+        """httpx transports routing Unix socket endpoints to their sockets."""
+        return {
+            endpoint.base_url: httpx.AsyncHTTPTransport(uds=endpoint.socket_path, verify=parser_ssl_context())
+            for endpoint in self.endpoints
+            if endpoint.socket_path
+        }
+
+    def choose(self, exclude: Iterable[ParserEndpoint] = ()) -> Optional[ParserEndpoint]:
+        """
+        Pick an endpoint for the next request, or None if none is in rotation.
+
+        Endpoints in ``exclude`` (already tried by this request) are avoided
+        while others are available. XML_PARSER_BALANCER selects ``p2c``
+        (least outstanding of two random candidates, the default) or
+        ``least_outstanding`` (least outstanding of all candidates).
+        """
+        endpoints = [e for e in self.endpoints if e.available]
+        exclude = set(exclude)
+        candidates = [e for e in endpoints if e not in exclude] or endpoints
+
+        while candidates:
+            if len(candidates) == 1:
+                pick = candidates[0]
+            elif config.XML_PARSER_BALANCER == "least_outstanding":
+                fewest = min(e.outstanding for e in candidates)
+                pick = random.choice([e for e in candidates if e.outstanding == fewest])
+            else:
+                first, second = random.sample(candidates, 2)
+                pick = first if first.outstanding <= second.outstanding else second
+            # A half-open endpoint admits a single trial request at a time
+            if pick.breaker.allow():
+                return pick
+            candidates.remove(pick)
+        return None
+
+    async def probe(self, client: httpx.AsyncClient, endpoint: ParserEndpoint) -> bool:
+        """Check one endpoint's /health and eject or re-admit it accordingly."""
+        started = time.monotonic()
+        try:
+            response = await client.get(f"{endpoint.base_url}/health", timeout=config.XML_PARSER_PROBE_TIMEOUT)
+            ok = response.status_code == 200 and response.json().get("status") == "healthy"
+            error = None if ok else f"HTTP {response.status_code}"
+        except (httpx.HTTPError, ValueError) as e:
+            ok, error = False, str(e) or type(e).__name__
+
+        endpoint.last_probe = {
+            "ok": ok,
+            "error": error,
+            "latency_ms": round((time.monotonic() - started) * 1000, 1),
+        }
+        if ok and not endpoint.available:
+            logger.info("Parser endpoint %s passed its health probe, back in rotation", endpoint.url)
+            endpoint.breaker.record_success()
+        elif not ok and endpoint.healthy:
+            logger.warning("Parser endpoint %s failed its health probe (%s), ejecting", endpoint.url, error)
+        endpoint.healthy = ok
+        return ok
+
+    async def probe_all(self, client: httpx.AsyncClient):
+        await asyncio.gather(*(self.probe(client, endpoint) for endpoint in self.endpoints))
+
+    async def run_probes(self):
+        """Probe all endpoints every XML_PARSER_PROBE_INTERVAL seconds until cancelled."""
+        headers = {}
+        if config.XML_PARSER_TOKEN:
+            headers["Authorization"] = f"Bearer {config.XML_PARSER_TOKEN}"
+        async with httpx.AsyncClient(headers=headers, mounts=self.mounts(), verify=parser_ssl_context()) as client:
+            while True:
+                try:
+                    await self.probe_all(client)
+                except Exception as e:
+                    logger.error("Parser health probing failed: %s", e)
+                await asyncio.sleep(config.XML_PARSER_PROBE_INTERVAL)
+
+
+# Shared by all requests in this process
+parser_pool = ParserPool()
@@ -0,0 +1,159 @@
+"""
+Unit price statistics per material and price anomaly checks.
+
+Each new purchase item with a material and a unit price updates that
+material's :class:`app.models.MaterialPriceStats` row in the same
+transaction (after the flush that inserts it): last price, min/max, a
+lifetime average and an exponentially weighted mean and variance. Checking
+an ingested line against its material is then a dictionary lookup, with
+the statistics for a whole invoice loaded in one query.
+"""
+import math
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import bindparam, delete, event, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import config
+
+stats_table = models.MaterialPriceStats.__table__
+item_table = models.PurchaseItem.__table__
+
+# Ids per IN (...) list, well below SQLite's bound parameter limit
+_IN_CHUNK = 500
+# Item rows fetched per block by the rebuild
+_REBUILD_CHUNK = 50000
+
+
+def update_stats(stats: Optional[dict], material_id: int, item_id: Optional[int], price: float) -> dict:
+    """Return ``stats`` (a MaterialPriceStats row as a dict, or None) updated with one price."""
+    if stats is None:
+        return {
+            "material_id": material_id,
+            "count": 1,
+            "last_price": price,
+            "last_item_id": item_id,
+            "min_price": price,
+            "max_price": price,
+            "sum_price": price,
+            "mean": price,
+            "variance": 0.0,
+        }
+    alpha = config.PRICE_STATS_ALPHA
+    diff = price - stats["mean"]
+    increment = alpha * diff
+    return {
+        **stats,
+        "count": stats["count"] + 1,
+        "last_price": price,
+        "last_item_id": item_id,
+        "min_price": min(stats["min_price"], price),
+        "max_price": max(stats["max_price"], price),
+        "sum_price": stats["sum_price"] + price,
+        "mean": stats["mean"] + increment,
+        "variance": (1 - alpha) * (stats["variance"] + diff * increment),
+    }
+
+
+def load_price_stats(session: Session, material_ids: Iterable[int]) -> Dict[int, dict]:
+    """Current statistics for the given materials, keyed by material id."""
+    material_ids = list({m for m in material_ids if m is not None})
+    stats = {}
+    connection = session.connection()
+    for start in range(0, len(material_ids), _IN_CHUNK):
+        chunk = material_ids[start:start + _IN_CHUNK]
+        for row in connection.execute(select(stats_table).where(stats_table.c.material_id.in_(chunk))).mappings():
+            stats[row["material_id"]] = dict(row)
+    return stats
+
+
+def _store(connection, updated: Dict[int, dict], existing: Iterable[int]):
+    existing = set(existing)
+    updates = [{f"p_{k}": v for k, v in row.items()} for m, row in updated.items() if m in existing]
+    inserts = [row for m, row in updated.items() if m not in existing]
+    if updates:
+        columns = [c.name for c in stats_table.columns if c.name != "material_id"]
+        connection.execute(
+            stats_table.update()
+            .where(stats_table.c.material_id == bindparam("p_material_id"))
+            .values({c: bindparam(f"p_{c}") for c in columns}),
+            updates
+        )
+    if inserts:
+        connection.execute(stats_table.insert(), inserts)
+
+
+@event.listens_for(Session, "after_flush")
+def _update_after_flush(session, flush_context):
+    items = sorted(
+        (obj for obj in session.new
+         if isinstance(obj, models.PurchaseItem) and obj.material_id is not None and obj.unit_price is not None),
+        key=lambda item: item.id
+    )
+    if not items:
+        return
+    stats = load_price_stats(session, (item.material_id for item in items))
+    existing = set(stats)
+    for item in items:
+        stats[item.material_id] = update_stats(stats.get(item.material_id), item.material_id, item.id, item.unit_price)
+    _store(session.connection(), {item.material_id: stats[item.material_id] for item in items}, existing)
+
+
+def price_anomaly(stats: Optional[dict], unit_price: Optional[float]) -> Optional[dict]:
+    """
+    Compare a unit price with its material's statistics.
+
+    Returns None for a normal price (or when there is not enough history),
+    otherwise the expected price and the relative deviation from it.
+    """
+    threshold = config.PRICE_ANOMALY_THRESHOLD
+    if threshold <= 0 or stats is None or unit_price is None:
+        return None
+    if stats["count"] < config.PRICE_ANOMALY_MIN_SAMPLES or not stats["mean"]:
+        return None
+    deviation = (unit_price - stats["mean"]) / stats["mean"]
+    if abs(deviation) <= threshold:
+        return None
+    stddev = math.sqrt(stats["variance"])
+    return {
+        "expected_price": round(stats["mean"], 4),
+        "deviation": round(deviation, 4),
+        "z_score": round((unit_price - stats["mean"]) / stddev, 2) if stddev else None,
+    }
+
+
+def describe_stats(stats: dict) -> dict:
+    """Statistics as returned by the API, with derived average and standard deviation."""
+    return {
+        "material_id": stats["material_id"],
+        "count": stats["count"],
+        "last_price": stats["last_price"],
+        "last_item_id": stats["last_item_id"],
+        "min_price": stats["min_price"],
+        "max_price": stats["max_price"],
+        "avg_price": stats["sum_price"] / stats["count"],
+        "rolling_mean": stats["mean"],
+        "rolling_stddev": math.sqrt(stats["variance"]),
+    }
+
+
+def rebuild_price_stats(session: Session) -> dict:
+    """Recompute every material's statistics from its items in insertion order, and commit."""
+    connection = session.connection()
+    result = connection.execute(
+        select(item_table.c.id, item_table.c.material_id, item_table.c.unit_price)
+        .where(item_table.c.material_id.isnot(None), item_table.c.unit_price.isnot(None))
+        .order_by(item_table.c.id)
+        .execution_options(stream_results=True)
+    )
+    stats = {}
+    for block in result.partitions(_REBUILD_CHUNK):
+        for item_id, material_id, price in block:
+            stats[material_id] = update_stats(stats.get(material_id), material_id, item_id, price)
+
+    connection.execute(delete(stats_table))
+    if stats:
+        connection.execute(stats_table.insert(), list(stats.values()))
+    session.commit()
+    return {"price_stats_rows": len(stats)}
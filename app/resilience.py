@@ -0,0 +1,119 @@
+"""
+Building blocks for calling a flaky downstream service.
+
+A :class:`CircuitBreaker` fails fast while the service is unhealthy,
+:class:`LatencyWindow` tracks recent response times to derive a hedging
+delay, and :func:`backoff_delay` spaces retries out with full jitter so
+callers don't retry in lockstep while a worker restarts.
+"""
+import math
+import random
+import time
+from collections import deque
+from typing import Optional
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Full-jitter exponential backoff.
+
+    Returns a random delay in ``[0, min(cap, base * 2**(attempt - 1))]`` for
+    the given retry number (1 for the first retry).
+    """
+    return random.uniform(0, min(cap, base * 2 ** max(attempt - 1, 0)))
+
+
+class LatencyWindow:
+    """Rolling window of recent latencies (seconds) with percentile lookup."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Return the p-th percentile, or None until min_samples are recorded."""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def clear(self):
+        self._samples.clear()
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    ``closed``: calls go through. After ``failure_threshold`` consecutive
+    failures the breaker turns ``open`` and :meth:`allow` returns False.
+    Once ``reset_timeout`` seconds have passed it is ``half_open`` and lets
+    a single trial call through; its outcome closes or re-opens the breaker.
+    A trial that ends without an outcome (cancelled, or failed for reasons
+    unrelated to the service) must call :meth:`release_trial`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def allow(self) -> bool:
+        """Return True if a call may be attempted now."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN or self._trial_in_flight:
+            return False
+        self._trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._trial_in_flight or self._failures >= self.failure_threshold:
+            self._state = self.OPEN
+            self._opened_at = self.clock()
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        """Let another trial call through: the one in flight ended without an outcome."""
+        self._trial_in_flight = False
+
+    def snapshot(self) -> dict:
+        """State for health endpoints."""
+        state = self.state
+        retry_in = None
+        if state == self.OPEN:
+            retry_in = round(self.reset_timeout - (self.clock() - self._opened_at), 3)
+        return {
+            "state": state,
+            "consecutive_failures": self._failures,
+            "retry_in_seconds": retry_in,
+        }
@@ -0,0 +1,223 @@
+"""
+Full-text search over material names and purchase line descriptions.
+
+On SQLite an FTS5 table (``search_index``) holds one row per material and
+per purchase item, tokenised with ``unicode61 remove_diacritics 2`` so that
+"teava cupru" finds "Țeavă cupru 22mm" and every query word is matched as
+a prefix ("cablu sol" finds "Cablu solar"). The rowid encodes the source
+row (``2 * id`` for an item, ``2 * id + 1`` for a material), which keeps
+updates and deletes to rowid lookups. A session listener writes the index
+in the same transaction as every ORM change to materials or items; rows
+written through Core statements (or before the index existed) need a
+rebuild::
+
+    python -m app.search
+
+Other databases have no FTS5: there :func:`search` and
+:func:`rebuild_search_index` raise :class:`SearchUnavailable` rather than
+answer with unranked, diacritic-sensitive matches.
+"""
+import re
+from typing import List, Optional
+
+from sqlalchemy import DDL, bindparam, event, select, text
+from sqlalchemy.orm import Session
+from sqlmodel import SQLModel
+
+from app import models
+
+INDEX = "search_index"
+KIND_ITEM = "item"
+KIND_MATERIAL = "material"
+
+purchase_table = models.Purchase.__table__
+item_table = models.PurchaseItem.__table__
+material_table = models.Material.__table__
+
+# Rowids per IN (...) list, well below SQLite's bound parameter limit
+_IN_CHUNK = 500
+_WORD = re.compile(r"\w+", re.UNICODE)
+# bm25() column weights: a SKU match is more specific than a word in a name
+_WEIGHTS = "1.0, 2.0"
+
+INDEX_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX} USING fts5("
+    "text, sku, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+# Created alongside the ORM tables, which create_all() does on its own
+event.listen(SQLModel.metadata, "after_create", DDL(INDEX_DDL).execute_if(dialect="sqlite"))
+
+_insert_entries = text(f"INSERT INTO {INDEX} (rowid, text, sku) VALUES (:rowid, :text, :sku)")
+_delete_entries = text(f"DELETE FROM {INDEX} WHERE rowid IN :rowids").bindparams(
+    bindparam("rowids", expanding=True)
+)
+
+
+class SearchUnavailable(RuntimeError):
+    """Raised when the database has no FTS5 for ranked search."""
+
+    def __init__(self):
+        super().__init__("Full-text search needs SQLite with FTS5")
+
+
+def index_rowid(kind: str, row_id: int) -> int:
+    return 2 * row_id + (1 if kind == KIND_MATERIAL else 0)
+
+
+def _skus(*values: Optional[str]) -> str:
+    return " ".join(value for value in values if value)
+
+
+def _entry(obj) -> Optional[dict]:
+    if isinstance(obj, models.PurchaseItem):
+        return {"rowid": index_rowid(KIND_ITEM, obj.id), "text": obj.description or "",
+                "sku": _skus(obj.sku_raw, obj.sku_clean)}
+    if isinstance(obj, models.Material):
+        return {"rowid": index_rowid(KIND_MATERIAL, obj.id), "text": obj.name or "", "sku": obj.sku or ""}
+    return None
+
+
+def uses_fts(session: Session) -> bool:
+    return session.get_bind().dialect.name == "sqlite"
+
+
+@event.listens_for(Session, "after_flush")
+def _index_after_flush(session, flush_context):
+    entries, stale = [], []
+    for obj in session.new:
+        entry = _entry(obj)
+        if entry is not None:
+            entries.append(entry)
+    for obj in session.dirty:
+        entry = _entry(obj)
+        if entry is not None and session.is_modified(obj):
+            entries.append(entry)
+            stale.append(entry["rowid"])
+    for obj in session.deleted:
+        entry = _entry(obj)
+        if entry is not None:
+            stale.append(entry["rowid"])
+    if not (entries or stale) or not uses_fts(session):
+        return
+
+    connection = session.connection()
+    for start in range(0, len(stale), _IN_CHUNK):
+        connection.execute(_delete_entries, {"rowids": stale[start:start + _IN_CHUNK]})
+    if entries:
+        connection.execute(_insert_entries, entries)
+
+
+def fts_query(query: str) -> Optional[str]:
+    """
+    FTS5 query matching every word of ``query`` as a prefix, e.g.
+    ``cablu 6mm`` -> ``"cablu"* "6mm"*``; None when there is no word.
+    Quoting keeps FTS5 operators and punctuation in user input literal.
+    """
+    words = _WORD.findall(query)
+    return " ".join(f'"{word}"*' for word in words) or None
+
+
+def _kind_filter(kind: Optional[str]) -> str:
+    if kind is None:
+        return ""
+    return f" AND rowid % 2 = {1 if kind == KIND_MATERIAL else 0}"
+
+
+def _describe_items(session: Session, item_ids: List[int]) -> dict:
+    rows = session.connection().execute(
+        select(item_table.c.id, item_table.c.purchase_id, item_table.c.material_id, item_table.c.description,
+               item_table.c.sku_clean, item_table.c.sku_raw, item_table.c.quantity, item_table.c.unit_price,
+               purchase_table.c.supplier, purchase_table.c.invoice_number, purchase_table.c.invoice_date)
+        .join(purchase_table, purchase_table.c.id == item_table.c.purchase_id)
+        .where(item_table.c.id.in_(item_ids))
+    ).mappings()
+    return {row["id"]: {
+        "kind": KIND_ITEM,
+        "id": row["id"],
+        "description": row["description"],
+        "sku": row["sku_clean"] or row["sku_raw"],
+        "material_id": row["material_id"],
+        "quantity": row["quantity"],
+        "unit_price": row["unit_price"],
+        "purchase_id": row["purchase_id"],
+        "supplier": row["supplier"],
+        "invoice_number": row["invoice_number"],
+        "invoice_date": row["invoice_date"],
+    } for row in rows}
+
+
+def _describe_materials(session: Session, material_ids: List[int]) -> dict:
+    rows = session.connection().execute(
+        select(material_table.c.id, material_table.c.name, material_table.c.sku, material_table.c.unit)
+        .where(material_table.c.id.in_(material_ids))
+    ).mappings()
+    return {row["id"]: {"kind": KIND_MATERIAL, **row} for row in rows}
+
+
+def _search_fts(session: Session, match: str, kind: Optional[str], limit: int, offset: int):
+    connection = session.connection()
+    where = f"{INDEX} MATCH :match" + _kind_filter(kind)
+    total = connection.execute(text(f"SELECT count(*) FROM {INDEX} WHERE {where}"), {"match": match}).scalar()
+    hits = connection.execute(text(
+        f"SELECT rowid, bm25({INDEX}, {_WEIGHTS}) AS score,"
+        f" snippet({INDEX}, 0, '[', ']', '…', 12) AS snippet"
+        f" FROM {INDEX} WHERE {where} ORDER BY score LIMIT :limit OFFSET :offset"
+    ), {"match": match, "limit": limit, "offset": offset}).all()
+
+    items = _describe_items(session, [rowid // 2 for rowid, _, _ in hits if rowid % 2 == 0])
+    materials = _describe_materials(session, [rowid // 2 for rowid, _, _ in hits if rowid % 2 == 1])
+    results = []
+    for rowid, score, snippet in hits:
+        row = (materials if rowid % 2 else items).get(rowid // 2)
+        if row is None:  # source row deleted outside the ORM
+            continue
+        # bm25() is lower for better matches
+        results.append({**row, "score": round(-score, 4), "snippet": snippet})
+    return total, results
+
+
+def search(session: Session, query: str, kind: Optional[str] = None, limit: int = 20, offset: int = 0) -> dict:
+    """
+    Materials and purchase items matching every word of ``query``, best
+    match first, optionally only one ``kind`` (``material`` or ``item``).
+
+    Item results carry their purchase's supplier, invoice number and date.
+    Raises SearchUnavailable when the database has no FTS5.
+    """
+    if not uses_fts(session):
+        raise SearchUnavailable()
+    match = fts_query(query)
+    if match is None:
+        total, results = 0, []
+    else:
+        total, results = _search_fts(session, match, kind, limit, offset)
+    return {"query": query, "total": total, "limit": limit, "offset": offset, "results": results}
+
+
+def rebuild_search_index(session: Session) -> dict:
+    """Re-index every material and purchase item from scratch, and commit."""
+    if not uses_fts(session):
+        raise SearchUnavailable()
+    connection = session.connection()
+    connection.execute(text(f"DELETE FROM {INDEX}"))
+    items = connection.execute(text(
+        f"INSERT INTO {INDEX} (rowid, text, sku)"
+        " SELECT 2 * id, coalesce(description, ''), trim(coalesce(sku_raw, '') || ' ' || coalesce(sku_clean, ''))"
+        f" FROM {item_table.name}"
+    )).rowcount
+    materials = connection.execute(text(
+        f"INSERT INTO {INDEX} (rowid, text, sku)"
+        f" SELECT 2 * id + 1, coalesce(name, ''), coalesce(sku, '') FROM {material_table.name}"
+    )).rowcount
+    # Merge the index b-trees written by the bulk inserts
+    connection.execute(text(f"INSERT INTO {INDEX} ({INDEX}) VALUES ('optimize')"))
+    session.commit()
+    return {"indexed_items": items, "indexed_materials": materials}
+
+
+if __name__ == "__main__":
+    from app.database import engine, init_db
+
+    init_db()
+    with Session(engine) as session:
+        print(rebuild_search_index(session))
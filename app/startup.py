@@ -0,0 +1,103 @@
+"""
+Start-up profile: where a worker spends its time before it can answer
+the first request.
+
+:mod:`app.main` times its own import and each step of the lifespan
+start-up with a :class:`StartupProfile`, logs it once and serves it at
+``GET /api/v1/startup``. Running the module prints the same phases for a
+fresh process, preceded by a per-module import breakdown measured with
+``python -X importtime`` in a child interpreter::
+
+    python -m app.startup [top]
+"""
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+class StartupProfile:
+    """Ordered (phase, seconds) timings of one process start."""
+
+    def __init__(self):
+        self.phases: List[Tuple[str, float]] = []
+
+    def record(self, name: str, seconds: float):
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    @property
+    def total(self) -> float:
+        return sum(seconds for _, seconds in self.phases)
+
+    def as_dict(self) -> dict:
+        return {
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases},
+            "total_ms": round(self.total * 1000, 1),
+        }
+
+    def __str__(self) -> str:
+        phases = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.phases)
+        return f"{phases} (total {self.total * 1000:.1f} ms)"
+
+
+def _group(module: str) -> str:
+    # This app's modules one by one, dependencies by top-level package
+    parts = module.split(".")
+    return module if parts[0] == "app" else parts[0]
+
+
+def import_breakdown(module: str = "app.main") -> List[Tuple[str, float]]:
+    """
+    Import time of ``module`` in a fresh interpreter, per app module and per
+    third-party package (self time, seconds), slowest first.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    totals = defaultdict(float)
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            totals[_group(match.group(4))] += int(match.group(1)) / 1e6
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+
+async def _run_lifespan(app):
+    async with app.router.lifespan_context(app):
+        pass
+
+
+def main(top: int = 15):
+    from app.main import app, startup_profile
+
+    asyncio.run(_run_lifespan(app))
+    print(f"Start-up phases ({startup_profile.total * 1000:.1f} ms):")
+    for name, seconds in startup_profile.phases:
+        print(f"  {name.ljust(40)} {seconds * 1000:9.1f} ms")
+
+    breakdown = import_breakdown()
+    print(f"Imports of app.main in a fresh interpreter ({sum(s for _, s in breakdown) * 1000:.1f} ms), slowest:")
+    for name, seconds in breakdown[:top]:
+        print(f"  {name.ljust(40)} {seconds * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 15)
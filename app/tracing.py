@@ -0,0 +1,325 @@
+"""
+Request tracing across the backend and the XML parser service.
+
+:class:`TracingMiddleware` gives every HTTP request a trace, continuing
+the caller's W3C ``traceparent`` when there is one, and answers with
+``X-Request-ID`` (the caller's, or the trace id). The parser client
+forwards ``traceparent`` and ``X-Request-ID`` to the parser service, which
+records its spans under the same trace id and logs the request id, so a
+slow upload can be matched with its ``/parse`` call.
+
+Spans cover the request, the upload read, the parser round-trip and each
+attempt, the ingestion of the parsed lines and every database commit made
+while a trace is active. They are exported per TRACE_EXPORTER:
+
+- ``log``: one JSON record per span on the ``pvapp.trace`` logger
+- ``file``: OTLP/JSON lines appended to TRACE_FILE, one
+  ``{"resourceSpans": [...]}`` export per request, the format of the
+  OpenTelemetry collector's file exporter (and ``otlpjsonfile`` receiver)
+
+With no exporter only the ids are propagated.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger("pvapp.trace")
+
+SERVICE_NAME = "pvapp-backend"
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+_current: ContextVar[Optional["Span"]] = ContextVar("pvapp_span", default=None)
+_request_id: ContextVar[Optional[str]] = ContextVar("pvapp_request_id", default=None)
+# Session.info key of the open commit span
+_COMMIT_SPAN = "trace_commit_span"
+
+_file_lock = threading.Lock()
+_files: Dict[str, object] = {}
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+class _Trace:
+    """Spans of one trace finished in this process, exported together."""
+
+    __slots__ = ("spans", "exported")
+
+    def __init__(self):
+        self.spans: List["Span"] = []
+        self.exported = False
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "attributes", "start_ns", "end_ns", "error",
+                 "_trace", "_local_root")
+
+    def __init__(self, name: str, kind: int, trace_id: str, parent_id: Optional[str], trace: Optional[_Trace],
+                 attributes: dict):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self._local_root = trace is None
+        self._trace = _Trace() if trace is None else trace
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return None if self.end_ns is None else (self.end_ns - self.start_ns) / 1e6
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def end(self, error: Optional[BaseException] = None):
+        """Finish the span; a local root exports its whole trace."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if not config.TRACE_EXPORTER:
+            return
+        trace = self._trace
+        if trace.exported:
+            # Outlived the root of its trace
+            export([self])
+            return
+        trace.spans.append(self)
+        if self._local_root:
+            trace.exported = True
+            export(trace.spans)
+
+    def as_record(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round(self.duration_ms, 3),
+            "error": self.error,
+            **self.attributes,
+        }
+
+    def as_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def otlp_export(spans: List[Span], service_name: str = SERVICE_NAME) -> dict:
+    """An OTLP/JSON ``ExportTraceServiceRequest`` holding ``spans``."""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [_otlp_attribute("service.name", service_name)]},
+        "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": [span.as_otlp() for span in spans]}],
+    }]}
+
+
+def _write_line(path: str, line: str):
+    with _file_lock:
+        file = _files.get(path)
+        if file is None:
+            file = _files[path] = open(path, "a", encoding="utf-8", buffering=1)
+        file.write(line)
+
+
+def export(spans: List[Span]):
+    """Hand finished spans to the configured exporter."""
+    exporter = config.TRACE_EXPORTER
+    try:
+        if exporter == "log":
+            if trace_logger.isEnabledFor(logging.INFO):
+                for span in spans:
+                    trace_logger.info("%s", json.dumps(span.as_record(), default=str))
+        elif exporter == "file":
+            _write_line(config.TRACE_FILE, json.dumps(otlp_export(spans), default=str) + "\n")
+    except Exception:
+        # Tracing must never fail the request it describes
+        logger.exception("Exporting %d spans failed", len(spans))
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(trace id, parent span id) from a W3C ``traceparent`` header, or None."""
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def start_span(name: str, trace_id: Optional[str] = None, parent_id: Optional[str] = None, kind: int = INTERNAL,
+               **attributes) -> Span:
+    """
+    Start a span under the current one (or a new trace) without making it
+    current; the caller must :meth:`Span.end` it.
+    """
+    parent = _current.get()
+    if parent is not None and trace_id is None:
+        return Span(name, kind, parent.trace_id, parent.span_id, parent._trace, attributes)
+    return Span(name, kind, trace_id or _new_id(16), parent_id, None, attributes)
+
+
+@contextmanager
+def span(name: str, kind: int = INTERNAL, **attributes):
+    """Run the block in a new span, current for its duration."""
+    current = start_span(name, kind=kind, **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+@contextmanager
+def use_span(current: Span):
+    """Make a span started with :func:`start_span` current for the block, without ending it."""
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+def propagation_headers() -> dict:
+    """Headers carrying the current trace to another service."""
+    headers = {}
+    current = _current.get()
+    if current is not None:
+        headers["traceparent"] = current.traceparent
+    request_id = _request_id.get() or (current.trace_id if current is not None else None)
+    if request_id:
+        headers[REQUEST_ID_HEADER] = request_id
+    return headers
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware running each HTTP request in a root span.
+
+    The span continues an incoming ``traceparent``; the response carries
+    ``X-Request-ID``, the caller's if it sent one, the trace id otherwise.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        parent = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:128] or None
+        root = start_span(
+            f"{scope['method']} {scope['path']}",
+            trace_id=parent[0] if parent else None,
+            parent_id=parent[1] if parent else None,
+            kind=SERVER,
+            **{"http.method": scope["method"], "http.target": scope["path"]},
+        )
+        if request_id:
+            root.set(**{"request.id": request_id})
+        request_id = request_id or root.trace_id
+        span_token, id_token = _current.set(root), _request_id.set(request_id)
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                root.set(**{"http.status_code": message["status"]})
+                message = {
+                    **message,
+                    "headers": [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        except BaseException as e:
+            root.end(e)
+            raise
+        finally:
+            _current.reset(span_token)
+            _request_id.reset(id_token)
+            root.end()
+
+
+@event.listens_for(Session, "before_commit")
+def _start_commit_span(session):
+    if _current.get() is not None:
+        session.info[_COMMIT_SPAN] = start_span("db.commit", **{"db.system": session.get_bind().dialect.name})
+
+
+@event.listens_for(Session, "after_commit")
+def _end_commit_span(session):
+    commit_span = session.info.pop(_COMMIT_SPAN, None)
+    if commit_span is not None:
+        commit_span.end()
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _fail_commit_span(session, previous_transaction):
+    commit_span = session.info.pop(_COMMIT_SPAN, None)
+    if commit_span is not None:
+        commit_span.error = "rolled back"
+        commit_span.end()
@@ -0,0 +1,237 @@
+"""
+Bounded-memory ingestion of uploaded invoice files.
+
+Uploads are copied in fixed-size chunks into a spooled temporary file that
+stays in memory for small invoices and spills to disk past
+UPLOAD_SPOOL_THRESHOLD. The SHA-256 digest and byte count are computed on
+the same pass, and the copy stops with :class:`UploadTooLarge` as soon as
+the upload passes the configured limit, so no handler ever holds a whole
+upload (or a decoded copy of it) in memory.
+"""
+import asyncio
+import hashlib
+import tempfile
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+
+from app.compression import (
+    DecompressionLimitExceeded,
+    StreamDecoder,
+    sniff_encoding,
+)
+from app import tracing
+from app.config import config
+
+# Bytes read from the upload per iteration
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload is larger than the configured limit."""
+
+
+class SpooledUpload:
+    """
+    An upload copied into a spooled temporary file.
+
+    Attributes:
+        file: Binary file object positioned at the start of the content
+        filename: Original file name
+        size: Size of the upload as received, in bytes
+        sha256: Hex SHA-256 digest of the upload as received
+        content_encoding: Encoding the spooled content is still in, or None
+            when it is plain XML (never compressed, or decoded while spooling)
+    """
+
+    def __init__(self, file, filename: str, size: int, sha256: str, content_encoding: Optional[str]):
+        self.file = file
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+        self.content_encoding = content_encoding
+
+    @property
+    def in_memory(self) -> bool:
+        """True while the content has not spilled to disk."""
+        return not getattr(self.file, "_rolled", False)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class UploadReader:
+    """
+    Async iterator over an upload's chunks that hashes and counts them.
+
+    The limit is checked as each chunk is read, so a caller forwarding the
+    chunks elsewhere stops with :class:`UploadTooLarge` without ever holding
+    more than one chunk. ``size`` and ``sha256`` are final once the
+    iteration is exhausted. Reading is traced as one ``upload.read`` span,
+    from the first chunk to the end of the upload.
+    """
+
+    def __init__(self, upload: UploadFile, max_size: Optional[int] = None, chunk_size: int = CHUNK_SIZE):
+        self.upload = upload
+        self.filename = upload.filename or ""
+        self.max_size = config.MAX_UPLOAD_SIZE if max_size is None else max_size
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._head = None
+        self._span = None
+
+        # Reject early when the multipart parser already knows the size
+        if upload.size is not None and upload.size > self.max_size:
+            raise UploadTooLarge(f"Upload exceeds limit of {self.max_size} bytes")
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    async def peek(self) -> bytes:
+        """Read and return the first chunk without consuming it."""
+        if self._head is None:
+            self._head = await self._read()
+        return self._head
+
+    async def _read(self) -> bytes:
+        if self._span is None:
+            self._span = tracing.start_span("upload.read", filename=self.filename)
+        chunk = await self.upload.read(self.chunk_size)
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            error = UploadTooLarge(f"Upload exceeds limit of {self.max_size} bytes")
+            self._span.end(error)
+            raise error
+        self._digest.update(chunk)
+        if not chunk:
+            self._span.set(bytes=self.size)
+            self._span.end()
+        return chunk
+
+    async def __aiter__(self):
+        chunk = await self.peek()
+        while chunk:
+            yield chunk
+            chunk = await self._read()
+
+
+async def spool_upload(
+    upload: UploadFile,
+    decode: bool = False,
+    max_size: Optional[int] = None,
+) -> SpooledUpload:
+    """
+    Copy an upload into a spooled temporary file, hashing it on the way.
+
+    gzip/zstd files are detected from their magic bytes or extension. With
+    ``decode=True`` they are decompressed while spooling (bounded by
+    MAX_DECOMPRESSED_SIZE), otherwise they are kept as-is and the coding is
+    reported in ``content_encoding``.
+
+    Args:
+        upload: Uploaded file
+        decode: Decompress gzip/zstd content while spooling
+        max_size: Limit on the upload size; defaults to MAX_UPLOAD_SIZE
+
+    Raises:
+        UploadTooLarge: If the upload is larger than ``max_size``
+        DecompressionError: If compressed content is corrupt or too large
+            (``app.compression``)
+    """
+    reader = UploadReader(upload, max_size)
+    spool = tempfile.SpooledTemporaryFile(max_size=config.UPLOAD_SPOOL_THRESHOLD)
+    decoder = None
+    try:
+        head = await reader.peek()
+        encoding = sniff_encoding(head, reader.filename) if head else None
+        if decode and encoding:
+            decoder = StreamDecoder(encoding, config.MAX_DECOMPRESSED_SIZE)
+
+        async for chunk in reader:
+            spool.write(decoder.decompress(chunk) if decoder else chunk)
+
+        if decoder:
+            spool.write(decoder.flush())
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return SpooledUpload(
+        spool,
+        reader.filename,
+        reader.size,
+        reader.sha256,
+        None if decoder else encoding,
+    )
+
+
+class ReplayableBody:
+    """
+    Request body that can be sent more than once from a one-shot stream.
+
+    Chunks pulled from ``source`` are teed into a spooled temporary file, so
+    a retry or a concurrent hedged request replays what was already read and
+    then continues with the rest of the source. The source is only ever
+    consumed once, and errors it raises (e.g. :class:`UploadTooLarge`) are
+    re-raised to every reader.
+    """
+
+    def __init__(self, source):
+        self._source = source.__aiter__()
+        self._spool = tempfile.SpooledTemporaryFile(max_size=config.UPLOAD_SPOOL_THRESHOLD)
+        self._size = 0
+        self._done = False
+        self._error = None
+        self._lock = asyncio.Lock()
+
+    async def _chunk_at(self, offset: int) -> bytes:
+        async with self._lock:
+            if offset < self._size:
+                self._spool.seek(offset)
+                return self._spool.read(min(CHUNK_SIZE, self._size - offset))
+            if self._error is not None:
+                raise self._error
+            if self._done:
+                return b""
+            try:
+                chunk = b""
+                while not chunk:
+                    chunk = await self._source.__anext__()
+            except StopAsyncIteration:
+                self._done = True
+                return b""
+            except Exception as e:
+                self._error = e
+                raise
+            self._spool.seek(self._size)
+            self._spool.write(chunk)
+            self._size += len(chunk)
+            return chunk
+
+    async def __aiter__(self):
+        offset = 0
+        while True:
+            chunk = await self._chunk_at(offset)
+            if not chunk:
+                return
+            offset += len(chunk)
+            yield chunk
+
+    def close(self):
+        self._spool.close()
+
+
+def upload_http_error(e: ValueError) -> HTTPException:
+    """Map an ingestion failure to the HTTP error returned to the client."""
+    if isinstance(e, (UploadTooLarge, DecompressionLimitExceeded)):
+        return HTTPException(status_code=413, detail=str(e))
+    return HTTPException(status_code=400, detail=str(e))
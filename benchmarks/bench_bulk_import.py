@@ -0,0 +1,87 @@
+"""
+Throughput of the NDJSON bulk import against a SQLite file database.
+
+Posts purchases to /api/v1/purchases/import through the ASGI test client
+and compares with one create_purchase call per purchase (on a sample, as
+it commits per item).
+
+    python benchmarks/bench_bulk_import.py [purchases] [items_per_purchase] [chunk_size]
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, create_engine
+
+from common import report
+
+from app.database import get_session
+from app.main import app
+from app import models
+
+
+def purchase(i: int, items: int, material_ids) -> dict:
+    return {
+        "supplier": f"Supplier {i % 50}",
+        "invoice_number": f"ERP-{i:07d}",
+        "invoice_date": f"2023-{i % 12 + 1:02d}-15",
+        "items": [
+            {"material_id": material_ids[(i + j) % len(material_ids)], "description": f"Line {j}",
+             "quantity": j + 1, "unit_price": 12.5}
+            for j in range(items)
+        ],
+    }
+
+
+def main():
+    purchases = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    items = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    chunk_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    logging.getLogger().setLevel(logging.ERROR)
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        materials = [models.Material(name=f"Material {i}") for i in range(200)]
+        session.add_all(materials)
+        session.commit()
+        material_ids = [m.id for m in materials]
+
+    def get_session_override():
+        with Session(engine) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = get_session_override
+    client = TestClient(app)
+
+    body = "".join(json.dumps(purchase(i, items, material_ids)) + "\n" for i in range(purchases)).encode()
+    start = time.perf_counter()
+    response = client.post(
+        "/api/v1/purchases/import", params={"chunk_size": chunk_size}, content=body,
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+    bulk = time.perf_counter() - start
+    summary = json.loads(response.text.splitlines()[-1])["summary"]
+    assert summary.get("created") == purchases, summary
+
+    sample = min(200, purchases)
+    start = time.perf_counter()
+    for i in range(purchases, purchases + sample):
+        client.post("/api/v1/purchases/", json=purchase(i, items, material_ids)).raise_for_status()
+    single = (time.perf_counter() - start) / sample
+
+    report(f"{purchases} purchases x {items} items, chunk_size={chunk_size}", [
+        ("bulk import, total", bulk),
+        ("bulk import, per purchase", bulk / purchases),
+        ("create_purchase, per purchase", single),
+    ])
+    print(f"  bulk import: {purchases / bulk * 60:,.0f} purchases/minute")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Time to first request of a fresh backend process.
+
+Each run starts a new interpreter that imports ``app.main``, runs the
+lifespan start-up against a SQLite file and answers one
+``GET /api/v1/purchases/`` through the ASGI interface, and reports the
+wall-clock time from spawning the process to the response. Compared:
+
+* eager: the parser client, UBL engine, NumPy and pyarrow imported up
+  front and create_all() on every start, as before lazy imports and the
+  schema fingerprint
+* lazy, new schema: create_all() runs (first start after a schema change)
+* lazy, schema current: create_all() skipped
+
+    python benchmarks/bench_cold_start.py [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT
+
+CHILD = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+if sys.argv[1] == "eager":
+    import httpx, numpy, pyarrow.parquet, app.parser_client, app.parsers.invoice_xml
+from app.main import app, startup_profile
+
+async def first_request():
+    messages = []
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+    async def send(message):
+        messages.append(message)
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": "/api/v1/purchases/", "raw_path": b"/api/v1/purchases/",
+        "query_string": b"", "headers": [], "root_path": "",
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+    async with app.router.lifespan_context(app):
+        await app(scope, receive, send)
+    assert messages[0]["status"] == 200, messages[0]
+
+asyncio.run(first_request())
+print(json.dumps({"in_process": time.perf_counter() - started, "phases": startup_profile.phases}))
+"""
+
+
+def run_child(mode: str, db_path: str) -> tuple:
+    if mode != "current":
+        # Forget the stored fingerprint so init_db() runs create_all()
+        import sqlite3
+        with sqlite3.connect(db_path) as connection:
+            connection.execute("DELETE FROM schemaversion")
+    env = dict(os.environ, PVAPP_DB_URL=f"sqlite:///{db_path}")
+    env.pop("XML_PARSER_URL", None)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", CHILD, mode], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return time.perf_counter() - started, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "db.sqlite3")
+        subprocess.run([sys.executable, "-c", "from app.database import init_db; init_db()"], cwd=ROOT,
+                       env=dict(os.environ, PVAPP_DB_URL=f"sqlite:///{db_path}"), check=True)
+
+        print(f"Time to first request, best of {runs} fresh processes")
+        for label, mode in [("eager imports + create_all", "eager"), ("lazy, new schema", "new"),
+                            ("lazy, schema current", "current")]:
+            wall, child = min((run_child(mode, db_path) for _ in range(runs)), key=lambda r: r[0])
+            phases = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in child["phases"])
+            print(f"  {label.ljust(28)} {wall * 1000:8.1f} ms  (in process {child['in_process'] * 1000:.1f} ms: {phases})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark the event feed's fan-out (app.events): what a commit pays to
+publish with many open streams, and how long until every stream has the
+event. Half of the streams never read, like clients on a stalled network.
+Publishing happens on a thread, as from a sync endpoint, so its time
+includes waiting for the GIL while the loop serves readers.
+
+Usage: python benchmarks/bench_events.py [streams]
+"""
+import asyncio
+import sys
+import threading
+import time
+
+import common  # noqa: F401  (puts the repo root on sys.path)
+
+from app.events import EventHub, event_stream
+
+EVENTS = 200
+
+
+def publish(hub, n, times):
+    started = time.perf_counter()
+    hub.publish([("tick", {"n": n})])
+    times.append(time.perf_counter() - started)
+
+
+async def fan_out(streams: int):
+    hub = EventHub()
+    readers = [event_stream(None, hub=hub, heartbeat=60) for _ in range(streams)]
+    for reader in readers:
+        await reader.__anext__()
+    active = readers[::2]
+
+    async def read_one(reader):
+        return await reader.__anext__()
+
+    publish_times = []
+    delivered = []
+    for n in range(EVENTS):
+        pending = [asyncio.ensure_future(read_one(reader)) for reader in active]
+        await asyncio.sleep(0)
+        started = time.perf_counter()
+        # Writers publish from the threadpool running sync endpoints
+        writer = threading.Thread(target=publish, args=(hub, n, publish_times))
+        writer.start()
+        await asyncio.gather(*pending)
+        delivered.append(time.perf_counter() - started)
+        writer.join()
+    for reader in readers:
+        await reader.aclose()
+    return sorted(publish_times), sorted(delivered)
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10, 1000]
+    print(f"{EVENTS} events, half of the streams reading")
+    for streams in counts:
+        publish, delivered = asyncio.run(fan_out(streams))
+        print(f"  {str(streams).rjust(5)} streams  publish p50 {publish[len(publish) // 2] * 1e6:7.0f} us"
+              f"   all readers served p50 {delivered[len(delivered) // 2] * 1e3:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Throughput of the e-Factura backfill (app.ingest) against a SQLite file
+database, parsing in this process and in a process pool, and the cost of
+a resumed run over finished files.
+
+Writes ANAF-style ZIPs (invoice + signature) to a temporary directory.
+
+    python benchmarks/bench_ingest.py [invoices] [lines_per_invoice] [workers]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+from sqlmodel import Session, SQLModel, create_engine
+
+from common import make_invoice
+
+from app.ingest import Checkpoint, Ingest
+
+
+def write_archive(directory: str, invoices: int, lines: int):
+    xml = make_invoice(lines)
+    for i in range(invoices):
+        with zipfile.ZipFile(os.path.join(directory, f"{i:06d}.zip"), "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr(f"{i:06d}.xml", xml.replace(b"BENCH-001", f"EF-{i:06d}".encode()))
+            z.writestr(f"semnatura_{i:06d}.xml", "<Signature/>")
+
+
+def ingest(tmp: str, archive: str, name: str, workers: int) -> tuple:
+    engine = create_engine(f"sqlite:///{os.path.join(tmp, name + '.sqlite3')}")
+    SQLModel.metadata.create_all(engine)
+    checkpoint = os.path.join(tmp, name + ".jsonl")
+    with Session(engine) as session:
+        with Ingest(session, Checkpoint(checkpoint), workers=workers) as backfill:
+            report = backfill.run([archive])
+        assert not report["failed"], report["failed"][:3]
+        started = time.perf_counter()
+        with Ingest(session, Checkpoint(checkpoint), workers=workers) as backfill:
+            assert backfill.run([archive])["documents"] == 0
+        resumed = time.perf_counter() - started
+    return report, resumed
+
+
+def main():
+    invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count() or 1
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = os.path.join(tmp, "efactura")
+        os.mkdir(archive)
+        write_archive(archive, invoices, lines)
+        rows = [("in process", *ingest(tmp, archive, "serial", 0)),
+                (f"{workers} workers", *ingest(tmp, archive, "pool", workers))]
+
+    print(f"Ingest {invoices} ZIPs x {lines} lines on a SQLite file")
+    for label, report, resumed in rows:
+        print(f"  {label.ljust(12)}  {report['documents_per_second']:8.1f} invoices/s  ({report['seconds']:.2f} s),"
+              f" resumed run {resumed * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
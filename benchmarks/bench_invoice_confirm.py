@@ -0,0 +1,92 @@
+"""
+Throughput of the bulk invoice confirm against a SQLite file database.
+
+Stages VALIDATED invoices with their items through Core inserts, then
+compares :func:`app.confirm.confirm_invoices` with converting one invoice
+at a time in the create_purchase style (a commit per purchase, item and
+stock movement, run on a sample).
+
+    python benchmarks/bench_invoice_confirm.py [invoices] [items_per_invoice] [chunk_size]
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from sqlmodel import Session, SQLModel, create_engine, select
+
+import common  # noqa: F401  (puts the repository root on sys.path)
+
+from app import confirm, models
+
+
+def stage(session: Session, invoices: int, items: int, first_id: int = 1):
+    connection = session.connection()
+    ids = range(first_id, first_id + invoices)
+    connection.execute(models.Invoice.__table__.insert(), [
+        {"id": i, "supplier": f"Supplier {i % 50}", "invoice_number": f"EF-{i:07d}",
+         "invoice_date": f"2023-{i % 12 + 1:02d}-15", "status": "VALIDATED"}
+        for i in ids
+    ])
+    connection.execute(models.InvoiceItem.__table__.insert(), [
+        {"invoice_id": i, "material_id": (i + j) % 200 + 1, "description": f"Line {j}",
+         "quantity": j + 1.0, "unit_price": 12.5, "total_price": (j + 1) * 12.5}
+        for i in ids for j in range(items)
+    ])
+    session.commit()
+    return list(ids)
+
+
+def confirm_one_by_one(session: Session, invoice_ids):
+    for invoice_id in invoice_ids:
+        invoice = session.get(models.Invoice, invoice_id)
+        purchase = models.Purchase(supplier=invoice.supplier, invoice_number=invoice.invoice_number,
+                                   invoice_date=invoice.invoice_date, total_amount=invoice.total_amount)
+        session.add(purchase)
+        session.commit()
+        session.refresh(purchase)
+        lines = session.exec(select(models.InvoiceItem).where(models.InvoiceItem.invoice_id == invoice_id)).all()
+        for line in lines:
+            session.add(models.PurchaseItem(purchase_id=purchase.id, material_id=line.material_id,
+                                            description=line.description, quantity=line.quantity,
+                                            unit_price=line.unit_price, total_price=line.total_price))
+            session.commit()
+            session.add(models.StockMovement(material_id=line.material_id, change=line.quantity,
+                                             movement_type="purchase_in", reference_type="purchase",
+                                             reference_id=purchase.id, quantity=line.quantity))
+            session.commit()
+        invoice.status = "CONFIRMED"
+        session.add(invoice)
+        session.commit()
+
+
+def main():
+    invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    items = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    chunk_size = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    sample = min(200, invoices)
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.sqlite3')}")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            session.add_all([models.Material(id=i, name=f"Material {i}") for i in range(1, 201)])
+            session.commit()
+            ids = stage(session, invoices + sample, items)
+
+            started = time.perf_counter()
+            confirm_one_by_one(session, ids[invoices:])
+            one_by_one = sample / (time.perf_counter() - started)
+
+            report = confirm.confirm_invoices(session, invoice_ids=ids[:invoices], chunk_size=chunk_size)
+            assert report["confirmed"] == invoices, report["failed"][:3]
+
+    print(f"Confirm {invoices} invoices x {items} items (chunks of {chunk_size}) on a SQLite file")
+    print(f"  one by one, per-row commits   {one_by_one:10.1f} invoices/s  (sample of {sample})")
+    print(f"  confirm_invoices              {report['invoices_per_second']:10.1f} invoices/s  ({report['seconds']:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Benchmark the lxml backend against the defusedxml (etree) backend.
+
+Usage: python benchmarks/bench_lxml_backend.py [lines ...]
+"""
+import sys
+
+from common import best_of, make_invoice, report
+
+from ubl_engine import available_backends
+from parser_app import parse_ubl_invoice
+from app.parsers.invoice_xml import parse_invoice_products
+
+
+def main():
+    if 'lxml' not in available_backends():
+        sys.exit("lxml is not installed: pip install lxml")
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 5000, 50000]
+    for lines in sizes:
+        xml = make_invoice(lines)
+        assert parse_ubl_invoice(xml, backend='lxml') == parse_ubl_invoice(xml, backend='etree')
+        assert parse_invoice_products(xml, 'lxml') == parse_invoice_products(xml, 'etree')
+
+        repeat = 3 if lines > 10000 else 7
+        rows = []
+        for backend in ('etree', 'lxml'):
+            rows.append((f"{backend} parse_ubl_invoice", best_of(lambda: parse_ubl_invoice(xml, backend=backend), repeat)))
+        for backend in ('etree', 'lxml'):
+            rows.append((f"{backend} parse_invoice_products", best_of(lambda: parse_invoice_products(xml, backend), repeat)))
+        report(f"{lines} lines ({len(xml) / 1024:.0f} KiB)", rows)
+
+
+if __name__ == '__main__':
+    main()
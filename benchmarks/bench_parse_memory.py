@@ -0,0 +1,59 @@
+"""
+Benchmark the memory held by parse results: the slotted records
+(ubl_engine.LineItem / Product) against the dicts the parsers used to
+return, and the peak of writing the /parse JSON body from them.
+
+Usage: python benchmarks/bench_parse_memory.py [lines ...]
+"""
+import gc
+import json
+import sys
+import tracemalloc
+
+from common import make_invoice
+
+from parser_app import invoice_as_dict, iter_json, parse_ubl_invoice
+from app.parsers.invoice_xml import parse_invoice_products
+
+
+def allocated(build):
+    """(bytes still allocated by what build() returns, peak bytes while building it)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def mib(size):
+    return f"{size / 1024 / 1024:8.2f} MiB"
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [5000, 50000]
+    for lines in sizes:
+        xml = make_invoice(lines)
+        parsed = parse_ubl_invoice(xml)
+        rows = [
+            ("parse_ubl_invoice lines, records", allocated(lambda: parse_ubl_invoice(xml)['line_items'])[0]),
+            ("parse_ubl_invoice lines, dicts",
+             allocated(lambda: invoice_as_dict(parse_ubl_invoice(xml))['line_items'])[0]),
+            ("parse_invoice_products, records", allocated(lambda: parse_invoice_products(xml)['products'])[0]),
+            ("parse_invoice_products, dicts",
+             allocated(lambda: [p.as_dict() for p in parse_invoice_products(xml)['products']])[0]),
+            ("JSON body peak, from records", allocated(lambda: ''.join(iter_json(parsed, 'invoice.xml')))[1]),
+            ("JSON body peak, via dicts", allocated(lambda: json.dumps(
+                {'success': True, 'filename': 'invoice.xml', 'data': invoice_as_dict(parsed)}))[1]),
+        ]
+        print(f"{lines} lines ({len(xml) / 1024:.0f} KiB)")
+        width = max(len(label) for label, _ in rows)
+        for label, size in rows:
+            print(f"  {label.ljust(width)}  {mib(size)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark the parser service's document limits.
+
+Shows how quickly /parse refuses pathological documents (deep nesting,
+millions of empty elements) and what enforcing the limits costs on a
+regular invoice.
+
+Usage: python benchmarks/bench_parser_limits.py [lines]
+"""
+import sys
+from io import BytesIO
+
+from common import best_of, make_invoice, report
+
+import parser_app
+from parser_app import LIMITS, DocumentLimits, app, iter_ubl_invoice, parse_ubl_invoice
+
+UNLIMITED = DocumentLimits()
+
+
+def post(client, xml, output_format='json'):
+    response = client.post(f'/parse?format={output_format}', data=xml, content_type='application/xml')
+    response.get_data()
+    return response.status_code
+
+
+def main():
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    app.config['MAX_CONTENT_LENGTH'] = None
+    client = app.test_client()
+
+    deep = b'<a>' * 500000 + b'</a>' * 500000
+    wide = b'<r>' + b'<e/>' * 4000000 + b'</r>'
+    for name, xml in (("500k nested elements", deep), ("4M empty elements", wide)):
+        assert post(client, xml) == 422
+        parser_app.LIMITS = UNLIMITED
+        unlimited = best_of(lambda: post(client, xml), 1)
+        parser_app.LIMITS = LIMITS
+        report(f"{name} ({len(xml) / 1024 / 1024:.1f} MiB)", [
+            ("POST /parse, no limits", unlimited),
+            ("POST /parse, rejected with 422", best_of(lambda: post(client, xml), 3)),
+        ])
+
+    xml = make_invoice(lines)
+    report(f"{lines} lines ({len(xml) / 1024:.0f} KiB)", [
+        ("parse_ubl_invoice", best_of(lambda: parse_ubl_invoice(xml), 5)),
+        ("parse_ubl_invoice, limits", best_of(lambda: parse_ubl_invoice(BytesIO(xml), limits=LIMITS), 5)),
+        ("iter_ubl_invoice, limits", best_of(lambda: list(iter_ubl_invoice(BytesIO(xml))), 5)),
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Per-call latency to the XML parser over loopback TCP vs a Unix domain socket.
+
+Serves the real parser app twice (127.0.0.1 and a Unix socket, werkzeug's
+threaded server) and times sequential calls with httpx:
+
+- kept-alive: one client, one reused connection
+- new connection: one client, ``Connection: close`` on every call
+- new client: a client per call sharing one SSL context, as the backend
+  does per upload
+
+    python benchmarks/bench_parser_transport.py [calls] [invoice_lines]
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+import httpx
+from werkzeug.serving import make_server
+
+from common import best_of, make_invoice, report
+
+from parser_app import app
+
+SSL_CONTEXT = httpx.create_ssl_context()
+
+
+def serve(host: str, port: int = 0):
+    server = make_server(host, port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    invoice = make_invoice(lines)
+    # The parser configures INFO logging; per-request log lines would dominate
+    for name in ('', 'werkzeug'):
+        logging.getLogger(name).setLevel(logging.ERROR)
+
+    socket_path = os.path.join(tempfile.mkdtemp(), 'xml-parser.sock')
+    tcp = serve('127.0.0.1')
+    uds = serve(f'unix://{socket_path}')
+    targets = {
+        'tcp': ({}, f'http://127.0.0.1:{tcp.server_port}'),
+        'uds': ({'uds': socket_path}, 'http://parser'),
+    }
+
+    params = {'format': 'ndjson', 'filename': 'bench.xml'}
+    rows = []
+    for name, (transport_options, base_url) in targets.items():
+        def new_client():
+            transport = httpx.HTTPTransport(verify=SSL_CONTEXT, **transport_options)
+            return httpx.Client(transport=transport, verify=SSL_CONTEXT)
+
+        def parse(client, **headers):
+            client.post(
+                f'{base_url}/parse', content=invoice, params=params,
+                headers={'Content-Type': 'application/xml', **headers}
+            ).raise_for_status()
+
+        with new_client() as client:
+            client.get(f'{base_url}/health')  # warm up
+            rows.append((f'{name} /health, kept-alive', best_of(
+                lambda: [client.get(f'{base_url}/health') for _ in range(calls)], 3) / calls))
+            rows.append((f'{name} /parse,  kept-alive', best_of(
+                lambda: [parse(client) for _ in range(calls)], 3) / calls))
+            rows.append((f'{name} /parse,  new connection', best_of(
+                lambda: [parse(client, Connection='close') for _ in range(calls)], 3) / calls))
+
+        def parse_new_client():
+            for _ in range(calls):
+                with new_client() as client:
+                    parse(client)
+
+        rows.append((f'{name} /parse,  new client', best_of(parse_new_client, 3) / calls))
+
+    tcp.shutdown()
+    uds.shutdown()
+    report(f'Per-call latency, {calls} sequential calls, {lines}-line invoice', rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Finding purchase lines by words: LIKE scan vs the FTS5 index.
+
+Fills an in-memory SQLite database with purchase items through Core
+inserts, builds the search index with :func:`app.search.rebuild_search_index`
+and times the same three-word query as the ``LIKE`` scan it replaces and as
+a ranked FTS5 search (first page of 20).
+
+    python benchmarks/bench_search.py [items]
+"""
+import random
+import sys
+from datetime import datetime
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+from common import best_of, report
+
+from app import models, search
+
+WORDS = ["cablu", "solar", "panou", "fotovoltaic", "invertor", "hibrid", "conector", "siguranță",
+         "țeavă", "cupru", "profil", "aluminiu", "clemă", "prindere", "negru", "roșu", "4mm", "6mm", "10mm"]
+QUERY = "cablu solar 6mm"
+
+
+def populate(session: Session, items: int):
+    random.seed(1)
+    connection = session.connection()
+    purchases = items // 10
+    connection.execute(models.Purchase.__table__.insert(), [
+        {"id": i, "supplier": f"Supplier {i % 40}", "invoice_number": f"INV-{i}", "invoice_date": "2024-06-30",
+         "created_at": datetime(2024, 1, 1)}
+        for i in range(1, purchases + 1)
+    ])
+    connection.execute(models.PurchaseItem.__table__.insert(), [
+        {"purchase_id": i % purchases + 1, "description": " ".join(random.sample(WORDS, 4)).capitalize(),
+         "sku_raw": f"SKU-{i:07d}", "quantity": 1.0, "unit_price": 10.0}
+        for i in range(items)
+    ])
+    session.commit()
+
+
+def main():
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+
+    with Session(engine) as session:
+        populate(session, items)
+        rows = [("rebuild index", best_of(lambda: search.rebuild_search_index(session), 1))]
+
+        item = models.PurchaseItem.__table__
+        words = QUERY.split()
+        condition = and_(*(or_(item.c.description.ilike(f"%{w}%"), item.c.sku_raw.ilike(f"%{w}%")) for w in words))
+        connection = session.connection()
+        like_total = connection.execute(select(func.count()).select_from(item).where(condition)).scalar()
+        rows.append(("LIKE scan, count + page",
+                     best_of(lambda: (connection.execute(select(func.count()).select_from(item).where(condition)).scalar(),
+                                      connection.execute(select(item).where(condition).limit(20)).all()))))
+        result = search.search(session, QUERY, kind="item")
+        assert result["total"] == like_total, (result["total"], like_total)
+        rows.append(("FTS5, ranked page", best_of(lambda: search.search(session, QUERY, kind="item"))))
+
+    report(f"Search {QUERY!r} in {items} purchase items ({like_total} matches)", rows)
+
+
+if __name__ == "__main__":
+    main()
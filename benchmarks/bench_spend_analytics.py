@@ -0,0 +1,75 @@
+"""
+Spend per material and month: ad-hoc GROUP BY vs the aggregate tables.
+
+Fills an in-memory SQLite database with purchases and items through Core
+inserts (bypassing the ORM listeners), rebuilds the aggregates with NumPy
+and with the pure-Python fallback, then times the same question answered
+from the raw tables and from the aggregate table.
+
+    python benchmarks/bench_spend_analytics.py [purchases] [items_per_purchase]
+"""
+import random
+import sys
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.pool import StaticPool
+from sqlmodel import Session, SQLModel, create_engine
+
+from common import best_of, report
+
+from app import analytics, models
+
+
+def populate(session: Session, purchases: int, items_per_purchase: int):
+    random.seed(1)
+    connection = session.connection()
+    connection.execute(models.Material.__table__.insert(), [
+        {"id": i, "sku": f"SKU-{i}", "name": f"Material {i}", "created_at": datetime(2024, 1, 1)}
+        for i in range(1, 501)
+    ])
+    connection.execute(models.Purchase.__table__.insert(), [
+        {"id": i, "supplier": f"Supplier {i % 40}", "invoice_date": f"20{20 + i % 5}-{i % 12 + 1:02d}-15",
+         "total_amount": 1000.0, "created_at": datetime(2024, 1, 1)}
+        for i in range(1, purchases + 1)
+    ])
+    connection.execute(models.PurchaseItem.__table__.insert(), [
+        {"purchase_id": p, "material_id": random.randint(1, 500), "quantity": 2.0,
+         "unit_price": 12.5, "total_price": 25.0}
+        for p in range(1, purchases + 1) for _ in range(items_per_purchase)
+    ])
+    session.commit()
+
+
+def main():
+    purchases = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    items_per_purchase = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+
+    rows = []
+    with Session(engine) as session:
+        populate(session, purchases, items_per_purchase)
+
+        rows.append(("rebuild, numpy", best_of(lambda: analytics.rebuild_spend_aggregates(session), 3)))
+        numpy, analytics.numpy = analytics.numpy, None
+        rows.append(("rebuild, pure Python", best_of(lambda: analytics.rebuild_spend_aggregates(session), 3)))
+        analytics.numpy = numpy
+
+        purchase, item = models.Purchase.__table__, models.PurchaseItem.__table__
+        month = func.substr(purchase.c.invoice_date, 1, 7)
+        adhoc = (
+            select(item.c.material_id, month, func.count(), func.sum(item.c.quantity), func.sum(item.c.total_price))
+            .join_from(item, purchase, item.c.purchase_id == purchase.c.id)
+            .where(item.c.material_id == 42)
+            .group_by(item.c.material_id, month)
+        )
+        rows.append(("material 42 by month, GROUP BY", best_of(lambda: session.connection().execute(adhoc).all())))
+        rows.append(("material 42 by month, aggregate", best_of(
+            lambda: analytics.material_spend(session, material_id=42))))
+
+    report(f"Spend analytics, {purchases} purchases x {items_per_purchase} items", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Benchmark the compiled ubl_engine adapters against the legacy parsers.
+
+Usage: python benchmarks/bench_ubl_engine.py [lines ...]
+"""
+import sys
+
+from common import best_of, make_invoice, report
+
+from legacy_parsers import legacy_parse_invoice_products, legacy_parse_ubl_invoice
+from parser_app import invoice_as_dict, parse_ubl_invoice
+from app.parsers.invoice_xml import parse_invoice_products
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 5000, 50000]
+    for lines in sizes:
+        xml = make_invoice(lines)
+        assert invoice_as_dict(parse_ubl_invoice(xml)) == legacy_parse_ubl_invoice(xml)
+        products = parse_invoice_products(xml)
+        products['products'] = [p.as_dict() for p in products['products']]
+        assert products == legacy_parse_invoice_products(xml)
+
+        repeat = 3 if lines > 10000 else 7
+        report(f"{lines} lines ({len(xml) / 1024:.0f} KiB)", [
+            ("legacy parse_ubl_invoice", best_of(lambda: legacy_parse_ubl_invoice(xml), repeat)),
+            ("engine parse_ubl_invoice", best_of(lambda: parse_ubl_invoice(xml), repeat)),
+            ("legacy parse_invoice_products", best_of(lambda: legacy_parse_invoice_products(xml), repeat)),
+            ("engine parse_invoice_products", best_of(lambda: parse_invoice_products(xml), repeat)),
+        ])
+
+
+if __name__ == '__main__':
+    main()
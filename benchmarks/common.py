@@ -0,0 +1,68 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Run benchmarks from the repository root, e.g.:
+    python benchmarks/bench_ubl_engine.py
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PARSER_DIR = os.path.join(ROOT, 'services', 'xml_parser')
+
+for path in (ROOT, PARSER_DIR, os.path.join(PARSER_DIR, 'tests')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+UBL_LINE = (
+    '<cac:InvoiceLine>'
+    '<cbc:ID>{0}</cbc:ID>'
+    '<cbc:InvoicedQuantity unitCode="H87">{1}</cbc:InvoicedQuantity>'
+    '<cbc:LineExtensionAmount>{2:.2f}</cbc:LineExtensionAmount>'
+    '<cac:Item>'
+    '<cbc:Name>Panou fotovoltaic 450W model {0}</cbc:Name>'
+    '<cac:SellersItemIdentification><cbc:ID>SKU-{0:06d}</cbc:ID></cac:SellersItemIdentification>'
+    '<cac:ClassifiedTaxCategory><cbc:ID>S</cbc:ID><cbc:Percent>19.00</cbc:Percent></cac:ClassifiedTaxCategory>'
+    '</cac:Item>'
+    '<cac:Price><cbc:PriceAmount>{3:.2f}</cbc:PriceAmount></cac:Price>'
+    '<cac:TaxTotal><cac:TaxSubtotal><cac:TaxCategory><cbc:Percent>19.00</cbc:Percent>'
+    '</cac:TaxCategory></cac:TaxSubtotal></cac:TaxTotal>'
+    '</cac:InvoiceLine>'
+)
+
+
+def make_invoice(lines: int) -> bytes:
+    """Build a realistic UBL invoice with the given number of lines."""
+    body = ''.join(UBL_LINE.format(i, i % 7 + 1, (i % 7 + 1) * 12.5, 12.5) for i in range(1, lines + 1))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"'
+        ' xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"'
+        ' xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+        '<cbc:CustomizationID>urn:cen.eu:en16931:2017#compliant#urn:efactura.mfinante.ro:CIUS-RO:1.0.1</cbc:CustomizationID>'
+        '<cbc:ID>BENCH-001</cbc:ID><cbc:IssueDate>2024-06-30</cbc:IssueDate>'
+        '<cac:AccountingSupplierParty><cac:Party><cac:PartyName><cbc:Name>Bench Supplier SRL</cbc:Name>'
+        '</cac:PartyName></cac:Party></cac:AccountingSupplierParty>'
+        + body +
+        '<cac:LegalMonetaryTotal><cbc:TaxInclusiveAmount>1000.00</cbc:TaxInclusiveAmount></cac:LegalMonetaryTotal>'
+        '</Invoice>'
+    ).encode('utf-8')
+
+
+def best_of(func, repeat: int = 5) -> float:
+    """Return the fastest wall-clock time of ``repeat`` calls, in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def report(title: str, rows):
+    """Print a small aligned table of (label, seconds) rows."""
+    print(title)
+    width = max(len(label) for label, _ in rows)
+    for label, seconds in rows:
+        print(f"  {label.ljust(width)}  {seconds * 1000:9.2f} ms")
@@ -157,6 +157,9 @@ install_application() {
     if [ -f update.sh ]; then
         sudo chmod +x update.sh
     fi
+    if [ -f pvapp-ingest ]; then
+        sudo chmod +x pvapp-ingest
+    fi
     print_success "Scripts are now executable"
 }
 
@@ -189,7 +192,8 @@ create_env_file() {
 PVAPP_DB_URL=sqlite:///$INSTALL_DIR/db.sqlite3
 
 # XML Parser Microservice Configuration
-XML_PARSER_URL=http://localhost:5000
+# The parser runs on this host and listens on a Unix socket (and on http://localhost:5000)
+XML_PARSER_URL=unix:/run/pvapp/xml-parser.sock
 
 # Optional: Authentication token for the XML parser service
 # XML_PARSER_TOKEN=
@@ -297,7 +301,7 @@ print_completion() {
     if [ "$SETUP_SYSTEMD" = "yes" ]; then
         echo "Services have been installed and started:"
         echo "  • pvapp (main backend) - http://localhost:8000"
-        echo "  • pvapp-xml-parser (XML parser) - http://localhost:5000"
+        echo "  • pvapp-xml-parser (XML parser) - unix:/run/pvapp/xml-parser.sock, http://localhost:5000"
         echo ""
         echo "Service management commands:"
         echo "  sudo systemctl status pvapp"
@@ -0,0 +1,14 @@
+"""
+Gunicorn settings for the container image.
+
+Listens on 0.0.0.0:$PORT and, when XML_PARSER_SOCKET is set, also on that
+Unix socket (mount its directory to share it with a backend on the host).
+"""
+import os
+
+bind = [f"0.0.0.0:{os.environ.get('PORT', '5000')}"]
+if os.environ.get('XML_PARSER_SOCKET'):
+    bind.insert(0, f"unix:{os.environ['XML_PARSER_SOCKET']}")
+
+workers = int(os.environ.get('XML_PARSER_WORKERS', '2'))
+timeout = 60
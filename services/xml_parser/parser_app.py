@@ -3,171 +3,452 @@ Robust XML Invoice Parser Microservice
 Uses defusedxml to prevent XXE attacks and avoid fragile XPath predicates.
 Parses UBL XML invoices and returns structured JSON data.
 """
+import gzip
+import json
 import logging
 import os
 import io
-from flask import Flask, request, jsonify
+import zlib
+from flask import Flask, Response, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 import defusedxml.ElementTree as ET
+import tracing
+from ubl_engine import LINE_ITEMS_SPEC, PARSE_ERRORS, check_backend, get_document, iterparse_document
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+try:
+    import zstandard
+except ImportError:  # zstd support is optional
+    zstandard = None
+
+# Configure logging; records carry the request id sent by the backend
+logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(name)s:[%(request_id)s] %(message)s')
+for handler in logging.getLogger().handlers:
+    handler.addFilter(tracing.RequestIdFilter())
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Continue the caller's trace (traceparent) and echo X-Request-ID
+tracing.init_app(app)
+
+# Tree backend for parse_ubl_invoice: 'etree' (defusedxml) or 'lxml' (optional, faster)
+XML_BACKEND = check_backend(os.environ.get('XML_PARSER_BACKEND', 'etree'))
+
+# Upper bound on decompressed request size (bytes), guards against zip bombs
+MAX_DECOMPRESSED_SIZE = int(os.environ.get('XML_PARSER_MAX_DECOMPRESSED_SIZE', str(50 * 1024 * 1024)))
+
+# Upper bound on the request body as received (bytes); a larger
+# Content-Length is refused before the body is read, a chunked body as soon
+# as it passes the limit (0 disables)
+MAX_CONTENT_LENGTH = int(os.environ.get('XML_PARSER_MAX_CONTENT_LENGTH', str(20 * 1024 * 1024)))
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH or None
+
+# Responses smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = int(os.environ.get('XML_PARSER_COMPRESS_MIN_SIZE', '1024'))
+
+
+class PayloadTooLarge(ValueError):
+    """Raised when a payload exceeds MAX_CONTENT_LENGTH or MAX_DECOMPRESSED_SIZE."""
 
-# UBL 2.1 namespaces
-NAMESPACES = {
-    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
-    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
-    'ubl': 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2'
-}
 
-def parse_ubl_invoice(xml_content):
+class UnsupportedEncoding(ValueError):
+    """Raised for a Content-Encoding the service cannot decode."""
+
+
+class DocumentTooComplex(ValueError):
+    """Raised when a document passes one of the DocumentLimits."""
+
+
+class DocumentLimits:
     """
-    Parse UBL XML invoice using fully-qualified namespace tags.
-    Avoids fragile XPath predicates by using iterative traversal.
+    Caps on element nesting depth, element count and invoice line count
+    (0 disables a cap).
     
-    Returns dict with invoice metadata and line items.
+    They are checked on the events of an incremental parse, as each
+    element opens or a line closes, so a pathological document (deeply
+    nested, or millions of tiny elements) is rejected as soon as it crosses
+    a limit, while the body is still being read, instead of after it has
+    been parsed into a tree.
     """
-    try:
-        # Parse XML safely with defusedxml
-        root = ET.fromstring(xml_content)
-        
-        result = {
-            'invoice_metadata': {},
-            'line_items': []
-        }
+    
+    def __init__(self, max_depth=0, max_elements=0, max_lines=0):
+        self.max_depth = max_depth
+        self.max_elements = max_elements
+        self.max_lines = max_lines
+    
+    def iter_lines(self, events, line_tag):
+        """
+        Yield the closed line_tag elements from the (event, element) pairs
+        of a start/end iterparse, raising DocumentTooComplex past a limit.
+        """
+        max_depth = self.max_depth or float('inf')
+        max_elements = self.max_elements or float('inf')
+        max_lines = self.max_lines or float('inf')
+        depth = elements = lines = 0
+        for event, elem in events:
+            if event == 'start':
+                depth += 1
+                elements += 1
+                if depth > max_depth:
+                    raise DocumentTooComplex(f"Elements nested deeper than {self.max_depth} levels")
+                if elements > max_elements:
+                    raise DocumentTooComplex(f"Document has more than {self.max_elements} elements")
+                continue
+            depth -= 1
+            if elem.tag == line_tag:
+                lines += 1
+                if lines > max_lines:
+                    raise DocumentTooComplex(f"Invoice has more than {self.max_lines} lines")
+                yield elem
+
+
+# Complexity limits for documents parsed by /parse (0 disables one)
+LIMITS = DocumentLimits(
+    max_depth=int(os.environ.get('XML_PARSER_MAX_DEPTH', '64')),
+    max_elements=int(os.environ.get('XML_PARSER_MAX_ELEMENTS', '2000000')),
+    max_lines=int(os.environ.get('XML_PARSER_MAX_LINES', '100000')),
+)
+
+
+class DecompressingReader(io.RawIOBase):
+    """
+    Read-only file object that decodes a gzip/deflate/zstd stream on read().
+    
+    Output is produced in bounded steps so a zip bomb is rejected as soon as
+    it crosses max_size rather than after it has been fully inflated. With
+    no encoding (identity) reads are passed straight through to the source.
+    """
+    
+    CHUNK_SIZE = 64 * 1024
+    
+    def __init__(self, raw, encoding, max_size=None):
+        super().__init__()
+        self.raw = raw
+        self.max_size = MAX_DECOMPRESSED_SIZE if max_size is None else max_size
+        self.size = 0
+        self.encoding = (encoding or 'identity').strip().lower()
+        self._pending = bytearray()
+        self._eof = False
+        self._zlib = None
+        self._zstd = None
         
-        # Extract invoice metadata using fully-qualified tags
-        # Invoice number
-        invoice_number_elem = root.find('.//{%s}ID' % NAMESPACES['cbc'])
-        if invoice_number_elem is not None and invoice_number_elem.text:
-            result['invoice_metadata']['invoice_number'] = invoice_number_elem.text.strip()
+        if self.encoding in ('gzip', 'x-gzip'):
+            self._zlib = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        elif self.encoding == 'deflate':
+            self._zlib = zlib.decompressobj(wbits=32 + zlib.MAX_WBITS)
+        elif self.encoding == 'zstd' and zstandard is not None:
+            self._zstd = zstandard.ZstdDecompressor().stream_reader(raw)
+        elif self.encoding != 'identity':
+            raise UnsupportedEncoding(f"Unsupported content encoding: {self.encoding}")
+    
+    def readable(self):
+        return True
+    
+    def _read_raw(self, size):
+        try:
+            return self.raw.read(size)
+        except RequestEntityTooLarge:
+            raise PayloadTooLarge(f"Request body exceeds {MAX_CONTENT_LENGTH} bytes")
+    
+    def _fill(self):
+        """Decode the next bounded block of output into the pending buffer."""
+        if self._zlib is not None:
+            data = self._zlib.unconsumed_tail or self._read_raw(self.CHUNK_SIZE)
+            if not data:
+                raise ValueError(f"Truncated {self.encoding} payload")
+            try:
+                out = self._zlib.decompress(data, self.CHUNK_SIZE)
+            except zlib.error as e:
+                raise ValueError(f"Corrupt {self.encoding} payload: {e}")
+            if self._zlib.eof:
+                self._eof = True
+        else:
+            try:
+                out = self._zstd.read(self.CHUNK_SIZE)
+            except zstandard.ZstdError as e:
+                raise ValueError(f"Corrupt zstd payload: {e}")
+            if not out:
+                self._eof = True
         
-        # Invoice date
-        invoice_date_elem = root.find('.//{%s}IssueDate' % NAMESPACES['cbc'])
-        if invoice_date_elem is not None and invoice_date_elem.text:
-            result['invoice_metadata']['invoice_date'] = invoice_date_elem.text.strip()
+        self.size += len(out)
+        if self.size > self.max_size:
+            raise PayloadTooLarge(f"Decompressed payload exceeds {self.max_size} bytes")
+        self._pending += out
+    
+    def read(self, size=-1):
+        if self._zlib is None and self._zstd is None:
+            return self._read_raw(size)
         
-        # Supplier party name
-        supplier_elem = root.find('.//{%s}AccountingSupplierParty//{%s}Name' % (NAMESPACES['cac'], NAMESPACES['cbc']))
-        if supplier_elem is not None and supplier_elem.text:
-            result['invoice_metadata']['supplier'] = supplier_elem.text.strip()
+        while not self._eof and (size is None or size < 0 or len(self._pending) < size):
+            self._fill()
         
-        # Total amount (TaxInclusiveAmount or PayableAmount)
-        total_elem = root.find('.//{%s}LegalMonetaryTotal/{%s}TaxInclusiveAmount' % (NAMESPACES['cac'], NAMESPACES['cbc']))
-        if total_elem is None:
-            total_elem = root.find('.//{%s}LegalMonetaryTotal/{%s}PayableAmount' % (NAMESPACES['cac'], NAMESPACES['cbc']))
-        if total_elem is not None and total_elem.text:
+        if size is None or size < 0:
+            size = len(self._pending)
+        out = bytes(self._pending[:size])
+        del self._pending[:size]
+        return out
+    
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def decompress_payload(data, encoding, max_size=None):
+    """Decode a complete gzip/deflate/zstd payload, enforcing max_size."""
+    return DecompressingReader(io.BytesIO(data), encoding, max_size).read()
+
+
+def accepted_response_encoding(accept_encoding):
+    """Pick the response coding to use from an Accept-Encoding header."""
+    offered = {}
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
             try:
-                result['invoice_metadata']['total_amount'] = float(total_elem.text.strip())
+                quality = float(params.strip()[2:])
             except ValueError:
-                logger.warning(f"Could not parse total amount: {total_elem.text}")
+                quality = 0.0
+        if token:
+            offered[token.lower()] = quality
+    if zstandard is not None and offered.get('zstd', 0) > 0:
+        return 'zstd'
+    if offered.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def parse_invoice_line(line, document=LINE_ITEMS_SPEC):
+    """
+    Extract one cac:InvoiceLine element into a LineItem.
+    
+    Shared by the whole-document and the incremental parsers; document is
+    the compiled spec matching the backend that produced the element.
+    """
+    line_item = document.line(line)
+    
+    # Calculate total_price if we have quantity and unit_price
+    if line_item.quantity is not None and line_item.unit_price is not None:
+        line_item.total_price = line_item.quantity * line_item.unit_price
+    elif line_item.line_total is not None:
+        line_item.total_price = line_item.line_total
+    
+    return line_item
+
+
+def parse_ubl_invoice(xml_content, backend=None, limits=None):
+    """
+    Parse UBL XML invoice using fully-qualified namespace tags.
+    Avoids fragile XPath predicates by using iterative traversal.
+    
+    Field lookups come from the line_items spec in ubl_engine, compiled
+    once at import for each backend. backend defaults to XML_BACKEND.
+    
+    With limits (a DocumentLimits), xml_content may also be a binary
+    file-like object: the tree is then built incrementally while it is
+    read, and the parse stops with DocumentTooComplex at the first element
+    past a limit.
+    
+    Returns dict with the InvoiceMetadata ('invoice_metadata') and the
+    LineItem records ('line_items'); see invoice_as_dict().
+    """
+    try:
+        document = get_document('line_items', backend or XML_BACKEND)
         
-        # Parse invoice lines using iteration (avoiding fragile XPath predicates)
-        for line in root.findall('.//{%s}InvoiceLine' % NAMESPACES['cac']):
-            line_item = {}
-            
-            # Line ID
-            line_id = line.find('{%s}ID' % NAMESPACES['cbc'])
-            if line_id is not None and line_id.text:
-                line_item['line_id'] = line_id.text.strip()
-            
-            # Quantity
-            quantity_elem = line.find('.//{%s}InvoicedQuantity' % NAMESPACES['cbc'])
-            if quantity_elem is not None and quantity_elem.text:
-                try:
-                    line_item['quantity'] = float(quantity_elem.text.strip())
-                except ValueError:
-                    logger.warning(f"Could not parse quantity: {quantity_elem.text}")
-                    line_item['quantity'] = 0.0
-                
-                # Unit code attribute
-                unit_code = quantity_elem.get('unitCode')
-                if unit_code:
-                    line_item['unit_code'] = unit_code
-            
-            # Line extension amount (line total before tax)
-            line_total_elem = line.find('.//{%s}LineExtensionAmount' % NAMESPACES['cbc'])
-            if line_total_elem is not None and line_total_elem.text:
-                try:
-                    line_item['line_total'] = float(line_total_elem.text.strip())
-                except ValueError:
-                    logger.warning(f"Could not parse line total: {line_total_elem.text}")
-            
-            # Unit price
-            price_elem = line.find('.//{%s}Price/{%s}PriceAmount' % (NAMESPACES['cac'], NAMESPACES['cbc']))
-            if price_elem is not None and price_elem.text:
-                try:
-                    line_item['unit_price'] = float(price_elem.text.strip())
-                except ValueError:
-                    logger.warning(f"Could not parse unit price: {price_elem.text}")
-            
-            # Item description/name
-            item_name = line.find('.//{%s}Item/{%s}Name' % (NAMESPACES['cac'], NAMESPACES['cbc']))
-            if item_name is not None and item_name.text:
-                line_item['description'] = item_name.text.strip()
-            
-            # Item SKU/ID
-            seller_id = line.find('.//{%s}Item/{%s}SellersItemIdentification/{%s}ID' % 
-                                 (NAMESPACES['cac'], NAMESPACES['cac'], NAMESPACES['cbc']))
-            if seller_id is not None and seller_id.text:
-                line_item['sku_raw'] = seller_id.text.strip()
-            
-            # Tax percentage
-            tax_percent_elem = line.find('.//{%s}TaxTotal/{%s}TaxSubtotal/{%s}TaxCategory/{%s}Percent' % 
-                                        (NAMESPACES['cac'], NAMESPACES['cac'], NAMESPACES['cac'], NAMESPACES['cbc']))
-            if tax_percent_elem is not None and tax_percent_elem.text:
-                try:
-                    line_item['tax_percent'] = float(tax_percent_elem.text.strip())
-                except ValueError:
-                    logger.warning(f"Could not parse tax percent: {tax_percent_elem.text}")
-            
-            # Calculate total_price if we have quantity and unit_price
-            if 'quantity' in line_item and 'unit_price' in line_item:
-                line_item['total_price'] = line_item['quantity'] * line_item['unit_price']
-            elif 'line_total' in line_item:
-                line_item['total_price'] = line_item['line_total']
-            
-            result['line_items'].append(line_item)
+        # Parse XML safely (defusedxml, or hardened lxml)
+        with tracing.span('parse.tree'):
+            if limits is None:
+                root = document.parse(xml_content)
+            else:
+                source = io.BytesIO(xml_content) if isinstance(xml_content, bytes) else xml_content
+                events = iterparse_document(source, document.backend)
+                for _ in limits.iter_lines(events, document.line_tag):
+                    pass
+                root = events.root
         
-        logger.info(f"Successfully parsed {len(result['line_items'])} invoice lines")
+        with tracing.span('parse.extract') as span:
+            result = {
+                'invoice_metadata': document.metadata(root),
+                'line_items': [parse_invoice_line(line, document) for line in document.lines(root)]
+            }
+            span.set(line_count=len(result['line_items']))
+        
+        logger.info("Successfully parsed %s invoice lines", len(result['line_items']))
         return result
         
-    except ET.ParseError as e:
-        logger.error(f"XML parsing error: {e}")
+    except (DocumentTooComplex, PayloadTooLarge, UnsupportedEncoding):
+        raise
+    except PARSE_ERRORS as e:
+        logger.error("XML parsing error: %s", e)
         raise ValueError(f"Invalid XML: {e}")
     except Exception as e:
-        logger.error(f"Unexpected error parsing XML: {e}")
+        logger.error("Unexpected error parsing XML: %s", e)
         raise ValueError(f"Failed to parse XML: {e}")
 
 
+def iter_ubl_invoice(source, limits=None):
+    """
+    Incrementally parse a UBL XML invoice from a file-like object.
+    
+    Yields ('line_item', LineItem) as soon as each cac:InvoiceLine closes,
+    so callers can emit output before the document has been fully read, and
+    finally one ('invoice_metadata', InvoiceMetadata) event. Processed lines are
+    cleared to keep memory flat on large invoices; the metadata is then
+    extracted from what remains of the tree with the same compiled spec
+    parse_ubl_invoice uses. limits defaults to LIMITS.
+    """
+    line_count = 0
+    
+    try:
+        events = ET.iterparse(source, events=('start', 'end'))
+        for elem in (limits or LIMITS).iter_lines(events, LINE_ITEMS_SPEC.line_tag):
+            line_count += 1
+            yield 'line_item', parse_invoice_line(elem)
+            elem.clear()
+    except ET.ParseError as e:
+        logger.error("XML parsing error: %s", e)
+        raise ValueError(f"Invalid XML: {e}")
+    
+    logger.info("Successfully streamed %s invoice lines", line_count)
+    yield 'invoice_metadata', LINE_ITEMS_SPEC.metadata(events.root)
+
+
+def invoice_as_dict(parsed_data):
+    """parse_ubl_invoice() output with its records as dicts (fields not found left out)."""
+    return {
+        'invoice_metadata': parsed_data['invoice_metadata'].as_dict(),
+        'line_items': [item.as_dict() for item in parsed_data['line_items']],
+    }
+
+
+def iter_json(parsed_data, filename):
+    """
+    Yield the /parse JSON body in pieces, one per line item.
+    
+    Each record is turned into a dict only while it is being encoded, so
+    the body is written without first building a dict per line.
+    """
+    yield '{"success":true,"filename":%s,"data":{"invoice_metadata":%s,"line_items":[' % (
+        json.dumps(filename), json.dumps(parsed_data['invoice_metadata'].as_dict()))
+    separator = ''
+    for item in parsed_data['line_items']:
+        yield separator + json.dumps(item.as_dict())
+        separator = ','
+    yield ']}}'
+
+
+CSV_COLUMNS = ['line_id', 'description', 'sku_raw', 'quantity', 'unit_code', 'unit_price', 'total_price', 'tax_percent']
+
+
+class _RowBuffer:
+    """File-like sink that hands each CSV row straight back to the caller."""
+    
+    def write(self, value):
+        return value
+
+
+def iter_csv(line_items):
+    """Yield the CSV header and then one encoded row per line item."""
+    import csv
+    
+    writer = csv.writer(_RowBuffer())
+    yield writer.writerow(CSV_COLUMNS)
+    for item in line_items:
+        # csv writes the fields that were not found (None) as empty
+        yield writer.writerow([getattr(item, column) for column in CSV_COLUMNS])
+
+
 def xml_to_csv(parsed_data):
     """Convert parsed invoice data to CSV format."""
-    import csv
-    from io import StringIO
+    return ''.join(iter_csv(parsed_data['line_items']))
+
+
+def stream_parse_response(source, filename, output_format):
+    """
+    Build a streamed CSV or NDJSON response over an incremental parse.
     
-    output = StringIO()
-    writer = csv.writer(output)
+    The document is parsed up to its first invoice line before the response
+    starts, so malformed XML still gets a regular 400. Errors after that point
+    end the stream: NDJSON gets a final {"error": ...} record, while CSV has
+    no room for one and aborts the body instead, so the client sees an
+    incomplete transfer rather than a short file that looks valid.
     
-    # Header
-    writer.writerow(['line_id', 'description', 'sku_raw', 'quantity', 'unit_code', 'unit_price', 'total_price', 'tax_percent'])
+    NDJSON output is one line item object per line followed by a trailer:
+    {"invoice_metadata": {...}, "line_count": N}
+    """
+    events = iter_ubl_invoice(source)
+    with tracing.span('parse.first_line'):
+        first = next(events)
+    # The body is generated after the request has returned
+    request_span = tracing.current_span()
     
-    # Data rows
-    for item in parsed_data['line_items']:
-        writer.writerow([
-            item.get('line_id', ''),
-            item.get('description', ''),
-            item.get('sku_raw', ''),
-            item.get('quantity', ''),
-            item.get('unit_code', ''),
-            item.get('unit_price', ''),
-            item.get('total_price', ''),
-            item.get('tax_percent', '')
-        ])
+    def line_items():
+        kind, payload = first
+        while kind == 'line_item':
+            yield payload
+            kind, payload = next(events)
+        stream_state['metadata'] = payload
     
-    return output.getvalue()
+    stream_state = {}
+    
+    def generate_csv():
+        with tracing.span('parse.stream', parent=request_span, format='csv') as span:
+            try:
+                yield from iter_csv(line_items())
+            except ValueError as e:
+                logger.error("Parse error while streaming %s: %s", filename, e)
+                span.error = str(e)
+                # Raising out of the body leaves the chunked response unterminated
+                raise
+    
+    def generate_ndjson():
+        count = 0
+        with tracing.span('parse.stream', parent=request_span, format='ndjson') as span:
+            try:
+                for item in line_items():
+                    count += 1
+                    yield json.dumps(item.as_dict()) + '\n'
+                yield json.dumps({'invoice_metadata': stream_state['metadata'].as_dict(), 'line_count': count}) + '\n'
+            except ValueError as e:
+                logger.error("Parse error while streaming %s: %s", filename, e)
+                span.error = str(e)
+                yield json.dumps({'error': str(e), 'filename': filename}) + '\n'
+            span.set(line_count=count)
+    
+    if output_format == 'csv':
+        return Response(
+            stream_with_context(generate_csv()),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename="{filename}.csv"'}
+        )
+    return Response(stream_with_context(generate_ndjson()), mimetype='application/x-ndjson')
+
+
+@app.after_request
+def compress_response(response):
+    """Compress JSON/CSV responses when the client negotiates it."""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers):
+        return response
+    
+    encoding = accepted_response_encoding(request.headers.get('Accept-Encoding'))
+    response.vary.add('Accept-Encoding')
+    if encoding is None:
+        return response
+    
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    
+    if encoding == 'zstd':
+        body = zstandard.ZstdCompressor(level=3).compress(body)
+    else:
+        body = gzip.compress(body, compresslevel=5)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
 
 
 @app.route('/health', methods=['GET'])
@@ -182,15 +463,17 @@ def parse_invoice():
     Parse UBL XML invoice.
     
     Accepts:
-    - multipart/form-data with 'file' field
-    - application/xml or text/xml raw body
+    - multipart/form-data with 'file' field (plain or gzip/zstd compressed)
+    - application/xml or text/xml raw body, optionally sent with
+      Content-Encoding: gzip, deflate or zstd
     
     Query params:
-    - format: 'json' (default) or 'csv'
+    - format: 'json' (default), 'csv' or 'ndjson'
     
     Returns:
     - JSON with invoice_metadata and line_items
-    - Or CSV if format=csv
+    - Or a streamed CSV / NDJSON body if format=csv / format=ndjson,
+      written row by row while the document is still being parsed
     """
     # Check authentication token if configured
     expected_token = os.environ.get('XML_PARSER_TOKEN')
@@ -200,8 +483,8 @@ def parse_invoice():
             logger.warning("Unauthorized access attempt")
             return jsonify({'error': 'Unauthorized'}), 401
     
-    xml_content = None
     filename = 'unknown'
+    output_format = request.args.get('format', 'json')
     
     try:
         # Check if multipart file upload
@@ -209,43 +492,62 @@ def parse_invoice():
             file = request.files['file']
             if file.filename:
                 filename = secure_filename(file.filename)
-            xml_content = file.read()
+            source = file.stream
+            # Compressed file upload (.xml.gz / .xml.zst)
+            magic = source.read(4)
+            source.seek(0)
+            if magic.startswith(b'\x1f\x8b'):
+                source = DecompressingReader(source, 'gzip')
+            elif magic.startswith(b'\x28\xb5\x2f\xfd'):
+                source = DecompressingReader(source, 'zstd')
         # Check if raw XML in body
-        elif request.content_type in ['application/xml', 'text/xml']:
-            xml_content = request.data
+        elif request.mimetype in ['application/xml', 'text/xml']:
+            source = DecompressingReader(request.stream, request.headers.get('Content-Encoding'))
             filename = request.args.get('filename', 'uploaded.xml')
         else:
             return jsonify({'error': 'No XML file or data provided'}), 400
         
-        if not xml_content:
-            return jsonify({'error': 'Empty XML content'}), 400
-        
-        logger.info(f"Parsing XML file: {filename}, size: {len(xml_content)} bytes")
+        # CSV and NDJSON are streamed from an incremental parse
+        if output_format in ('csv', 'ndjson'):
+            logger.info("Streaming %s for XML file: %s, size: %s bytes", output_format, filename, request.content_length)
+            response = stream_parse_response(source, filename, output_format)
+            if 'file' in request.files:
+                # Flask closes the request's files when the view returns, before
+                # the body is written: the response takes the upload over instead
+                upload = request.files['file']
+                response.call_on_close(upload.stream.close)
+                upload.stream = io.BytesIO()
+            return response
         
-        # Parse the XML
-        parsed_data = parse_ubl_invoice(xml_content)
+        logger.info("Parsing XML file: %s, size: %s bytes", filename, request.content_length)
         
-        # Return format
-        output_format = request.args.get('format', 'json')
+        # Parse the XML while the body is read, under the complexity limits
+        parsed_data = parse_ubl_invoice(source, limits=LIMITS)
         
-        if output_format == 'csv':
-            csv_data = xml_to_csv(parsed_data)
-            return csv_data, 200, {'Content-Type': 'text/csv', 'Content-Disposition': f'attachment; filename="{filename}.csv"'}
-        else:
-            return jsonify({
-                'success': True,
-                'filename': filename,
-                'data': parsed_data
-            })
+        return Response(''.join(iter_json(parsed_data, filename)), mimetype='application/json')
     
+    except (PayloadTooLarge, RequestEntityTooLarge) as e:
+        logger.warning("Rejected oversized payload for %s: %s", filename, e)
+        if isinstance(e, RequestEntityTooLarge):
+            e = f"Request body exceeds {MAX_CONTENT_LENGTH} bytes"
+        return jsonify({'error': str(e), 'filename': filename}), 413
+    except DocumentTooComplex as e:
+        logger.warning("Rejected overly complex document %s: %s", filename, e)
+        return jsonify({'error': str(e), 'filename': filename}), 422
+    except UnsupportedEncoding as e:
+        return jsonify({'error': str(e), 'filename': filename}), 415
     except ValueError as e:
-        logger.error(f"Parse error for {filename}: {e}")
+        logger.error("Parse error for %s: %s", filename, e)
         return jsonify({'error': str(e), 'filename': filename}), 400
     except Exception as e:
-        logger.error(f"Unexpected error for {filename}: {e}", exc_info=True)
+        logger.error("Unexpected error for %s: %s", filename, e, exc_info=True)
         return jsonify({'error': 'Internal server error', 'detail': str(e)}), 500
 
 
 if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    socket_path = os.environ.get('XML_PARSER_SOCKET')
+    if socket_path:
+        app.run(host=f'unix://{socket_path}', debug=False)
+    else:
+        port = int(os.environ.get('PORT', 5000))
+        app.run(host='0.0.0.0', port=port, debug=False)
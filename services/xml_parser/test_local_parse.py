@@ -5,7 +5,7 @@ Usage: python test_local_parse.py <xml_file_path>
 """
 import sys
 import json
-from parser_app import parse_ubl_invoice
+from parser_app import invoice_as_dict, parse_ubl_invoice
 
 
 def main():
@@ -24,7 +24,7 @@ def main():
         print(f"Parsing {xml_file}...")
         print(f"File size: {len(xml_content)} bytes\n")
         
-        result = parse_ubl_invoice(xml_content)
+        result = invoice_as_dict(parse_ubl_invoice(xml_content))
         
         print("=" * 60)
         print("PARSED RESULT (JSON):")
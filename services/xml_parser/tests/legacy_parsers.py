@@ -0,0 +1,283 @@
+"""
+Reference copies of the two UBL parsers that predate ubl_engine.
+
+Kept verbatim (renamed) so the parity tests and the benchmark can compare
+the engine-backed adapters against the original behaviour.
+"""
+import logging
+from typing import Dict
+import defusedxml.ElementTree as ET
+
+logger = logging.getLogger(__name__)
+
+NAMESPACES = {
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+    'ubl': 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2'
+}
+
+
+def legacy_parse_ubl_invoice(xml_content):
+    """
+    Parse UBL XML invoice using fully-qualified namespace tags.
+    Avoids fragile XPath predicates by using iterative traversal.
+    
+    Returns dict with invoice metadata and line items.
+    """
+    try:
+        # Parse XML safely with defusedxml
+        root = ET.fromstring(xml_content)
+        
+        result = {
+            'invoice_metadata': {},
+            'line_items': []
+        }
+        
+        # Extract invoice metadata using fully-qualified tags
+        # Invoice number
+        invoice_number_elem = root.find('.//{%s}ID' % NAMESPACES['cbc'])
+        if invoice_number_elem is not None and invoice_number_elem.text:
+            result['invoice_metadata']['invoice_number'] = invoice_number_elem.text.strip()
+        
+        # Invoice date
+        invoice_date_elem = root.find('.//{%s}IssueDate' % NAMESPACES['cbc'])
+        if invoice_date_elem is not None and invoice_date_elem.text:
+            result['invoice_metadata']['invoice_date'] = invoice_date_elem.text.strip()
+        
+        # Supplier party name
+        supplier_elem = root.find('.//{%s}AccountingSupplierParty//{%s}Name' % (NAMESPACES['cac'], NAMESPACES['cbc']))
+        if supplier_elem is not None and supplier_elem.text:
+            result['invoice_metadata']['supplier'] = supplier_elem.text.strip()
+        
+        # Total amount (TaxInclusiveAmount or PayableAmount)
+        total_elem = root.find('.//{%s}LegalMonetaryTotal/{%s}TaxInclusiveAmount' % (NAMESPACES['cac'], NAMESPACES['cbc']))
+        if total_elem is None:
+            total_elem = root.find('.//{%s}LegalMonetaryTotal/{%s}PayableAmount' % (NAMESPACES['cac'], NAMESPACES['cbc']))
+        if total_elem is not None and total_elem.text:
+            try:
+                result['invoice_metadata']['total_amount'] = float(total_elem.text.strip())
+            except ValueError:
+                logger.warning(f"Could not parse total amount: {total_elem.text}")
+        
+        # Parse invoice lines using iteration (avoiding fragile XPath predicates)
+        for line in root.findall('.//{%s}InvoiceLine' % NAMESPACES['cac']):
+            line_item = {}
+            
+            # Line ID
+            line_id = line.find('{%s}ID' % NAMESPACES['cbc'])
+            if line_id is not None and line_id.text:
+                line_item['line_id'] = line_id.text.strip()
+            
+            # Quantity
+            quantity_elem = line.find('.//{%s}InvoicedQuantity' % NAMESPACES['cbc'])
+            if quantity_elem is not None and quantity_elem.text:
+                try:
+                    line_item['quantity'] = float(quantity_elem.text.strip())
+                except ValueError:
+                    logger.warning(f"Could not parse quantity: {quantity_elem.text}")
+                    line_item['quantity'] = 0.0
+                
+                # Unit code attribute
+                unit_code = quantity_elem.get('unitCode')
+                if unit_code:
+                    line_item['unit_code'] = unit_code
+            
+            # Line extension amount (line total before tax)
+            line_total_elem = line.find('.//{%s}LineExtensionAmount' % NAMESPACES['cbc'])
+            if line_total_elem is not None and line_total_elem.text:
+                try:
+                    line_item['line_total'] = float(line_total_elem.text.strip())
+                except ValueError:
+                    logger.warning(f"Could not parse line total: {line_total_elem.text}")
+            
+            # Unit price
+            price_elem = line.find('.//{%s}Price/{%s}PriceAmount' % (NAMESPACES['cac'], NAMESPACES['cbc']))
+            if price_elem is not None and price_elem.text:
+                try:
+                    line_item['unit_price'] = float(price_elem.text.strip())
+                except ValueError:
+                    logger.warning(f"Could not parse unit price: {price_elem.text}")
+            
+            # Item description/name
+            item_name = line.find('.//{%s}Item/{%s}Name' % (NAMESPACES['cac'], NAMESPACES['cbc']))
+            if item_name is not None and item_name.text:
+                line_item['description'] = item_name.text.strip()
+            
+            # Item SKU/ID
+            seller_id = line.find('.//{%s}Item/{%s}SellersItemIdentification/{%s}ID' % 
+                                 (NAMESPACES['cac'], NAMESPACES['cac'], NAMESPACES['cbc']))
+            if seller_id is not None and seller_id.text:
+                line_item['sku_raw'] = seller_id.text.strip()
+            
+            # Tax percentage
+            tax_percent_elem = line.find('.//{%s}TaxTotal/{%s}TaxSubtotal/{%s}TaxCategory/{%s}Percent' % 
+                                        (NAMESPACES['cac'], NAMESPACES['cac'], NAMESPACES['cac'], NAMESPACES['cbc']))
+            if tax_percent_elem is not None and tax_percent_elem.text:
+                try:
+                    line_item['tax_percent'] = float(tax_percent_elem.text.strip())
+                except ValueError:
+                    logger.warning(f"Could not parse tax percent: {tax_percent_elem.text}")
+            
+            # Calculate total_price if we have quantity and unit_price
+            if 'quantity' in line_item and 'unit_price' in line_item:
+                line_item['total_price'] = line_item['quantity'] * line_item['unit_price']
+            elif 'line_total' in line_item:
+                line_item['total_price'] = line_item['line_total']
+            
+            result['line_items'].append(line_item)
+        
+        logger.info(f"Successfully parsed {len(result['line_items'])} invoice lines")
+        return result
+        
+    except ET.ParseError as e:
+        logger.error(f"XML parsing error: {e}")
+        raise ValueError(f"Invalid XML: {e}")
+    except Exception as e:
+        logger.error(f"Unexpected error parsing XML: {e}")
+        raise ValueError(f"Failed to parse XML: {e}")
+
+
+def legacy_parse_invoice_products(xml_content: str) -> Dict:
+    """
+    Parsează o factură XML în format UBL (e-Factura RO) și extrage informații despre produse.
+    
+    Args:
+        xml_content: Conținutul XML ca string
+        
+    Returns:
+        Dict cu informații despre factură și produse
+    """
+    root = ET.fromstring(xml_content)
+    
+    namespaces = {
+        'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+        'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2'
+    }
+    
+    # Extrage informații generale despre factură
+    invoice_number = root.find('cbc:ID', namespaces)
+    invoice_date = root.find('cbc:IssueDate', namespaces)
+    supplier_name = root.find('cac:AccountingSupplierParty/cac:Party/cac:PartyName/cbc:Name', namespaces)
+    
+    # Extrage produsele
+    products = []
+    
+    for line in root.findall('cac:InvoiceLine', namespaces):
+        name = line.find('cac:Item/cbc:Name', namespaces)
+        quantity = line.find('cbc:InvoicedQuantity', namespaces)
+        price = line.find('cac:Price/cbc:PriceAmount', namespaces)
+        total = line.find('cbc:LineExtensionAmount', namespaces)
+        tax = line.find('cac:Item/cac:ClassifiedTaxCategory/cbc:Percent', namespaces)
+        
+        # Extrage SKU dacă există
+        sku = line.find('cac:Item/cac:SellersItemIdentification/cbc:ID', namespaces)
+        
+        product = {
+            "name": name.text if name is not None else "",
+            "sku": sku.text if sku is not None else "",
+            "quantity": float(quantity.text) if quantity is not None else 0.0,
+            "unit": quantity.attrib.get('unitCode', 'buc') if quantity is not None else 'buc',
+            "unit_price": float(price.text) if price is not None else 0.0,
+            "total_price": float(total.text) if total is not None else 0.0,
+            "tax_percent": float(tax.text) if tax is not None else 0.0
+        }
+        
+        products.append(product)
+    
+    return {
+        "invoice_number": invoice_number.text if invoice_number is not None else "",
+        "invoice_date": invoice_date.text if invoice_date is not None else "",
+        "supplier": supplier_name.text if supplier_name is not None else "",
+        "products": products,
+        "total_amount": sum(p["total_price"] for p in products)
+    }
+
+
+def _invoice(body):
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"'
+        ' xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"'
+        ' xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+        + body + '</Invoice>'
+    ).encode('utf-8')
+
+
+# Documents exercising the edge cases where the two legacy parsers differ:
+# missing/empty/whitespace elements, total fallbacks, nested lines,
+# repeated Items, alternative tax locations and bad numbers.
+PARITY_DOCUMENTS = {
+    'empty_invoice': _invoice(''),
+    'header_only': _invoice(
+        '<cbc:ID> INV-7 </cbc:ID><cbc:IssueDate>2024-03-01</cbc:IssueDate>'
+        '<cac:AccountingSupplierParty><cac:Party><cac:PartyName><cbc:Name>  Furnizor SRL </cbc:Name>'
+        '</cac:PartyName></cac:Party></cac:AccountingSupplierParty>'
+    ),
+    'payable_fallback': _invoice(
+        '<cbc:ID>INV-8</cbc:ID>'
+        '<cac:LegalMonetaryTotal><cbc:PayableAmount>42.50</cbc:PayableAmount></cac:LegalMonetaryTotal>'
+    ),
+    'empty_tax_inclusive_blocks_fallback': _invoice(
+        '<cac:LegalMonetaryTotal><cbc:TaxInclusiveAmount/><cbc:PayableAmount>9</cbc:PayableAmount>'
+        '</cac:LegalMonetaryTotal>'
+    ),
+    'supplier_name_elsewhere': _invoice(
+        '<cac:AccountingSupplierParty><cac:Party><cbc:Name>Direct</cbc:Name>'
+        '<cac:PartyName><cbc:Name>Named</cbc:Name></cac:PartyName></cac:Party>'
+        '</cac:AccountingSupplierParty>'
+    ),
+    'empty_elements': _invoice(
+        '<cbc:ID/><cbc:IssueDate></cbc:IssueDate>'
+        '<cac:InvoiceLine><cbc:ID/><cac:Item><cbc:Name/></cac:Item></cac:InvoiceLine>'
+    ),
+    'missing_unit_code': _invoice(
+        '<cac:InvoiceLine><cbc:ID>1</cbc:ID><cbc:InvoicedQuantity>3</cbc:InvoicedQuantity>'
+        '<cbc:LineExtensionAmount>30</cbc:LineExtensionAmount></cac:InvoiceLine>'
+    ),
+    'empty_unit_code': _invoice(
+        '<cac:InvoiceLine><cbc:InvoicedQuantity unitCode="">3</cbc:InvoicedQuantity></cac:InvoiceLine>'
+    ),
+    'line_total_only': _invoice(
+        '<cac:InvoiceLine><cbc:ID>1</cbc:ID><cbc:LineExtensionAmount>12.5</cbc:LineExtensionAmount>'
+        '</cac:InvoiceLine>'
+    ),
+    'classified_tax_category': _invoice(
+        '<cac:InvoiceLine><cbc:ID>1</cbc:ID><cbc:InvoicedQuantity unitCode="H87">2</cbc:InvoicedQuantity>'
+        '<cbc:LineExtensionAmount>20</cbc:LineExtensionAmount>'
+        '<cac:Item><cbc:Name>Panou</cbc:Name><cac:ClassifiedTaxCategory><cbc:Percent>19</cbc:Percent>'
+        '</cac:ClassifiedTaxCategory></cac:Item>'
+        '<cac:Price><cbc:PriceAmount>10</cbc:PriceAmount></cac:Price></cac:InvoiceLine>'
+    ),
+    'second_item_has_name': _invoice(
+        '<cac:InvoiceLine><cac:Item/><cac:Item><cbc:Name>Second</cbc:Name>'
+        '<cac:SellersItemIdentification><cbc:ID>S-2</cbc:ID></cac:SellersItemIdentification></cac:Item>'
+        '</cac:InvoiceLine>'
+    ),
+    'whitespace_values': _invoice(
+        '<cac:InvoiceLine><cbc:ID> 4 </cbc:ID><cbc:InvoicedQuantity unitCode="KG"> 1.5 </cbc:InvoicedQuantity>'
+        '<cac:Item><cbc:Name>\n  Cablu solar 6mm\n</cbc:Name></cac:Item>'
+        '<cac:Price><cbc:PriceAmount> 4.20 </cbc:PriceAmount></cac:Price></cac:InvoiceLine>'
+    ),
+    'nested_invoice_lines': _invoice(
+        '<cac:InvoiceLine><cbc:ID>1</cbc:ID></cac:InvoiceLine>'
+        '<cac:Wrapper><cac:InvoiceLine><cbc:ID>2</cbc:ID></cac:InvoiceLine></cac:Wrapper>'
+    ),
+    'lines_before_header': _invoice(
+        '<cac:InvoiceLine><cbc:ID>1</cbc:ID><cbc:InvoicedQuantity unitCode="EA">1</cbc:InvoicedQuantity>'
+        '</cac:InvoiceLine><cbc:ID>LATE-ID</cbc:ID>'
+    ),
+}
+
+# Documents where the products parser raises (bad numbers), which the
+# line-items parser tolerates
+INVALID_NUMBER_DOCUMENTS = {
+    'bad_quantity': _invoice(
+        '<cac:InvoiceLine><cbc:InvoicedQuantity unitCode="EA">ten</cbc:InvoicedQuantity></cac:InvoiceLine>'
+    ),
+    'bad_price': _invoice(
+        '<cac:InvoiceLine><cac:Price><cbc:PriceAmount>n/a</cbc:PriceAmount></cac:Price></cac:InvoiceLine>'
+    ),
+    'empty_line_total': _invoice(
+        '<cac:InvoiceLine><cbc:LineExtensionAmount/></cac:InvoiceLine>'
+    ),
+}
@@ -4,12 +4,18 @@ Unit tests for XML invoice parser.
 import pytest
 import sys
 import os
+import gzip
+import json
+import logging
+import time
 from io import BytesIO
 
 # Add parent directory to path to import parser_app
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from parser_app import app, parse_ubl_invoice
+import parser_app
+from parser_app import app, parse_ubl_invoice, iter_ubl_invoice
+from ubl_engine import InvoiceMetadata
 
 
 @pytest.fixture
@@ -46,10 +52,10 @@ def test_parse_ubl_invoice_function(sample_xml):
     assert 'line_items' in result
     
     metadata = result['invoice_metadata']
-    assert metadata['invoice_number'] == 'INV-2024-001'
-    assert metadata['invoice_date'] == '2024-01-15'
-    assert metadata['supplier'] == 'Test Supplier Ltd'
-    assert metadata['total_amount'] == 1190.00
+    assert metadata.invoice_number == 'INV-2024-001'
+    assert metadata.invoice_date == '2024-01-15'
+    assert metadata.supplier == 'Test Supplier Ltd'
+    assert metadata.total_amount == 1190.00
     
     # Check line items
     items = result['line_items']
@@ -57,27 +63,27 @@ def test_parse_ubl_invoice_function(sample_xml):
     
     # First line item
     item1 = items[0]
-    assert item1['line_id'] == '1'
-    assert item1['description'] == 'Widget A'
-    assert item1['sku_raw'] == 'SKU-001'
-    assert item1['quantity'] == 10.0
-    assert item1['unit_code'] == 'EA'
-    assert item1['unit_price'] == 50.00
-    assert item1['line_total'] == 500.00
-    assert item1['tax_percent'] == 19.00
-    assert item1['total_price'] == 500.00  # quantity * unit_price
+    assert item1.line_id == '1'
+    assert item1.description == 'Widget A'
+    assert item1.sku_raw == 'SKU-001'
+    assert item1.quantity == 10.0
+    assert item1.unit_code == 'EA'
+    assert item1.unit_price == 50.00
+    assert item1.line_total == 500.00
+    assert item1.tax_percent == 19.00
+    assert item1.total_price == 500.00  # quantity * unit_price
     
     # Second line item
     item2 = items[1]
-    assert item2['line_id'] == '2'
-    assert item2['description'] == 'Material B'
-    assert item2['sku_raw'] == 'SKU-002'
-    assert item2['quantity'] == 5.0
-    assert item2['unit_code'] == 'KG'
-    assert item2['unit_price'] == 120.00
-    assert item2['line_total'] == 600.00
-    assert item2['tax_percent'] == 19.00
-    assert item2['total_price'] == 600.00
+    assert item2.line_id == '2'
+    assert item2.description == 'Material B'
+    assert item2.sku_raw == 'SKU-002'
+    assert item2.quantity == 5.0
+    assert item2.unit_code == 'KG'
+    assert item2.unit_price == 120.00
+    assert item2.line_total == 600.00
+    assert item2.tax_percent == 19.00
+    assert item2.total_price == 600.00
 
 
 def test_parse_endpoint_with_file(client, sample_xml):
@@ -188,8 +194,269 @@ def test_parse_malformed_xml_elements():
     assert 'line_items' in result
     assert len(result['line_items']) == 1
     # Should handle invalid quantity gracefully
-    assert result['line_items'][0]['quantity'] == 0.0
+    assert result['line_items'][0].quantity == 0.0
 
 
+def test_parse_endpoint_gzip_content_encoding(client, sample_xml):
+    """Test raw XML body sent with Content-Encoding: gzip."""
+    response = client.post(
+        '/parse',
+        data=gzip.compress(sample_xml),
+        content_type='application/xml',
+        headers={'Content-Encoding': 'gzip'}
+    )
+    assert response.status_code == 200
+    assert len(response.get_json()['data']['line_items']) == 2
+
+
+def test_parse_endpoint_gzip_file_upload(client, sample_xml):
+    """Test a .xml.gz multipart upload."""
+    data = {'file': (BytesIO(gzip.compress(sample_xml)), 'test_invoice.xml.gz')}
+    response = client.post('/parse', data=data, content_type='multipart/form-data')
+    assert response.status_code == 200
+    assert response.get_json()['data']['invoice_metadata']['invoice_number'] == 'INV-2024-001'
+
+
+def test_parse_endpoint_rejects_gzip_bomb(client, monkeypatch):
+    """Test that a payload inflating past the limit is rejected with 413."""
+    monkeypatch.setattr(parser_app, 'MAX_DECOMPRESSED_SIZE', 1024 * 1024)
+    bomb = gzip.compress(b'<a>' + b' ' * (4 * 1024 * 1024) + b'</a>')
+    response = client.post(
+        '/parse', data=bomb, content_type='application/xml', headers={'Content-Encoding': 'gzip'}
+    )
+    assert response.status_code == 413
+
+
+def test_parse_endpoint_unsupported_encoding(client, sample_xml):
+    """Test an unknown Content-Encoding is rejected with 415."""
+    response = client.post(
+        '/parse', data=sample_xml, content_type='application/xml', headers={'Content-Encoding': 'br'}
+    )
+    assert response.status_code == 415
+
+
+def test_parse_endpoint_compressed_response(client, sample_xml, monkeypatch):
+    """Test that the JSON response is gzip-compressed when negotiated."""
+    monkeypatch.setattr(parser_app, 'COMPRESS_MIN_SIZE', 0)
+    response = client.post(
+        '/parse', data=sample_xml, content_type='application/xml',
+        headers={'Accept-Encoding': 'gzip'}
+    )
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert b'INV-2024-001' in gzip.decompress(response.data)
+
+
+def make_large_invoice(lines):
+    """Build a UBL invoice with the given number of invoice lines."""
+    line = (
+        '<cac:InvoiceLine><cbc:ID>{0}</cbc:ID>'
+        '<cbc:InvoicedQuantity unitCode="EA">2</cbc:InvoicedQuantity>'
+        '<cbc:LineExtensionAmount>20.00</cbc:LineExtensionAmount>'
+        '<cac:Item><cbc:Name>Item {0}</cbc:Name></cac:Item>'
+        '<cac:Price><cbc:PriceAmount>10.00</cbc:PriceAmount></cac:Price>'
+        '</cac:InvoiceLine>'
+    )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"'
+        ' xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"'
+        ' xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+        '<cbc:ID>BIG-1</cbc:ID>'
+        + ''.join(line.format(i) for i in range(1, lines + 1)) +
+        '<cac:LegalMonetaryTotal><cbc:PayableAmount>99.00</cbc:PayableAmount></cac:LegalMonetaryTotal>'
+        '</Invoice>'
+    ).encode('utf-8')
+
+
+def test_iter_ubl_invoice_matches_parse_ubl_invoice(sample_xml):
+    """Test the incremental parser produces the same data as the tree parser."""
+    events = list(iter_ubl_invoice(BytesIO(sample_xml)))
+    expected = parse_ubl_invoice(sample_xml)
+    
+    assert [payload for kind, payload in events if kind == 'line_item'] == expected['line_items']
+    assert events[-1] == ('invoice_metadata', expected['invoice_metadata'])
+
+
+def test_iter_ubl_invoice_yields_before_document_is_read():
+    """Test the first line item is produced before the whole source is consumed."""
+    xml = make_large_invoice(5000)
+    source = BytesIO(xml)
+    
+    events = iter_ubl_invoice(source)
+    kind, item = next(events)
+    assert kind == 'line_item'
+    assert item.line_id == '1'
+    assert source.tell() < len(xml)
+    
+    rest = list(events)
+    assert len(rest) == 5000
+    assert rest[-1] == ('invoice_metadata', InvoiceMetadata(invoice_number='BIG-1', total_amount=99.0))
+
+
+def test_parse_endpoint_csv_is_streamed(client, sample_xml):
+    """Test format=csv returns a streamed body equal to the buffered conversion."""
+    response = client.post('/parse?format=csv', data=sample_xml, content_type='application/xml')
+    assert response.status_code == 200
+    assert response.is_streamed
+    
+    from parser_app import xml_to_csv
+    assert response.data.decode('utf-8') == xml_to_csv(parse_ubl_invoice(sample_xml))
+
+
+def test_parse_endpoint_ndjson_format(client, sample_xml):
+    """Test format=ndjson streams one line item per line plus a metadata trailer."""
+    response = client.post('/parse?format=ndjson', data=sample_xml, content_type='application/xml')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    
+    records = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert len(records) == 3
+    assert records[0]['description'] == 'Widget A'
+    assert records[1]['sku_raw'] == 'SKU-002'
+    assert records[2]['invoice_metadata']['invoice_number'] == 'INV-2024-001'
+    assert records[2]['line_count'] == 2
+
+
+def test_parse_endpoint_streamed_invalid_xml(client):
+    """Test malformed XML is still rejected with 400 on the streaming formats."""
+    for output_format in ('csv', 'ndjson'):
+        response = client.post(
+            f'/parse?format={output_format}', data=b'<not>valid<xml>', content_type='application/xml'
+        )
+        assert response.status_code == 400
+
+
+
+
+@pytest.mark.parametrize('backend', ['etree', 'lxml'])
+def test_parse_ubl_invoice_with_limits_matches_plain_parse(sample_xml, backend):
+    """Test the incremental, limited parse gives the same result as the plain one, from bytes or a stream."""
+    if backend == 'lxml':
+        pytest.importorskip('lxml')
+    expected = parse_ubl_invoice(sample_xml, backend=backend)
+    assert parse_ubl_invoice(sample_xml, backend=backend, limits=parser_app.LIMITS) == expected
+    assert parse_ubl_invoice(BytesIO(sample_xml), backend=backend, limits=parser_app.LIMITS) == expected
+
+
+@pytest.mark.parametrize('output_format', ['json', 'ndjson'])
+def test_deeply_nested_document_rejected_early(client, output_format):
+    """Test a pathologically deep document is refused with 422 at the first element past the depth limit."""
+    depth = 100000
+    xml = b'<a>' * depth + b'</a>' * depth
+    
+    started = time.perf_counter()
+    response = client.post(f'/parse?format={output_format}', data=xml, content_type='application/xml')
+    elapsed = time.perf_counter() - started
+    
+    assert response.status_code == 422
+    assert 'nested deeper than' in response.get_json()['error']
+    assert elapsed < 0.5
+
+
+@pytest.mark.parametrize('limits, message, ndjson_status', [
+    ({'max_elements': 20}, 'more than 20 elements', 422),
+    ({'max_lines': 1}, 'more than 1 lines', 200),
+])
+def test_element_and_line_limits(client, sample_xml, monkeypatch, limits, message, ndjson_status):
+    """Test the element and invoice line caps answer 422, or end an NDJSON stream with an error record."""
+    monkeypatch.setattr(parser_app, 'LIMITS', parser_app.DocumentLimits(**limits))
+    
+    response = client.post('/parse', data=sample_xml, content_type='application/xml')
+    assert response.status_code == 422
+    assert message in response.get_json()['error']
+    
+    # Past the first line the NDJSON response has already started
+    response = client.post('/parse?format=ndjson', data=sample_xml, content_type='application/xml')
+    assert response.status_code == ndjson_status
+    records = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert message in records[-1]['error']
+
+
+def test_body_over_max_content_length_rejected(client, sample_xml, monkeypatch):
+    """Test a body larger than MAX_CONTENT_LENGTH is refused with 413, declared or chunked."""
+    monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 100)
+    monkeypatch.setattr(parser_app, 'MAX_CONTENT_LENGTH', 100)
+    
+    response = client.post('/parse', data=sample_xml, content_type='application/xml')
+    assert response.status_code == 413
+    assert response.get_json()['error'] == 'Request body exceeds 100 bytes'
+    
+    response = client.post(
+        '/parse', input_stream=BytesIO(sample_xml), content_type='application/xml',
+        environ_overrides={'wsgi.input_terminated': True}
+    )
+    assert response.status_code == 413
+    
+    response = client.post('/parse', data={'file': (BytesIO(sample_xml), 'invoice.xml')})
+    assert response.status_code == 413
+
+def read_trace_file(path):
+    spans = []
+    with open(path) as f:
+        for line in f:
+            for resource in json.loads(line)['resourceSpans']:
+                for scope in resource['scopeSpans']:
+                    spans.extend(scope['spans'])
+    return {span['name']: span for span in spans}
+
+
+@pytest.mark.parametrize('output_format', ['json', 'ndjson'])
+def test_parse_continues_backend_trace(client, sample_xml, tmp_path, monkeypatch, output_format):
+    """Test the backend's traceparent and X-Request-ID are continued, with a span per parse stage."""
+    import tracing
+    trace_file = tmp_path / 'traces.jsonl'
+    monkeypatch.setattr(tracing, 'TRACE_EXPORTER', 'file')
+    monkeypatch.setattr(tracing, 'TRACE_FILE', str(trace_file))
+    trace_id, parent_id = '4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7'
+    
+    response = client.post(
+        f'/parse?format={output_format}', data=sample_xml, content_type='application/xml',
+        headers={'traceparent': f'00-{trace_id}-{parent_id}-01', 'X-Request-ID': 'upload-42'}
+    )
+    assert response.status_code == 200
+    response.get_data()
+    response.close()
+    assert response.headers['X-Request-ID'] == 'upload-42'
+    
+    spans = read_trace_file(trace_file)
+    root = spans['POST /parse']
+    assert root['traceId'] == trace_id
+    assert root['parentSpanId'] == parent_id
+    stages = {'parse.tree', 'parse.extract'} if output_format == 'json' else {'parse.first_line', 'parse.stream'}
+    assert stages <= set(spans)
+    assert {span['traceId'] for span in spans.values()} == {trace_id}
+
+
+def test_log_records_carry_request_id(client, sample_xml, caplog):
+    """Test log records written while serving a request carry its X-Request-ID."""
+    import tracing
+    caplog.handler.addFilter(tracing.RequestIdFilter())
+    with caplog.at_level(logging.INFO):
+        client.post('/parse', data=sample_xml, content_type='application/xml', headers={'X-Request-ID': 'upload-42'})
+    
+    parsed = [r for r in caplog.records if r.getMessage().startswith('Parsing XML file')]
+    assert [r.request_id for r in parsed] == ['upload-42']
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
+
+
+def test_parse_endpoint_stream_fails_halfway(client, sample_xml):
+    """Test a document that breaks after its first line ends NDJSON with an error record and aborts CSV."""
+    end = sample_xml.index(b'</cac:InvoiceLine>') + len(b'</cac:InvoiceLine>')
+    broken = sample_xml[:end] + b'<cac:InvoiceLine><broken></cac:InvoiceLine>'
+    
+    response = client.post('/parse?format=ndjson', data=broken, content_type='application/xml')
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+    assert records[0]['description'] == 'Widget A'
+    assert 'mismatched tag' in records[-1]['error']
+    
+    response = client.post('/parse?format=csv', data=broken, content_type='application/xml')
+    assert response.status_code == 200
+    chunks = []
+    with pytest.raises(ValueError, match='mismatched tag'):
+        for chunk in response.response:
+            chunks.append(chunk)
+    assert b''.join(chunks).decode('utf-8').splitlines()[1].startswith('1,Widget A')
@@ -0,0 +1,188 @@
+"""
+Parity and unit tests for the shared UBL extraction engine.
+"""
+import pytest
+import sys
+import os
+from io import BytesIO
+
+# Add parent directory to path to import parser_app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import ubl_engine
+from ubl_engine import Field, compile_path, parse_document
+from parser_app import app, invoice_as_dict, parse_ubl_invoice, iter_ubl_invoice
+from legacy_parsers import INVALID_NUMBER_DOCUMENTS, PARITY_DOCUMENTS, legacy_parse_ubl_invoice
+
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), 'sample_invoice.xml')
+
+
+def all_documents():
+    with open(SAMPLE_PATH, 'rb') as f:
+        documents = {'sample_invoice': f.read()}
+    documents.update(PARITY_DOCUMENTS)
+    documents.update(INVALID_NUMBER_DOCUMENTS)
+    return documents
+
+
+@pytest.mark.parametrize('name,xml', sorted(all_documents().items()))
+def test_parse_ubl_invoice_parity(name, xml):
+    """parse_ubl_invoice must match the pre-engine implementation exactly."""
+    assert invoice_as_dict(parse_ubl_invoice(xml)) == legacy_parse_ubl_invoice(xml)
+
+
+@pytest.mark.parametrize('name,xml', sorted(PARITY_DOCUMENTS.items()))
+def test_iter_ubl_invoice_line_parity(name, xml):
+    """The incremental parser yields the same line items as the tree parser."""
+    events = list(iter_ubl_invoice(BytesIO(xml)))
+    items = [payload.as_dict() for kind, payload in events if kind == 'line_item']
+    assert items == legacy_parse_ubl_invoice(xml)['line_items']
+
+
+@pytest.mark.parametrize('name,xml', sorted(PARITY_DOCUMENTS.items()))
+def test_parse_endpoint_json_parity(name, xml):
+    """The JSON body written from the records carries the legacy dicts."""
+    response = app.test_client().post('/parse', data=xml, content_type='application/xml')
+    assert response.status_code == 200
+    assert response.get_json() == {'success': True, 'filename': 'uploaded.xml', 'data': legacy_parse_ubl_invoice(xml)}
+
+
+def test_records_are_slotted():
+    """Parsed lines are slotted records, without a per-instance dict."""
+    xml = all_documents()['sample_invoice']
+    result = parse_ubl_invoice(xml)
+    for record in [result['invoice_metadata'], *result['line_items']]:
+        assert not hasattr(record, '__dict__')
+    assert result['line_items'][0].total_price == 500.0
+    assert ubl_engine.InvoiceMetadata(invoice_number='INV-1').as_dict() == {'invoice_number': 'INV-1'}
+
+
+def test_compile_record_rejects_unknown_field():
+    with pytest.raises(ValueError, match='no field'):
+        ubl_engine.compile_record((Field('colour', ('cbc:Colour',)),), record_type=ubl_engine.LineItem)
+
+
+@pytest.mark.parametrize('path', [
+    'cbc:ID',
+    './/cbc:ID',
+    'cac:InvoiceLine/cac:Item/cbc:Name',
+    './/cac:Item/cbc:Name',
+    './/cac:AccountingSupplierParty//cbc:Name',
+    './/cac:InvoiceLine/cac:Item/cac:SellersItemIdentification/cbc:ID',
+    'cac:InvoiceLine[2]/cbc:ID',
+])
+@pytest.mark.parametrize('name', sorted(PARITY_DOCUMENTS))
+def test_compiled_path_matches_elementpath(path, name):
+    """Compiled lookups return the same element as ElementTree's find()."""
+    root = parse_document(PARITY_DOCUMENTS[name])
+    expected = root.find(ubl_engine.to_clark(path))
+    assert compile_path(path)(root) is expected
+
+
+def test_field_defaults_and_errors():
+    """Field options control missing, empty and unparseable values."""
+    root = parse_document(
+        b'<r xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+        b'<cbc:A> 1.5 </cbc:A><cbc:B>x</cbc:B><cbc:C/></r>'
+    )
+    extract = lambda **kw: ubl_engine.compile_field(Field('f', **kw))(root)
+
+    assert extract(paths=('cbc:A',), convert=float) == 1.5
+    assert extract(paths=('cbc:Z',)) is ubl_engine.MISSING
+    assert extract(paths=('cbc:Z', 'cbc:A')) == '1.5'
+    assert extract(paths=('cbc:C',), default='') == ''
+    assert extract(paths=('cbc:C',), keep_empty=True, default='') is None
+    assert extract(paths=('cbc:B',), convert=float, on_error=0.0) == 0.0
+    with pytest.raises(ValueError):
+        extract(paths=('cbc:B',), convert=float, on_error=ubl_engine.RAISE)
+
+
+def test_specs_are_compiled_at_import():
+    """Both consumer specs are prebuilt CompiledDocument instances."""
+    assert isinstance(ubl_engine.LINE_ITEMS_SPEC, ubl_engine.CompiledDocument)
+    assert isinstance(ubl_engine.PRODUCTS_SPEC, ubl_engine.CompiledDocument)
+
+
+lxml_only = pytest.mark.skipif('lxml' not in ubl_engine.available_backends(), reason='lxml not installed')
+
+BILLION_LAUGHS = b"""<?xml version="1.0"?>
+<!DOCTYPE lolz [
+  <!ENTITY lol "lol">
+  <!ENTITY lol2 "&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;&lol;">
+  <!ENTITY lol3 "&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;&lol2;">
+  <!ENTITY lol4 "&lol3;&lol3;&lol3;&lol3;&lol3;&lol3;&lol3;&lol3;&lol3;&lol3;">
+  <!ENTITY lol5 "&lol4;&lol4;&lol4;&lol4;&lol4;&lol4;&lol4;&lol4;&lol4;&lol4;">
+  <!ENTITY lol6 "&lol5;&lol5;&lol5;&lol5;&lol5;&lol5;&lol5;&lol5;&lol5;&lol5;">
+  <!ENTITY lol7 "&lol6;&lol6;&lol6;&lol6;&lol6;&lol6;&lol6;&lol6;&lol6;&lol6;">
+  <!ENTITY lol8 "&lol7;&lol7;&lol7;&lol7;&lol7;&lol7;&lol7;&lol7;&lol7;&lol7;">
+  <!ENTITY lol9 "&lol8;&lol8;&lol8;&lol8;&lol8;&lol8;&lol8;&lol8;&lol8;&lol8;">
+]>
+<Invoice xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">
+  <cbc:ID>&lol9;</cbc:ID>
+</Invoice>"""
+
+EXTERNAL_ENTITY = b"""<?xml version="1.0"?>
+<!DOCTYPE Invoice [<!ENTITY xxe SYSTEM "file:///etc/passwd">]>
+<Invoice xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">
+  <cbc:ID>&xxe;</cbc:ID>
+</Invoice>"""
+
+PARAMETER_ENTITY = b"""<?xml version="1.0"?>
+<!DOCTYPE Invoice [<!ENTITY % remote SYSTEM "http://127.0.0.1:9/evil.dtd"> %remote;]>
+<Invoice xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">
+  <cbc:ID>INV-1</cbc:ID>
+</Invoice>"""
+
+EXTERNAL_DTD = b"""<?xml version="1.0"?>
+<!DOCTYPE Invoice SYSTEM "http://127.0.0.1:9/invoice.dtd">
+<Invoice xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">
+  <cbc:ID>INV-1</cbc:ID>
+</Invoice>"""
+
+
+@lxml_only
+@pytest.mark.parametrize('name,xml', sorted(all_documents().items()))
+def test_lxml_backend_parity(name, xml):
+    """The lxml backend extracts the same data as the defusedxml backend."""
+    assert invoice_as_dict(parse_ubl_invoice(xml, backend='lxml')) == legacy_parse_ubl_invoice(xml)
+
+
+@pytest.mark.parametrize('backend', ubl_engine.available_backends())
+@pytest.mark.parametrize('payload', [BILLION_LAUGHS, EXTERNAL_ENTITY, PARAMETER_ENTITY])
+def test_entity_payloads_rejected(backend, payload):
+    """Entity declarations are refused by every backend, without expansion."""
+    with pytest.raises(ValueError):
+        parse_ubl_invoice(payload, backend=backend)
+
+
+@pytest.mark.parametrize('backend', ubl_engine.available_backends())
+def test_external_dtd_not_fetched(backend):
+    """An external DTD is never loaded: etree ignores it, lxml refuses the network load."""
+    if backend == 'lxml':
+        with pytest.raises(ValueError, match='network'):
+            parse_ubl_invoice(EXTERNAL_DTD, backend=backend)
+    else:
+        result = parse_ubl_invoice(EXTERNAL_DTD, backend=backend)
+        assert result['invoice_metadata'].invoice_number == 'INV-1'
+
+
+@lxml_only
+def test_lxml_depth_limit():
+    """libxml2's nesting limit stays in force (huge_tree is off)."""
+    deep = b'<a>' * 20000 + b'</a>' * 20000
+    with pytest.raises(ValueError):
+        parse_ubl_invoice(deep, backend='lxml')
+
+
+@lxml_only
+def test_lxml_accepts_str_with_encoding_declaration():
+    xml = '<?xml version="1.0" encoding="ISO-8859-2"?><Invoice xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"><cbc:ID>Ș-1</cbc:ID></Invoice>'
+    root = parse_document(xml, backend='lxml')
+    assert ubl_engine.get_document('line_items', 'lxml').metadata(root).as_dict() == {'invoice_number': 'Ș-1'}
+
+
+def test_unknown_backend_rejected():
+    with pytest.raises(ValueError):
+        ubl_engine.check_backend('sax')
@@ -0,0 +1,230 @@
+"""
+Request tracing for the parser service.
+
+Each request continues the caller's trace: the W3C ``traceparent`` header
+sent by the backend makes the ``POST /parse`` span a child of the
+backend's parser attempt, and the ``X-Request-ID`` header is echoed in the
+response and added to every log record (``[request id]``), so a slow
+upload in the backend logs can be matched with its parse here. Without the
+headers a new trace is started.
+
+Spans are exported per XML_PARSER_TRACE_EXPORTER in the backend's formats:
+``log`` writes one JSON record per span on the ``xml_parser.trace``
+logger, ``file`` appends one OTLP/JSON ``{"resourceSpans": [...]}`` line per
+request to XML_PARSER_TRACE_FILE. Unset, only the request id is logged.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+trace_logger = logging.getLogger('xml_parser.trace')
+
+SERVICE_NAME = 'xml-parser'
+
+# Span exporter: 'log', 'file' or empty (ids only)
+TRACE_EXPORTER = os.environ.get('XML_PARSER_TRACE_EXPORTER', '').lower()
+TRACE_FILE = os.environ.get('XML_PARSER_TRACE_FILE', 'parser-traces.jsonl')
+
+# OTLP span kinds
+INTERNAL, SERVER = 1, 2
+
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+_current = ContextVar('xml_parser_span', default=None)
+_request_id = ContextVar('xml_parser_request_id', default=None)
+_file_lock = threading.Lock()
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+class Span:
+    """A timed operation; a span without a local parent exports its trace when it ends."""
+
+    __slots__ = ('name', 'kind', 'trace_id', 'span_id', 'parent_id', 'attributes', 'start_ns', 'end_ns', 'error',
+                 'finished', 'local_root')
+
+    def __init__(self, name, kind, trace_id, parent_id, finished, attributes):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self.local_root = finished is None
+        # Spans of this trace finished so far, shared with the children
+        self.finished = [] if finished is None else finished
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        if not TRACE_EXPORTER:
+            return
+        self.finished.append(self)
+        if self.local_root:
+            export(self.finished)
+
+    def as_record(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start_ns / 1e9,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'error': self.error,
+            **self.attributes,
+        }
+
+    def as_otlp(self):
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def otlp_export(spans):
+    """An OTLP/JSON ExportTraceServiceRequest holding spans."""
+    return {'resourceSpans': [{
+        'resource': {'attributes': [_otlp_attribute('service.name', SERVICE_NAME)]},
+        'scopeSpans': [{'scope': {'name': 'xml_parser.tracing'}, 'spans': [span.as_otlp() for span in spans]}],
+    }]}
+
+
+def export(spans):
+    try:
+        if TRACE_EXPORTER == 'log':
+            if trace_logger.isEnabledFor(logging.INFO):
+                for span in spans:
+                    trace_logger.info('%s', json.dumps(span.as_record(), default=str))
+        elif TRACE_EXPORTER == 'file':
+            line = json.dumps(otlp_export(spans), default=str) + '\n'
+            with _file_lock, open(TRACE_FILE, 'a', encoding='utf-8') as f:
+                f.write(line)
+    except Exception:
+        # Tracing must never fail the parse it describes
+        logger.exception('Exporting %d spans failed', len(spans))
+
+
+def parse_traceparent(header):
+    """(trace id, parent span id) from a W3C traceparent header, or None."""
+    match = _TRACEPARENT.match((header or '').strip().lower())
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2)
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name, trace_id=None, parent_id=None, kind=INTERNAL, parent=None, **attributes):
+    """Start a span under parent, the current span or in a new trace; the caller ends it."""
+    parent = parent or _current.get()
+    if parent is not None and trace_id is None:
+        return Span(name, kind, parent.trace_id, parent.span_id, parent.finished, attributes)
+    return Span(name, kind, trace_id or _new_id(16), parent_id, None, attributes)
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """Run the block in a new span, current for its duration."""
+    current = start_span(name, parent=parent, **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the current request id (or '-') to log records as request_id."""
+
+    def filter(self, record):
+        record.request_id = _request_id.get() or '-'
+        return True
+
+
+def _start_request():
+    parent = parse_traceparent(request.headers.get('traceparent'))
+    root = start_span(
+        f"{request.method} {request.path}",
+        trace_id=parent[0] if parent else _new_id(16),
+        parent_id=parent[1] if parent else None,
+        kind=SERVER,
+        **{'http.method': request.method, 'http.target': request.path},
+    )
+    g.trace_span = root
+    g.request_id = request.headers.get('X-Request-ID', '')[:128] or root.trace_id
+    g.trace_tokens = (_current.set(root), _request_id.set(g.request_id))
+
+
+def _tag_response(response):
+    root = g.trace_span
+    response.headers['X-Request-ID'] = g.request_id
+    root.set(**{'http.status_code': response.status_code})
+    if response.is_streamed:
+        # The request span lasts until the streamed body has been sent
+        g.trace_span = None
+        response.call_on_close(root.end)
+    return response
+
+
+def _end_request(error=None):
+    tokens = g.pop('trace_tokens', None)
+    if tokens is None:
+        return
+    _current.reset(tokens[0])
+    _request_id.reset(tokens[1])
+    root = g.pop('trace_span', None)
+    if root is not None:
+        root.end(error)
+
+
+def init_app(app):
+    """Trace every request of a Flask app."""
+    app.before_request(_start_request)
+    app.after_request(_tag_response)
+    app.teardown_request(_end_request)
@@ -0,0 +1,564 @@
+"""
+Declarative UBL 2.1 extraction engine.
+
+Shared by the parser microservice (parser_app.parse_ubl_invoice) and the
+backend (app.parsers.invoice_xml.parse_invoice_products). Each consumer
+describes what it wants as a DocumentSpec: the header fields, where the
+invoice lines are, and the fields of each line. compile_document() turns a
+spec into precompiled lookups once, at import time, so parsing a document
+only walks the tree; the thin adapters in each service then shape the
+extracted records into their existing output formats.
+
+Both specs extract into slotted dataclasses (InvoiceMetadata, LineItem,
+Product) rather than dicts: on invoices with tens of thousands of lines
+the per-line dict was most of the parse's memory. A field that was not
+found is None, and Record.as_dict() leaves it out, which gives the
+dicts the parsers used to return.
+
+Two tree backends are supported: 'etree' (defusedxml over the standard
+library ElementTree, always available) and 'lxml' (optional, faster on large
+invoices). The lxml backend uses a hardened parser - no entity expansion,
+no network access, no DTD loading, libxml2's default size/depth limits -
+and rejects documents that declare entities, matching defusedxml. Its field
+lookups are compiled into lxml.etree.XPath objects.
+
+This module depends only on defusedxml (and optionally lxml) so the parser
+service can ship it as a single extra file.
+"""
+import logging
+import re
+import threading
+from dataclasses import dataclass, fields
+from typing import Any, Callable, Optional, Tuple
+
+import defusedxml.ElementTree as ET
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:  # the lxml backend is optional
+    lxml_etree = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = 'etree'
+
+# UBL 2.1 namespaces
+NAMESPACES = {
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+    'ubl': 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2'
+}
+
+# Sentinels for Field.default / Field.on_error
+MISSING = object()  # leave the key out of the record
+RAISE = object()    # let the conversion error propagate
+
+_PREFIXED = re.compile(r'([A-Za-z_][\w.-]*):([A-Za-z_][\w.-]*)')
+
+# Exceptions raised for malformed XML by any backend
+PARSE_ERRORS = (ET.ParseError,) + ((lxml_etree.XMLSyntaxError,) if lxml_etree is not None else ())
+
+
+class ForbiddenXMLError(ValueError):
+    """Raised when a document declares entities (billion laughs, XXE)."""
+
+
+def available_backends() -> Tuple[str, ...]:
+    """Return the tree backends usable in this process."""
+    return ('etree', 'lxml') if lxml_etree is not None else ('etree',)
+
+
+def check_backend(backend: Optional[str]) -> str:
+    """Validate a backend name, defaulting to DEFAULT_BACKEND."""
+    backend = (backend or DEFAULT_BACKEND).lower()
+    if backend not in ('etree', 'lxml'):
+        raise ValueError(f"Unknown XML backend: {backend}")
+    if backend not in available_backends():
+        raise ValueError("The lxml XML backend requires the 'lxml' package")
+    return backend
+
+
+@dataclass(frozen=True)
+class Field:
+    """
+    One value to extract relative to a context element.
+
+    Attributes:
+        name: Key in the output record
+        paths: ElementPath expressions using the cac/cbc/ubl prefixes; the
+            first path that matches an element is used
+        convert: Callable applied to the raw value (None keeps it as is)
+        attr: Read this attribute instead of the element text
+        strip: Strip surrounding whitespace before converting
+        default: Value when nothing usable was found (MISSING omits the key)
+        on_error: Value when convert fails (RAISE propagates the error)
+        keep_empty: Treat an empty/None value on a found element as a value
+            instead of falling back to default
+        when_text: Only use the element if it has text (applies to attr too)
+    """
+    name: str
+    paths: Tuple[str, ...]
+    convert: Optional[Callable[[str], Any]] = None
+    attr: Optional[str] = None
+    strip: bool = True
+    default: Any = MISSING
+    on_error: Any = MISSING
+    keep_empty: bool = False
+    when_text: bool = False
+
+
+@dataclass(frozen=True)
+class DocumentSpec:
+    """
+    Header fields, the path to the invoice lines and the per-line fields.
+
+    metadata_record and line_record are the Record classes the header and
+    each line are extracted into (None extracts plain dicts).
+    """
+    metadata: Tuple[Field, ...]
+    lines: str
+    line: Tuple[Field, ...]
+    metadata_record: Optional[type] = None
+    line_record: Optional[type] = None
+
+
+class Record:
+    """Base of the slotted records the specs extract into; None marks a field that was not found."""
+
+    __slots__ = ()
+
+    def as_dict(self) -> dict:
+        """The record as a dict, without the fields that were not found."""
+        result = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                result[name] = value
+        return result
+
+
+@dataclass(slots=True)
+class InvoiceMetadata(Record):
+    """Invoice header fields."""
+    invoice_number: Optional[str] = None
+    invoice_date: Optional[str] = None
+    supplier: Optional[str] = None
+    total_amount: Optional[float] = None
+
+
+@dataclass(slots=True)
+class LineItem(Record):
+    """One cac:InvoiceLine as read by the parser service (total_price is computed by it)."""
+    line_id: Optional[str] = None
+    quantity: Optional[float] = None
+    unit_code: Optional[str] = None
+    line_total: Optional[float] = None
+    unit_price: Optional[float] = None
+    description: Optional[str] = None
+    sku_raw: Optional[str] = None
+    tax_percent: Optional[float] = None
+    total_price: Optional[float] = None
+
+
+@dataclass(slots=True)
+class Product(Record):
+    """One cac:InvoiceLine as read by the backend's parse_invoice_products."""
+    name: Optional[str] = ''
+    sku: Optional[str] = ''
+    quantity: float = 0.0
+    unit: Optional[str] = 'buc'
+    unit_price: float = 0.0
+    total_price: float = 0.0
+    tax_percent: float = 0.0
+
+    def as_dict(self) -> dict:
+        # Every field is always set (an empty element gives None)
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def to_clark(path: str, namespaces: dict = NAMESPACES) -> str:
+    """Rewrite ``cac:Item/cbc:Name`` into Clark notation ``{uri}Item/{uri}Name``."""
+    return _PREFIXED.sub(lambda m: '{%s}%s' % (namespaces[m.group(1)], m.group(2)), path)
+
+
+def compile_path(path: str, namespaces: dict = NAMESPACES, backend: str = 'etree') -> Callable:
+    """
+    Compile an ElementPath expression into a ``find(elem)`` callable.
+
+    Paths made of plain tags joined by ``/`` and ``//`` are turned into
+    nested loops over the C-level ``findall()``/``iter()`` so no ElementPath
+    tokenizing happens per call; the first match is the same element
+    ``elem.find(path)`` would return. Anything fancier (predicates,
+    wildcards) falls back to ``elem.find`` with the precomputed Clark path.
+
+    For the lxml backend the path is compiled into an ``lxml.etree.XPath``
+    object instead (ElementPath's abbreviated syntax is valid XPath) and
+    the first node in document order is returned.
+    """
+    if backend == 'lxml':
+        xpath = lxml_etree.XPath(path, namespaces=namespaces)
+
+        def find_xpath(elem):
+            found = xpath(elem)
+            return found[0] if found else None
+        return find_xpath
+
+    clark = to_clark(path, namespaces)
+    steps = _parse_steps(clark)
+    if steps is None:
+        return lambda elem: elem.find(clark)
+    return _build_finder(steps)
+
+
+def compile_findall(path: str, namespaces: dict = NAMESPACES, backend: str = 'etree') -> Callable:
+    """Compile a path into a ``findall(elem)`` callable returning a list."""
+    if backend == 'lxml':
+        return lxml_etree.XPath(path, namespaces=namespaces)
+    clark = to_clark(path, namespaces)
+    steps = _parse_steps(clark)
+    if steps is not None and len(steps) == 1:
+        axis, tag = steps[0]
+        if axis == 'desc':
+            return lambda elem: [child for child in elem.iter(tag) if child is not elem]
+        return lambda elem: elem.findall(tag)
+    return lambda elem: elem.findall(clark)
+
+
+def _parse_steps(clark: str):
+    """
+    Split a Clark-notation path into (axis, tag) steps.
+
+    axis is 'child' or 'desc'; returns None for expressions that need the
+    full ElementPath engine.
+    """
+    if clark.startswith('.//'):
+        axis, rest = 'desc', clark[3:]
+    elif clark.startswith('./'):
+        axis, rest = 'child', clark[2:]
+    else:
+        axis, rest = 'child', clark
+
+    steps, tag, depth = [], [], 0
+    i = 0
+    while i < len(rest):
+        ch = rest[i]
+        if ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+        if ch == '/' and depth == 0:
+            steps.append((axis, ''.join(tag)))
+            tag = []
+            if rest.startswith('//', i):
+                axis = 'desc'
+                i += 1
+            else:
+                axis = 'child'
+        else:
+            tag.append(ch)
+        i += 1
+    steps.append((axis, ''.join(tag)))
+
+    for _, name in steps:
+        local = name.rsplit('}', 1)[-1]
+        if not re.fullmatch(r'[A-Za-z_][\w.-]*', local):
+            return None
+    return steps
+
+
+def _build_finder(steps):
+    axis, tag = steps[0]
+    rest = _build_finder(steps[1:]) if len(steps) > 1 else None
+
+    if axis == 'child':
+        if rest is None:
+            return lambda elem: elem.find(tag)
+
+        def find_child(elem):
+            for child in elem.findall(tag):
+                found = rest(child)
+                if found is not None:
+                    return found
+            return None
+        return find_child
+
+    def find_descendant(elem):
+        for child in elem.iter(tag):
+            if child is elem:
+                continue
+            if rest is None:
+                return child
+            found = rest(child)
+            if found is not None:
+                return found
+        return None
+    return find_descendant
+
+
+def compile_field(spec: Field, namespaces: dict = NAMESPACES, backend: str = 'etree') -> Callable:
+    """Compile a Field into an ``extract(elem)`` callable."""
+    finders = tuple(compile_path(p, namespaces, backend) for p in spec.paths)
+    name, convert, attr = spec.name, spec.convert, spec.attr
+    strip, default, on_error = spec.strip, spec.default, spec.on_error
+    keep_empty, when_text = spec.keep_empty, spec.when_text
+
+    def extract(elem):
+        found = None
+        for find in finders:
+            found = find(elem)
+            if found is not None:
+                break
+        if found is None:
+            return default
+        if when_text and not found.text:
+            return default
+
+        if attr is None:
+            raw = found.text
+        else:
+            raw = found.get(attr)
+            if raw is None:
+                return default
+        if not raw and not keep_empty:
+            return default
+        if strip and raw:
+            raw = raw.strip()
+        if convert is None:
+            return raw
+
+        try:
+            return convert(raw)
+        except (TypeError, ValueError):
+            if on_error is RAISE:
+                raise
+            logger.warning("Could not parse %s: %s", name, raw)
+            return on_error
+
+    return extract
+
+
+def compile_record(specs, namespaces: dict = NAMESPACES, backend: str = 'etree', record_type=None) -> Callable:
+    """
+    Compile a tuple of Fields into a ``record(elem)`` callable.
+
+    The callable returns a record_type instance, built positionally in the
+    order of its fields (those without a Field, and those not found, are
+    None), or a dict of the fields found when record_type is None.
+    """
+    compiled = tuple((f.name, compile_field(f, namespaces, backend)) for f in specs)
+
+    if record_type is not None:
+        by_name = dict(compiled)
+        unknown = set(by_name) - {f.name for f in fields(record_type)}
+        if unknown:
+            raise ValueError(f"{record_type.__name__} has no field {', '.join(sorted(unknown))}")
+        extractors = tuple(by_name.get(f.name) for f in fields(record_type))
+
+        def build(elem):
+            values = []
+            for extract in extractors:
+                value = None if extract is None else extract(elem)
+                values.append(None if value is MISSING else value)
+            return record_type(*values)
+
+        return build
+
+    def record(elem):
+        result = {}
+        for name, extract in compiled:
+            value = extract(elem)
+            if value is not MISSING:
+                result[name] = value
+        return result
+
+    return record
+
+
+class CompiledDocument:
+    """A DocumentSpec compiled into callables for one backend; build once and reuse."""
+
+    def __init__(self, spec: DocumentSpec, namespaces: dict = NAMESPACES, backend: str = 'etree'):
+        self.spec = spec
+        self.backend = backend
+        self.metadata = compile_record(spec.metadata, namespaces, backend, spec.metadata_record)
+        self.line = compile_record(spec.line, namespaces, backend, spec.line_record)
+        self.lines = compile_findall(spec.lines, namespaces, backend)
+        # Tag used to spot finished lines in incremental (iterparse) mode
+        self.line_tag = to_clark(spec.lines, namespaces).lstrip('./')
+
+    def parse(self, source):
+        """Parse source with this document's backend and return the root."""
+        return parse_document(source, self.backend)
+
+    def extract(self, root):
+        """Return (metadata record, list of line records) for a parsed document."""
+        line = self.line
+        return self.metadata(root), [line(elem) for elem in self.lines(root)]
+
+
+def compile_document(spec: DocumentSpec, namespaces: dict = NAMESPACES, backend: str = 'etree') -> CompiledDocument:
+    return CompiledDocument(spec, namespaces, check_backend(backend))
+
+
+_lxml_parsers = threading.local()
+
+
+def _hardened_lxml_parser(encoding: Optional[str] = None):
+    """
+    Return this thread's hardened lxml parser (parsers are not thread-safe).
+
+    No entity resolution, no network, no DTD loading or validation, and
+    huge_tree left off so libxml2's depth and text-size limits apply.
+    """
+    key = encoding or 'auto'
+    parser = getattr(_lxml_parsers, key, None)
+    if parser is None:
+        parser = lxml_etree.XMLParser(
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+            dtd_validation=False,
+            huge_tree=False,
+            remove_comments=True,
+            remove_pis=True,
+            collect_ids=False,
+            encoding=encoding,
+        )
+        setattr(_lxml_parsers, key, parser)
+    return parser
+
+
+def _parse_lxml(source):
+    if hasattr(source, 'read'):
+        root = lxml_etree.parse(source, _hardened_lxml_parser()).getroot()
+    elif isinstance(source, str):
+        # lxml refuses str input with an encoding declaration; the text is
+        # already decoded, so feed UTF-8 and override the declaration
+        root = lxml_etree.fromstring(source.encode('utf-8'), _hardened_lxml_parser('utf-8'))
+    else:
+        root = lxml_etree.fromstring(source, _hardened_lxml_parser())
+
+    dtd = root.getroottree().docinfo.internalDTD
+    if dtd is not None and any(True for _ in dtd.iterentities()):
+        raise ForbiddenXMLError("Entity declarations are forbidden")
+    return root
+
+
+def parse_document(source, backend: str = 'etree'):
+    """
+    Parse XML safely with the selected backend.
+
+    Accepts bytes/str content or a binary file-like object; returns the root.
+    """
+    if backend == 'lxml':
+        return _parse_lxml(source)
+    if hasattr(source, 'read'):
+        return ET.parse(source).getroot()
+    return ET.fromstring(source)
+
+
+class _LxmlIterparse:
+    """lxml iterparse with the hardened parser options and the entity check of parse_document."""
+
+    def __init__(self, source, events):
+        self._events = lxml_etree.iterparse(
+            source,
+            events=events,
+            resolve_entities=False,
+            no_network=True,
+            load_dtd=False,
+            dtd_validation=False,
+            huge_tree=False,
+            remove_comments=True,
+            remove_pis=True,
+        )
+        self.root = None
+
+    def __iter__(self):
+        yield from self._events
+        self.root = self._events.root
+        dtd = self.root.getroottree().docinfo.internalDTD
+        if dtd is not None and any(True for _ in dtd.iterentities()):
+            raise ForbiddenXMLError("Entity declarations are forbidden")
+
+
+def iterparse_document(source, backend: str = 'etree', events=('start', 'end')):
+    """
+    Incrementally parse a binary file-like object with the selected backend.
+
+    Returns an iterator of (event, element) pairs, hardened like
+    parse_document; its ``root`` is the document root once exhausted.
+    """
+    if backend == 'lxml':
+        return _LxmlIterparse(source, events)
+    return ET.iterparse(source, events=events)
+
+
+# Fields of parser_app.parse_ubl_invoice: descendant lookups, stripped text,
+# None (left out of as_dict()) when absent, unparseable numbers logged and skipped
+# (quantity falls back to 0.0).
+LINE_ITEMS = DocumentSpec(
+    metadata=(
+        Field('invoice_number', ('.//cbc:ID',)),
+        Field('invoice_date', ('.//cbc:IssueDate',)),
+        Field('supplier', ('.//cac:AccountingSupplierParty//cbc:Name',)),
+        Field('total_amount', (
+            './/cac:LegalMonetaryTotal/cbc:TaxInclusiveAmount',
+            './/cac:LegalMonetaryTotal/cbc:PayableAmount',
+        ), convert=float),
+    ),
+    lines='.//cac:InvoiceLine',
+    line=(
+        Field('line_id', ('cbc:ID',)),
+        Field('quantity', ('.//cbc:InvoicedQuantity',), convert=float, on_error=0.0),
+        Field('unit_code', ('.//cbc:InvoicedQuantity',), attr='unitCode', when_text=True),
+        Field('line_total', ('.//cbc:LineExtensionAmount',), convert=float),
+        Field('unit_price', ('.//cac:Price/cbc:PriceAmount',), convert=float),
+        Field('description', ('.//cac:Item/cbc:Name',)),
+        Field('sku_raw', ('.//cac:Item/cac:SellersItemIdentification/cbc:ID',)),
+        Field('tax_percent', ('.//cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory/cbc:Percent',), convert=float),
+    ),
+    metadata_record=InvoiceMetadata,
+    line_record=LineItem,
+)
+
+# Fields of app.parsers.invoice_xml.parse_invoice_products: direct child
+# paths, raw text, defaults for absent elements and conversion errors raised.
+PRODUCTS = DocumentSpec(
+    metadata=(
+        Field('invoice_number', ('cbc:ID',), strip=False, default='', keep_empty=True),
+        Field('invoice_date', ('cbc:IssueDate',), strip=False, default='', keep_empty=True),
+        Field('supplier', ('cac:AccountingSupplierParty/cac:Party/cac:PartyName/cbc:Name',),
+              strip=False, default='', keep_empty=True),
+    ),
+    lines='cac:InvoiceLine',
+    line=(
+        Field('name', ('cac:Item/cbc:Name',), strip=False, default='', keep_empty=True),
+        Field('sku', ('cac:Item/cac:SellersItemIdentification/cbc:ID',), strip=False, default='', keep_empty=True),
+        Field('quantity', ('cbc:InvoicedQuantity',), convert=float, default=0.0, on_error=RAISE, keep_empty=True),
+        Field('unit', ('cbc:InvoicedQuantity',), attr='unitCode', strip=False, default='buc', keep_empty=True),
+        Field('unit_price', ('cac:Price/cbc:PriceAmount',), convert=float, default=0.0, on_error=RAISE, keep_empty=True),
+        Field('total_price', ('cbc:LineExtensionAmount',), convert=float, default=0.0, on_error=RAISE, keep_empty=True),
+        Field('tax_percent', ('cac:Item/cac:ClassifiedTaxCategory/cbc:Percent',),
+              convert=float, default=0.0, on_error=RAISE, keep_empty=True),
+    ),
+    metadata_record=InvoiceMetadata,
+    line_record=Product,
+)
+
+# Every spec compiled for every available backend, once, at import
+COMPILED = {
+    backend: {
+        'line_items': compile_document(LINE_ITEMS, backend=backend),
+        'products': compile_document(PRODUCTS, backend=backend),
+    }
+    for backend in available_backends()
+}
+
+LINE_ITEMS_SPEC = COMPILED['etree']['line_items']
+PRODUCTS_SPEC = COMPILED['etree']['products']
+
+
+def get_document(name: str, backend: Optional[str] = None) -> CompiledDocument:
+    """Return the compiled 'line_items' or 'products' spec for a backend."""
+    return COMPILED[check_backend(backend)][name]
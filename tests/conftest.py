@@ -0,0 +1,119 @@
+"""
+Shared fixtures for the backend test suite.
+"""
+import os
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, create_engine, SQLModel
+from sqlmodel.pool import StaticPool
+from app.main import app
+from app.database import get_read_session, get_session, track_queries
+from app.caching import response_cache
+
+
+# Most SQL statements one request may run, per endpoint, with the data these
+# tests send. A change that adds queries to an endpoint (an N+1 loop over
+# items, say) fails the tests calling it; raise a budget deliberately, in
+# the change that needs it.
+STATEMENT_BUDGETS = {
+    "GET /api/v1": 0,
+    "GET /api/v1/startup": 0,
+    "GET /api/invoices/health": 0,
+    "GET /api/v1/events": 0,
+    "GET /api/v1/purchases/": 2,
+    "GET /api/v1/purchases/{purchase_id}": 3,
+    "GET /api/v1/purchases/export": 5,
+    "GET /api/v1/search": 4,
+    "GET /api/v1/analytics/spend/suppliers": 1,
+    "GET /api/v1/analytics/spend/materials": 1,
+    "GET /api/v1/analytics/prices/{material_id}": 1,
+    "POST /api/v1/purchases/": 43,
+    "POST /api/v1/purchases/import": 126,
+    "POST /api/v1/purchases/upload-xml": 40,
+    "POST /api/v1/purchases/duplicates/check": 3,
+    "POST /api/invoices/upload": 25,
+    "POST /api/invoices/confirm": 89,
+    "POST /api/v1/analytics/rebuild": 9,
+    "POST /api/v1/search/rebuild": 4,
+}
+
+
+class StatementBudget:
+    """
+    ASGI wrapper counting the SQL statements of each request, streamed
+    bodies included, and failing it (so the test) when the endpoint's
+    budget is exceeded or it has none.
+    """
+
+    def __init__(self, app, budgets):
+        self.app = app
+        self.budgets = budgets
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        with track_queries() as stats:
+            await self.app(scope, receive, send)
+        route = scope.get("route")
+        if route is None:
+            return
+        endpoint = f"{scope['method']} {route.path}"
+        budget = self.budgets.get(endpoint)
+        assert budget is not None, f"No SQL statement budget for {endpoint}, add one to STATEMENT_BUDGETS"
+        assert stats.statements <= budget, (
+            f"{endpoint} ran {stats.statements} SQL statements, over its budget of {budget}"
+        )
+
+
+@pytest.fixture
+def statement_budgets():
+    """The budgets enforced by ``make_client``; a test may tighten one for its own requests."""
+    return dict(STATEMENT_BUDGETS)
+
+
+@pytest.fixture
+def make_client(statement_budgets):
+    """Factory of test clients for the app that enforce the statement budgets."""
+    def make():
+        return TestClient(StatementBudget(app, statement_budgets))
+    return make
+
+
+# Create in-memory test database
+@pytest.fixture(name="session")
+def session_fixture():
+    """Create a fresh in-memory database for each test."""
+    engine = create_engine(
+        "sqlite:///:memory:",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+
+@pytest.fixture(name="client")
+def client_fixture(session: Session, make_client):
+    """Create test client with overridden database session."""
+    def get_session_override():
+        return session
+
+    app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_read_session] = get_session_override
+    response_cache.clear()
+    client = make_client()
+    yield client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def sample_xml():
+    """Load sample UBL invoice XML."""
+    xml_path = os.path.join(
+        os.path.dirname(os.path.dirname(__file__)), 
+        'services/xml_parser/tests/sample_invoice.xml'
+    )
+    with open(xml_path, 'rb') as f:
+        return f.read()
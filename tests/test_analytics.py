@@ -0,0 +1,129 @@
+"""
+Tests for the incrementally maintained spend aggregates.
+"""
+import pytest
+from sqlmodel import select
+
+from app import analytics, models
+
+
+@pytest.fixture
+def materials(session):
+    panel, cable = models.Material(sku="P450", name="Panou 450W"), models.Material(sku="C6", name="Cablu 6mm")
+    session.add_all([panel, cable])
+    session.commit()
+    return panel.id, cable.id
+
+
+@pytest.fixture
+def purchases(client, materials):
+    panel, cable = materials
+    for supplier, number, date, items in [
+        ("Alpha SRL", "A-1", "2024-01-10", [(panel, 10, 500.0), (cable, 100, 4.5)]),
+        ("Alpha SRL", "A-2", "2024-01-25", [(panel, 2, 520.0)]),
+        ("Beta SA", "B-1", "2024-02-03", [(cable, 50, 4.0), (None, 1, 99.0)]),
+    ]:
+        response = client.post("/api/v1/purchases/", json={
+            "supplier": supplier,
+            "invoice_number": number,
+            "invoice_date": date,
+            "items": [{"material_id": m, "quantity": q, "unit_price": p} for m, q, p in items],
+        })
+        assert response.status_code == 201
+
+
+def snapshot(client):
+    suppliers = client.get("/api/v1/analytics/spend/suppliers").json()
+    materials = client.get("/api/v1/analytics/spend/materials").json()
+    return suppliers, [{k: v for k, v in row.items() if k not in ("sku", "name")} for row in materials]
+
+
+def test_spend_maintained_on_create(client, materials, purchases):
+    """Test purchases created through the API update both aggregates."""
+    panel, cable = materials
+    suppliers = client.get("/api/v1/analytics/spend/suppliers").json()
+    assert suppliers == [
+        {"supplier": "Alpha SRL", "month": "2024-01", "purchases": 2, "total_amount": 6490.0},
+        {"supplier": "Beta SA", "month": "2024-02", "purchases": 1, "total_amount": 299.0},
+    ]
+
+    rows = client.get("/api/v1/analytics/spend/materials", params={"month_to": "2024-01"}).json()
+    assert [(r["material_id"], r["items"], r["quantity"], r["spend"], r["name"]) for r in rows] == [
+        (panel, 2, 12.0, 6040.0, "Panou 450W"),
+        (cable, 1, 100.0, 450.0, "Cablu 6mm"),
+    ]
+    rows = client.get("/api/v1/analytics/spend/materials", params={"material_id": cable}).json()
+    assert [(r["month"], r["spend"]) for r in rows] == [("2024-01", 450.0), ("2024-02", 200.0)]
+
+
+def test_spend_follows_updates_and_deletes(client, session, materials, purchases):
+    """Test moving a purchase to another month and deleting items adjusts the groups."""
+    panel, _ = materials
+    purchase = session.exec(select(models.Purchase).where(models.Purchase.invoice_number == "A-2")).one()
+    purchase.invoice_date = "2024-02-01"
+    session.add(purchase)
+    session.commit()
+
+    suppliers = client.get("/api/v1/analytics/spend/suppliers", params={"supplier": "Alpha SRL"}).json()
+    assert [(r["month"], r["purchases"]) for r in suppliers] == [("2024-01", 1), ("2024-02", 1)]
+    rows = client.get("/api/v1/analytics/spend/materials", params={"material_id": panel}).json()
+    assert [(r["month"], r["quantity"]) for r in rows] == [("2024-01", 10.0), ("2024-02", 2.0)]
+
+    for item in session.exec(select(models.PurchaseItem).where(models.PurchaseItem.purchase_id == purchase.id)):
+        session.delete(item)
+    session.commit()
+    rows = client.get("/api/v1/analytics/spend/materials", params={"material_id": panel}).json()
+    assert [r["month"] for r in rows] == ["2024-01"]
+
+
+def test_only_touched_groups_are_dropped(session, materials, purchases):
+    """Test a write only deletes the emptied groups it touched, not every empty row in the table."""
+    # An empty row left by a load that bypassed the listeners
+    session.add(models.SupplierMonthlySpend(supplier="Stale SRL", month="2023-12", purchases=0, total_amount=0))
+    session.commit()
+
+    purchase = session.exec(select(models.Purchase).where(models.Purchase.invoice_number == "B-1")).one()
+    for item in session.exec(select(models.PurchaseItem).where(models.PurchaseItem.purchase_id == purchase.id)):
+        session.delete(item)
+    session.delete(purchase)
+    session.commit()
+
+    rows = {(r.supplier, r.month): r.purchases for r in session.exec(select(models.SupplierMonthlySpend))}
+    assert rows == {("Alpha SRL", "2024-01"): 2, ("Stale SRL", "2023-12"): 0}
+
+
+def test_metadata_set_after_items_flushed(client, session, materials):
+    """Test a purchase whose supplier and date are filled in last (streamed ingest) lands in the right groups."""
+    panel, _ = materials
+    purchase = models.Purchase()
+    session.add(purchase)
+    session.flush()
+    session.add(models.PurchaseItem(purchase_id=purchase.id, material_id=panel, quantity=3, unit_price=10.0, total_price=30.0))
+    session.flush()
+    purchase.supplier, purchase.invoice_date, purchase.total_amount = "Gamma SRL", "2023-12-30", 35.7
+    session.add(purchase)
+    session.commit()
+
+    suppliers, materials_rows = snapshot(client)
+    assert suppliers == [{"supplier": "Gamma SRL", "month": "2023-12", "purchases": 1, "total_amount": 35.7}]
+    assert materials_rows == [{"material_id": panel, "month": "2023-12", "items": 1, "quantity": 3.0, "spend": 30.0}]
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_rebuild_matches_incremental(client, purchases, monkeypatch, use_numpy):
+    """Test the rebuild produces the same aggregates as incremental maintenance."""
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(analytics, "numpy", None)
+    expected = snapshot(client)
+
+    response = client.post("/api/v1/analytics/rebuild")
+    assert response.status_code == 200
+    assert response.json() == {"supplier_rows": 2, "material_rows": 3, "price_stats_rows": 2}
+    assert snapshot(client) == expected
+
+
+def test_invalid_month(client):
+    response = client.get("/api/v1/analytics/spend/suppliers", params={"month_from": "2024-1"})
+    assert response.status_code == 422
@@ -0,0 +1,139 @@
+"""
+Tests for the NDJSON bulk purchase import.
+"""
+import gzip
+import json
+import tracemalloc
+
+import pytest
+from sqlmodel import select
+
+from app import models
+from app.config import config
+
+
+def ndjson(*records) -> bytes:
+    return b"".join(
+        (record if isinstance(record, bytes) else json.dumps(record).encode("utf-8")) + b"\n"
+        for record in records
+    )
+
+
+def purchase(number, supplier="Alpha SRL", material_id=None, quantity=2, unit_price=10.0):
+    return {
+        "supplier": supplier,
+        "invoice_number": number,
+        "invoice_date": "2024-05-01",
+        "items": [{"material_id": material_id, "description": "Panou", "quantity": quantity, "unit_price": unit_price}],
+    }
+
+
+def run_import(client, body, **params):
+    response = client.post(
+        "/api/v1/purchases/import", params=params, content=body,
+        headers={"Content-Type": "application/x-ndjson"}
+    )
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return lines[:-1], lines[-1]["summary"]
+
+
+def test_bulk_import_chunks_and_results(client, session):
+    material = models.Material(name="Panou")
+    session.add(material)
+    session.commit()
+
+    records = [purchase(f"B-{i}", material_id=material.id) for i in range(25)]
+    results, summary = run_import(client, ndjson(*records), chunk_size=10)
+
+    assert summary == {"lines": 25, "created": 25}
+    assert [r["line"] for r in results] == list(range(1, 26))
+    ids = [r["id"] for r in results]
+    assert len(set(ids)) == 25
+    assert len(session.exec(select(models.PurchaseItem)).all()) == 25
+    assert len(session.exec(select(models.StockMovement)).all()) == 25
+    stored = session.get(models.Purchase, ids[0])
+    assert (stored.invoice_number, stored.total_amount) == ("B-0", 20.0)
+
+
+def test_bulk_import_reports_invalid_lines(client, session):
+    body = ndjson(
+        purchase("C-1"),
+        b"{not json",
+        {"supplier": "Alpha SRL", "items": []},
+        {"supplier": "Alpha SRL", "items": [{"quantity": "lots", "unit_price": 1}]},
+        b"",
+        purchase("C-2"),
+    )
+    results, summary = run_import(client, body)
+    by_line = {r["line"]: r for r in results}
+
+    assert summary == {"lines": 6, "created": 2, "error": 3}
+    assert by_line[1]["status"] == by_line[6]["status"] == "created"
+    assert by_line[3]["error"] == "items required"
+    assert "items.0.quantity" in by_line[4]["error"]
+    assert len(session.exec(select(models.Purchase)).all()) == 2
+
+
+def test_bulk_import_duplicates(client):
+    first, _ = run_import(client, ndjson(purchase("D-1")))
+    existing_id = first[0]["id"]
+
+    body = ndjson(purchase("D-1"), purchase("d 1", supplier="alpha s.r.l."), purchase("D-2"), purchase("D-2"))
+    results, summary = run_import(client, body)
+    assert [r["status"] for r in results] == ["duplicate", "duplicate", "created", "duplicate"]
+    assert results[0]["id"] == existing_id
+    assert results[3]["id"] == results[2]["id"]
+
+    results, _ = run_import(client, ndjson(purchase("D-1")), on_duplicate="return_existing")
+    assert results == [{"line": 1, "status": "existing", "id": existing_id}]
+
+    results, summary = run_import(client, ndjson(purchase("D-1"), purchase("D-1")), on_duplicate="force")
+    assert summary["created"] == 2
+
+
+def test_bulk_import_gzip_body(client):
+    response = client.post(
+        "/api/v1/purchases/import",
+        content=gzip.compress(ndjson(purchase("E-1"), purchase("E-2"))),
+        headers={"Content-Type": "application/x-ndjson", "Content-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert json.loads(response.text.splitlines()[-1])["summary"]["created"] == 2
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return pytest.importorskip("zstandard").compress(body)
+    return gzip.compress(body, compresslevel=1)
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_bulk_import_compressed_body_over_decompressed_limit(client, monkeypatch, encoding):
+    """Test a compressed import is held to MAX_IMPORT_SIZE, not the XML uploads' MAX_DECOMPRESSED_SIZE."""
+    padding = b" " * (1024 * 1024 - 1) + b"\n"
+    assert 51 * 1024 * 1024 > config.MAX_DECOMPRESSED_SIZE
+    response = client.post(
+        "/api/v1/purchases/import",
+        content=compress(ndjson(purchase("G-1")) + padding * 51, encoding),
+        headers={"Content-Type": "application/x-ndjson", "Content-Encoding": encoding}
+    )
+    assert response.status_code == 200
+    assert json.loads(response.text.splitlines()[-1])["summary"]["created"] == 1
+
+    # A bomb expanding to five times the import limit
+    monkeypatch.setattr("app.config.config.MAX_IMPORT_SIZE", 50 * 1024 * 1024)
+    bomb = compress(ndjson(purchase("G-2")) + padding * 250, encoding)
+    tracemalloc.start()
+    try:
+        response = client.post(
+            "/api/v1/purchases/import",
+            content=bomb,
+            headers={"Content-Type": "application/x-ndjson", "Content-Encoding": encoding}
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert response.status_code == 413
+    # Stopped at the limit rather than expanded whole
+    assert peak < 64 * 1024 * 1024
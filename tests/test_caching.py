@@ -0,0 +1,72 @@
+"""
+Tests for the response cache and ETag helpers.
+"""
+import pytest
+
+from app.caching import MATERIALS, ResponseCache, etag_matches, make_etag
+from app.config import config
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def cache(monkeypatch, clock):
+    monkeypatch.setattr(config, "RESPONSE_CACHE_SIZE", 2)
+    monkeypatch.setattr(config, "RESPONSE_CACHE_TTL", 10)
+    return ResponseCache(clock=clock)
+
+
+def test_lru_eviction(cache):
+    cache.put("a", '"1"', b"A")
+    cache.put("b", '"1"', b"B")
+    assert cache.get("a", '"1"') == b"A"  # a is now most recently used
+    cache.put("c", '"1"', b"C")
+    assert cache.get("b", '"1"') is None
+    assert cache.get("a", '"1"') == b"A"
+    assert len(cache) == 2
+
+
+def test_ttl_and_etag_mismatch(cache, clock):
+    cache.put("a", '"1"', b"A")
+    assert cache.get("a", '"2"') is None
+    cache.put("a", '"1"', b"A")
+    clock.now = 10
+    assert cache.get("a", '"1"') is None
+
+
+def test_materials_invalidate_details(cache, monkeypatch):
+    monkeypatch.setattr(config, "RESPONSE_CACHE_SIZE", 10)
+    cache.put("purchases", '"1"', b"L")
+    cache.put("purchase:1", '"1"', b"D")
+    cache.invalidate({MATERIALS})
+    assert cache.get("purchase:1", '"1"') is None
+    assert cache.get("purchases", '"1"') == b"L"
+
+
+def test_disabled(cache, monkeypatch):
+    monkeypatch.setattr(config, "RESPONSE_CACHE_SIZE", 0)
+    cache.put("a", '"1"', b"A")
+    assert cache.get("a", '"1"') is None
+
+
+@pytest.mark.parametrize("header,expected", [
+    (None, False),
+    ('"purchases-3"', True),
+    ('W/"purchases-3"', True),
+    ('"purchases-2", "purchases-3"', True),
+    ('"purchases-2"', False),
+    ("*", True),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, make_etag("purchases", 3)) is expected
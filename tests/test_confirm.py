@@ -0,0 +1,113 @@
+"""
+Tests for the bulk confirm of validated invoices.
+"""
+import pytest
+from sqlmodel import select
+
+from app import confirm, models
+
+
+def add_invoice(session, number, status="VALIDATED", supplier="Alpha SRL", items=((None, 2, 10.0),), total=None):
+    invoice = models.Invoice(supplier=supplier, invoice_number=number, invoice_date="2024-05-01",
+                             total_amount=total, status=status)
+    session.add(invoice)
+    session.flush()
+    for material_id, quantity, unit_price in items:
+        session.add(models.InvoiceItem(invoice_id=invoice.id, material_id=material_id, description=f"Line {number}",
+                                       quantity=quantity, unit_price=unit_price))
+    session.commit()
+    return invoice.id
+
+
+@pytest.fixture
+def material(session):
+    panel = models.Material(name="Panou 450W")
+    session.add(panel)
+    session.commit()
+    return panel.id
+
+
+def test_confirm_all_validated_invoices(client, session, material):
+    """Test every VALIDATED invoice becomes a purchase with items and stock, in chunks."""
+    ids = [add_invoice(session, f"V-{i}", items=[(material, 3, 100.0), (None, 1, 5.0)]) for i in range(7)]
+    pending = add_invoice(session, "P-1", status="PENDING")
+
+    response = client.post("/api/invoices/confirm", params={"chunk_size": 3})
+    assert response.status_code == 200
+    report = response.json()
+    assert (report["confirmed"], report["items"], report["stock_movements"], report["chunks"]) == (7, 14, 7, 3)
+    assert report["failed"] == [] and report["duplicates"] == []
+    assert report["invoices_per_second"] > 0
+
+    purchases = {int(k): v for k, v in report["purchases"].items()}
+    assert sorted(purchases) == ids
+    purchase = session.get(models.Purchase, purchases[ids[0]])
+    assert (purchase.invoice_number, purchase.total_amount) == ("V-0", 305.0)
+    items = session.exec(select(models.PurchaseItem).where(models.PurchaseItem.purchase_id == purchase.id)).all()
+    assert [(i.material_id, i.quantity, i.total_price) for i in items] == [(material, 3, 300.0), (None, 1, 5.0)]
+    movements = session.exec(select(models.StockMovement)).all()
+    assert {m.reference_id for m in movements} == set(purchases.values())
+
+    statuses = dict(session.exec(select(models.Invoice.id, models.Invoice.status)).all())
+    assert statuses == {**{i: "CONFIRMED" for i in ids}, pending: "PENDING"}
+
+    # Nothing left to confirm
+    assert client.post("/api/invoices/confirm").json()["confirmed"] == 0
+
+
+def test_confirm_selected_invoices(client, session):
+    first, second = add_invoice(session, "S-1"), add_invoice(session, "S-2")
+    pending = add_invoice(session, "S-3", status="PENDING")
+
+    report = client.post("/api/invoices/confirm", json={"invoice_ids": [second, pending, 999]}).json()
+    assert report["confirmed"] == 1
+    assert list(report["purchases"]) == [str(second)]
+    assert report["not_validated"] == [pending, 999]
+    assert session.get(models.Invoice, first).status == "VALIDATED"
+
+
+def test_confirm_duplicates_follow_policy(client, session):
+    """Test invoices already imported are left VALIDATED, linked or forced per policy."""
+    response = client.post("/api/v1/purchases/", json={
+        "supplier": "Alpha S.R.L.", "invoice_number": "D-1", "invoice_date": "2024-05-01",
+        "items": [{"quantity": 1, "unit_price": 1.0}],
+    })
+    existing = response.json()["id"]
+    duplicate = add_invoice(session, "D-1")
+    twins = [add_invoice(session, "D-2"), add_invoice(session, "d 2")]
+
+    report = client.post("/api/invoices/confirm").json()
+    assert report["duplicates"] == [{"invoice_id": duplicate, "purchase_id": existing},
+                                    {"invoice_id": twins[1], "purchase_id": report["purchases"][str(twins[0])]}]
+    assert report["confirmed"] == 1
+    assert session.get(models.Invoice, duplicate).status == "VALIDATED"
+
+    report = client.post("/api/invoices/confirm", params={"on_duplicate": "return_existing"}).json()
+    assert report["purchases"] == {}
+    assert {e["invoice_id"]: e["purchase_id"] for e in report["existing"]}[duplicate] == existing
+    assert session.get(models.Invoice, duplicate).status == "CONFIRMED"
+
+
+def test_invoice_without_items_is_reported(client, session):
+    empty = add_invoice(session, "E-1", items=())
+    report = client.post("/api/invoices/confirm").json()
+    assert report["failed"] == [{"invoice_id": empty, "error": "Invoice has no items"}]
+    assert session.get(models.Invoice, empty).status == "VALIDATED"
+
+
+def test_invoice_confirmed_concurrently_is_not_converted_twice(session, monkeypatch):
+    """Test an invoice claimed by another confirm between read and write is skipped."""
+    invoice_id = add_invoice(session, "C-1")
+    load_items = confirm._load_items
+
+    def confirm_elsewhere(session, invoice_ids):
+        items = load_items(session, invoice_ids)
+        session.connection().execute(
+            confirm.invoice_table.update().where(confirm.invoice_table.c.id == invoice_id).values(status="CONFIRMED")
+        )
+        return items
+
+    monkeypatch.setattr(confirm, "_load_items", confirm_elsewhere)
+    report = confirm.confirm_invoices(session)
+    assert report["confirmed"] == 0
+    assert session.exec(select(models.Purchase)).all() == []
@@ -0,0 +1,154 @@
+"""
+Tests for duplicate invoice detection and the duplicate policies.
+"""
+import asyncio
+
+import pytest
+from sqlmodel import select
+
+from app import duplicates, models
+
+
+def post_purchase(client, invoice_number="A-1", supplier="Alpha SRL", invoice_date="2024-01-10", **params):
+    return client.post("/api/v1/purchases/", params=params, json={
+        "supplier": supplier,
+        "invoice_number": invoice_number,
+        "invoice_date": invoice_date,
+        "items": [{"description": "Panou 450W", "quantity": 1, "unit_price": 500.0}],
+    })
+
+
+def test_invoice_key_normalisation():
+    assert duplicates.invoice_key("Alpha S.R.L.", "INV-2024/001", "2024-01-10") == \
+        duplicates.invoice_key("  alpha srl", "inv 2024 001", "2024-01-10T00:00:00")
+    assert duplicates.invoice_key("Șantier Construct", "1", None) == ("santierconstruct", "1", "")
+    assert duplicates.invoice_key(None, "1", "2024-01-10") is None
+    assert duplicates.invoice_key("Alpha", " - ", "2024-01-10") is None
+
+
+def test_create_purchase_duplicate_policies(client, session):
+    first = post_purchase(client)
+    assert first.status_code == 201
+
+    rejected = post_purchase(client, "a 1", supplier="ALPHA S.R.L.")
+    assert rejected.status_code == 409
+    assert str(first.json()["id"]) in rejected.json()["detail"]
+
+    existing = post_purchase(client, on_duplicate="return_existing")
+    assert existing.status_code == 200
+    assert existing.json()["id"] == first.json()["id"]
+    assert existing.json()["duplicate"] is True
+
+    forced = post_purchase(client, on_duplicate="force")
+    assert forced.status_code == 201
+    assert len(session.exec(select(models.Purchase)).all()) == 2
+
+    # Another date is another invoice
+    assert post_purchase(client, invoice_date="2024-02-10").status_code == 201
+    assert post_purchase(client, on_duplicate="ignore").status_code == 422
+
+
+def test_default_policy_from_config(client, monkeypatch):
+    monkeypatch.setattr("app.config.config.DUPLICATE_POLICY", "return_existing")
+    first = post_purchase(client).json()["id"]
+    response = post_purchase(client)
+    assert (response.status_code, response.json()["id"]) == (200, first)
+
+
+def test_upload_xml_duplicate_rejected(client, session, sample_xml):
+    files = {"file": ("invoice.xml", sample_xml, "application/xml")}
+    first = client.post("/api/v1/purchases/upload-xml", files=files)
+    assert first.status_code == 201
+
+    assert client.post("/api/v1/purchases/upload-xml", files=files).status_code == 409
+    existing = client.post("/api/v1/purchases/upload-xml", params={"on_duplicate": "return_existing"}, files=files)
+    assert existing.status_code == 200
+    assert existing.json()["purchase_id"] == first.json()["purchase_id"]
+    assert len(session.exec(select(models.PurchaseItem)).all()) == 2
+
+
+def commit_between_check_and_commit(monkeypatch, session, **invoice):
+    """Commit a purchase for the same invoice right after the endpoint's duplicate check passed."""
+    real_check = duplicates.check_duplicate
+    competitor = models.Purchase(**invoice)
+
+    def check_then_race(session_, purchase, policy):
+        real_check(session_, purchase, policy)
+        session.add(competitor)
+        session.commit()
+
+    monkeypatch.setattr(duplicates, "check_duplicate", check_then_race)
+    return competitor
+
+
+def test_concurrent_create_purchase_gets_409(client, session, monkeypatch):
+    competitor = commit_between_check_and_commit(
+        monkeypatch, session, supplier="Alpha SRL", invoice_number="A-1", invoice_date="2024-01-10"
+    )
+    response = post_purchase(client)
+    assert response.status_code == 409
+    assert response.json() == {"detail": f"Invoice already imported as purchase {competitor.id}"}
+    assert [p.id for p in session.exec(select(models.Purchase)).all()] == [competitor.id]
+    assert session.exec(select(models.PurchaseItem)).all() == []
+
+    existing = post_purchase(client, "A-1", on_duplicate="return_existing")
+    assert (existing.status_code, existing.json()["id"]) == (200, competitor.id)
+
+
+def test_concurrent_upload_xml_gets_409(client, session, sample_xml, monkeypatch):
+    competitor = commit_between_check_and_commit(
+        monkeypatch, session, supplier="Test Supplier Ltd", invoice_number="INV-2024-001", invoice_date="2024-01-15"
+    )
+    response = client.post("/api/v1/purchases/upload-xml", files={"file": ("invoice.xml", sample_xml, "application/xml")})
+    assert response.status_code == 409
+    assert response.json() == {"detail": f"Invoice already imported as purchase {competitor.id}"}
+    assert len(session.exec(select(models.Purchase)).all()) == 1
+
+
+def test_concurrent_streamed_invoice_is_a_duplicate(session, monkeypatch):
+    from app.api.invoices import create_purchase_from_parser_stream
+
+    metadata = {"supplier": "Alpha SRL", "invoice_number": "A-1", "invoice_date": "2024-01-10", "total_amount": 5.0}
+    competitor = models.Purchase(**{k: v for k, v in metadata.items() if k != "total_amount"})
+    session.add(competitor)
+    session.commit()
+    # The streamed purchase is already flushed when its metadata arrives, so
+    # the race is simulated by a check that ran before the competitor committed
+    monkeypatch.setattr(duplicates, "check_duplicate", lambda session, purchase, policy: None)
+
+    async def parser_events():
+        yield "line_item", {"description": "Cablu", "quantity": 1.0, "unit_price": 5.0, "total_price": 5.0}
+        yield "invoice_metadata", metadata
+
+    with pytest.raises(duplicates.DuplicatePurchase) as raised:
+        asyncio.run(create_purchase_from_parser_stream(parser_events(), session))
+    assert raised.value.purchase_id == competitor.id
+    assert [p.id for p in session.exec(select(models.Purchase)).all()] == [competitor.id]
+
+
+def test_bulk_duplicate_check(client):
+    ids = [post_purchase(client, f"A-{i}").json()["id"] for i in range(3)]
+    response = client.post("/api/v1/purchases/duplicates/check", json={"invoices": [
+        {"supplier": "alpha srl", "invoice_number": "a-0", "invoice_date": "2024-01-10"},
+        {"supplier": "Alpha SRL", "invoice_number": "A-9", "invoice_date": "2024-01-10"},
+        {"supplier": None, "invoice_number": "A-1"},
+        {"supplier": "Alpha SRL", "invoice_number": "A-2", "invoice_date": "2024-01-10"},
+    ] + [{"supplier": "Beta", "invoice_number": str(i)} for i in range(1200)]})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["duplicates"][:4] == [ids[0], None, None, ids[2]]
+    assert data["duplicate_count"] == 2
+
+
+def test_rebuild_keys_for_existing_history(session):
+    # History imported before keys existed, through Core so no keys are written
+    session.execute(models.Purchase.__table__.insert(), [
+        {"supplier": "Gamma", "invoice_number": number, "invoice_date": "2024-03-01"}
+        for number in ("X-1", "x 1", "X-2")
+    ])
+    session.commit()
+    assert duplicates.find_duplicate(session, "Gamma", "X-1", "2024-03-01") is None
+
+    assert duplicates.rebuild_purchase_keys(session) == {"purchase_keys": 2, "duplicates": 1}
+    first = session.exec(select(models.Purchase).where(models.Purchase.invoice_number == "X-1")).one()
+    assert duplicates.find_duplicate(session, "GAMMA", "x1", "2024-03-01") == first.id
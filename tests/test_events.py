@@ -0,0 +1,235 @@
+"""
+Tests for the purchase and stock event feed (app.events, GET /api/v1/events).
+"""
+import asyncio
+import json
+import threading
+
+import pytest
+
+from app import models
+from app.events import EventHub, event_hub, event_stream
+from app.main import app
+
+
+@pytest.fixture(autouse=True)
+def hub():
+    event_hub.clear()
+    yield event_hub
+    event_hub.clear()
+
+
+def parse(message: bytes) -> dict:
+    fields = dict(line.split(": ", 1) for line in message.decode().splitlines() if line)
+    fields["data"] = json.loads(fields["data"])
+    return fields
+
+
+def published(hub, since):
+    return [(e.type, e.data) for e in hub.since(since)[0]]
+
+
+async def take(stream, count, timeout=2.0):
+    return [await asyncio.wait_for(stream.__anext__(), timeout) for _ in range(count)]
+
+
+def test_create_purchase_publishes_after_commit(client, session, hub):
+    material = models.Material(name="Cablu")
+    session.add(material)
+    session.commit()
+    start = hub.last_seq
+
+    response = client.post("/api/v1/purchases/", json={
+        "supplier": "ACME", "invoice_number": "F-1", "invoice_date": "2024-03-01",
+        "items": [{"material_id": material.id, "quantity": 2, "unit_price": 5},
+                  {"material_id": material.id, "quantity": 3, "unit_price": 5},
+                  {"description": "Transport", "quantity": 1, "unit_price": 10}],
+    })
+    assert response.status_code == 201
+
+    events = published(hub, start)
+    assert events[0] == ("purchase.created", {
+        "id": response.json()["id"], "supplier": "ACME", "invoice_number": "F-1",
+        "invoice_date": "2024-03-01", "total_amount": 35.0, "created_at": response.json()["created_at"],
+    })
+    # create_purchase commits each movement on its own
+    assert events[1:] == [("stock.movement", {"material_id": material.id, "change": 2.0, "movements": 1}),
+                          ("stock.movement", {"material_id": material.id, "change": 3.0, "movements": 1})]
+
+
+def test_one_event_per_material_and_transaction(client, session, hub):
+    materials = [models.Material(name="Cablu"), models.Material(name="Clema")]
+    session.add_all(materials)
+    session.commit()
+    ids = [m.id for m in materials]
+    start = hub.last_seq
+
+    lines = [json.dumps({"supplier": "ACME", "invoice_number": f"F-{i}", "items": [
+        {"material_id": ids[0], "quantity": 1, "unit_price": 1},
+        {"material_id": ids[1], "quantity": 4, "unit_price": 1},
+    ]}) for i in range(3)]
+    response = client.post("/api/v1/purchases/import", content="\n".join(lines))
+    assert response.status_code == 200
+
+    events = published(hub, start)
+    assert [data["invoice_number"] for kind, data in events if kind == "purchase.created"] == ["F-0", "F-1", "F-2"]
+    assert [data for kind, data in events if kind == "stock.movement"] == [
+        {"material_id": ids[0], "change": 3.0, "movements": 3},
+        {"material_id": ids[1], "change": 12.0, "movements": 3},
+    ]
+
+
+def test_streamed_invoice_event_has_its_metadata(session, hub):
+    from app.api.invoices import create_purchase_from_parser_stream
+
+    async def parser_events():
+        # The parser sends the invoice metadata after the lines
+        yield "line_item", {"description": "Cablu", "quantity": 2.0, "unit_price": 5.0, "total_price": 10.0}
+        yield "invoice_metadata", {"supplier": "ACME", "invoice_number": "INV-2024-001",
+                                   "invoice_date": "2024-01-15", "total_amount": 10.0}
+
+    start = hub.last_seq
+    asyncio.run(create_purchase_from_parser_stream(parser_events(), session))
+    [(kind, data)] = published(hub, start)
+    assert kind == "purchase.created"
+    assert (data["supplier"], data["invoice_number"], data["total_amount"]) == ("ACME", "INV-2024-001", 10.0)
+
+
+def test_rollback_publishes_nothing(session, hub):
+    start = hub.last_seq
+    session.add(models.Purchase(supplier="ACME"))
+    session.flush()
+    session.rollback()
+    session.add(models.Purchase(supplier="Other"))
+    session.commit()
+    assert [data["supplier"] for _, data in published(hub, start)] == ["Other"]
+
+
+def test_ring_buffer_is_bounded(monkeypatch):
+    monkeypatch.setattr("app.config.config.EVENTS_BUFFER_SIZE", 3)
+    hub = EventHub()
+    hub.publish(("tick", {"n": n}) for n in range(1, 6))
+
+    assert len(hub) == 3
+    events, last, complete = hub.since(3)
+    assert ([e.data["n"] for e in events], last, complete) == ([4, 5], 5, True)
+    # Event 2 was overwritten: the caller can't be brought up to date
+    assert hub.since(1) == ([], 5, False)
+    assert hub.since(5) == ([], 5, True)
+    assert hub.since(9)[2] is False
+
+
+def test_stream_resumes_from_last_event_id(monkeypatch):
+    hub = EventHub()
+    hub.publish(("tick", {"n": n}) for n in range(1, 4))
+
+    async def run():
+        stream = event_stream(f"{hub.stream_id}-1", hub=hub, heartbeat=5)
+        retry, *events = await take(stream, 3)
+        await stream.aclose()
+        return retry, events
+
+    retry, events = asyncio.run(run())
+    assert retry == b"retry: 3000\n\n"
+    assert [parse(m)["id"] for m in events] == [f"{hub.stream_id}-2", f"{hub.stream_id}-3"]
+    assert [parse(m)["data"] for m in events] == [{"n": 2}, {"n": 3}]
+
+
+def test_stream_resets_unknown_or_lost_positions(monkeypatch):
+    monkeypatch.setattr("app.config.config.EVENTS_BUFFER_SIZE", 2)
+    hub = EventHub()
+    hub.publish(("tick", {"n": n}) for n in range(1, 6))
+
+    async def first_event(last_event_id):
+        stream = event_stream(last_event_id, hub=hub, heartbeat=5)
+        _, message = await take(stream, 2)
+        await stream.aclose()
+        return parse(message)
+
+    for last_event_id in ("0123abcd-4", f"{hub.stream_id}-1"):
+        reset = asyncio.run(first_event(last_event_id))
+        assert reset["event"] == "reset"
+        assert reset["id"] == reset["data"]["last_event_id"] == f"{hub.stream_id}-5"
+
+
+def test_stream_wakes_on_publish_from_another_thread():
+    hub = EventHub()
+
+    async def run():
+        stream = event_stream(None, hub=hub, heartbeat=0.05)
+        await take(stream, 1)
+        # Idle: a keep-alive comment
+        assert await take(stream, 1) == [b": keepalive\n\n"]
+        writer = threading.Thread(target=hub.publish, args=([("tick", {"n": 1})],))
+        writer.start()
+        writer.join()
+        messages = await take(stream, 2)
+        await stream.aclose()
+        return [m for m in messages if not m.startswith(b":")]
+
+    [message] = asyncio.run(run())
+    assert parse(message)["data"] == {"n": 1}
+
+
+def test_slow_stream_does_not_hold_up_writers(monkeypatch):
+    monkeypatch.setattr("app.config.config.EVENTS_BUFFER_SIZE", 100)
+    hub = EventHub()
+
+    async def run():
+        # A subscriber that never reads
+        stream = event_stream(None, hub=hub, heartbeat=5)
+        await take(stream, 1)
+        hub.publish(("tick", {"n": n}) for n in range(1, 10001))
+        assert len(hub) == 100
+        # It skips what it missed, then carries on with new events
+        [reset] = await take(stream, 1)
+        hub.publish([("tick", {"n": 10001})])
+        [message] = await take(stream, 1)
+        await stream.aclose()
+        return reset, message
+
+    reset, message = asyncio.run(run())
+    assert parse(reset)["event"] == "reset"
+    assert parse(message)["data"] == {"n": 10001}
+
+
+def test_events_endpoint(hub):
+    hub.publish([("purchase.created", {"id": 1}), ("purchase.created", {"id": 2})])
+    start = {"type": None}
+    body = []
+
+    async def run():
+        disconnect = asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message.get("body"):
+                body.append(message["body"])
+                if len(body) == 2:
+                    disconnect.set()
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/api/v1/events", "raw_path": b"/api/v1/events", "root_path": "",
+            "query_string": b"", "server": ("testserver", 80), "client": ("testclient", 50000),
+            "headers": [(b"host", b"testserver"), (b"last-event-id", f"{hub.stream_id}-{hub.last_seq - 1}".encode())],
+        }
+        await asyncio.wait_for(app(scope, receive, send), 5)
+
+    asyncio.run(run())
+    assert start["status"] == 200
+    headers = dict(start["headers"])
+    assert headers[b"content-type"].startswith(b"text/event-stream")
+    assert headers[b"cache-control"] == b"no-cache"
+    assert body[0].startswith(b"retry:")
+    assert parse(body[1])["data"] == {"id": 2}
+
+
+def test_events_endpoint_disabled(client, monkeypatch):
+    monkeypatch.setattr("app.config.config.EVENTS_BUFFER_SIZE", 0)
+    assert client.get("/api/v1/events").status_code == 404
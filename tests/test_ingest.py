@@ -0,0 +1,145 @@
+"""
+Tests for the e-Factura backfill CLI (app.ingest).
+"""
+import json
+import os
+import zipfile
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from app import ingest, models
+from app.ingest import Checkpoint, Ingest
+
+
+def invoice(sample_xml: bytes, number: str) -> bytes:
+    return sample_xml.replace(b"INV-2024-001", number.encode())
+
+
+@pytest.fixture
+def archive(tmp_path, sample_xml):
+    """Two loose invoices, one in a subfolder, and an ANAF ZIP (invoice + signature)."""
+    root = tmp_path / "efactura"
+    (root / "2024").mkdir(parents=True)
+    (root / "a.xml").write_bytes(invoice(sample_xml, "A-1"))
+    (root / "2024" / "b.xml").write_bytes(invoice(sample_xml, "B-1"))
+    (root / "notes.txt").write_text("not an invoice")
+    with zipfile.ZipFile(root / "2024" / "4100.zip", "w") as z:
+        z.writestr("4100.xml", invoice(sample_xml, "Z-1"))
+        z.writestr("semnatura_4100.xml", "<Signature/>")
+    return root
+
+
+def run(session, paths, checkpoint, **kwargs):
+    with Ingest(session, Checkpoint(str(checkpoint)), **kwargs) as backfill:
+        return backfill.run([str(p) for p in paths])
+
+
+def test_ingest_directories_and_zips(session, archive, tmp_path):
+    report = run(session, [archive], tmp_path / "checkpoint.jsonl", chunk_size=2)
+
+    assert (report["files"], report["documents"], report["imported"], report["items"]) == (3, 3, 3, 6)
+    assert report["failed"] == []
+    purchases = session.exec(select(models.Purchase).order_by(models.Purchase.invoice_number)).all()
+    assert [p.invoice_number for p in purchases] == ["A-1", "B-1", "Z-1"]
+    # One material per SKU, shared by the three invoices, with stock movements
+    materials = session.exec(select(models.Material)).all()
+    assert sorted(m.sku for m in materials) == ["SKU-001", "SKU-002"]
+    assert len(session.exec(select(models.StockMovement)).all()) == 6
+    sources = session.exec(select(models.ImportedDocument.source)).all()
+    assert any(source.endswith("4100.zip!4100.xml") for source in sources)
+
+    lines = [json.loads(line) for line in (tmp_path / "checkpoint.jsonl").read_text().splitlines()]
+    assert sorted(os.path.basename(line["path"]) for line in lines) == ["4100.zip", "a.xml", "b.xml"]
+
+
+def test_finished_files_and_known_content_are_skipped(session, archive, tmp_path, sample_xml):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    run(session, [archive], checkpoint)
+
+    # Same checkpoint: nothing is even read
+    again = run(session, [archive], checkpoint)
+    assert (again["files"], again["documents"], again["imported"]) == (0, 0, 0)
+
+    # A copy under another name (and a fresh checkpoint) is skipped by its hash
+    (archive / "copy-of-a.xml").write_bytes(invoice(sample_xml, "A-1"))
+    fresh = run(session, [archive], tmp_path / "other.jsonl")
+    assert (fresh["documents"], fresh["already_imported"], fresh["imported"]) == (4, 4, 0)
+    assert len(session.exec(select(models.Purchase)).all()) == 3
+
+
+def test_same_invoice_with_other_content_follows_duplicate_policy(session, archive, tmp_path, sample_xml):
+    run(session, [archive], tmp_path / "checkpoint.jsonl")
+    (archive / "a-reissued.xml").write_bytes(invoice(sample_xml, "A-1").replace(b"Widget A", b"Widget A "))
+
+    report = run(session, [archive], tmp_path / "checkpoint.jsonl", on_duplicate="reject")
+    assert (report["documents"], report["duplicates"], report["imported"]) == (1, 1, 0)
+
+    forced = run(session, [archive / "a-reissued.xml"], tmp_path / "forced.jsonl", on_duplicate="force")
+    # The content is now known, whatever the policy
+    assert (forced["already_imported"], forced["imported"]) == (1, 0)
+
+
+def test_interrupted_run_resumes(session, archive, tmp_path, monkeypatch):
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    calls = []
+    real_add_purchases = ingest.add_purchases
+
+    def fail_second_chunk(session, entries):
+        calls.append(len(entries))
+        if len(calls) == 2:
+            raise RuntimeError("disk full")
+        real_add_purchases(session, entries)
+
+    monkeypatch.setattr(ingest, "add_purchases", fail_second_chunk)
+    report = run(session, [archive], checkpoint, chunk_size=1)
+    assert report["imported"] == 2
+    assert [f["error"] for f in report["failed"]] == ["Chunk not imported: disk full"]
+    assert len(checkpoint.read_text().splitlines()) == 2
+
+    monkeypatch.setattr(ingest, "add_purchases", real_add_purchases)
+    resumed = run(session, [archive], checkpoint, chunk_size=1)
+    assert (resumed["files"], resumed["imported"], resumed["failed"]) == (1, 1, [])
+    assert len(session.exec(select(models.Purchase)).all()) == 3
+
+
+def test_invalid_documents_are_reported(session, tmp_path, sample_xml):
+    drop = tmp_path / "drop"
+    drop.mkdir()
+    (drop / "broken.xml").write_bytes(b"<Invoice><unclosed>")
+    (drop / "empty.xml").write_bytes(b"<Invoice/>")
+    (drop / "bad.zip").write_bytes(b"PK not really")
+    (drop / "ok.xml").write_bytes(sample_xml)
+
+    report = run(session, [drop], tmp_path / "checkpoint.jsonl")
+    assert (report["imported"], report["empty"]) == (1, 1)
+    assert sorted(os.path.basename(f["source"]) for f in report["failed"]) == ["bad.zip", "broken.xml"]
+    # Failed files are retried by the next run
+    assert sorted(os.path.basename(json.loads(line)["path"])
+                  for line in (tmp_path / "checkpoint.jsonl").read_text().splitlines()) == ["empty.xml", "ok.xml"]
+
+
+def test_watch_pass_waits_for_files_to_settle(session, tmp_path, sample_xml):
+    drop = tmp_path / "drop"
+    drop.mkdir()
+    (drop / "new.xml").write_bytes(sample_xml)
+    with Ingest(session, Checkpoint(str(tmp_path / "checkpoint.jsonl"))) as backfill:
+        assert backfill.run([str(drop)], settle=60)["files"] == 0
+        assert backfill.run([str(drop)], settle=0)["imported"] == 1
+
+
+def test_parse_in_process_pool(session, archive, tmp_path):
+    report = run(session, [archive], tmp_path / "checkpoint.jsonl", workers=2)
+    assert (report["imported"], report["items"], report["failed"]) == (3, 6, [])
+
+
+def test_cli(archive, tmp_path, monkeypatch, capsys):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite3'}")
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr("app.database.engine", engine)
+
+    code = ingest.main([str(archive), "--workers", "1", "--checkpoint", str(tmp_path / "checkpoint.jsonl")])
+    assert code == 0
+    assert json.loads(capsys.readouterr().out)["imported"] == 3
+    with Session(engine) as session:
+        assert len(session.exec(select(models.Purchase)).all()) == 3
@@ -0,0 +1,54 @@
+"""
+Tests for the in-process UBL parser used by /api/v1/purchases/upload-xml.
+"""
+import pytest
+from unittest.mock import patch
+from app.parsers.invoice_xml import parse_invoice_products
+from services.xml_parser.tests.legacy_parsers import (
+    INVALID_NUMBER_DOCUMENTS,
+    PARITY_DOCUMENTS,
+    legacy_parse_invoice_products,
+)
+from services.xml_parser.ubl_engine import available_backends
+
+
+def as_dicts(result):
+    return {**result, 'products': [p.as_dict() for p in result['products']]}
+
+
+@pytest.mark.parametrize('backend', available_backends())
+@pytest.mark.parametrize('name,xml', sorted(PARITY_DOCUMENTS.items()))
+def test_parse_invoice_products_parity(name, xml, backend):
+    """parse_invoice_products must match the pre-engine implementation exactly."""
+    assert as_dicts(parse_invoice_products(xml, backend)) == legacy_parse_invoice_products(xml)
+    assert as_dicts(parse_invoice_products(xml.decode('utf-8'), backend)) == legacy_parse_invoice_products(xml.decode('utf-8'))
+
+
+@pytest.mark.parametrize('backend', available_backends())
+@pytest.mark.parametrize('name,xml', sorted(INVALID_NUMBER_DOCUMENTS.items()))
+def test_parse_invoice_products_rejects_bad_numbers(name, xml, backend):
+    """Unparseable numbers still raise, as before."""
+    with pytest.raises((TypeError, ValueError)):
+        legacy_parse_invoice_products(xml)
+    with pytest.raises((TypeError, ValueError)):
+        parse_invoice_products(xml, backend)
+
+
+def test_upload_xml_with_lxml_backend(client, sample_xml):
+    """The configured backend is used by /api/v1/purchases/upload-xml."""
+    pytest.importorskip('lxml')
+    with patch('app.config.config.XML_BACKEND', 'lxml'):
+        response = client.post(
+            "/api/v1/purchases/upload-xml",
+            files={"file": ("invoice.xml", sample_xml, "application/xml")}
+        )
+    assert response.status_code == 201
+    assert response.json()['items_created'] == 2
+
+
+def test_parse_invoice_products_sample(sample_xml):
+    result = parse_invoice_products(sample_xml)
+    assert result['invoice_number'] == 'INV-2024-001'
+    assert result['supplier'] == 'Test Supplier Ltd'
+    assert [p.sku for p in result['products']] == ['SKU-001', 'SKU-002']
+    assert result['total_amount'] == 1100.0
@@ -2,51 +2,18 @@
 Integration tests for invoice upload and XML parsing.
 """
 import pytest
-from fastapi.testclient import TestClient
-from sqlmodel import Session, create_engine, SQLModel
-from sqlmodel.pool import StaticPool
-import os
-from unittest.mock import patch, AsyncMock
-from app.main import app
+import asyncio
+import gzip
+import hashlib
+import inspect
+import json
+import threading
+import tracemalloc
+import httpx
+from unittest.mock import patch
 from app import models
-from app.database import get_session
-
-
-# Create in-memory test database
-@pytest.fixture(name="session")
-def session_fixture():
-    """Create a fresh in-memory database for each test."""
-    engine = create_engine(
-        "sqlite:///:memory:",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
-    SQLModel.metadata.create_all(engine)
-    with Session(engine) as session:
-        yield session
-
-
-@pytest.fixture(name="client")
-def client_fixture(session: Session):
-    """Create test client with overridden database session."""
-    def get_session_override():
-        return session
-
-    app.dependency_overrides[get_session] = get_session_override
-    client = TestClient(app)
-    yield client
-    app.dependency_overrides.clear()
-
-
-@pytest.fixture
-def sample_xml():
-    """Load sample UBL invoice XML."""
-    xml_path = os.path.join(
-        os.path.dirname(os.path.dirname(__file__)), 
-        'services/xml_parser/tests/sample_invoice.xml'
-    )
-    with open(xml_path, 'rb') as f:
-        return f.read()
+from app.parser_client import _release, _send_hedged, parser_latency
+from app.parser_pool import parser_pool
 
 
 @pytest.fixture
@@ -90,6 +57,59 @@ def mock_parser_response():
     }
 
 
+def ndjson_body(parser_response: dict) -> bytes:
+    """Render a parser result the way the parser streams it with format=ndjson."""
+    data = parser_response['data']
+    lines = [json.dumps(item) for item in data['line_items']]
+    lines.append(json.dumps({
+        'invoice_metadata': data['invoice_metadata'],
+        'line_count': len(data['line_items'])
+    }))
+    return ("\n".join(lines) + "\n").encode('utf-8')
+
+
+@pytest.fixture(autouse=True)
+def reset_parser_resilience(monkeypatch):
+    """Start every test with fresh parser endpoints, no latency history and no backoff sleeps."""
+    parser_pool.reset()
+    parser_latency.clear()
+    monkeypatch.setattr('app.config.config.XML_PARSER_BACKOFF_BASE', 0.0)
+    yield
+    parser_pool.reset()
+    parser_latency.clear()
+
+
+@pytest.fixture
+def fake_parser(monkeypatch):
+    """
+    Route the backend's httpx.AsyncClient to an in-process parser stand-in.
+    
+    Call the fixture with a ``handler(request, body) -> httpx.Response``;
+    it returns the list of (request, body) pairs the parser received.
+    """
+    real_client = httpx.AsyncClient
+    
+    def install(handler):
+        received = []
+        
+        async def transport_handler(request):
+            body = await request.aread()
+            received.append((request, body))
+            response = handler(request, body)
+            if inspect.isawaitable(response):
+                response = await response
+            return response
+        
+        monkeypatch.setattr(
+            httpx, 'AsyncClient',
+            lambda **kwargs: real_client(transport=httpx.MockTransport(transport_handler), **kwargs)
+        )
+        monkeypatch.setattr('app.config.config.XML_PARSER_URL', 'http://localhost:5000')
+        return received
+    
+    return install
+
+
 def test_root_endpoint(client):
     """Test root endpoint."""
     response = client.get("/api/v1")
@@ -149,27 +169,15 @@ def test_upload_xml_without_parser_configured(client, sample_xml):
         assert "not configured" in response.json()['detail']
 
 
-@pytest.mark.asyncio
-async def test_upload_xml_with_parser_success(client, session, sample_xml, mock_parser_response):
-    """Test successful XML upload with mocked parser service."""
-    # Mock the httpx client response
-    mock_response = AsyncMock()
-    mock_response.status_code = 200
-    mock_response.json = lambda: mock_parser_response  # Use regular function, not async
-    
-    mock_client = AsyncMock()
-    mock_client.post = AsyncMock(return_value=mock_response)
-    
-    async def mock_async_client(*args, **kwargs):
-        return mock_client
-    
-    with patch('app.config.config.XML_PARSER_URL', 'http://localhost:5000'):
-        with patch('httpx.AsyncClient') as mock_client_class:
-            mock_client_class.return_value.__aenter__.return_value = mock_client
-            response = client.post(
-                "/api/invoices/upload",
-                files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
-            )
+def test_upload_xml_with_parser_success(client, session, sample_xml, mock_parser_response, fake_parser):
+    """Test successful XML upload with a stubbed parser service."""
+    fake_parser(lambda request, body: httpx.Response(
+        200, content=ndjson_body(mock_parser_response), headers={'Content-Type': 'application/x-ndjson'}
+    ))
+    response = client.post(
+        "/api/invoices/upload",
+        files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+    )
     
     # Verify response
     assert response.status_code == 201
@@ -198,50 +206,386 @@ async def test_upload_xml_with_parser_success(client, session, sample_xml, mock_
     assert items[1].description == 'Material B'
 
 
-@pytest.mark.asyncio
-async def test_upload_xml_parser_auth_failure(client, sample_xml):
+def test_upload_xml_parser_auth_failure(client, sample_xml, fake_parser):
     """Test XML upload when parser authentication fails."""
-    mock_response = AsyncMock()
-    mock_response.status_code = 401
-    mock_response.json = lambda: {'error': 'Unauthorized'}
-    mock_response.text = '{"error": "Unauthorized"}'
+    fake_parser(lambda request, body: httpx.Response(401, json={'error': 'Unauthorized'}))
+    response = client.post(
+        "/api/invoices/upload",
+        files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+    )
+    
+    assert response.status_code == 502
+    assert "authentication failed" in response.json()['detail']
+
+
+def test_upload_xml_parser_error(client, sample_xml, fake_parser):
+    """Test XML upload when parser returns an error."""
+    fake_parser(lambda request, body: httpx.Response(400, json={'error': 'Invalid XML'}))
+    response = client.post(
+        "/api/invoices/upload",
+        files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+    )
     
-    mock_client = AsyncMock()
-    mock_client.post = AsyncMock(return_value=mock_response)
+    assert response.status_code == 502
+    assert "Parser service error" in response.json()['detail']
+
+
+def test_upload_xml_over_parser_limits(client, sample_xml, fake_parser):
+    """Test the parser's 413/422 for oversized or overly complex documents is passed on."""
+    for status, error in ((413, 'Request body exceeds 100 bytes'), (422, 'Elements nested deeper than 64 levels')):
+        fake_parser(lambda request, body: httpx.Response(status, json={'error': error}))
+        response = client.post(
+            "/api/invoices/upload",
+            files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+        )
+        
+        assert response.status_code == status
+        assert response.json()['detail'] == error
+
+
+def test_upload_xml_parser_error_mid_stream_rolls_back(client, session, sample_xml, mock_parser_response, fake_parser):
+    """Test that an error record after some line items leaves no purchase behind."""
+    first_item = json.dumps(mock_parser_response['data']['line_items'][0])
+    fake_parser(lambda request, body: httpx.Response(
+        200, content=f'{first_item}\n{{"error": "Invalid XML: mismatched tag"}}\n'.encode('utf-8')
+    ))
+    response = client.post(
+        "/api/invoices/upload",
+        files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+    )
     
-    with patch('app.config.config.XML_PARSER_URL', 'http://localhost:5000'):
-        with patch('httpx.AsyncClient') as mock_client_class:
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+    assert response.status_code == 502
+    assert "mismatched tag" in response.json()['detail']
+    from sqlmodel import select
+    assert session.exec(select(models.Purchase)).all() == []
+    assert session.exec(select(models.PurchaseItem)).all() == []
+
+
+def test_upload_xml_duplicate_invoice(client, session, sample_xml, mock_parser_response, fake_parser):
+    """Test the same invoice uploaded twice is rejected or resolved to the first purchase."""
+    fake_parser(lambda request, body: httpx.Response(200, content=ndjson_body(mock_parser_response)))
+    files = {"file": ("test_invoice.xml", sample_xml, "application/xml")}
+    first = client.post("/api/invoices/upload", files=files)
+    assert first.status_code == 201
+    
+    rejected = client.post("/api/invoices/upload", files=files)
+    assert rejected.status_code == 409
+    existing = client.post("/api/invoices/upload", params={"on_duplicate": "return_existing"}, files=files)
+    assert existing.status_code == 200
+    assert existing.json()['duplicate'] is True
+    assert existing.json()['purchase_id'] == first.json()['purchase_id']
+    
+    from sqlmodel import select
+    assert len(session.exec(select(models.Purchase)).all()) == 1
+    assert len(session.exec(select(models.PurchaseItem)).all()) == 2
+
+
+def test_upload_xml_gz_to_purchases(client, session, sample_xml):
+    """Test uploading a gzip-compressed XML file to the in-process parser."""
+    response = client.post(
+        "/api/v1/purchases/upload-xml",
+        files={"file": ("invoice.xml.gz", gzip.compress(sample_xml), "application/gzip")}
+    )
+    assert response.status_code == 201
+    data = response.json()
+    assert data['invoice_number'] == 'INV-2024-001'
+    assert data['items_created'] == 2
+
+
+def test_upload_with_gzip_content_encoding(client, sample_xml):
+    """Test a multipart upload whose whole body is sent with Content-Encoding: gzip."""
+    request = client.build_request(
+        "POST",
+        "/api/v1/purchases/upload-xml",
+        files={"file": ("invoice.xml", sample_xml, "application/xml")}
+    )
+    body = gzip.compress(request.read())
+    response = client.post(
+        "/api/v1/purchases/upload-xml",
+        content=body,
+        headers={
+            "Content-Type": request.headers["Content-Type"],
+            "Content-Encoding": "gzip",
+        }
+    )
+    assert response.status_code == 201
+    assert response.json()['items_created'] == 2
+
+
+def test_upload_gzip_bomb_rejected(client):
+    """Test that a compressed payload expanding past the limit is rejected with 413."""
+    bomb = gzip.compress(b"<a>" + b" " * (2 * 1024 * 1024) + b"</a>")
+    with patch('app.config.config.MAX_DECOMPRESSED_SIZE', 1024 * 1024):
+        response = client.post(
+            "/api/v1/purchases/upload-xml",
+            files={"file": ("bomb.xml.gz", bomb, "application/gzip")}
+        )
+        assert response.status_code == 413
+        
+        response = client.post(
+            "/api/v1/purchases/upload-xml",
+            content=gzip.compress(b"x" * (2 * 1024 * 1024)),
+            headers={"Content-Type": "multipart/form-data; boundary=x", "Content-Encoding": "gzip"}
+        )
+        assert response.status_code == 413
+
+
+def test_upload_zstd_bomb_rejected_without_expanding(client):
+    """Test that a zstd bomb is stopped at the limit, not decoded whole before the check."""
+    zstandard = pytest.importorskip("zstandard")
+    # 256 MB of spaces in about 8 KB
+    bomb = zstandard.ZstdCompressor(level=19).compress(b" " * (256 * 1024 * 1024))
+    with patch('app.config.config.MAX_DECOMPRESSED_SIZE', 1024 * 1024):
+        tracemalloc.start()
+        try:
             response = client.post(
+                "/api/v1/purchases/upload-xml",
+                content=bomb,
+                headers={"Content-Type": "multipart/form-data; boundary=x", "Content-Encoding": "zstd"}
+            )
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    assert response.status_code == 413
+    assert peak < 8 * 1024 * 1024
+
+
+def test_upload_zst_file_bomb_rejected(client):
+    """Test that a spooled .xml.zst upload expanding past the limit is rejected with 413."""
+    zstandard = pytest.importorskip("zstandard")
+    bomb = zstandard.ZstdCompressor(level=19).compress(b"<a>" + b" " * (64 * 1024 * 1024) + b"</a>")
+    with patch('app.config.config.MAX_DECOMPRESSED_SIZE', 1024 * 1024):
+        response = client.post(
+            "/api/v1/purchases/upload-xml",
+            files={"file": ("bomb.xml.zst", bomb, "application/zstd")}
+        )
+    assert response.status_code == 413
+
+
+def test_upload_too_large_rejected(client, sample_xml):
+    """Test that uploads over MAX_UPLOAD_SIZE are rejected with 413 on both endpoints."""
+    with patch('app.config.config.MAX_UPLOAD_SIZE', len(sample_xml) - 1):
+        response = client.post(
+            "/api/invoices/upload",
+            files={"file": ("invoice.xml", sample_xml, "application/xml")}
+        )
+        assert response.status_code == 413
+        
+        response = client.post(
+            "/api/v1/purchases/upload-xml",
+            files={"file": ("invoice.xml", sample_xml, "application/xml")}
+        )
+        assert response.status_code == 413
+
+
+def test_upload_streams_compressed_body_to_parser(client, sample_xml, mock_parser_response, fake_parser):
+    """Test that XML is sent gzip-compressed and chunked to the raw NDJSON endpoint."""
+    received = fake_parser(lambda request, body: httpx.Response(200, content=ndjson_body(mock_parser_response)))
+    response = client.post(
+        "/api/invoices/upload",
+        files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+    )
+    
+    assert response.status_code == 201
+    request, body = received[0]
+    assert request.headers['Content-Type'] == 'application/xml'
+    assert request.headers['Content-Encoding'] == 'gzip'
+    assert request.headers['Transfer-Encoding'] == 'chunked'
+    assert 'gzip' in request.headers['Accept-Encoding']
+    assert request.url.params['format'] == 'ndjson'
+    assert gzip.decompress(body) == sample_xml
+    assert response.json()['sha256'] == hashlib.sha256(sample_xml).hexdigest()
+
+
+def test_upload_xml_gz_forwarded_without_recompression(client, sample_xml, mock_parser_response, fake_parser):
+    """Test that an uploaded .xml.gz reaches the parser byte for byte."""
+    compressed = gzip.compress(sample_xml)
+    received = fake_parser(lambda request, body: httpx.Response(200, content=ndjson_body(mock_parser_response)))
+    response = client.post(
+        "/api/invoices/upload",
+        files={"file": ("invoice.xml.gz", compressed, "application/gzip")}
+    )
+    
+    assert response.status_code == 201
+    request, body = received[0]
+    assert request.headers['Content-Encoding'] == 'gzip'
+    assert body == compressed
+
+
+def test_parser_restart_is_retried(client, sample_xml, mock_parser_response, fake_parser):
+    """Test that 503s and refused connections are retried with the full body replayed."""
+    outcomes = [
+        httpx.Response(503, json={'error': 'restarting'}),
+        httpx.ConnectError("Connection refused"),
+    ]
+    
+    def handler(request, body):
+        if outcomes:
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+        return httpx.Response(200, content=ndjson_body(mock_parser_response))
+    
+    received = fake_parser(handler)
+    response = client.post(
+        "/api/invoices/upload",
+        files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+    )
+    
+    assert response.status_code == 201
+    assert len(received) == 3
+    assert all(gzip.decompress(body) == sample_xml for _, body in received)
+    assert parser_pool.endpoints[0].breaker.state == 'closed'
+
+
+def test_circuit_breaker_fails_fast(client, sample_xml, fake_parser, monkeypatch):
+    """Test that the breaker opens after repeated failures and shows up in health."""
+    monkeypatch.setattr('app.config.config.XML_PARSER_RETRIES', 0)
+    monkeypatch.setattr('app.config.config.XML_PARSER_BREAKER_THRESHOLD', 2)
+    received = fake_parser(lambda request, body: httpx.Response(503, json={'error': 'down'}))
+    
+    for _ in range(2):
+        response = client.post(
+            "/api/invoices/upload",
+            files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+        )
+        assert response.status_code == 502
+    
+    response = client.post(
+        "/api/invoices/upload",
+        files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+    )
+    assert response.status_code == 503
+    assert "circuit breaker open" in response.json()['detail']
+    assert len(received) == 2
+    
+    health = client.get("/api/invoices/health").json()
+    [endpoint] = health['xml_parser_endpoints']
+    assert endpoint['circuit']['state'] == 'open'
+    assert endpoint['circuit']['consecutive_failures'] == 2
+    assert endpoint['in_rotation'] is False
+
+
+def test_failed_attempt_moves_to_another_endpoint(client, sample_xml, mock_parser_response, fake_parser):
+    """Test that a retry goes to a different parser instance and stats are reported per endpoint."""
+    def handler(request, body):
+        if request.url.host == 'parser-a':
+            raise httpx.ConnectError("Connection refused")
+        return httpx.Response(200, content=ndjson_body(mock_parser_response))
+    
+    received = fake_parser(handler)
+    with patch('app.config.config.XML_PARSER_URL', 'http://parser-a:5000,http://parser-b:5000'):
+        statuses = [
+            client.post(
                 "/api/invoices/upload",
+                params={"on_duplicate": "force"},
                 files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+            ).status_code
+            for _ in range(4)
+        ]
+        health = client.get("/api/invoices/health").json()
+    
+    assert statuses == [201] * 4
+    assert {request.url.host for request, _ in received} <= {'parser-a', 'parser-b'}
+    stats = {e['url']: e for e in health['xml_parser_endpoints']}
+    assert stats['http://parser-b:5000']['requests'] == 4
+    assert stats['http://parser-b:5000']['outstanding'] == 0
+    assert stats['http://parser-b:5000']['latency_p95_ms'] is not None
+    assert stats['http://parser-a:5000']['failures'] == stats['http://parser-a:5000']['requests']
+
+
+def test_slow_parser_request_is_hedged(client, sample_xml, mock_parser_response, fake_parser, monkeypatch):
+    """Test that a request slower than the recent p95 is raced by a hedged copy."""
+    monkeypatch.setattr('app.config.config.XML_PARSER_HEDGE', True)
+    for _ in range(parser_latency.min_samples):
+        parser_latency.observe(0.01)
+    
+    async def handler(request, body):
+        if len(received) == 1:
+            await asyncio.sleep(5)
+        return httpx.Response(200, content=ndjson_body(mock_parser_response))
+    
+    received = fake_parser(handler)
+    response = client.post(
+        "/api/invoices/upload",
+        files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
+    )
+    
+    assert response.status_code == 201
+    assert response.json()['items_count'] == 2
+    assert len(received) == 2
+    assert received[0][1] == received[1][1]
+
+
+def test_cancelled_hedge_releases_half_open_trial(mock_parser_response, fake_parser, monkeypatch):
+    """Test that a half-open trial request losing a hedge race doesn't keep its endpoint out of rotation."""
+    monkeypatch.setattr('app.config.config.XML_PARSER_HEDGE', True)
+    for _ in range(parser_latency.min_samples):
+        parser_latency.observe(0.01)
+    
+    async def handler(request, body):
+        if request.url.host == 'parser-a':
+            await asyncio.sleep(5)
+        return httpx.Response(200, content=ndjson_body(mock_parser_response))
+    
+    fake_parser(handler)
+    monkeypatch.setattr('app.config.config.XML_PARSER_URL', 'http://parser-a:5000,http://parser-b:5000')
+    slow = next(e for e in parser_pool.endpoints if e.url == 'http://parser-a:5000')
+    now = [0.0]
+    slow.breaker.clock = lambda: now[0]
+    for _ in range(slow.breaker.failure_threshold):
+        slow.record_failure()
+    now[0] = slow.breaker.reset_timeout
+    # Taken by parser_pool.choose() for the primary request
+    assert slow.breaker.allow()
+    
+    async def race():
+        async with httpx.AsyncClient() as client:
+            call = await _send_hedged(
+                client, slow, lambda base_url: client.build_request('POST', base_url + '/parse', content=b'<Invoice/>'), [slow]
             )
+            await _release(call)
+            return call[0]
     
-    assert response.status_code == 502
-    assert "authentication failed" in response.json()['detail']
+    assert asyncio.run(race()).url == 'http://parser-b:5000'
+    assert slow.outstanding == 0
+    assert slow.breaker.state == 'half_open'
+    assert slow.breaker.allow()
 
 
-@pytest.mark.asyncio
-async def test_upload_xml_parser_error(client, sample_xml):
-    """Test XML upload when parser returns an error."""
-    mock_response = AsyncMock()
-    mock_response.status_code = 400
-    mock_response.json = lambda: {'error': 'Invalid XML'}
-    mock_response.text = '{"error": "Invalid XML"}'
+def test_upload_over_unix_socket(client, tmp_path, sample_xml, mock_parser_response):
+    """Test a real chunked round trip to a parser listening on a Unix socket."""
+    serving = pytest.importorskip("werkzeug.serving")
+    wrappers = pytest.importorskip("werkzeug.wrappers")
+    received = []
     
-    mock_client = AsyncMock()
-    mock_client.post = AsyncMock(return_value=mock_response)
+    @wrappers.Request.application
+    def parser(request):
+        received.append((request.path, request.headers.get('Content-Encoding'), request.get_data()))
+        if request.path == '/parse':
+            return wrappers.Response(ndjson_body(mock_parser_response), mimetype='application/x-ndjson')
+        return wrappers.Response('{"status": "healthy"}', mimetype='application/json')
     
-    with patch('app.config.config.XML_PARSER_URL', 'http://localhost:5000'):
-        with patch('httpx.AsyncClient') as mock_client_class:
-            mock_client_class.return_value.__aenter__.return_value = mock_client
+    socket_path = tmp_path / 'parser.sock'
+    server = serving.make_server(f'unix://{socket_path}', 0, parser, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with patch('app.config.config.XML_PARSER_URL', f'unix:{socket_path}'):
             response = client.post(
                 "/api/invoices/upload",
                 files={"file": ("test_invoice.xml", sample_xml, "application/xml")}
             )
+            health = client.get("/api/invoices/health").json()
+    finally:
+        server.shutdown()
     
-    assert response.status_code == 502
-    assert "Parser service error" in response.json()['detail']
+    assert response.status_code == 201
+    assert response.json()['items_count'] == 2
+    path, encoding, body = received[0]
+    assert (path, encoding) == ('/parse', 'gzip')
+    assert gzip.decompress(body) == sample_xml
+    assert health['xml_parser_endpoints'][0]['url'] == f'unix:{socket_path}'
 
 
 if __name__ == '__main__':
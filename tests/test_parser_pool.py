@@ -0,0 +1,81 @@
+"""
+Tests for load balancing and health probing across parser instances.
+"""
+import asyncio
+import httpx
+import pytest
+from unittest.mock import patch
+from app.parser_pool import ParserPool
+
+
+@pytest.fixture
+def pool():
+    with patch('app.config.config.XML_PARSER_URL', 'http://p1:5000, http://p2:5000/,http://p3:5000'):
+        yield ParserPool()
+
+
+def test_pool_follows_configured_urls(pool):
+    assert [e.url for e in pool.endpoints] == ['http://p1:5000', 'http://p2:5000', 'http://p3:5000']
+    first = pool.endpoints[0]
+    
+    with patch('app.config.config.XML_PARSER_URL', 'http://p1:5000,http://p4:5000'):
+        assert [e.url for e in pool.endpoints] == ['http://p1:5000', 'http://p4:5000']
+        assert pool.endpoints[0] is first
+
+
+@pytest.mark.parametrize("balancer", ["p2c", "least_outstanding"])
+def test_choose_prefers_fewer_outstanding_requests(pool, balancer):
+    """Test that busy endpoints are avoided and already-tried ones skipped."""
+    p1, p2, p3 = pool.endpoints
+    p1.outstanding, p2.outstanding, p3.outstanding = 5, 0, 5
+    
+    with patch('app.config.config.XML_PARSER_BALANCER', balancer):
+        picks = [pool.choose() for _ in range(50)]
+        # p2c wins every pair that includes p2 (2 in 3); least_outstanding always picks it
+        assert picks.count(p2) >= (20 if balancer == 'p2c' else 50)
+        assert pool.choose(exclude=[p2]) in (p1, p3)
+        
+        # With everything tried, fall back to any endpoint in rotation
+        assert pool.choose(exclude=[p1, p2, p3]) is not None
+
+
+def test_open_breaker_ejects_endpoint(pool):
+    p1, p2, p3 = pool.endpoints
+    for _ in range(p1.breaker.failure_threshold):
+        p1.record_failure()
+    p3.healthy = False
+    
+    assert not p1.available
+    assert {pool.choose() for _ in range(20)} == {p2}
+    
+    p2.healthy = False
+    assert pool.choose() is None
+
+
+def test_health_probes_eject_and_readmit(pool):
+    """Test that failing /health probes take an endpoint out of rotation until it recovers."""
+    down = {'http://p2:5000'}
+    
+    def handler(request):
+        base = f"{request.url.scheme}://{request.url.host}:{request.url.port}"
+        if base in down:
+            return httpx.Response(503, json={'status': 'unhealthy'})
+        return httpx.Response(200, json={'status': 'healthy', 'service': 'xml-parser'})
+    
+    async def probe():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            await pool.probe_all(client)
+    
+    asyncio.run(probe())
+    p1, p2, p3 = pool.endpoints
+    assert (p1.available, p2.available, p3.available) == (True, False, True)
+    assert p2.stats()['last_probe']['error'] == 'HTTP 503'
+    assert p2 not in {pool.choose() for _ in range(20)}
+    
+    # An endpoint ejected by its breaker is re-admitted by a passing probe too
+    for _ in range(p3.breaker.failure_threshold):
+        p3.record_failure()
+    down.clear()
+    asyncio.run(probe())
+    assert all(e.available for e in pool.endpoints)
+    assert p3.stats()['circuit']['state'] == 'closed'
@@ -0,0 +1,74 @@
+"""
+Tests for per-material price statistics and ingest-time anomaly flags.
+"""
+import pytest
+
+from app import models, pricing
+from app.config import config
+
+
+def upload(client, xml):
+    response = client.post(
+        "/api/v1/purchases/upload-xml",
+        params={"on_duplicate": "force"},
+        files={"file": ("invoice.xml", xml, "application/xml")}
+    )
+    assert response.status_code == 201
+    return response.json()
+
+
+@pytest.fixture
+def material(session):
+    material = models.Material(sku="P450", name="Panou 450W")
+    session.add(material)
+    session.commit()
+    return material.id
+
+
+def test_update_stats_rolling_mean(monkeypatch):
+    monkeypatch.setattr(config, "PRICE_STATS_ALPHA", 0.5)
+    stats = None
+    for price in (10.0, 20.0, 20.0):
+        stats = pricing.update_stats(stats, 1, None, price)
+    assert (stats["count"], stats["min_price"], stats["max_price"], stats["last_price"]) == (3, 10.0, 20.0, 20.0)
+    assert stats["mean"] == 17.5
+    assert stats["sum_price"] / stats["count"] == pytest.approx(50 / 3)
+    assert stats["variance"] > 0
+
+
+def test_price_stats_endpoint(client, material):
+    """Test items created through the API update the material's statistics."""
+    for price in (100.0, 110.0, 90.0):
+        response = client.post("/api/v1/purchases/", json={
+            "supplier": "Alpha SRL",
+            "items": [{"material_id": material, "quantity": 1, "unit_price": price}],
+        })
+        assert response.status_code == 201
+
+    stats = client.get(f"/api/v1/analytics/prices/{material}").json()
+    assert stats["count"] == 3
+    assert stats["last_price"] == 90.0
+    assert (stats["min_price"], stats["max_price"]) == (90.0, 110.0)
+    assert stats["avg_price"] == 100.0
+    assert 90.0 < stats["rolling_mean"] < 110.0
+
+    assert client.get("/api/v1/analytics/prices/999").status_code == 404
+
+
+def test_upload_xml_flags_price_anomalies(client, sample_xml, monkeypatch):
+    """Test a line priced far from its material's history is flagged at ingest."""
+    monkeypatch.setattr(config, "PRICE_ANOMALY_MIN_SAMPLES", 2)
+    for _ in range(2):
+        assert upload(client, sample_xml)["price_anomalies"] == []
+
+    expensive = sample_xml.replace(b"<cbc:PriceAmount>50.00</cbc:PriceAmount>", b"<cbc:PriceAmount>80.00</cbc:PriceAmount>")
+    data = upload(client, expensive)
+    assert len(data["price_anomalies"]) == 1
+    anomaly = data["price_anomalies"][0]
+    assert anomaly["unit_price"] == 80.0
+    assert anomaly["expected_price"] == 50.0
+    assert anomaly["deviation"] == 0.6
+    assert anomaly["item_id"] == data["items"][0]["id"]
+
+    monkeypatch.setattr(config, "PRICE_ANOMALY_THRESHOLD", 0)
+    assert upload(client, expensive)["price_anomalies"] == []
@@ -0,0 +1,149 @@
+"""
+Integration tests for the purchases API.
+"""
+import csv
+import io
+import json
+import pytest
+
+
+def create_purchase(client, supplier, invoice_number, invoice_date, items):
+    response = client.post("/api/v1/purchases/", json={
+        "supplier": supplier,
+        "invoice_number": invoice_number,
+        "invoice_date": invoice_date,
+        "items": items
+    })
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+@pytest.fixture
+def purchases(client):
+    """Three purchases from two suppliers across two months."""
+    return [
+        create_purchase(client, "Alpha SRL", "A-1", "2024-01-10", [
+            {"description": "Panou 450W", "quantity": 10, "unit_price": 500.0},
+            {"description": "Cablu solar 6mm", "quantity": 100, "unit_price": 4.5},
+        ]),
+        create_purchase(client, "Beta SA", "B-1", "2024-01-20", [
+            {"description": "Invertor 10kW", "quantity": 1, "unit_price": 7000.0},
+        ]),
+        create_purchase(client, "Alpha SRL", "A-2", "2024-02-05", [
+            {"description": "Conector MC4", "quantity": 50, "unit_price": 3.0},
+        ]),
+    ]
+
+
+def test_export_csv(client, purchases):
+    """Test CSV export streams one row per purchase item."""
+    response = client.get("/api/v1/purchases/export?format=csv")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 4
+    assert rows[0]["supplier"] == "Alpha SRL"
+    assert rows[0]["description"] == "Panou 450W"
+    assert rows[3]["invoice_number"] == "A-2"
+
+
+def test_export_ndjson_with_filters(client, purchases):
+    """Test supplier and date-range filters on the NDJSON export."""
+    response = client.get(
+        "/api/v1/purchases/export",
+        params={"format": "ndjson", "supplier": "Alpha SRL", "date_from": "2024-01-01", "date_to": "2024-01-31"}
+    )
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["description"] for r in rows] == ["Panou 450W", "Cablu solar 6mm"]
+    assert all(r["purchase_id"] == purchases[0] for r in rows)
+
+
+def test_export_resume_from_cursor(client, purchases):
+    """Test chunked reads and resuming from the last received item_id."""
+    full = client.get("/api/v1/purchases/export", params={"format": "ndjson", "chunk_size": 1})
+    rows = [json.loads(line) for line in full.text.splitlines()]
+    assert len(rows) == 4
+
+    resumed = client.get("/api/v1/purchases/export", params={"format": "ndjson", "cursor": rows[1]["item_id"]})
+    assert [json.loads(line) for line in resumed.text.splitlines()] == rows[2:]
+
+
+def test_export_parquet(client, purchases):
+    """Test Parquet export round-trips through pyarrow."""
+    pq = pytest.importorskip("pyarrow.parquet")
+    response = client.get("/api/v1/purchases/export", params={"format": "parquet", "chunk_size": 2})
+    assert response.status_code == 200
+
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.num_rows == 4
+    assert table.column("description").to_pylist()[2] == "Invertor 10kW"
+
+
+def test_export_unknown_format(client):
+    response = client.get("/api/v1/purchases/export?format=xlsx")
+    assert response.status_code == 400
+
+
+def test_list_purchases_etag(client, purchases):
+    """Test the list is served with an ETag and revalidates to 304 until a write."""
+    response = client.get("/api/v1/purchases/")
+    assert response.status_code == 200
+    assert [p["id"] for p in response.json()] == purchases[::-1]
+    assert response.json()[0]["created_at"]
+    etag = response.headers["etag"]
+
+    cached = client.get("/api/v1/purchases/")
+    assert cached.headers["x-cache"] == "HIT"
+    assert cached.content == response.content
+
+    not_modified = client.get("/api/v1/purchases/", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["etag"] == etag
+    assert not_modified.content == b""
+
+    create_purchase(client, "Gamma SRL", "G-1", "2024-03-01", [
+        {"description": "Siguranta 15A", "quantity": 4, "unit_price": 12.0},
+    ])
+    changed = client.get("/api/v1/purchases/", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.headers["x-cache"] == "MISS"
+    assert len(changed.json()) == 4
+
+
+def test_purchase_detail_etag_tracks_items_and_materials(client, session, purchases):
+    """Test the detail ETag changes with the purchase's items and with materials only."""
+    from sqlmodel import select
+    from app import models
+
+    url = f"/api/v1/purchases/{purchases[0]}"
+    etag = client.get(url).headers["etag"]
+
+    # Another purchase changing leaves this one's ETag alone
+    create_purchase(client, "Beta SA", "B-2", "2024-03-02", [
+        {"description": "Invertor 5kW", "quantity": 1, "unit_price": 4000.0},
+    ])
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    item = session.exec(
+        select(models.PurchaseItem).where(models.PurchaseItem.purchase_id == purchases[0])
+    ).first()
+    item.quantity = 12
+    session.add(item)
+    session.commit()
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["items"][0]["quantity"] == 12
+    etag = response.headers["etag"]
+
+    session.add(models.Material(name="Clema"))
+    session.commit()
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_purchase_detail_not_found(client):
+    """Test a missing purchase is still a 404."""
+    response = client.get("/api/v1/purchases/999")
+    assert response.status_code == 404
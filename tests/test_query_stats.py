@@ -0,0 +1,65 @@
+"""
+Tests for the per-request SQL statement counts (app.database.track_queries,
+QueryStatsMiddleware) and the statement budgets the test client enforces.
+"""
+import pytest
+from sqlmodel import select
+
+from app import models
+from app.database import track_queries
+
+
+def create_purchase(client, invoice_number):
+    response = client.post("/api/v1/purchases/", json={
+        "supplier": "ACME", "invoice_number": invoice_number,
+        "items": [{"description": "Cablu", "quantity": 2, "unit_price": 5}],
+    })
+    assert response.status_code == 201
+    return response
+
+
+def test_no_headers_outside_debug_mode(client):
+    response = client.get("/api/v1/purchases/")
+    assert response.status_code == 200
+    assert "x-db-queries" not in response.headers
+
+
+def test_debug_headers(client, monkeypatch):
+    monkeypatch.setattr("app.config.config.DEBUG", True)
+    created = create_purchase(client, "F-1")
+    assert int(created.headers["x-db-queries"]) > 0
+    assert int(created.headers["x-db-commits"]) >= 1
+
+    response = client.get("/api/v1/purchases/")
+    assert (response.headers["x-db-queries"], response.headers["x-db-commits"]) == ("2", "0")
+    assert float(response.headers["x-db-time-ms"]) >= 0
+
+
+def test_nested_tracking_counts_in_both(session):
+    with track_queries() as outer:
+        session.exec(select(models.Purchase)).all()
+        with track_queries() as inner:
+            session.add(models.Purchase(supplier="ACME"))
+            session.commit()
+    assert inner.statements > 0 and inner.commits == 1
+    assert outer.statements > inner.statements
+    assert outer.commits == 1
+    assert outer.seconds >= inner.seconds
+
+    # Nothing is counted once the block has ended
+    counted = outer.statements
+    session.exec(select(models.Purchase)).all()
+    assert outer.statements == counted
+
+
+def test_request_over_its_budget_fails(client, statement_budgets):
+    create_purchase(client, "F-1")
+    statement_budgets["GET /api/v1/purchases/"] = 1
+    with pytest.raises(AssertionError, match=r"GET /api/v1/purchases/ ran 2 SQL statements, over its budget of 1"):
+        client.get("/api/v1/purchases/")
+
+
+def test_endpoint_without_budget_fails(client, statement_budgets):
+    del statement_budgets["GET /api/v1/purchases/"]
+    with pytest.raises(AssertionError, match="No SQL statement budget for GET /api/v1/purchases/"):
+        client.get("/api/v1/purchases/")
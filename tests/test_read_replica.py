@@ -0,0 +1,82 @@
+"""
+Tests for routing reads to the read engine, with read-your-writes.
+"""
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.pool import StaticPool
+
+from app import database, models
+from app.caching import response_cache
+
+
+def memory_engine():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def engines(monkeypatch):
+    """A primary and a stand-in replica that never receives the primary's writes."""
+    primary, replica = memory_engine(), memory_engine()
+    with Session(replica) as session:
+        purchase = models.Purchase(supplier="Replica", invoice_number="R-1")
+        session.add(purchase)
+        session.commit()
+        # Two writes, so its version counters (and ETags) differ from the primary's
+        purchase.supplier = "Replica SRL"
+        session.add(purchase)
+        session.commit()
+    monkeypatch.setattr(database, "engine", primary)
+    monkeypatch.setattr(database, "read_engine", replica)
+    response_cache.clear()
+    yield primary, replica
+    response_cache.clear()
+
+
+def suppliers(response):
+    assert response.status_code == 200
+    return [p["supplier"] for p in response.json()]
+
+
+def test_reads_go_to_the_read_engine(engines, make_client):
+    """Test list reads are served by the replica for clients that didn't write."""
+    client = make_client()
+    assert suppliers(client.get("/api/v1/purchases/")) == ["Replica SRL"]
+
+
+def test_writer_reads_its_own_writes(engines, monkeypatch, make_client):
+    """Test a client that just wrote reads from the primary until the window ends."""
+    monkeypatch.setattr("app.config.config.READ_YOUR_WRITES_WINDOW", 2.5)
+    writer, other = make_client(), make_client()
+    response = writer.post("/api/v1/purchases/", json={
+        "supplier": "Primary SRL", "invoice_number": "P-1",
+        "items": [{"quantity": 1, "unit_price": 5.0}],
+    })
+    assert response.status_code == 201
+    cookie = response.headers["set-cookie"]
+    assert cookie.startswith(f"{database.WROTE_COOKIE}=1;")
+    assert "Max-Age=3" in cookie
+
+    assert suppliers(writer.get("/api/v1/purchases/")) == ["Primary SRL"]
+    assert suppliers(other.get("/api/v1/purchases/")) == ["Replica SRL"]
+
+
+def test_failed_write_does_not_pin_to_primary(engines, make_client):
+    client = make_client()
+    response = client.post("/api/v1/purchases/", json={"supplier": "X", "items": []})
+    assert response.status_code == 400
+    assert "set-cookie" not in response.headers
+    assert suppliers(client.get("/api/v1/purchases/")) == ["Replica SRL"]
+
+
+def test_no_cookie_without_read_engine(monkeypatch, make_client):
+    """Test nothing changes when reads already use the primary."""
+    primary = memory_engine()
+    monkeypatch.setattr(database, "engine", primary)
+    monkeypatch.setattr(database, "read_engine", primary)
+    response = make_client().post("/api/v1/purchases/", json={
+        "supplier": "Primary SRL", "items": [{"quantity": 1, "unit_price": 5.0}],
+    })
+    assert response.status_code == 201
+    assert "set-cookie" not in response.headers
@@ -0,0 +1,72 @@
+"""
+Tests for the retry, hedging and circuit breaker primitives.
+"""
+from app.resilience import CircuitBreaker, LatencyWindow, backoff_delay
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+
+def test_circuit_breaker_lifecycle():
+    """Test closed -> open -> half_open -> closed/open transitions."""
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=clock)
+    
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    assert breaker.snapshot()['retry_in_seconds'] == 10
+    
+    # After the reset timeout a single trial call is let through
+    clock.now = 10
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    
+    clock.now = 25
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.snapshot() == {'state': 'closed', 'consecutive_failures': 0, 'retry_in_seconds': None}
+
+
+def test_abandoned_trial_is_released():
+    """Test a half-open trial that ends without an outcome lets the next one through."""
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release_trial()
+    assert breaker.state == 'half_open'
+    assert breaker.allow()
+
+
+def test_latency_window_percentile():
+    window = LatencyWindow(size=100, min_samples=10)
+    for i in range(9):
+        window.observe(i / 100)
+    assert window.percentile(95) is None
+    
+    for i in range(9, 100):
+        window.observe(i / 100)
+    assert window.percentile(95) == 0.94
+    assert window.percentile(50) == 0.49
+
+
+def test_backoff_delay_is_jittered_and_capped():
+    delays = [backoff_delay(attempt, base=0.1, cap=1.0) for attempt in (1, 2, 3, 10) for _ in range(50)]
+    assert all(0 <= d <= 1.0 for d in delays)
+    assert max(backoff_delay(1, base=0.1, cap=1.0) for _ in range(50)) <= 0.1
+    assert len(set(delays)) > 1
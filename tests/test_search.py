@@ -0,0 +1,119 @@
+"""
+Tests for the FTS5 search index and the /api/v1/search endpoint.
+"""
+import pytest
+from sqlmodel import select
+
+from app import models, search
+
+
+@pytest.fixture
+def catalog(client, session):
+    cable = models.Material(sku="CS6", name="Cablu solar 6mm roșu")
+    pipe = models.Material(sku="TC22", name="Țeavă cupru 22mm")
+    session.add_all([cable, pipe])
+    session.commit()
+    for supplier, number, items in [
+        ("Alpha SRL", "A-1", [("Cablu solar 6mm negru", "CS6-N"), ("Conector MC4", "MC4")]),
+        ("Beta SA", "B-1", [("Panou fotovoltaic 450W", "P450"), ("cablu solar 4mm", None)]),
+    ]:
+        response = client.post("/api/v1/purchases/", json={
+            "supplier": supplier,
+            "invoice_number": number,
+            "invoice_date": "2024-03-01",
+            "items": [{"description": d, "sku_raw": s, "quantity": 1, "unit_price": 10.0} for d, s in items],
+        })
+        assert response.status_code == 201
+    return cable.id, pipe.id
+
+
+def test_search_ranks_materials_and_items(client, catalog):
+    """Test every word must match and the closest match comes first."""
+    response = client.get("/api/v1/search", params={"q": "cablu solar 6mm"})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] == 2
+    assert {(r["kind"], r.get("name") or r.get("description")) for r in data["results"]} == {
+        ("material", "Cablu solar 6mm roșu"), ("item", "Cablu solar 6mm negru"),
+    }
+    item = next(r for r in data["results"] if r["kind"] == "item")
+    assert item["supplier"] == "Alpha SRL"
+    assert item["invoice_number"] == "A-1"
+    assert item["snippet"] == "[Cablu] [solar] [6mm] negru"
+    assert item["score"] > 0
+
+
+def test_search_folds_diacritics_and_matches_prefixes(client, catalog):
+    """Test queries match regardless of diacritics, case and word endings."""
+    cable, pipe = catalog
+    results = client.get("/api/v1/search", params={"q": "TEAVA cup"}).json()["results"]
+    assert [(r["kind"], r["id"]) for r in results] == [("material", pipe)]
+
+    results = client.get("/api/v1/search", params={"q": "mc4"}).json()["results"]
+    assert [r["description"] for r in results] == ["Conector MC4"]
+
+
+def test_search_kind_filter_and_pagination(client, catalog):
+    """Test results can be limited to one kind and paged."""
+    items = client.get("/api/v1/search", params={"q": "cablu", "kind": "item"}).json()
+    assert items["total"] == 2
+    assert {r["kind"] for r in items["results"]} == {"item"}
+
+    pages = [client.get("/api/v1/search", params={"q": "cablu", "limit": 2, "offset": offset}).json()
+             for offset in (0, 2)]
+    assert [p["total"] for p in pages] == [3, 3]
+    assert [len(p["results"]) for p in pages] == [2, 1]
+    ids = {(r["kind"], r["id"]) for p in pages for r in p["results"]}
+    assert len(ids) == 3
+
+
+def test_search_input_is_not_an_fts_query(client, catalog):
+    """Test FTS5 syntax in user input is matched literally instead of failing."""
+    for q in ('cablu" OR', "NEAR(cablu", "*", "-"):
+        response = client.get("/api/v1/search", params={"q": q})
+        assert response.status_code == 200
+    assert client.get("/api/v1/search", params={"q": "-"}).json()["total"] == 0
+    assert client.get("/api/v1/search", params={"q": ""}).status_code == 422
+
+
+def test_index_follows_updates_and_deletes(client, session, catalog):
+    """Test the index changes in the same transaction as the rows."""
+    cable, _ = catalog
+    material = session.get(models.Material, cable)
+    material.name = "Cablu de împământare"
+    session.add(material)
+    item = session.exec(select(models.PurchaseItem).where(models.PurchaseItem.sku_raw == "MC4")).one()
+    session.delete(item)
+    session.commit()
+
+    assert client.get("/api/v1/search", params={"q": "mc4"}).json()["total"] == 0
+    results = client.get("/api/v1/search", params={"q": "cablu", "kind": "material"}).json()["results"]
+    assert [r["name"] for r in results] == ["Cablu de împământare"]
+    assert client.get("/api/v1/search", params={"q": "impamantare"}).json()["total"] == 1
+
+
+def test_rebuild_indexes_rows_written_outside_the_orm(client, session, catalog):
+    """Test the rebuild picks up rows inserted through Core."""
+    session.connection().execute(models.Material.__table__.insert(), [{"sku": "INV5", "name": "Invertor hibrid 5kW"}])
+    session.commit()
+    assert client.get("/api/v1/search", params={"q": "invertor"}).json()["total"] == 0
+
+    response = client.post("/api/v1/search/rebuild")
+    assert response.status_code == 200
+    assert response.json() == {"indexed_items": 4, "indexed_materials": 3}
+    assert client.get("/api/v1/search", params={"q": "invertor"}).json()["total"] == 1
+    assert client.get("/api/v1/search", params={"q": "cablu"}).json()["total"] == 3
+
+
+def test_fts_query_quotes_words():
+    assert search.fts_query("cablu 6mm") == '"cablu"* "6mm"*'
+    assert search.fts_query('"; DROP') == '"DROP"*'
+    assert search.fts_query("  -- ") is None
+
+
+def test_search_without_fts5_is_not_implemented(client, monkeypatch):
+    """Test a database without FTS5 gets a 501 instead of unranked results."""
+    monkeypatch.setattr(search, "uses_fts", lambda session: False)
+    for response in (client.get("/api/v1/search", params={"q": "cablu"}), client.post("/api/v1/search/rebuild")):
+        assert response.status_code == 501
+        assert response.json()["detail"] == "Full-text search needs SQLite with FTS5"
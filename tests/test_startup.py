@@ -0,0 +1,64 @@
+"""
+Tests for the start-up path: lazy imports, the cached schema check and
+the start-up profile.
+"""
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+from sqlmodel import create_engine
+
+from app import database, main
+from app.startup import ROOT, StartupProfile
+
+
+def test_heavy_modules_are_not_imported_at_startup():
+    """Test importing the app leaves the parser client, XML and optional modules for later."""
+    lazy = ["httpx", "defusedxml", "lxml", "numpy", "pyarrow", "app.parser_client", "app.parsers.invoice_xml"]
+    code = f"import sys, app.main; print([m for m in {lazy!r} if m in sys.modules])"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_init_db_skips_create_all_when_schema_is_current(tmp_path, monkeypatch):
+    """Test create_all only runs for a new database or a changed schema."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    assert database.stored_schema_fingerprint(engine) is None
+    assert database.init_db(bind=engine) is True
+    assert database.stored_schema_fingerprint(engine) == database.schema_fingerprint()
+
+    assert database.init_db(bind=engine) is False
+    assert database.init_db(force=True, bind=engine) is True
+
+    monkeypatch.setattr(database, "schema_fingerprint", lambda: "changed")
+    assert database.init_db(bind=engine) is True
+    assert database.init_db(bind=engine) is False
+
+
+def test_schema_fingerprint_is_stable():
+    """Test the fingerprint doesn't depend on set ordering within the process."""
+    code = "from app.database import schema_fingerprint; print(schema_fingerprint())"
+    runs = {subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True,
+                           check=True).stdout.strip() for _ in range(3)}
+    assert runs == {database.schema_fingerprint()}
+
+
+def test_lifespan_records_startup_profile(monkeypatch):
+    """Test the lifespan handler times its steps and the profile is served."""
+    monkeypatch.setattr(main, "init_db", lambda: False)
+    monkeypatch.setattr("app.config.config.XML_PARSER_URL", None)
+    monkeypatch.setattr(main, "startup_profile", StartupProfile())
+    with TestClient(main.app) as client:
+        profile = client.get("/api/v1/startup").json()
+    assert list(profile["phases_ms"]) == ["init_db (schema current)"]
+    assert profile["total_ms"] >= 0
+
+
+def test_startup_profile():
+    profile = StartupProfile()
+    profile.record("import app", 0.5)
+    with profile.phase("init_db"):
+        pass
+    assert [name for name, _ in profile.phases] == ["import app", "init_db"]
+    assert profile.as_dict()["phases_ms"]["import app"] == 500.0
+    assert str(profile).startswith("import app 500.0 ms, init_db ")
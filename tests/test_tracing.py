@@ -0,0 +1,126 @@
+"""
+Tests for request tracing (app.tracing).
+"""
+import json
+import logging
+
+import httpx
+import pytest
+
+from app import tracing
+from app.parser_pool import parser_pool
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+# What the parser streams back for a two-line invoice (format=ndjson)
+PARSER_NDJSON = "\n".join(json.dumps(record) for record in [
+    {"line_id": "1", "description": "Widget A", "sku_raw": "SKU-001", "quantity": 10.0, "unit_price": 50.0,
+     "total_price": 500.0},
+    {"line_id": "2", "description": "Material B", "sku_raw": "SKU-002", "quantity": 5.0, "unit_price": 120.0,
+     "total_price": 600.0},
+    {"invoice_metadata": {"invoice_number": "INV-2024-001", "invoice_date": "2024-01-15",
+                          "supplier": "Test Supplier Ltd", "total_amount": 1190.0}, "line_count": 2},
+]).encode() + b"\n"
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    """Export spans to a fresh OTLP/JSON file and return a reader for them."""
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr("app.config.config.TRACE_EXPORTER", "file")
+    monkeypatch.setattr("app.config.config.TRACE_FILE", str(path))
+
+    def read():
+        spans = []
+        for line in path.read_text().splitlines():
+            for resource in json.loads(line)["resourceSpans"]:
+                for scope in resource["scopeSpans"]:
+                    spans.extend(scope["spans"])
+        return spans
+
+    return read
+
+
+def attributes(span: dict) -> dict:
+    return {a["key"]: next(iter(a["value"].values())) for a in span["attributes"]}
+
+
+def test_request_id_is_echoed_or_generated(client):
+    response = client.get("/api/v1", headers={"X-Request-ID": "upload-42"})
+    assert response.headers["X-Request-ID"] == "upload-42"
+
+    generated = client.get("/api/v1").headers["X-Request-ID"]
+    assert len(generated) == 32 and int(generated, 16)
+
+
+def test_incoming_traceparent_is_continued(client, trace_file):
+    response = client.get("/api/v1", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+
+    assert response.headers["X-Request-ID"] == TRACE_ID
+    [root] = trace_file()
+    assert root["traceId"] == TRACE_ID
+    assert root["parentSpanId"] == PARENT_ID
+    assert root["name"] == "GET /api/v1"
+    assert root["kind"] == tracing.SERVER
+    assert attributes(root)["http.status_code"] == "200"
+
+
+def test_upload_is_traced_through_the_parser(client, sample_xml, trace_file, monkeypatch):
+    received = []
+
+    def handler(request):
+        received.append(request.headers)
+        return httpx.Response(200, content=PARSER_NDJSON,
+                              headers={"Content-Type": "application/x-ndjson"})
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(httpx, "AsyncClient",
+                        lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs))
+    monkeypatch.setattr("app.config.config.XML_PARSER_URL", "http://localhost:5000")
+    parser_pool.reset()
+
+    response = client.post(
+        "/api/invoices/upload",
+        files={"file": ("test_invoice.xml", sample_xml, "application/xml")},
+        headers={"X-Request-ID": "upload-42"},
+    )
+    parser_pool.reset()
+
+    assert response.status_code == 201
+    spans = {span["name"]: span for span in trace_file()}
+    assert {"POST /api/invoices/upload", "upload.read", "parser.request", "parser.attempt", "ingest",
+            "db.commit"} <= set(spans)
+    root = spans["POST /api/invoices/upload"]
+    assert {span["traceId"] for span in spans.values()} == {root["traceId"]}
+
+    # The parser gets the request id and continues the trace from the attempt
+    [headers] = received
+    assert headers["X-Request-ID"] == "upload-42"
+    attempt = spans["parser.attempt"]
+    assert headers["traceparent"] == f"00-{root['traceId']}-{attempt['spanId']}-01"
+    assert attempt["parentSpanId"] == spans["parser.request"]["spanId"]
+    assert attempt["kind"] == tracing.CLIENT
+
+    assert spans["db.commit"]["parentSpanId"] == spans["ingest"]["spanId"]
+    assert attributes(spans["ingest"])["items"] == "2"
+    assert attributes(spans["upload.read"])["bytes"] == str(len(sample_xml))
+
+
+def test_spans_as_json_log_records(client, monkeypatch, caplog):
+    monkeypatch.setattr("app.config.config.TRACE_EXPORTER", "log")
+    with caplog.at_level(logging.INFO, logger="pvapp.trace"):
+        client.get("/api/v1", headers={"X-Request-ID": "abc"})
+
+    [record] = [json.loads(r.getMessage()) for r in caplog.records if r.name == "pvapp.trace"]
+    assert record["name"] == "GET /api/v1"
+    assert record["request.id"] == "abc"
+    assert record["http.status_code"] == 200
+    assert record["duration_ms"] >= 0
+
+
+def test_parse_traceparent():
+    assert tracing.parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01") == (TRACE_ID, PARENT_ID)
+    assert tracing.parse_traceparent(f"00-{'0' * 32}-{PARENT_ID}-01") is None
+    assert tracing.parse_traceparent("garbage") is None
+    assert tracing.parse_traceparent(None) is None
@@ -0,0 +1,85 @@
+"""
+Tests for spooled upload ingestion.
+"""
+import gzip
+import hashlib
+import io
+import tracemalloc
+import pytest
+from unittest.mock import patch
+from fastapi import UploadFile
+from app.compression import DecompressionLimitExceeded
+from app.uploads import UploadTooLarge, spool_upload
+
+
+def make_upload(data: bytes, filename: str = "invoice.xml", size=None) -> UploadFile:
+    return UploadFile(io.BytesIO(data), filename=filename, size=size)
+
+
+@pytest.mark.asyncio
+async def test_spool_upload_hashes_and_spills_to_disk(sample_xml):
+    """Test that size and digest are computed while copying and large uploads spill to disk."""
+    data = sample_xml * 40
+    with patch('app.config.config.UPLOAD_SPOOL_THRESHOLD', 1024):
+        upload = await spool_upload(make_upload(data))
+    
+    with upload:
+        assert upload.size == len(data)
+        assert upload.sha256 == hashlib.sha256(data).hexdigest()
+        assert upload.content_encoding is None
+        assert not upload.in_memory
+        assert upload.file.read() == data
+
+
+@pytest.mark.asyncio
+async def test_spool_upload_keeps_or_decodes_compressed_content(sample_xml):
+    """Test .xml.gz uploads are kept encoded by default and decoded on request."""
+    compressed = gzip.compress(sample_xml)
+    
+    with await spool_upload(make_upload(compressed, "invoice.xml.gz")) as upload:
+        assert upload.content_encoding == 'gzip'
+        assert upload.file.read() == compressed
+    
+    with await spool_upload(make_upload(compressed, "invoice.xml.gz"), decode=True) as upload:
+        assert upload.content_encoding is None
+        assert upload.size == len(compressed)
+        assert upload.sha256 == hashlib.sha256(compressed).hexdigest()
+        assert upload.file.read() == sample_xml
+
+
+@pytest.mark.asyncio
+async def test_spool_upload_limits():
+    """Test the upload and decompression limits stop the copy early."""
+    with pytest.raises(UploadTooLarge):
+        await spool_upload(make_upload(b"x" * 1000), max_size=100)
+    
+    # A size reported by the multipart parser is rejected before reading
+    upload = make_upload(b"x" * 10, size=1000)
+    with pytest.raises(UploadTooLarge):
+        await spool_upload(upload, max_size=100)
+    assert upload.file.tell() == 0
+    
+    bomb = gzip.compress(b" " * 100_000)
+    with patch('app.config.config.MAX_DECOMPRESSED_SIZE', 10_000):
+        with pytest.raises(DecompressionLimitExceeded):
+            await spool_upload(make_upload(bomb, "bomb.xml.gz"), decode=True)
+
+
+@pytest.mark.asyncio
+async def test_spool_upload_zstd(sample_xml):
+    """Test .xml.zst uploads are decoded on request and held to the decompression limit."""
+    zstandard = pytest.importorskip("zstandard")
+    with await spool_upload(make_upload(zstandard.compress(sample_xml), "invoice.xml.zst"), decode=True) as upload:
+        assert upload.file.read() == sample_xml
+    
+    bomb = zstandard.ZstdCompressor(level=19).compress(b" " * (64 * 1024 * 1024))
+    tracemalloc.start()
+    try:
+        with patch('app.config.config.MAX_DECOMPRESSED_SIZE', 10_000):
+            with pytest.raises(DecompressionLimitExceeded):
+                await spool_upload(make_upload(bomb, "bomb.xml.zst"), decode=True)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # Stopped within one decoding step of the limit
+    assert peak < 1024 * 1024